@@ -0,0 +1,182 @@
+"""
+recipes.markdown_content の圧縮前後で、保存サイズと読み取りレイテンシを比べる。
+
+LLM の出力に近い長さ・ばらつきの日本語レシピを未圧縮で投入し、
+未圧縮 → zstd（辞書なし）→ zstd + 学習済み辞書 の順に移行しながら計測する。
+
+    python -m bench.bench_compression --recipes 10000 --users 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+
+from src import db_compress
+from src.compression import codec
+from src.db_models import Base, Recipe, User
+from src.db_seed import bulk_insert
+
+_INGREDIENTS = [
+    "鶏むね肉", "豚ロース", "鮭の切り身", "木綿豆腐", "卵", "ブロッコリー", "にんじん", "玉ねぎ",
+    "キャベツ", "ほうれん草", "しめじ", "まいたけ", "トマト", "なす", "ピーマン", "じゃがいも",
+    "玄米ごはん", "オートミール", "ギリシャヨーグルト", "納豆", "ひじき", "わかめ", "アボカド", "さば缶",
+]
+_SEASONINGS = ["塩", "こしょう", "しょうゆ", "みりん", "酒", "味噌", "酢", "ごま油", "オリーブオイル",
+               "砂糖", "しょうが", "にんにく", "鶏がらスープの素", "ポン酢", "白ごま"]
+_UNITS = ["g", "個", "本", "枚", "大さじ", "小さじ", "カップ", "片"]
+_ACTIONS = [
+    "{a}は食べやすい大きさに切り、{b}と一緒にボウルに入れて軽く混ぜます。",
+    "フライパンに{s}を熱し、{a}を中火で{n}分ほど焼き色がつくまで焼きます。",
+    "鍋に湯を沸かし、{a}を{n}分ゆでてからざるにあげ、水気をしっかり切ります。",
+    "{s}と{t}を合わせて調味料を作り、{a}にからめて{n}分ほど置いて味をなじませます。",
+    "耐熱容器に{a}と{b}を入れ、ふんわりとラップをして600Wの電子レンジで{n}分加熱します。",
+    "器に盛り付け、お好みで{s}をかけて完成です。温かいうちに召し上がってください。",
+]
+_POINTS = [
+    "たんぱく質が{n}g とれ、筋肉の維持に役立ちます。",
+    "食物繊維が豊富で、血糖値の上昇がゆるやかになります。",
+    "{a}に含まれるビタミンCは加熱しすぎると失われるため、手早く調理するのがポイントです。",
+    "塩分は{n}g 程度に抑えているので、減塩中の方にもおすすめです。",
+    "作り置きする場合は冷蔵で{n}日ほど保存できます。",
+    "{a}の代わりに{b}を使っても美味しく作れます。",
+]
+
+
+def recipe_body(rng: random.Random, title: str) -> str:
+    """LLM の出力に近い構成・長さ（約1〜8KB）の Markdown"""
+    lines = [f"# {title}", "", f"{rng.choice(_INGREDIENTS)}を使った、"
+             f"{rng.choice(['朝食', '昼食', '夕食', '作り置き'])}向けのヘルシーなレシピです。", "",
+             f"## 材料（{rng.randint(1, 4)}人分）"]
+    for name in rng.sample(_INGREDIENTS, rng.randint(4, 10)):
+        lines.append(f"- {name}: {rng.randint(1, 300)}{rng.choice(_UNITS)}")
+    for name in rng.sample(_SEASONINGS, rng.randint(3, 7)):
+        lines.append(f"- {name}: {rng.choice(['小さじ', '大さじ', '少々', ''])}{rng.randint(1, 3)}")
+    lines += ["", "## 作り方"]
+    for i in range(rng.randint(4, 12)):
+        action = rng.choice(_ACTIONS).format(
+            a=rng.choice(_INGREDIENTS), b=rng.choice(_INGREDIENTS),
+            s=rng.choice(_SEASONINGS), t=rng.choice(_SEASONINGS), n=rng.randint(1, 15))
+        lines.append(f"{i + 1}. {action}")
+    lines += ["", "## 栄養成分（1人分）", "| 項目 | 量 |", "| --- | --- |"]
+    for label, unit, low, high in (("エネルギー", "kcal", 250, 750), ("たんぱく質", "g", 10, 45),
+                                   ("脂質", "g", 3, 30), ("炭水化物", "g", 20, 90),
+                                   ("食物繊維", "g", 1, 12), ("食塩相当量", "g", 0, 4)):
+        lines.append(f"| {label} | {rng.uniform(low, high):.1f}{unit} |")
+    lines += ["", "## 栄養ポイント"]
+    for _ in range(rng.randint(2, 8)):
+        lines.append("- " + rng.choice(_POINTS).format(
+            a=rng.choice(_INGREDIENTS), b=rng.choice(_INGREDIENTS), n=rng.randint(1, 30)))
+    return "\n".join(lines) + "\n"
+
+
+def seed_raw(engine, recipes: int, users: int, rng: random.Random) -> None:
+    """圧縮を無効にして未圧縮（移行前と同じ状態）で投入する"""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    now = datetime(2025, 1, 1)
+    enabled, codec.enabled = codec.enabled, False
+    try:
+        with engine.begin() as conn:
+            bulk_insert(conn, User.__table__,
+                        ["id", "name", "email", "password_hash", "disabled", "created_at"],
+                        [(i, f"user{i}", f"user{i}@bench.example", "x", False, now)
+                         for i in range(1, users + 1)])
+            bulk_insert(conn, Recipe.__table__,
+                        ["id", "user_id", "title", "markdown_content", "content_format",
+                         "created_at", "updated_at", "version"],
+                        ((i, 1 + i % users, f"レシピ {i}",
+                          recipe_body(rng, f"レシピ {i}"), "markdown",
+                          now + timedelta(minutes=i), now, 1)
+                         for i in range(1, recipes + 1)))
+    finally:
+        codec.enabled = enabled
+
+
+def _timed(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(statistics.median(samples), 3),
+            "mean_ms": round(statistics.fmean(samples), 3)}
+
+
+def measure(engine, path: str, recipes: int, users: int, repeat: int, rng: random.Random) -> dict:
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    stored = db_compress.storage_stats(engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    recipe_ids = [rng.randint(1, recipes) for _ in range(repeat)]
+    user_ids = [rng.randint(1, users) for _ in range(repeat)]
+    detail_iter = iter(recipe_ids * 2)
+    user_iter = iter(user_ids * 4)
+    try:
+        result = {
+            "stored_bytes": sum(item["bytes"] for item in stored.values()),
+            "db_file_bytes": os.path.getsize(path),
+            "formats": {kind: item["rows"] for kind, item in stored.items()},
+            # 本文を読む: 詳細・一覧
+            "detail": _timed(lambda: Recipe.get_recipe_by_id(db, next(detail_iter)), repeat),
+            "list_full": _timed(lambda: Recipe.get_recipes_by_user(db, next(user_iter)), repeat),
+            # 本文を読まない: 要約一覧・全件のタイトル走査
+            "list_summary": _timed(
+                lambda: Recipe.get_recipe_summaries_by_user(db, next(user_iter)), repeat),
+            "title_scan": _timed(
+                lambda: db.execute(select(Recipe.id, Recipe.title, Recipe.created_at)).all(),
+                max(3, repeat // 20)),
+        }
+    finally:
+        db.close()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--dict-samples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        codec.dict_dir = os.path.join(tmp, "dicts")
+        quiet = lambda *a, **k: None  # noqa: E731
+
+        seed_raw(engine, args.recipes, args.users, rng)
+        results = {"raw": measure(engine, path, args.recipes, args.users, args.repeat, rng)}
+
+        start = time.perf_counter()
+        db_compress.migrate(engine, log=quiet)
+        results["zstd"] = measure(engine, path, args.recipes, args.users, args.repeat, rng)
+        results["zstd"]["migrate_s"] = round(time.perf_counter() - start, 2)
+
+        zdict = db_compress.train(engine, samples=args.dict_samples, log=quiet)
+        codec.dict_id = zdict.dict_id()
+        start = time.perf_counter()
+        db_compress.migrate(engine, recompress=True, log=quiet)
+        results["zstd_dict"] = measure(engine, path, args.recipes, args.users, args.repeat, rng)
+        results["zstd_dict"]["migrate_s"] = round(time.perf_counter() - start, 2)
+        engine.dispose()
+
+    raw = results["raw"]["stored_bytes"]
+    for name in ("zstd", "zstd_dict"):
+        results[name]["ratio"] = round(raw / results[name]["stored_bytes"], 2)
+    print(json.dumps({"recipes": args.recipes, "users": args.users, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
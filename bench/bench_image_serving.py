@@ -0,0 +1,178 @@
+"""
+保存済み画像の配信（GET /api/images/{name}、FileResponse）と、ファイルをすべて読み込んで返す
+素朴な実装のスループット・レイテンシ・サーバーのピークメモリ（VmHWM）を比べる。
+
+ハンドラーごとに uvicorn を子プロセスで起動し、同じ画像を並列に取得する。
+シナリオ: DALL·E 相当の 1.5MB・100KB の全体取得、1.5MB の先頭 64KB の Range 取得、
+ETag を付けた再検証（配信ルートは 304、素朴な実装は毎回全体を返す）。
+1 CPU の環境ではクライアントとサーバーが CPU を取り合うので、rps は 1リクエストあたりの CPU 時間の比較になる。
+
+    python -m bench.bench_image_serving --duration 5 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+# シナリオ名 -> (画像の大きさ, 追加するヘッダー)。revalidate は ETag を持ったクライアントの再検証
+SCENARIOS = {
+    "full_1500kb": (1_500_000, {}),
+    "full_100kb": (100_000, {}),
+    "range_64kb_of_1500kb": (1_500_000, {"range": "bytes=0-65535"}),
+    "revalidate_1500kb": (1_500_000, {"if-none-match": "ETAG"}),
+}
+
+
+def create_app():
+    """計測用のアプリ（本番と同じ配信ルートと、比較用の素朴なルート）"""
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.responses import Response
+    from src import image_store
+    from src.api.images.index import router
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api/images")
+
+    @app.get("/naive/{name}")
+    def naive(name: str, request: Request):
+        # ファイル全体をメモリに読み込んでから返す（Range も読み込んだ後に切り出す）
+        path = image_store.path_for(name)
+        if path is None or not os.path.exists(path):
+            raise HTTPException(status_code=404)
+        with open(path, "rb") as f:
+            data = f.read()
+        http_range = request.headers.get("range")
+        if http_range:
+            start, end = (int(v) for v in http_range.removeprefix("bytes=").split("-"))
+            return Response(data[start:end + 1], status_code=206, media_type="image/png",
+                            headers={"content-range": f"bytes {start}-{end}/{len(data)}"})
+        return Response(data, media_type="image/png")
+
+    return app
+
+
+def peak_rss_kb(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def wait_until_ready(base_url: str, timeout_s: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                await client.get("/api/images/missing")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def drive(base_url: str, path: str, headers: dict, duration: float, concurrency: int) -> dict:
+    latencies = []
+    received = 0
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal received, errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code not in (200, 206, 304):
+                    errors += 1
+                received += len(response.content)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "mb_per_s": round(received / elapsed / 1e6, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+async def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "IMAGE_STORE_DIR": tmp,
+            "DATABASE_URL": os.getenv("DATABASE_URL") or f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "SECRET_KEY": os.getenv("SECRET_KEY") or "bench-secret",
+            "ALGORITHM": os.getenv("ALGORITHM") or "HS256",
+            "ACCESS_TOKEN_EXPIRE_MINUTES": os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "60",
+            "IMAGE_ACCEL_REDIRECT_PREFIX": "",
+        }
+        if args.chunk_bytes:
+            env["IMAGE_SEND_CHUNK_BYTES"] = str(args.chunk_bytes)
+        os.environ.update(env)
+        from src import image_store
+
+        names = {size: image_store.store_bytes(os.urandom(size), "image/png")
+                 for size in {size for size, _ in SCENARIOS.values()}}
+
+        results = {}
+        for handler, prefix in (("file_response", "/api/images/"), ("naive", "/naive/")):
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "bench.bench_image_serving:create_app",
+                 "--factory", "--port", str(args.port), "--log-level", "warning"],
+                env=env,
+            )
+            base_url = f"http://127.0.0.1:{args.port}"
+            try:
+                await wait_until_ready(base_url)
+                results[handler] = {}
+                for scenario, (size, headers) in SCENARIOS.items():
+                    etag = '"' + names[size].split(".")[0] + '"'
+                    headers = {key: etag if value == "ETAG" else value for key, value in headers.items()}
+                    results[handler][scenario] = await drive(
+                        base_url, prefix + names[size], headers, args.duration, args.concurrency)
+                results[handler]["server_peak_rss_mb"] = round((peak_rss_kb(server.pid) or 0) / 1024, 1)
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+        return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--chunk-bytes", type=int, help="IMAGE_SEND_CHUNK_BYTES for the FileResponse route")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps({
+        "duration_s": args.duration,
+        "concurrency": args.concurrency,
+        "cpus": os.cpu_count(),
+        "handlers": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+アプリの import 時間（コールドスタート）の計測。
+
+`python -X importtime -c "import src.main"` を別プロセスで繰り返し実行し、合計時間と
+累積時間の大きいモジュールを出力する。重い外部SDK（openai / stripe / requests）が
+起動時に読み込まれていないことも確認する（読み込まれていれば終了コード1）。--spawn-server を付けると uvicorn を起動してから
+/healthz が最初に応答するまでの時間も測る。
+
+    python -m bench.bench_import_time --runs 5 --max-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from src.integrations import INTEGRATIONS
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# src は import 時に JWT 設定を必須とするので、未設定ならダミーを入れる
+_ENV_DEFAULTS = {
+    "SECRET_KEY": "bench-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    for key, value in _ENV_DEFAULTS.items():
+        env.setdefault(key, value)
+    return env
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    modules = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                # インデント幅 = import の深さ
+                "depth": len(indent) // 2,
+            })
+    return modules
+
+
+def measure_import(module: str) -> list[dict]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=_env(), check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_healthz(timeout_s: float = 60.0) -> dict:
+    """uvicorn 起動から /healthz が 200 を返すまでの時間"""
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port),
+         "--log-level", "warning"],
+        env=_env(), stdout=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as r:
+                    body = json.loads(r.read())
+                    return {
+                        "first_healthz_ms": (time.perf_counter() - start) * 1000,
+                        "integrations_at_first_healthz": body.get("integrations"),
+                    }
+            except OSError:
+                if time.perf_counter() - start > timeout_s:
+                    raise
+                time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--spawn-server", action="store_true")
+    parser.add_argument("--max-ms", type=float,
+                        help="exit with status 1 if the median import time exceeds this")
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(args.runs)]
+    totals = [next(m["cumulative_ms"] for m in reversed(run) if m["module"] == args.module)
+              for run in runs]
+    # 中央値の回の内訳を出す
+    median_run = runs[sorted(range(len(runs)), key=lambda i: totals[i])[len(runs) // 2]]
+    imported = {m["module"] for m in median_run}
+
+    result = {
+        "module": args.module,
+        "runs": args.runs,
+        "total_ms": {
+            "min": min(totals),
+            "median": statistics.median(totals),
+            "max": max(totals),
+        },
+        "modules_imported": len(median_run),
+        "eager_integrations": sorted(name for name in INTEGRATIONS if name in imported),
+        "top_cumulative": [
+            {k: m[k] for k in ("module", "cumulative_ms", "self_ms")}
+            for m in sorted((m for m in median_run if m["depth"] <= 2),
+                            key=lambda m: m["cumulative_ms"], reverse=True)[:args.top]
+        ],
+        "top_self": [
+            {k: m[k] for k in ("module", "self_ms")}
+            for m in sorted(median_run, key=lambda m: m["self_ms"], reverse=True)[:args.top]
+        ],
+    }
+    if args.spawn_server:
+        result.update(measure_first_healthz())
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    # 起動時に重いSDKを読み込んでいたら退行として扱う
+    if result["eager_integrations"]:
+        sys.exit(1)
+    if args.max_ms is not None and result["total_ms"]["median"] > args.max_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
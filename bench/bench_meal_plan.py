@@ -0,0 +1,123 @@
+"""
+献立の探索（src/meal_plan.py の solve）の時間と、目標からのずれを計測する。
+
+栄養価は 1食分としてありそうな範囲の乱数（エネルギーは PFC から計算）で作る。
+目標は既定値を ±20% の範囲で変えたものを使い、次を比べる。
+- random: ランダムな組み合わせを candidates 個試した中で最良のもの
+- beam: ビームサーチのみ（入れ替えなし）
+- beam_swap: ビームサーチ + 1食ずつの入れ替え（API と同じ設定）
+- optimal: 全組み合わせの最良（--exact-pool 件のときだけ計算できる）
+プールが小さく組み合わせが MEAL_PLAN_EXACT_COMBINATIONS 以下なら solve 自体が全件を調べる。
+
+    python -m bench.bench_meal_plan --sizes 10000,100000
+"""
+import argparse
+import itertools
+import json
+import random
+import statistics
+import time
+
+import numpy as np
+
+from src import meal_plan
+
+
+def nutrient_matrix(n: int, rng: np.random.Generator):
+    """(N, 6) の栄養価。列の順は RecipeNutrition.NUTRIENTS"""
+    protein = rng.uniform(8, 50, n)
+    fat = rng.uniform(3, 40, n)
+    carbohydrates = rng.uniform(15, 120, n)
+    calories = 4 * protein + 9 * fat + 4 * carbohydrates + rng.normal(0, 20, n)
+    fiber = rng.gamma(2.0, 2.0, n)
+    salt = rng.uniform(0.3, 4.5, n)
+    return np.stack([calories, protein, fat, carbohydrates, fiber, salt], axis=1).astype(np.float32)
+
+
+def random_targets(rng: random.Random) -> dict:
+    return {key: value * rng.uniform(0.8, 1.2) for key, value in meal_plan.DEFAULT_TARGETS.items()}
+
+
+def random_search(matrix, objective, meals: int, candidates: int, rng: np.random.Generator):
+    rows = np.stack([rng.choice(len(matrix), meals, replace=False) for _ in range(candidates)])
+    losses = objective.loss(matrix[rows].sum(axis=1))
+    return list(rows[int(np.argmin(losses))])
+
+
+def exact(matrix, objective, meals: int):
+    combos = np.array(list(itertools.combinations(range(len(matrix)), meals)))
+    losses = objective.loss(matrix[combos].sum(axis=1))
+    return list(combos[int(np.argmin(losses))])
+
+
+def _percentiles(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {"p50_ms": round(statistics.median(samples), 2),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+            "max_ms": round(samples[-1], 2)}
+
+
+def quality(matrix, meals: int, trials: int, solvers: dict, seed: int) -> dict:
+    rng = random.Random(seed)
+    results = {name: {"loss": [], "within": 0} for name in solvers}
+    for _ in range(trials):
+        objective = meal_plan.Objective(random_targets(rng))
+        for name, solver in solvers.items():
+            totals = matrix[solver(matrix, objective, meals)].sum(axis=0)
+            results[name]["loss"].append(float(objective.loss(totals)))
+            results[name]["within"] += objective.within(totals)
+    return {name: {"mean_loss": round(statistics.fmean(r["loss"]), 5),
+                   "within_tolerance": round(r["within"] / trials, 3)}
+            for name, r in results.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="50,10000,100000")
+    parser.add_argument("--meals", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--trials", type=int, default=30)
+    parser.add_argument("--random-candidates", type=int, default=2000)
+    parser.add_argument("--exact-pool", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    solvers = {
+        "random": lambda m, o, k: random_search(m, o, k, args.random_candidates, rng),
+        "beam": lambda m, o, k: meal_plan.solve(m, o, k, swap_passes=0),
+        "beam_swap": lambda m, o, k: meal_plan.solve(m, o, k),
+    }
+
+    sizes = {}
+    for size in (int(s) for s in args.sizes.split(",")):
+        matrix = nutrient_matrix(size, rng)
+        targets = random.Random(args.seed)
+        samples = []
+        for _ in range(args.repeat):
+            objective = meal_plan.Objective(random_targets(targets))
+            start = time.perf_counter()
+            meal_plan.solve(matrix, objective, args.meals)
+            samples.append((time.perf_counter() - start) * 1000)
+        sizes[size] = {
+            "solve": _percentiles(samples),
+            "quality": quality(matrix, args.meals, args.trials, solvers, args.seed),
+        }
+
+    # 小さいプール（1ユーザー分程度）で全組み合わせの最良と比べる
+    small = nutrient_matrix(args.exact_pool, rng)
+    small_quality = quality(small, args.meals, args.trials,
+                            {**solvers, "optimal": exact}, args.seed)
+
+    print(json.dumps({
+        "meals": args.meals,
+        "beam_width": meal_plan.BEAM_WIDTH,
+        "swap_passes": meal_plan.SWAP_PASSES,
+        "tolerance": meal_plan.TOLERANCE,
+        "sizes": sizes,
+        f"exact_pool_{args.exact_pool}": small_quality,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
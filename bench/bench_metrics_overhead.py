@@ -0,0 +1,106 @@
+"""
+計測（メトリクス・トレース）をホットパスに入れたことによるオーバーヘッドを測る。
+
+    python -m bench.bench_metrics_overhead --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+from src import metrics
+from src.tracing import span
+
+
+def per_op_ns(fn, iterations: int) -> float:
+    fn()
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter_ns() - start) / iterations
+
+
+async def _noop_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def asgi_per_request_ns(app, iterations: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/bench"}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    async def run():
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            await app(scope, receive, send)
+        return (time.perf_counter_ns() - start) / iterations
+
+    return asyncio.run(run())
+
+
+def query_per_op_ns(iterations: int, instrumented: bool) -> float:
+    listeners = (
+        ("before_cursor_execute", metrics._before_cursor_execute),
+        ("after_cursor_execute", metrics._after_cursor_execute),
+    )
+    if not instrumented:
+        for name, fn in listeners:
+            event.remove(Engine, name, fn)
+    try:
+        engine = create_engine("sqlite://")
+        with engine.connect() as conn:
+            return per_op_ns(lambda: conn.execute(text("select 1")), iterations)
+    finally:
+        if not instrumented:
+            for name, fn in listeners:
+                event.listen(Engine, name, fn)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    n = args.iterations
+
+    histogram = metrics.Histogram("bench_seconds", "bench", ("route",))
+    counter = metrics.Counter("bench_total", "bench", ("route",))
+
+    def traced():
+        with span("bench"):
+            pass
+
+    # 計測ノイズを抑えるため、有効/無効を交互に複数回測って最小値を使う
+    plain_asgi, instrumented_asgi, plain_query, instrumented_query = [], [], [], []
+    for _ in range(args.rounds):
+        plain_asgi.append(asgi_per_request_ns(_noop_app, n))
+        instrumented_asgi.append(asgi_per_request_ns(
+            metrics.MetricsMiddleware(_noop_app), n))
+        plain_query.append(query_per_op_ns(n, instrumented=False))
+        instrumented_query.append(query_per_op_ns(n, instrumented=True))
+
+    print(json.dumps({
+        "benchmark": "metrics_overhead",
+        "iterations": n,
+        "results": {
+            "histogram_observe_ns": round(per_op_ns(lambda: histogram.observe(0.12, "/bench"), n), 1),
+            "counter_inc_ns": round(per_op_ns(lambda: counter.inc("/bench"), n), 1),
+            "span_ns": round(per_op_ns(traced, n), 1),
+            "asgi_request_ns": round(min(plain_asgi), 1),
+            "middleware_overhead_ns_per_request": round(min(instrumented_asgi) - min(plain_asgi), 1),
+            "sqlite_query_ns": round(min(plain_query), 1),
+            "query_listener_overhead_ns_per_query": round(min(instrumented_query) - min(plain_query), 1),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+レシピ一覧のシリアライズ時間を、旧実装（dict + isoformat → response_model 再検証 →
+jsonable_encoder → json.dumps）と現行実装（射影行 → RecipeRead → orjson）で比較する。
+
+    python -m bench.bench_serialization --recipes 1000 --repeat 20
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, undefer
+
+from src.api_models import RecipeRead
+from src.db_models import Base, Image, Recipe, User
+from src.responses import ORJSONResponse
+
+MARKDOWN = (
+    "## 鶏むね肉とブロッコリーの塩炒め\n\n### 材料\n- 鶏むね肉: 120g\n- ブロッコリー: 80g\n"
+    "- 塩: 少々\n\n### 作り方\n1. 切る\n2. 炒める\n3. 盛り付ける\n"
+) * 8
+
+
+def seed(db, recipes: int) -> int:
+    user = User(name="bench", email="bench@example.com", password_hash="x")
+    db.add(user)
+    db.flush()
+    base = datetime(2025, 1, 1)
+    db.execute(Recipe.__table__.insert(), [
+        {
+            "user_id": user.id,
+            "title": f"recipe {i}",
+            "markdown_content": MARKDOWN,
+            "content_format": "markdown",
+            "created_at": base + timedelta(minutes=i),
+        }
+        for i in range(recipes)
+    ])
+    recipe_ids = [r for (r,) in db.query(Recipe.id).all()]
+    db.execute(Image.__table__.insert(), [
+        {
+            "recipe_id": rid,
+            "image_url": f"https://example.com/{rid}-{n}.png",
+            "is_regenerated": n > 0,
+            "created_at": base,
+        }
+        for rid in recipe_ids for n in range(1 + rid % 2)
+    ])
+    db.commit()
+    return user.id
+
+
+def legacy_dicts(db, user_id: int) -> list[dict]:
+    """user-029 以前の get_recipes_by_user と同じ組み立て方"""
+    # 当時は本文が deferred ではなかったので、同じく1クエリで読み込む
+    recipes = db.query(Recipe).options(undefer(Recipe.markdown_content)).filter(
+        Recipe.user_id == user_id).all()
+    return [
+        {
+            "id": recipe.id,
+            "title": recipe.title,
+            "markdown_content": recipe.rendered_markdown(),
+            "user": recipe.user.name if recipe.user else None,
+            "created_at": recipe.created_at.isoformat() if recipe.created_at else None,
+            "images": [
+                {
+                    "id": image.id,
+                    "image_url": image.image_url,
+                    "is_regenerated": image.is_regenerated,
+                    "created_at": image.created_at.isoformat() if image.created_at else None,
+                }
+                for image in recipe.images
+            ],
+        }
+        for recipe in recipes
+    ]
+
+
+def serialize_legacy(data: list[dict], adapter: TypeAdapter) -> bytes:
+    # FastAPI の serialize_response 相当: 検証 → JSON 互換に変換 → 標準 json
+    validated = adapter.validate_python(data)
+    return JSONResponse(jsonable_encoder(adapter.dump_python(validated, mode="json"))).body
+
+
+def run_legacy(session_factory, user_id: int, adapter: TypeAdapter) -> bytes:
+    with session_factory() as db:
+        data = legacy_dicts(db, user_id)
+    return serialize_legacy(data, adapter)
+
+
+def run_current(session_factory, user_id: int) -> bytes:
+    with session_factory() as db:
+        data = Recipe.get_recipes_by_user(db, user_id)
+    return ORJSONResponse(data).body
+
+
+def measure(fn, repeat: int) -> list[float]:
+    fn()  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipes", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        user_id = seed(db, args.recipes)
+
+    adapter = TypeAdapter(list[RecipeRead])
+    legacy_body = run_legacy(session_factory, user_id, adapter)
+    current_body = run_current(session_factory, user_id)
+    assert json.loads(legacy_body) == json.loads(current_body), "payload mismatch"
+
+    with session_factory() as db:
+        prebuilt_dicts = legacy_dicts(db, user_id)
+        prebuilt_models = Recipe.get_recipes_by_user(db, user_id)
+
+    per_1k = 1000 / args.recipes
+    results = {}
+    for name, fn in (
+        # クエリ + 組み立て + シリアライズ
+        ("legacy", lambda: run_legacy(session_factory, user_id, adapter)),
+        ("current", lambda: run_current(session_factory, user_id)),
+        # 組み立て済みデータのシリアライズのみ
+        ("legacy_serialize_only", lambda: serialize_legacy(prebuilt_dicts, adapter)),
+        ("current_serialize_only", lambda: ORJSONResponse(prebuilt_models).body),
+    ):
+        timings = measure(fn, args.repeat)
+        results[name] = {
+            "median_ms_per_1k": round(statistics.median(timings) * per_1k, 3),
+            "min_ms_per_1k": round(min(timings) * per_1k, 3),
+        }
+    results["speedup"] = round(
+        results["legacy"]["median_ms_per_1k"] / results["current"]["median_ms_per_1k"], 2)
+    results["serialize_only_speedup"] = round(
+        results["legacy_serialize_only"]["median_ms_per_1k"]
+        / results["current_serialize_only"]["median_ms_per_1k"], 2)
+
+    print(json.dumps({
+        "benchmark": "recipe_list_serialization",
+        "recipes": args.recipes,
+        "repeat": args.repeat,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
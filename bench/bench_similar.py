@@ -0,0 +1,118 @@
+"""
+類似レシピのインデックス（src/similar.py）の構築・保存・読み込み・検索を計測し、
+float16 / int8 で保存したときの recall@k を float32 の全件検索と比べる。
+
+埋め込みは bench_compression と同じ生成器で作ったレシピ本文から hashing 方式で計算する。
+
+    python -m bench.bench_similar --recipes 20000
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from bench.bench_compression import recipe_body
+from src import embeddings
+from src.similar import VectorIndex
+
+_DISHES = ["ソテー", "ハンバーグ", "塩焼き", "味噌汁", "煮物", "おひたし", "サラダ", "炊き込みご飯",
+           "スープ", "丼", "グラタン", "蒸し鶏"]
+
+
+def corpus(recipes: int, dim: int, rng: random.Random):
+    embedder = embeddings.HashingEmbedder(dim)
+    texts = []
+    for i in range(recipes):
+        title = f"{rng.choice(_DISHES)} {i}"
+        texts.append(embeddings.recipe_text(title, recipe_body(rng, title), "markdown"))
+    start = time.perf_counter()
+    vectors = np.concatenate([embedder.embed(texts[i:i + 1000]) for i in range(0, recipes, 1000)])
+    return vectors, (time.perf_counter() - start) / recipes * 1000
+
+
+def _timed(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(statistics.median(samples), 3),
+            "mean_ms": round(statistics.fmean(samples), 3)}
+
+
+def exact_top_k(vectors, queries, k: int):
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def measure(vectors, dtype: str, queries, truth, k: int, repeat: int) -> dict:
+    ids = np.arange(1, len(vectors) + 1)
+    quantized = embeddings.quantize(vectors, dtype)
+
+    start = time.perf_counter()
+    index = VectorIndex(vectors.shape[1], dtype)
+    for i in range(0, len(vectors), 1000):
+        index.upsert(ids[i:i + 1000].tolist(), quantized[i:i + 1000])
+    build_ms = (time.perf_counter() - start) * 1000
+
+    found = index.search(queries, k)
+    # ID は 1 始まり、truth は行番号
+    recall = statistics.fmean(
+        len({rid - 1 for rid, _ in hits} & set(row.tolist())) / k
+        for hits, row in zip(found, truth))
+
+    single = queries[:1]
+    batch = queries[:32]
+    result = {
+        "index_bytes": int(index.vectors[:len(index)].nbytes + index.ids[:len(index)].nbytes),
+        "build_ms": round(build_ms, 1),
+        f"recall_at_{k}": round(recall, 4),
+        "search_batch_1": _timed(lambda: index.search(single, k), repeat),
+        "search_batch_32": _timed(lambda: index.search(batch, k), max(3, repeat // 8)),
+    }
+    result["search_batch_32"]["per_query_ms"] = round(result["search_batch_32"]["mean_ms"] / 32, 3)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        index.save(directory, {"model": "bench"})
+        result["save_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        start = time.perf_counter()
+        loaded, _ = VectorIndex.load(directory)
+        result["load_mmap_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        # memory-map のまま（ページキャッシュから）検索する。一時ディレクトリを消す前に map を手放す
+        result["search_batch_1_mmap"] = _timed(lambda mapped=loaded: mapped.search(single, k), repeat)
+        del loaded
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipes", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=embeddings.DIM)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vectors, embed_ms = corpus(args.recipes, args.dim, rng)
+    queries = vectors[rng.sample(range(args.recipes), min(args.queries, args.recipes))]
+    truth = exact_top_k(vectors, queries, args.k)
+
+    print(json.dumps({
+        "recipes": args.recipes,
+        "dim": args.dim,
+        "embed_ms_per_recipe": round(embed_ms, 3),
+        "float32_bytes": int(vectors.nbytes),
+        "dtypes": {dtype: measure(vectors, dtype, queries, truth, args.k, args.repeat)
+                   for dtype in embeddings.DTYPES},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+subscriptions と Stripe の突き合わせ（src/stripe_sync.py）を、モックの Stripe に対して計測する。
+
+ユーザーごとの subscription を DB とモックの両方に作り、--drift の割合だけモック側の状態・Price ID を変え、
+--missing 件を Stripe にだけ作る。次を比べ、終わった後の DB が Stripe と一致するかも確かめる。
+- per_row: 同じ一覧を読み、Webhook と同じく1件ずつ get_subscription_by_stripe_subscription_id して
+  set_status し、コミットする
+- reconcile: ページごとに SELECT 1回・UPDATE 1回（executemany）・コミット1回
+- resume: reconcile を --resume-after ページで止め、もう一度呼んでチェックポイントの続きから終わらせる
+
+    python -m bench.bench_stripe_reconcile --subscriptions 5000 --drift 0.05
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench.datasets import Scale, seed
+from bench.mock_servers import Latency, MockConfig, MockServers
+
+STATUSES = ("active", "past_due", "canceled", "unpaid")
+
+
+def build(engine, servers: MockServers, args) -> None:
+    """DB と Stripe に同じ subscription を作り、Stripe 側だけをずらす"""
+    from sqlalchemy import text
+
+    rng = random.Random(args.seed)
+    seed(engine, Scale(users=args.subscriptions, recipes_per_user=0))
+    with engine.begin() as conn:
+        # 初期データの解約済みは end_date を持たないので、Stripe と一致した状態にそろえる
+        conn.execute(text("UPDATE subscriptions SET end_date = start_date WHERE status = 'canceled'"))
+    state = servers.stripe_state
+    for i in range(args.subscriptions):
+        status = "active" if i % 3 else "canceled"
+        price = "price_mock_starter"
+        if rng.random() < args.drift:
+            if rng.random() < 0.7:
+                status = rng.choice([s for s in STATUSES if s != status])
+            else:
+                price = "price_mock_pro"
+        state.add_subscription(f"sub_bench_{i}", f"cus_bench_{i}", status, price)
+    for i in range(args.missing):
+        state.add_subscription(f"sub_stripe_only_{i}", f"cus_stripe_only_{i}", "active")
+
+
+def mismatches(session_factory, servers: MockServers) -> int:
+    """Stripe と状態・Price ID・end_date の有無が合わない行の数"""
+    from src.api.payments.index import subscription_price_id
+    from src.db_models import Subscription
+
+    db = session_factory()
+    try:
+        local = {row.stripe_subscription_id: row for row in db.query(Subscription)}
+        count = 0
+        for item in servers.stripe_state.subscriptions:
+            row = local.get(item["id"])
+            if row is None:
+                continue
+            ended = item["status"] in Subscription.ENDED_STATUSES
+            count += (row.status != item["status"]
+                      or row.stripe_price_id != subscription_price_id(item)
+                      or (ended and row.end_date is None)
+                      or (item["status"] == "active" and row.end_date is not None))
+        return count
+    finally:
+        db.close()
+
+
+def per_row(session_factory, page_size: int) -> dict:
+    """Webhook と同じ1件ずつの処理で一覧を反映する（比較用）"""
+    from src import stripe_sync
+    from src.api.payments.index import subscription_price_id
+    from src.db_models import Subscription
+
+    db = session_factory()
+    try:
+        cursor = None
+        updated = 0
+        while True:
+            page = stripe_sync._list_page(cursor, page_size)
+            for item in page.data:
+                sub = Subscription.get_subscription_by_stripe_subscription_id(
+                    db=db, stripe_subscription_id=item["id"])
+                if sub:
+                    sub.set_status(db, item["status"])
+                    price_id = subscription_price_id(item)
+                    if price_id:
+                        sub.stripe_price_id = price_id
+                    updated += 1
+                    db.commit()
+            if not page.has_more or not page.data:
+                return {"written": updated}
+            cursor = page.data[-1]["id"]
+    finally:
+        db.close()
+
+
+def measure(servers: MockServers, fn, args) -> dict:
+    """一時 DB とモックの一覧を作り直して fn(session_factory) を計測する"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from src import metrics
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with servers.stripe_state.lock:
+            servers.stripe_state.subscriptions.clear()
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        build(engine, servers, args)
+        session_factory = sessionmaker(bind=engine)
+
+        queries = [0]
+
+        def count(statement, elapsed):
+            queries[0] += 1
+
+        metrics.query_observers.append(count)
+        try:
+            start = time.perf_counter()
+            result = fn(session_factory)
+            elapsed = time.perf_counter() - start
+        finally:
+            metrics.query_observers.remove(count)
+        mismatched = mismatches(session_factory, servers)
+        engine.dispose()
+        return {
+            "seconds": round(elapsed, 3),
+            "db_queries": queries[0],
+            "remaining_mismatches": mismatched,
+            "result": result,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscriptions", type=int, default=5000)
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--missing", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--resume-after", type=int, default=5, help="pages before the simulated stop")
+    parser.add_argument("--stripe-latency", default="fixed:0")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    servers = MockServers(MockConfig(stripe_latency=Latency(args.stripe_latency))).start()
+    tmp = tempfile.TemporaryDirectory()
+    # src の各モジュールは import 時に環境変数を読むので先に設定する
+    os.environ.update(servers.app_env())
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp.name, 'app.db')}")
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    from src import stripe_sync
+
+    def reconcile(session_factory):
+        db = session_factory()
+        try:
+            return stripe_sync.reconcile(db, page_size=args.page_size)
+        finally:
+            db.close()
+
+    def resume(session_factory):
+        db = session_factory()
+        try:
+            first = stripe_sync.reconcile(db, page_size=args.page_size, max_pages=args.resume_after)
+            second = stripe_sync.reconcile(db, page_size=args.page_size)
+        finally:
+            db.close()
+        return {"first": {k: first[k] for k in ("pages", "completed", "resumed")},
+                "second": {k: second[k] for k in ("pages", "updated", "completed", "resumed")}}
+
+    try:
+        results = {
+            "per_row": measure(servers, lambda sf: per_row(sf, args.page_size), args),
+            "reconcile": measure(servers, reconcile, args),
+            "resume": measure(servers, resume, args),
+        }
+    finally:
+        servers.stop()
+        tmp.cleanup()
+    results["reconcile"]["result"].pop("missing_ids")
+    print(json.dumps({
+        "subscriptions": args.subscriptions,
+        "drift": args.drift,
+        "missing": args.missing,
+        "page_size": args.page_size,
+        "stripe_latency": args.stripe_latency,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
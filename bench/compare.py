@@ -0,0 +1,84 @@
+"""
+bench.load の結果JSONを2つ比較し、ルート別の悪化を検出する。
+
+    python -m bench.compare baseline.json candidate.json --threshold 10
+
+p95/p99 が threshold% を超えて悪化した、rps が threshold% を超えて落ちた、
+リクエストあたりのDBクエリ数が増えた、エラーが増えたルートがあれば終了コード1で終わる。
+"""
+import argparse
+import json
+import sys
+
+
+def _change(before, after) -> float | None:
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> dict:
+    rows = []
+    regressions = []
+    for name, after in sorted(candidate["routes"].items()):
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+        row = {"route": name}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+            row[key] = {"baseline": before[key], "candidate": after[key],
+                        "change_pct": _change(before[key], after[key])}
+        row["db_queries_per_request"] = {
+            "baseline": before.get("db_queries_per_request"),
+            "candidate": after.get("db_queries_per_request"),
+        }
+        rows.append(row)
+
+        for key in ("p95_ms", "p99_ms"):
+            change = row[key]["change_pct"]
+            if change is not None and change > threshold:
+                regressions.append(f"{name}: {key} +{change:.1f}%")
+        change = row["rps"]["change_pct"]
+        if change is not None and change < -threshold:
+            regressions.append(f"{name}: rps {change:.1f}%")
+        db_before = before.get("db_queries_per_request")
+        db_after = after.get("db_queries_per_request")
+        if db_before is not None and db_after is not None and db_after > db_before + 0.01:
+            regressions.append(
+                f"{name}: db queries/request {db_before:.2f} -> {db_after:.2f}")
+        error_rate_before = before["errors"] / before["count"] if before["count"] else 0
+        error_rate_after = after["errors"] / after["count"] if after["count"] else 0
+        if error_rate_after > error_rate_before + 0.01:
+            regressions.append(
+                f"{name}: error rate {error_rate_before:.1%} -> {error_rate_after:.1%}")
+
+    return {
+        "baseline": baseline.get("version"),
+        "candidate": candidate.get("version"),
+        "threshold_pct": threshold,
+        "routes": rows,
+        "missing_routes": sorted(set(baseline["routes"]) - set(candidate["routes"])),
+        "regressions": regressions,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="allowed latency / throughput change in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    result = compare(baseline, candidate, args.threshold)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(1 if result["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+ベンチマーク用の決定的なデータセット。
+
+ユーザー i のメールアドレスは user{i}@bench.example、パスワードは全員 BENCH_PASSWORD。
+id は 1 から連番で振るので、負荷ドライバーは DB を引かずに各ユーザーのレシピ id を求められる。
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+
+BENCH_PASSWORD = "bench-password"
+
+
+@dataclass(frozen=True)
+class Scale:
+    users: int
+    recipes_per_user: int
+    images_per_recipe: int = 1
+
+
+SCALES = {
+    "tiny": Scale(users=10, recipes_per_user=5),
+    "small": Scale(users=100, recipes_per_user=10),
+    "medium": Scale(users=1_000, recipes_per_user=20),
+    "large": Scale(users=10_000, recipes_per_user=50),
+}
+
+TITLES = ["鶏むね肉のソテー", "豆腐ハンバーグ", "鮭の塩焼き", "野菜たっぷり味噌汁",
+          "ひじきの煮物", "サバの味噌煮", "ほうれん草のおひたし", "オートミール粥"]
+
+BODY = (
+    "---\n料理名：{title}\n材料：鶏むね肉 120g、ブロッコリー 80g、ごはん 150g\n"
+    "作り方：\n1. 材料を切る\n2. 油で炒めて塩で味付けする\n3. ごはんと盛り付ける\n"
+    "栄養ポイント：高たんぱく・低脂質で野菜もとれる一皿です。\n---\n"
+)
+
+
+def user_email(index: int) -> str:
+    return f"user{index}@bench.example"
+
+
+def recipe_ids_of(scale: Scale, user_index: int) -> range:
+    """user_index（0始まり）が持つレシピの id"""
+    start = user_index * scale.recipes_per_user + 1
+    return range(start, start + scale.recipes_per_user)
+
+
+def seed(engine, scale: Scale, batch_size: int = 5_000, rng_seed: int = 0) -> dict:
+    """テーブルを作り直してデータを投入する（パスワードハッシュは1回だけ計算する）"""
+    # src は import 時に環境変数を読むので、呼び出し側が設定し終えてから読み込む
+    from src import embeddings
+    from src.db_models import (
+        Base, User, Recipe, RecipeEmbedding, RecipeNutrition, Image, Subscription,
+    )
+    from src.db_seed import bulk_insert
+
+    rng = random.Random(rng_seed)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+
+    users = (
+        (i + 1, f"user{i}", user_email(i), password_hash, False,
+         now - timedelta(days=rng.randint(0, 365)))
+        for i in range(scale.users)
+    )
+    subscriptions = (
+        (i + 1, f"sub_bench_{i}", f"cus_bench_{i}", "price_mock_starter",
+         "active" if i % 3 else "canceled", now - timedelta(days=30))
+        for i in range(scale.users)
+    )
+    # 埋め込みはタイトルごとに1回だけ計算する
+    embedder = embeddings.get_embedder()
+    vectors = dict(zip(TITLES, (vector.tobytes() for vector in embeddings.quantize(embedder.embed([
+        embeddings.recipe_text(title, BODY.format(title=title), "markdown") for title in TITLES])))))
+    titles = []
+
+    def recipes():
+        for i in range(scale.users):
+            for recipe_id in recipe_ids_of(scale, i):
+                title = rng.choice(TITLES)
+                titles.append(title)
+                yield (recipe_id, i + 1, title, BODY.format(title=title), "markdown",
+                       now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)), now, 1)
+
+    recipe_embeddings = (
+        (recipe_id, embedder.name, embeddings.DTYPE, vectors[title], now)
+        for recipe_id, title in enumerate(titles, start=1)
+    )
+    # 栄養価は本文に無いので、1食分としてありそうな範囲の乱数を入れる（献立の探索用）
+    nutrition_rng = random.Random(rng_seed + 1)
+    recipe_nutrition = (
+        (recipe_id, i + 1, nutrition_rng.uniform(250, 900), nutrition_rng.uniform(8, 50),
+         nutrition_rng.uniform(3, 40), nutrition_rng.uniform(20, 120),
+         nutrition_rng.uniform(0.5, 12), nutrition_rng.uniform(0.3, 4.5), now)
+        for i in range(scale.users)
+        for recipe_id in recipe_ids_of(scale, i)
+    )
+    images = (
+        (recipe_id, f"https://example.com/images/{recipe_id}-{n}.png", False, False, now)
+        for recipe_id in range(1, scale.users * scale.recipes_per_user + 1)
+        for n in range(scale.images_per_recipe)
+    )
+
+    with engine.begin() as conn:
+        bulk_insert(conn, User.__table__,
+                    ["id", "name", "email", "password_hash", "disabled", "created_at"],
+                    users, batch_size)
+        bulk_insert(conn, Subscription.__table__,
+                    ["user_id", "stripe_subscription_id", "stripe_customer_id",
+                     "stripe_price_id", "status", "start_date"],
+                    subscriptions, batch_size)
+        bulk_insert(conn, Recipe.__table__,
+                    ["id", "user_id", "title", "markdown_content", "content_format",
+                     "created_at", "updated_at", "version"],
+                    recipes(), batch_size)
+        bulk_insert(conn, RecipeEmbedding.__table__,
+                    ["recipe_id", "model", "dtype", "vector", "updated_at"],
+                    recipe_embeddings, batch_size)
+        bulk_insert(conn, RecipeNutrition.__table__,
+                    ["recipe_id", "user_id", *RecipeNutrition.NUTRIENTS, "updated_at"],
+                    recipe_nutrition, batch_size)
+        bulk_insert(conn, Image.__table__,
+                    ["recipe_id", "image_url", "is_regenerated", "is_variant", "created_at"],
+                    images, batch_size)
+
+    return {
+        "users": scale.users,
+        "recipes": scale.users * scale.recipes_per_user,
+        "images": scale.users * scale.recipes_per_user * scale.images_per_recipe,
+    }
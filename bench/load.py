@@ -0,0 +1,585 @@
+"""
+負荷ドライバー。モックサーバーとシード済みDBを用意してアプリの全ルートを叩き、
+ルート別のスループット・p50/p95/p99・リクエストあたりのDBクエリ数をJSONで出力する。
+
+    python -m bench.load --scale small --duration 30 --concurrency 16 --output result.json
+    python -m bench.load --spawn-server --workers 1 ...   # uvicorn を子プロセスで起動して計測
+    python -m bench.load --spawn-server --workers 4 --fake-redis ...   # ワーカー間で状態を共有
+
+バージョン間の比較は bench.compare を使う。
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import httpx
+
+from bench.datasets import BENCH_PASSWORD, SCALES, recipe_ids_of, seed, user_email
+from bench.mock_servers import PNG_BYTES, MockServers, add_latency_arguments, config_from_args
+
+WEBHOOK_SECRET = "whsec_bench"
+# 画像モックは常に同じ PNG を返すので、ローカル保存したときのファイル名も決まる
+IMAGE_NAME = hashlib.sha256(PNG_BYTES).hexdigest() + ".png"
+# create-recipe を同じ Idempotency-Key で再送する割合
+RETRY_RATE = 0.1
+
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def git_version() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def sign_webhook(payload: bytes, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+# ------------------------------
+# /metrics の DB クエリ数
+# ------------------------------
+_DB_QUERIES_RE = re.compile(
+    r'^db_queries_per_request_(sum|count)\{route="([^"]*)"\} (\S+)$', re.M)
+
+
+def parse_db_queries(text: str) -> dict[str, list[float]]:
+    """route -> [sum, count]"""
+    result = defaultdict(lambda: [0.0, 0.0])
+    for kind, route, value in _DB_QUERIES_RE.findall(text):
+        result[route][0 if kind == "sum" else 1] = float(value)
+    return dict(result)
+
+
+# ------------------------------
+# シナリオ
+# ------------------------------
+@dataclass
+class VirtualUser:
+    index: int
+    email: str
+    token: str
+    recipe_ids: list[int]
+    etags: dict = field(default_factory=dict)
+
+
+@dataclass
+class Operation:
+    name: str              # 集計キー（"METHOD /path/template"）
+    weight: float
+    run: object            # async (client, vu, rng) -> httpx.Response
+
+
+def _auth(vu: VirtualUser) -> dict:
+    return {"Authorization": f"Bearer {vu.token}"}
+
+
+async def _conditional_get(client, vu, url):
+    headers = _auth(vu)
+    etag = vu.etags.get(url)
+    if etag:
+        headers["If-None-Match"] = etag
+    response = await client.get(url, headers=headers)
+    if "etag" in response.headers:
+        vu.etags[url] = response.headers["etag"]
+    return response
+
+
+async def op_token(client, vu, rng):
+    return await client.post("/api/auth/token", data={
+        "username": vu.email, "password": BENCH_PASSWORD})
+
+
+async def op_login(client, vu, rng):
+    return await client.post("/api/auth/login", json={
+        "email": vu.email, "password": BENCH_PASSWORD})
+
+
+async def op_logout(client, vu, rng):
+    return await client.post("/api/auth/logout", headers=_auth(vu))
+
+
+async def op_user(client, vu, rng):
+    return await client.get("/api/auth/user", headers=_auth(vu))
+
+
+async def op_usage(client, vu, rng):
+    return await client.get("/api/auth/usage", headers=_auth(vu))
+
+
+async def op_create_user(client, vu, rng):
+    suffix = f"{vu.index}-{rng.getrandbits(48):x}"
+    return await client.post("/api/auth/create-user", headers=_auth(vu), json={
+        "name": f"new-{suffix}",
+        "email": f"new-{suffix}@bench.example",
+        "password": BENCH_PASSWORD,
+        "disabled": False,
+    })
+
+
+async def op_create_recipe(client, vu, rng):
+    params = {"title": rng.choice(["高たんぱくな朝ごはん", "減塩の夕食", "作り置きおかず"])}
+    headers = {**_auth(vu), "Idempotency-Key": f"{rng.getrandbits(64):x}"}
+    response = await client.post("/api/recipe/create-recipe", params=params, headers=headers)
+    # タイムアウトしたクライアントの再送（保存済み応答が返り、生成は走らない）
+    if rng.random() < RETRY_RATE:
+        response = await client.post("/api/recipe/create-recipe", params=params, headers=headers)
+    if response.status_code == 200:
+        vu.recipe_ids.append(response.json()["recipe_id"])
+    return response
+
+
+async def op_list_recipes(client, vu, rng):
+    return await _conditional_get(client, vu, "/api/recipe/user-recipes")
+
+
+async def op_get_recipe(client, vu, rng):
+    return await _conditional_get(
+        client, vu, f"/api/recipe/recipe/{rng.choice(vu.recipe_ids)}")
+
+
+async def op_similar(client, vu, rng):
+    recipe_id = rng.choice(vu.recipe_ids)
+    return await client.get(f"/api/recipe/recipe/{recipe_id}/similar", headers=_auth(vu))
+
+
+async def op_meal_plan(client, vu, rng):
+    # 生成は create-recipe で計測するので、ここでは保存済みのレシピの組み合わせだけ
+    return await client.post(
+        "/api/recipe/meal-plan",
+        headers=_auth(vu),
+        json={"meals": rng.choice([2, 3]), "scope": rng.choice(["own", "all"])},
+    )
+
+
+async def op_regenerate_image(client, vu, rng):
+    # 作り置きがあれば即時、無ければモックの画像APIで生成する（どちらも補充がバックグラウンドで走る）
+    recipe_id = rng.choice(vu.recipe_ids)
+    return await client.post(f"/api/recipe/recipe/{recipe_id}/regenerate-image", headers=_auth(vu))
+
+
+async def op_update_recipe(client, vu, rng):
+    recipe_id = rng.choice(vu.recipe_ids)
+    return await client.put(
+        f"/api/recipe/recipe/{recipe_id}",
+        headers=_auth(vu),
+        json={"title": f"更新 {rng.randint(0, 9999)}"},
+    )
+
+
+async def op_list_versions(client, vu, rng):
+    recipe_id = rng.choice(vu.recipe_ids)
+    return await client.get(f"/api/recipe/recipe/{recipe_id}/versions", headers=_auth(vu))
+
+
+async def op_get_version(client, vu, rng):
+    # 履歴は最初の編集で作られるので、未編集のレシピは 404 になる
+    recipe_id = rng.choice(vu.recipe_ids)
+    return await client.get(f"/api/recipe/recipe/{recipe_id}/versions/1", headers=_auth(vu))
+
+
+async def op_restore_version(client, vu, rng):
+    recipe_id = rng.choice(vu.recipe_ids)
+    return await client.post(
+        f"/api/recipe/recipe/{recipe_id}/versions/1/restore", headers=_auth(vu))
+
+
+async def op_delete_recipe(client, vu, rng):
+    # 初期データを減らしすぎないよう、最低限を残して末尾（新しいもの）から消す
+    if len(vu.recipe_ids) <= 2:
+        return await op_get_recipe(client, vu, rng)
+    recipe_id = vu.recipe_ids.pop()
+    return await client.delete(f"/api/recipe/recipe/{recipe_id}", headers=_auth(vu))
+
+
+async def op_bulk_delete(client, vu, rng):
+    if len(vu.recipe_ids) <= 5:
+        return await op_get_recipe(client, vu, rng)
+    recipe_ids = [vu.recipe_ids.pop() for _ in range(3)]
+    return await client.post(
+        "/api/recipe/bulk-delete", headers=_auth(vu), json={"recipe_ids": recipe_ids})
+
+
+async def op_export(client, vu, rng):
+    # 画像の取得は外部URLに依存するので、ZIP も画像なしで計測する
+    params = {"format": rng.choice(["ndjson", "zip"]), "images": "false"}
+    return await client.get("/api/recipe/export", headers=_auth(vu), params=params)
+
+
+async def op_image(client, vu, rng):
+    # 通常の取得・Range・条件付き（304）を混ぜる
+    headers = rng.choice([
+        {}, {"Range": "bytes=0-31"}, {"If-None-Match": f'"{IMAGE_NAME.split(".")[0]}"'}])
+    return await client.get(f"/api/images/{IMAGE_NAME}", headers=headers)
+
+
+async def op_plans(client, vu, rng):
+    return await client.get("/api/payments/plans")
+
+
+async def op_checkout(client, vu, rng):
+    return await client.post("/api/payments/create-checkout-session", params={
+        "stripe_plan_id": "price_mock_starter", "user_email": vu.email},
+        headers={"Idempotency-Key": f"{rng.getrandbits(64):x}"})
+
+
+async def op_webhook(client, vu, rng):
+    event_type = rng.choice([
+        "customer.subscription.updated", "invoice.payment_succeeded", "invoice.payment_failed"])
+    subscription_id = f"sub_bench_{vu.index}"
+    obj = ({"id": subscription_id, "status": rng.choice(["active", "past_due"])}
+           if event_type.startswith("customer.") else
+           {"id": f"in_bench_{rng.getrandbits(32):x}", "subscription": subscription_id})
+    payload = json.dumps({
+        "id": f"evt_bench_{rng.getrandbits(48):x}",
+        "object": "event",
+        "type": event_type,
+        "data": {"object": obj},
+    }).encode()
+    return await client.post("/api/payments/webhook", content=payload, headers={
+        "stripe-signature": sign_webhook(payload),
+        "content-type": "application/json",
+    })
+
+
+async def op_admin_stats(client, vu, rng):
+    return await client.get("/api/admin/stats", headers=_auth(vu), params={"days": 30})
+
+
+async def op_admin_users(client, vu, rng):
+    params = {"limit": 100, "after_id": rng.randint(0, 50)}
+    return await client.get("/api/admin/users", headers=_auth(vu), params=params)
+
+
+async def op_breakers(client, vu, rng):
+    return await client.get("/api/metrics/breakers")
+
+
+async def op_llm_deployments(client, vu, rng):
+    return await client.get("/api/metrics/llm-deployments")
+
+
+async def op_healthz(client, vu, rng):
+    return await client.get("/healthz")
+
+
+async def op_prometheus(client, vu, rng):
+    return await client.get("/metrics")
+
+
+# 重みは実運用の比率を大まかに真似たもの（読み取り中心、生成はまれ）
+OPERATIONS = [
+    Operation("POST /api/auth/token", 1, op_token),
+    Operation("POST /api/auth/login", 1, op_login),
+    Operation("POST /api/auth/logout", 1, op_logout),
+    Operation("GET /api/auth/user", 5, op_user),
+    Operation("GET /api/auth/usage", 1, op_usage),
+    Operation("POST /api/auth/create-user", 0.5, op_create_user),
+    Operation("POST /api/recipe/create-recipe", 2, op_create_recipe),
+    Operation("GET /api/recipe/user-recipes", 30, op_list_recipes),
+    Operation("GET /api/recipe/recipe/{recipe_id}", 40, op_get_recipe),
+    Operation("GET /api/recipe/recipe/{recipe_id}/similar", 5, op_similar),
+    Operation("POST /api/recipe/meal-plan", 2, op_meal_plan),
+    Operation("POST /api/recipe/recipe/{recipe_id}/regenerate-image", 1, op_regenerate_image),
+    Operation("PUT /api/recipe/recipe/{recipe_id}", 3, op_update_recipe),
+    Operation("GET /api/recipe/recipe/{recipe_id}/versions", 2, op_list_versions),
+    Operation("GET /api/recipe/recipe/{recipe_id}/versions/{version}", 2, op_get_version),
+    Operation("POST /api/recipe/recipe/{recipe_id}/versions/{version}/restore", 1, op_restore_version),
+    Operation("DELETE /api/recipe/recipe/{recipe_id}", 1, op_delete_recipe),
+    Operation("POST /api/recipe/bulk-delete", 1, op_bulk_delete),
+    Operation("GET /api/recipe/export", 0.5, op_export),
+    Operation("GET /api/images/{name}", 5, op_image),
+    Operation("GET /api/payments/plans", 2, op_plans),
+    Operation("POST /api/payments/create-checkout-session", 1, op_checkout),
+    Operation("POST /api/payments/webhook", 2, op_webhook),
+    Operation("GET /api/admin/stats", 0.5, op_admin_stats),
+    Operation("GET /api/admin/users", 0.5, op_admin_users),
+    Operation("GET /api/metrics/breakers", 0.5, op_breakers),
+    Operation("GET /api/metrics/llm-deployments", 0.5, op_llm_deployments),
+    Operation("GET /metrics", 0.5, op_prometheus),
+    Operation("GET /healthz", 0.5, op_healthz),
+]
+
+
+def uncovered_routes(app, operations: list[Operation]) -> list[str]:
+    """アプリのルートのうちシナリオが叩かないもの（ルート追加時の更新漏れ検出）"""
+    covered = {op.name for op in operations}
+    routes = []
+    for route in app.routes:
+        methods = getattr(route, "methods", None) or ()
+        if not getattr(route, "include_in_schema", False):
+            continue
+        for method in sorted(methods - {"HEAD", "OPTIONS"}):
+            name = f"{method} {route.path}"
+            if name not in covered:
+                routes.append(name)
+    return routes
+
+
+# ------------------------------
+# 実行
+# ------------------------------
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def record(self, name: str, elapsed: float, status: int | None) -> None:
+        self.latencies[name].append(elapsed)
+        self.statuses[name][str(status) if status else "exception"] += 1
+        if status is None or status >= 500:
+            self.errors[name] += 1
+
+
+async def run_load(client, users: list[VirtualUser], operations, duration_s, concurrency, rng_seed):
+    recorder = Recorder()
+    weights = [op.weight for op in operations]
+    deadline = time.perf_counter() + duration_s
+
+    async def worker(worker_id: int):
+        rng = random.Random(rng_seed + worker_id)
+        while time.perf_counter() < deadline:
+            vu = rng.choice(users)
+            op = rng.choices(operations, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await op.run(client, vu, rng)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = None
+            recorder.record(op.name, time.perf_counter() - start, status)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return recorder, time.perf_counter() - start
+
+
+async def login_users(client, count: int, scale) -> list[VirtualUser]:
+    users = []
+    for i in range(count):
+        response = await client.post("/api/auth/login", json={
+            "email": user_email(i), "password": BENCH_PASSWORD})
+        response.raise_for_status()
+        users.append(VirtualUser(
+            index=i,
+            email=user_email(i),
+            token=response.json()["access_token"],
+            recipe_ids=list(recipe_ids_of(scale, i)),
+        ))
+    return users
+
+
+def summarize(recorder: Recorder, elapsed: float, db_before: dict, db_after: dict) -> dict:
+    routes = {}
+    for name in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[name])
+        route = name.split(" ", 1)[1]
+        before = db_before.get(route, [0.0, 0.0])
+        after = db_after.get(route, [0.0, 0.0])
+        db_count = after[1] - before[1]
+        routes[name] = {
+            "count": len(values),
+            "errors": recorder.errors[name],
+            "status": dict(recorder.statuses[name]),
+            "rps": len(values) / elapsed,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            # 同じパスを持つメソッド（GET/PUT/DELETE）は /metrics 上で区別されないので合算値
+            "db_queries_per_request": (after[0] - before[0]) / db_count if db_count else None,
+        }
+    all_values = sorted(v for values in recorder.latencies.values() for v in values)
+    total = {
+        "count": len(all_values),
+        "errors": sum(recorder.errors.values()),
+        "rps": len(all_values) / elapsed,
+        "p50_ms": percentile(all_values, 50) * 1000 if all_values else None,
+        "p95_ms": percentile(all_values, 95) * 1000 if all_values else None,
+        "p99_ms": percentile(all_values, 99) * 1000 if all_values else None,
+    }
+    return {"elapsed_s": elapsed, "total": total, "routes": routes}
+
+
+def app_environment(servers: MockServers, database_url: str, args) -> dict:
+    env = servers.app_env(deployments=args.deployments)
+    env.update({
+        "DATABASE_URL": database_url,
+        "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "SECRET_KEY": os.getenv("SECRET_KEY") or "bench-secret",
+        "ALGORITHM": os.getenv("ALGORITHM") or "HS256",
+        "ACCESS_TOKEN_EXPIRE_MINUTES": os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "60",
+        "RECIPE_GENERATION_MODE": args.mode,
+        "LOG_LEVEL": os.getenv("LOG_LEVEL") or "WARNING",
+        # 管理 API も計測できるよう、仮想ユーザーを管理者にする
+        "ADMIN_EMAILS": ",".join(user_email(i) for i in range(args.users)),
+    })
+    return env
+
+
+async def wait_until_ready(base_url: str, timeout_s: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while True:
+            try:
+                await client.get("/metrics")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def main_async(args) -> dict:
+    with MockServers(config_from_args(args)) as servers, tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        env = app_environment(servers, database_url, args)
+        # 類似レシピのインデックスは一時ディレクトリに保存する
+        env["SIMILAR_INDEX_DIR"] = os.path.join(tmp, "similar_index")
+        # 生成した画像はモックから取得して一時ディレクトリに保存し、/api/images から配信する
+        env["IMAGE_STORAGE"] = "local"
+        env["IMAGE_STORE_DIR"] = os.path.join(tmp, "images")
+        fake_redis = None
+        if args.fake_redis:
+            # ワーカー間で状態を共有する構成を Redis なしで再現する
+            from src.fake_redis import FakeRedisServer
+            fake_redis = FakeRedisServer().start()
+            env["SHARED_STATE_URL"] = fake_redis.url
+        # src の各モジュールは import 時に環境変数を読むので先に設定する
+        os.environ.update(env)
+
+        from sqlalchemy import create_engine
+
+        scale = SCALES[args.scale]
+        seed_engine = create_engine(database_url)
+        seed_start = time.perf_counter()
+        seeded = seed(seed_engine, scale)
+        seed_s = time.perf_counter() - seed_start
+        seed_engine.dispose()
+        from src import image_store
+        image_store.store_bytes(PNG_BYTES, "image/png")
+
+        from src.main import app
+        uncovered = uncovered_routes(app, OPERATIONS)
+
+        server = None
+        if args.spawn_server:
+            base_url = f"http://127.0.0.1:{args.port}"
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "src.main:app",
+                 "--port", str(args.port), "--workers", str(args.workers),
+                 "--log-level", "warning"],
+                env={**os.environ, **env},
+            )
+            await wait_until_ready(base_url)
+            client = httpx.AsyncClient(base_url=base_url, timeout=120)
+        else:
+            client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app),
+                base_url="http://bench", timeout=120)
+
+        try:
+            users = await login_users(client, min(args.users, scale.users), scale)
+            if args.warmup > 0:
+                await run_load(client, users, OPERATIONS, args.warmup, args.concurrency, args.seed + 10_000)
+            db_before = parse_db_queries((await client.get("/metrics")).text)
+            recorder, elapsed = await run_load(
+                client, users, OPERATIONS, args.duration, args.concurrency, args.seed)
+            db_after = parse_db_queries((await client.get("/metrics")).text)
+        finally:
+            await client.aclose()
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            else:
+                # lifespan を通さないので、再生成用の画像の補充はモックを止める前にここで終わらせる
+                from src import image_variants
+                image_variants.shutdown(wait=True)
+            if fake_redis is not None:
+                fake_redis.stop()
+
+    result = summarize(recorder, elapsed, db_before, db_after)
+    result.update({
+        "version": git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "config": {
+            "scale": args.scale,
+            "dataset": seeded,
+            "seed_seconds": seed_s,
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "virtual_users": len(users),
+            "spawn_server": args.spawn_server,
+            "workers": args.workers if args.spawn_server else None,
+            "shared_state": "fake-redis" if args.fake_redis else "memory",
+            "database": database_url.split(":", 1)[0],
+            "generation_mode": args.mode,
+            "mocks": {
+                "llm_ttft": args.llm_ttft,
+                "llm_token_interval": args.llm_token_interval,
+                "image_latency": args.image_latency,
+                "stripe_latency": args.stripe_latency,
+                "error_rate": args.error_rate,
+            },
+        },
+        "uncovered_routes": uncovered,
+    })
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", default="small", choices=["tiny", "small", "medium", "large"])
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=50, help="number of logged-in virtual users")
+    parser.add_argument("--deployments", type=int, default=2, help="mock LLM deployments")
+    parser.add_argument("--mode", default="text", choices=["text", "json"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--spawn-server", action="store_true", help="run uvicorn in a subprocess")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--fake-redis", action="store_true",
+                        help="share caches and limiters between workers through a FakeRedis server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
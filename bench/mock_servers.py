@@ -0,0 +1,514 @@
+"""
+ベンチマーク・負荷試験用のモックサーバー（Azure OpenAI chat completions / 画像API / Stripe）。
+外部サービスを呼ばずに、指定したレイテンシ分布で応答を返す。
+
+単体で起動する場合:
+
+    python -m bench.mock_servers --llm-ttft lognormal:800,0.4 --image-latency uniform:2000,6000
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 1x1 の PNG
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d00000000"
+    "49454e44ae426082"
+)
+
+SAMPLE_RECIPE = {
+    "title": "鶏むね肉とブロッコリーの塩炒め",
+    "ingredients": [
+        {"name": "鶏むね肉", "amount": "120g"},
+        {"name": "ブロッコリー", "amount": "80g"},
+        {"name": "ごはん", "amount": "150g"},
+    ],
+    "steps": ["材料を切る", "油で炒めて塩で味付けする", "ごはんと盛り付ける"],
+    "nutrition": {
+        "calories": 520, "protein": 34, "fat": 11,
+        "carbohydrates": 68, "fiber": 4.5, "salt": 1.6,
+    },
+    "points": "高たんぱく・低脂質で野菜もとれる一皿です。",
+}
+
+SAMPLE_MARKDOWN = (
+    "---\n料理名：鶏むね肉とブロッコリーの塩炒め\n"
+    "材料：鶏むね肉 120g、ブロッコリー 80g、ごはん 150g\n"
+    "作り方：\n1. 材料を切る\n2. 油で炒めて塩で味付けする\n3. ごはんと盛り付ける\n"
+    "栄養ポイント：高たんぱく・低脂質で野菜もとれる一皿です。\n---\n"
+)
+
+
+# ------------------------------
+# レイテンシ分布
+# ------------------------------
+class Latency:
+    """
+    "fixed:50" / "uniform:20,80" / "normal:100,20" / "lognormal:800,0.4"
+    （lognormal は中央値ms, sigma）の形式で指定するレイテンシ分布。単位はms。
+    """
+
+    def __init__(self, spec: str = "fixed:0", rng: random.Random | None = None):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+        self.rng = rng or random.Random()
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample_ms(self) -> float:
+        if self.kind == "fixed":
+            return self.args[0] if self.args else 0.0
+        if self.kind == "uniform":
+            return self.rng.uniform(self.args[0], self.args[1])
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(self.args[0], self.args[1]))
+        median, sigma = self.args
+        return self.rng.lognormvariate(0, sigma) * median
+
+    def sleep(self) -> None:
+        delay = self.sample_ms()
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def __repr__(self):
+        return f"Latency({self.spec!r})"
+
+
+@dataclass
+class MockConfig:
+    llm_ttft: Latency = field(default_factory=lambda: Latency("fixed:0"))
+    llm_token_interval: Latency = field(default_factory=lambda: Latency("fixed:0"))
+    llm_chunks: int = 20
+    image_latency: Latency = field(default_factory=lambda: Latency("fixed:0"))
+    stripe_latency: Latency = field(default_factory=lambda: Latency("fixed:0"))
+    error_rate: float = 0.0
+
+
+class RequestLog:
+    """受けたリクエストの数（"POST /v1/checkout/sessions" のようなキーごと）。テストで上流の呼び出し回数を見る"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] += 1
+
+    def count(self, fragment: str = "") -> int:
+        """キーに fragment を含むリクエストの数"""
+        with self.lock:
+            return sum(n for key, n in self.counts.items() if fragment in key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counts.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: MockConfig = None
+    request_log: RequestLog = None
+    server_name_label = "mock"
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+        if self.request_log is not None:
+            self.request_log.add(f"{self.command} {urlparse(self.path).path}")
+        return True
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントがタイムアウト・ヘッジで先に切断した
+            pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("content-length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status: int, data) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_fail(self) -> bool:
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            self._send_json(503, {"error": {"message": "mock upstream failure"}})
+            return True
+        return False
+
+
+# ------------------------------
+# Azure OpenAI chat completions
+# ------------------------------
+class AzureOpenAIHandler(_Handler):
+    _ids = itertools.count(1)
+
+    def do_POST(self):
+        request = json.loads(self._read_body() or b"{}")
+        if self._maybe_fail():
+            return
+
+        structured = (request.get("response_format") or {}).get("type") == "json_schema"
+        text = json.dumps(SAMPLE_RECIPE, ensure_ascii=False) if structured else SAMPLE_MARKDOWN
+        # 1トークン = 2文字として max_completion_tokens を超える分は打ち切る
+        finish_reason = "stop"
+        max_tokens = request.get("max_completion_tokens")
+        if max_tokens is not None and len(text) // 2 > max_tokens:
+            text = text[:max_tokens * 2]
+            finish_reason = "length"
+        chunk_count = max(1, self.config.llm_chunks)
+        size = max(1, len(text) // chunk_count + 1)
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        usage = {
+            "prompt_tokens": 180,
+            "completion_tokens": len(text) // 2,
+            "total_tokens": 180 + len(text) // 2,
+        }
+        completion_id = f"chatcmpl-mock-{next(self._ids)}"
+
+        self.config.llm_ttft.sleep()
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+
+        def write_event(data) -> None:
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i, part in enumerate(chunks):
+                if i:
+                    self.config.llm_token_interval.sleep()
+                write_event(json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": "mock",
+                    "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}],
+                }, ensure_ascii=False))
+            write_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+            }))
+            write_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [],
+                "usage": usage,
+            }))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # ヘッジで打ち切られた
+            pass
+
+
+# ------------------------------
+# 画像生成API（DALL·E 互換）
+# ------------------------------
+class ImageAPIHandler(_Handler):
+    _ids = itertools.count(1)
+
+    def do_POST(self):
+        self._read_body()
+        if self._maybe_fail():
+            return
+        self.config.image_latency.sleep()
+        host = self.headers.get("host")
+        self._send_json(200, {
+            "created": int(time.time()),
+            "data": [{"url": f"http://{host}/images/{next(self._ids)}.png"}],
+        })
+
+    def do_GET(self):
+        if not self.path.startswith("/images/"):
+            self._send_json(404, {"error": "not found"})
+            return
+        self.send_response(200)
+        self.send_header("content-type", "image/png")
+        self.send_header("content-length", str(len(PNG_BYTES)))
+        self.end_headers()
+        self.wfile.write(PNG_BYTES)
+
+
+# ------------------------------
+# Stripe（アプリが使うエンドポイントのみ）
+# ------------------------------
+class StripeState:
+    def __init__(self):
+        self.prices = [{
+            "id": "price_mock_starter",
+            "object": "price",
+            "active": True,
+            "currency": "usd",
+            "unit_amount": 1200,
+            "recurring": {"interval": "month", "interval_count": 1},
+            "product": "prod_mock_starter",
+        }]
+        # id 順に並べた subscription（list のページングに使う）
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self._session_ids = itertools.count(1)
+        self.idempotency = {}
+
+    def add_subscription(self, subscription_id: str, customer_id: str, status: str,
+                         price_id: str = "price_mock_starter") -> None:
+        with self.lock:
+            self.subscriptions.append({
+                "id": subscription_id,
+                "object": "subscription",
+                "customer": customer_id,
+                "status": status,
+                "created": int(time.time()),
+                "items": {"object": "list", "data": [{"price": {"id": price_id}}]},
+            })
+
+
+class StripeHandler(_Handler):
+    state: StripeState = None
+
+    def _send_list(self, items: list, url: str, query: dict) -> None:
+        limit = int(query.get("limit", ["10"])[0])
+        starting_after = query.get("starting_after", [None])[0]
+        start = 0
+        if starting_after:
+            for i, item in enumerate(items):
+                if item["id"] == starting_after:
+                    start = i + 1
+                    break
+            else:
+                # Stripe と同じく、消えたオブジェクトを起点にしたページングはエラー
+                self._send_json(400, {"error": {
+                    "type": "invalid_request_error",
+                    "message": f"No such object: '{starting_after}'",
+                    "param": "starting_after",
+                }})
+                return
+        self._send_json(200, {
+            "object": "list",
+            "url": url,
+            "has_more": start + limit < len(items),
+            "data": items[start:start + limit],
+        })
+
+    def do_GET(self):
+        if self._maybe_fail():
+            return
+        self.config.stripe_latency.sleep()
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+
+        if parsed.path == "/v1/prices":
+            self._send_list(self.state.prices, "/v1/prices", query)
+            return
+        match = re.fullmatch(r"/v1/prices/([\w-]+)", parsed.path)
+        if match:
+            for price in self.state.prices:
+                if price["id"] == match.group(1):
+                    self._send_json(200, price)
+                    return
+            self._send_json(404, {"error": {
+                "type": "invalid_request_error",
+                "message": f"No such price: '{match.group(1)}'",
+                "param": "id",
+            }})
+            return
+        if parsed.path == "/v1/subscriptions":
+            status = query.get("status", ["all"])[0]
+            with self.state.lock:
+                items = [
+                    s for s in self.state.subscriptions
+                    if status == "all" or s["status"] == status
+                ]
+            self._send_list(items, "/v1/subscriptions", query)
+            return
+        self._send_json(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self._maybe_fail():
+            return
+        self.config.stripe_latency.sleep()
+        if urlparse(self.path).path != "/v1/checkout/sessions":
+            self._send_json(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+            return
+
+        key = self.headers.get("idempotency-key")
+        with self.state.lock:
+            if key and key in self.state.idempotency:
+                self._send_json(200, self.state.idempotency[key])
+                return
+            session_id = f"cs_test_mock_{next(self.state._session_ids)}"
+            form = parse_qs(body.decode())
+            session = {
+                "id": session_id,
+                "object": "checkout.session",
+                "mode": form.get("mode", ["subscription"])[0],
+                "customer_email": form.get("customer_email", [None])[0],
+                "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+            }
+            if key:
+                self.state.idempotency[key] = session
+        self._send_json(200, session)
+
+
+# ------------------------------
+# 起動
+# ------------------------------
+def _serve(handler_cls, host: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), handler_cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MockServers:
+    """3種類のモックサーバーをまとめて起動・停止する"""
+
+    def __init__(self, config: MockConfig | None = None, host: str = "127.0.0.1"):
+        self.config = config or MockConfig()
+        self.host = host
+        self.stripe_state = StripeState()
+        self.requests = RequestLog()
+        self._servers = []
+        self.llm_url = self.image_url = self.stripe_url = None
+
+    def start(self, llm_port: int = 0, image_port: int = 0, stripe_port: int = 0) -> "MockServers":
+        common = {"config": self.config, "request_log": self.requests}
+        llm = _serve(type("LLM", (AzureOpenAIHandler,), common), self.host, llm_port)
+        image = _serve(type("Image", (ImageAPIHandler,), common), self.host, image_port)
+        stripe = _serve(type("Stripe", (StripeHandler,), {
+            **common, "state": self.stripe_state,
+        }), self.host, stripe_port)
+        self._servers = [llm, image, stripe]
+        self.llm_url = f"http://{self.host}:{llm.server_address[1]}"
+        self.image_url = f"http://{self.host}:{image.server_address[1]}"
+        self.stripe_url = f"http://{self.host}:{stripe.server_address[1]}"
+        return self
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def app_env(self, deployments: int = 1) -> dict:
+        """アプリをモックに向けるための環境変数"""
+        return {
+            "AZURE_DEPLOYMENTS": json.dumps([
+                {
+                    "name": f"mock-{i}",
+                    "endpoint": self.llm_url,
+                    "deployment": f"mock-{i}",
+                    "api_key": "mock",
+                    "api_version": "2024-10-21",
+                }
+                for i in range(deployments)
+            ]),
+            "AZURE_IMAGE_API_URI": f"{self.image_url}/openai/images/generations",
+            "AZURE_IMAGE_API_KEY": "mock",
+            "STRIPE_API_BASE": self.stripe_url,
+            "STRIPE_API_KEY": "sk_test_mock",
+            # モックのプランは無制限（回数の UPSERT は実行される）。解約済みユーザーは free の上限で 429 になる。
+            # 再生成用の画像は1枚作り置きする
+            "PLAN_QUOTAS": json.dumps(
+                {"price_mock_starter": {"daily": 0, "monthly": 0, "image_variants": 1}}),
+        }
+
+    def __enter__(self):
+        if not self._servers:
+            self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--llm-ttft", default="lognormal:300,0.5",
+                        help="time to first token distribution (ms)")
+    parser.add_argument("--llm-token-interval", default="fixed:5",
+                        help="delay between streamed chunks (ms)")
+    parser.add_argument("--llm-chunks", type=int, default=20)
+    parser.add_argument("--image-latency", default="lognormal:500,0.5")
+    parser.add_argument("--stripe-latency", default="lognormal:80,0.3")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        llm_ttft=Latency(args.llm_ttft),
+        llm_token_interval=Latency(args.llm_token_interval),
+        llm_chunks=args.llm_chunks,
+        image_latency=Latency(args.image_latency),
+        stripe_latency=Latency(args.stripe_latency),
+        error_rate=args.error_rate,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_latency_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=9001)
+    parser.add_argument("--image-port", type=int, default=9002)
+    parser.add_argument("--stripe-port", type=int, default=9003)
+    args = parser.parse_args()
+
+    servers = MockServers(config_from_args(args), host=args.host).start(
+        args.llm_port, args.image_port, args.stripe_port)
+    for key, value in servers.app_env().items():
+        print(f"{key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servers.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+管理画面用の日次集計（daily_stats）。
+
+集計は各処理のトランザクション内で DailyStat.add により加算されるので、
+管理 API は recipes / subscriptions を走査せず、期間の日数分の行だけを読む。
+- 有効なサブスクリプション数: subscriptions_started - subscriptions_ended の累積
+- 解約率: その日に終了した数 / その日の開始時点の有効数
+
+シードや直接の SQL などフックを通らない変更があった場合や、定期的な補正には
+元のテーブルから作り直す（cron などから実行する）。
+物理削除したレシピは元のテーブルに残らないので、レシピの作成数・削除数は
+記録済みの値より小さくしない（増える方向の補正だけを行う）。
+
+    python -m src.analytics rebuild --days 7     # 直近7日を作り直す
+    python -m src.analytics rebuild --all
+    python -m src.analytics show --days 30
+"""
+import argparse
+import json
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+from src.db_models import DailyStat, GenerationLog, PregeneratedRecipe, Recipe, Subscription, User
+
+
+def _to_date(value) -> date:
+    # SQLite の date() は文字列、PostgreSQL は date を返す
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _grouped(db: Session, column, since: date | None, *aggregates):
+    """column の日付ごとに aggregates を集計する"""
+    day = func.date(column)
+    stmt = select(day, *aggregates).where(column.is_not(None)).group_by(day)
+    if since is not None:
+        stmt = stmt.where(column >= datetime.combine(since, datetime.min.time()))
+    for row in db.execute(stmt):
+        yield _to_date(row[0]), row[1:]
+
+
+def rebuild(db: Session, since: date | None = None) -> int:
+    """
+    since 以降（None なら全期間）の日次集計を元のテーブルから作り直し、行数を返す。
+    レシピの作成数・削除数は物理削除で元の行が消えるため、記録済みの値を下限にする
+    """
+    days = defaultdict(lambda: dict.fromkeys(DailyStat.COUNTERS, 0))
+
+    for day, (count,) in _grouped(db, Recipe.created_at, since, func.count()):
+        days[day]["recipes_created"] = count
+    for day, (count,) in _grouped(db, Recipe.deleted_at, since, func.count()):
+        days[day]["recipes_deleted"] = count
+    for day, row in _grouped(
+            db, GenerationLog.created_at, since,
+            func.count(),
+            func.coalesce(func.sum(GenerationLog.latency_ms), 0.0),
+            func.coalesce(func.sum(GenerationLog.prompt_tokens), 0),
+            func.coalesce(func.sum(GenerationLog.completion_tokens), 0),
+            func.coalesce(func.sum(GenerationLog.image_count), 0),
+            func.coalesce(func.sum(GenerationLog.cost_usd), 0.0)):
+        item = days[day]
+        (item["generations"], item["generation_latency_ms"], item["prompt_tokens"],
+         item["completion_tokens"], item["images"], item["cost_usd"]) = row
+    # 事前生成（src/pregen.py）のトークン数・費用は生成した日に計上する
+    for day, (prompt, completion, cost) in _grouped(
+            db, PregeneratedRecipe.created_at, since,
+            func.coalesce(func.sum(PregeneratedRecipe.prompt_tokens), 0),
+            func.coalesce(func.sum(PregeneratedRecipe.completion_tokens), 0),
+            func.coalesce(func.sum(PregeneratedRecipe.cost_usd), 0.0)):
+        item = days[day]
+        item["prompt_tokens"] += prompt
+        item["completion_tokens"] += completion
+        item["cost_usd"] += cost
+    for day, (count,) in _grouped(db, User.created_at, since, func.count()):
+        days[day]["users_created"] = count
+    for day, (count,) in _grouped(db, Subscription.start_date, since, func.count()):
+        days[day]["subscriptions_started"] = count
+    for day, (count,) in _grouped(db, Subscription.end_date, since, func.count()):
+        days[day]["subscriptions_ended"] = count
+
+    # 物理削除（src/purge.py）したレシピは元のテーブルに残らないので、
+    # レシピの作成数・削除数は記録済みの値より小さくしない
+    stmt = select(DailyStat.day, DailyStat.recipes_created, DailyStat.recipes_deleted)
+    if since is not None:
+        stmt = stmt.where(DailyStat.day >= since)
+    for day, created, deleted in db.execute(stmt):
+        if created or deleted:
+            item = days[day]
+            item["recipes_created"] = max(item["recipes_created"], created)
+            item["recipes_deleted"] = max(item["recipes_deleted"], deleted)
+
+    stmt = delete(DailyStat)
+    if since is not None:
+        stmt = stmt.where(DailyStat.day >= since)
+    db.execute(stmt)
+    if days:
+        db.execute(insert(DailyStat), [{"day": day, **item} for day, item in sorted(days.items())])
+    db.commit()
+    return len(days)
+
+
+def daily_stats(db: Session, start: date, end: date) -> dict:
+    """start〜end（両端を含む）の日ごとの集計と合計"""
+    rows = {
+        row.day: row
+        for row in db.execute(
+            select(DailyStat).where(DailyStat.day >= start, DailyStat.day <= end)
+        ).scalars()
+    }
+    active = db.execute(
+        select(func.coalesce(
+            func.sum(DailyStat.subscriptions_started - DailyStat.subscriptions_ended), 0))
+        .where(DailyStat.day < start)
+    ).scalar()
+
+    active_at_start = active
+    totals = dict.fromkeys(DailyStat.COUNTERS, 0)
+    result = []
+    day = start
+    while day <= end:
+        row = rows.get(day)
+        item = {name: getattr(row, name) if row else 0 for name in DailyStat.COUNTERS}
+        for name in DailyStat.COUNTERS:
+            totals[name] += item[name]
+        ended = item["subscriptions_ended"]
+        item.update({
+            "day": day,
+            "avg_generation_latency_ms": (
+                item["generation_latency_ms"] / item["generations"] if item["generations"] else None),
+            "churn_rate": ended / active if active > 0 else None,
+        })
+        active += item["subscriptions_started"] - ended
+        item["active_subscriptions"] = active
+        result.append(item)
+        day += timedelta(days=1)
+
+    totals.update({
+        "avg_generation_latency_ms": (
+            totals["generation_latency_ms"] / totals["generations"] if totals["generations"] else None),
+        "churn_rate": (
+            totals["subscriptions_ended"] / active_at_start if active_at_start > 0 else None),
+        "active_subscriptions": active,
+    })
+    return {"start": start, "end": end, "days": result, "totals": totals}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the daily analytics rollups.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild")
+    p_rebuild.add_argument("--days", type=int, default=7, help="rebuild the last N days")
+    p_rebuild.add_argument("--all", action="store_true", help="rebuild the whole history")
+    p_show = sub.add_parser("show")
+    p_show.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+    db = SessionLocal()
+    try:
+        today = datetime.utcnow().date()
+        if args.command == "rebuild":
+            since = None if args.all else today - timedelta(days=args.days - 1)
+            print(f"Rebuilt {rebuild(db, since)} days")
+        else:
+            stats = daily_stats(db, today - timedelta(days=args.days - 1), today)
+            print(json.dumps(stats, default=str, ensure_ascii=False, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
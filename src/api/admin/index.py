@@ -0,0 +1,119 @@
+import os
+from datetime import date, datetime, timedelta
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.orm import Session
+from src import analytics
+from src.api_models import AdminStatsRead
+from src.db_models import User
+from src.get_conn import SessionLocal, get_db
+from src.responses import ORJSONResponse
+from src.utils import verify_access_token
+from dotenv import load_dotenv
+
+# .env をロード
+load_dotenv()
+
+router = APIRouter()
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
+
+# 管理 API を使えるユーザー（カンマ区切りのメールアドレス）
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+MAX_STATS_DAYS = 366
+MAX_USERS_PAGE = 10000
+
+
+def _get_admin(db: Session, token: str) -> User:
+    """トークンを確認し、ADMIN_EMAILS に含まれるユーザーだけを通す"""
+    payload = verify_access_token(token)
+
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    email = payload.get("sub")
+    user = User.get_user(db=db, email=email)
+    if not user:
+        raise HTTPException(
+            status_code=401, detail="User not found"
+        )
+    if user.disabled:
+        raise HTTPException(
+            status_code=403, detail="User account is disabled")
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return user
+
+
+@router.get("/stats", response_model=AdminStatsRead, response_class=ORJSONResponse)
+# 日ごとの集計（レシピ作成数・生成レイテンシ・費用・有効サブスクリプション数・解約率など）。daily_stats の日数分の行だけを読む
+async def get_stats(
+    days: int = Query(30, ge=1, le=MAX_STATS_DAYS),
+    end: date | None = None,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        _get_admin(db, token)
+        end = end or datetime.utcnow().date()
+        return ORJSONResponse(
+            analytics.daily_stats(db, end - timedelta(days=days - 1), end))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve stats: {str(e)}"
+        )
+
+
+@router.get("/users")
+# ユーザー一覧（ID順、after_id で次のページ。1行1ユーザーの NDJSON をカーソルから直接ストリーミング）
+async def list_users(
+    request: Request,
+    after_id: int = 0,
+    limit: int = Query(100, ge=1, le=MAX_USERS_PAGE),
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        _get_admin(db, token)
+
+        # 次ページの位置はインデックスだけで先に求め、ヘッダーで返す
+        count, last_id = User.get_page_end(db, after_id, limit)
+        headers = {"Cache-Control": "no-store"}
+        if count == limit:
+            headers["X-Next-After-Id"] = str(last_id)
+            headers["Link"] = (
+                f'<{request.url.include_query_params(after_id=last_id)}>; rel="next"')
+
+        reader = getattr(db, "reader", None)
+
+        def rows():
+            # 依存注入のセッションは応答の送信前に閉じられるので、同じ読み取り先で開き直す
+            stream_db = SessionLocal(reader=reader)
+            try:
+                result = User.get_users(stream_db, after_id=after_id, limit=limit)
+                # 1行ずつではなくカーソルのバッチ単位で書き出す
+                for batch in result.partitions():
+                    yield b"".join(
+                        orjson.dumps(row._asdict(), option=orjson.OPT_APPEND_NEWLINE)
+                        for row in batch)
+            finally:
+                stream_db.close()
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson", headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to list users: {str(e)}"
+        )
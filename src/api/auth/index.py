@@ -5,7 +5,8 @@ from src.db_models import User
 from src.get_conn import get_db
 from typing import Annotated
 from src.utils import create_access_token, verify_access_token
-from src.api_models import UserCreate, LoginRequest, TokenResponse, LogoutResponse, UserResponse, UserRead
+from src.api_models import UserCreate, LoginRequest, TokenResponse, LogoutResponse, UserResponse, UserRead, UsageRead
+from src import quota
 from jose import JWTError
 
 router = APIRouter()
@@ -33,7 +34,7 @@ async def get_token(
             detail="Inactive user",
         )
 
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "uid": user.id})
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -81,7 +82,7 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=403, detail="User account is disabled")
 
     try:
-        access_token = create_access_token(data={"sub": user.email})
+        access_token = create_access_token(data={"sub": user.email, "uid": user.id})
         return {"access_token": access_token, "token_type": "bearer"}
     except Exception as e:
         raise HTTPException(
@@ -125,3 +126,36 @@ async def get_user_info(
             status_code=500,
             detail=f"Failed to get user information: {str(e)}"
         )
+
+
+@router.get("/usage", response_model=UsageRead)
+# 自分のプラン・残りの生成回数・利用量（トークン数・画像枚数・概算費用）
+async def get_usage(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        payload = verify_access_token(token)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        email = payload.get("sub")
+        user = User.get_user(db=db, email=email)
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        if user.disabled:
+            raise HTTPException(
+                status_code=403, detail="User account is disabled")
+
+        return quota.usage_summary(db, user)
+
+    except HTTPException:
+        raise
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get usage: {str(e)}"
+        )
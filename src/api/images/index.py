@@ -0,0 +1,73 @@
+import os
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from src import image_store
+from dotenv import load_dotenv
+
+# .env をロード
+load_dotenv()
+
+router = APIRouter()
+
+# ファイル名が内容のハッシュなので、同じ URL の内容は変わらない
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# nginx などの前段に配信を任せる場合の internal location（例: /_images/）。
+# 設定すると本文は返さず X-Accel-Redirect だけを返し、前段が sendfile と Range を処理する
+ACCEL_REDIRECT_PREFIX = os.getenv("IMAGE_ACCEL_REDIRECT_PREFIX", "")
+# 1回の読み込み・送信の大きさ（FileResponse の既定 64KB だと 1.5MB の画像でスレッドの往復が 20回を超える）
+CHUNK_SIZE = int(os.getenv("IMAGE_SEND_CHUNK_BYTES", str(256 * 1024)))
+
+
+class ImageFileResponse(FileResponse):
+    chunk_size = CHUNK_SIZE
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """If-None-Match（あればこちらを優先）/ If-Modified-Since を満たせば True"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # Last-Modified は秒単位なので切り捨てて比べる
+        return int(mtime) <= since.timestamp()
+    return False
+
+
+@router.api_route("/{name}", methods=["GET", "HEAD"])
+# 保存済み画像の配信（名前が推測できない内容のハッシュなので、<img> から使えるようトークンは不要）
+async def get_image(name: str, request: Request):
+    path = image_store.path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    digest, ext = image_store.parse_name(name)
+    etag = f'"{digest}"'
+    headers = {
+        "cache-control": CACHE_CONTROL,
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+    if _not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = image_store.CONTENT_TYPES[ext]
+    if ACCEL_REDIRECT_PREFIX:
+        headers["x-accel-redirect"] = ACCEL_REDIRECT_PREFIX + image_store.relative_path(name)
+        return Response(media_type=media_type, headers=headers)
+    # 本文はメモリに読み込まずチャンク単位で送る（Range / If-Range も FileResponse が処理し、
+    # サーバーが http.response.pathsend に対応していればファイルのパスだけを渡す）
+    return ImageFileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
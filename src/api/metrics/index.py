@@ -0,0 +1,66 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from src import cache, metrics, resilience
+from src.llm_router import get_router
+
+router = APIRouter()
+
+# Prometheus 用（アプリのルートに prefix なしでマウントする）
+prometheus_router = APIRouter()
+
+BREAKER_STATE_VALUES = {
+    resilience.CLOSED: 0,
+    resilience.HALF_OPEN: 1,
+    resilience.OPEN: 2,
+}
+
+
+def _breaker_states() -> dict:
+    return {
+        (name,): BREAKER_STATE_VALUES[state["state"]]
+        for name, state in resilience.breaker_states().items()
+    }
+
+
+def _cache_requests() -> dict:
+    stats = cache.response_cache.stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+
+def _cache_hit_ratio() -> dict:
+    return {(): cache.response_cache.stats()["hit_ratio"]}
+
+
+metrics.registry.register(metrics.CallbackMetric(
+    "circuit_breaker_state",
+    "Circuit breaker state (0=closed, 1=half_open, 2=open)",
+    ("name",), _breaker_states))
+metrics.registry.register(metrics.CallbackMetric(
+    "response_cache_requests_total",
+    "Response cache lookups by result",
+    ("result",), _cache_requests, kind="counter"))
+metrics.registry.register(metrics.CallbackMetric(
+    "response_cache_hit_ratio",
+    "Response cache hit ratio since start",
+    (), _cache_hit_ratio))
+
+
+@prometheus_router.get("/metrics", response_class=PlainTextResponse)
+# Prometheus テキスト形式のメトリクス
+def get_metrics():
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@router.get("/breakers")
+# 外部連携ごとのサーキットブレーカーの状態
+def get_breakers():
+    return resilience.breaker_states()
+
+
+@router.get("/llm-deployments")
+# デプロイメントごとの観測レイテンシ・エラー率
+def get_llm_deployments():
+    return get_router().stats()
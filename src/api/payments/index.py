@@ -1,36 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
 from sqlalchemy.orm import Session
+import hashlib
 import os
-import stripe
+import uuid
 
 from src.get_conn import get_db
 from src.db_models import Subscription, User
-from datetime import datetime
+from src import idempotency, integrations, resilience
 
 router = APIRouter()
 
-stripe.api_key = os.getenv("STRIPE_API_KEY")
+
+def stripe_failures() -> tuple:
+    """上流障害として扱う Stripe の例外（4xx 系の InvalidRequestError などは含めない）"""
+    stripe = integrations.get_stripe()
+    return (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+
+def stripe_call(fn, idempotent: bool = True):
+    """Stripe API 呼び出しを期限・リトライ・ブレーカーで包む（各試行のタイムアウトは残り時間まで）"""
+    def attempt(timeout: float):
+        with integrations.stripe_timeout(timeout):
+            return fn()
+
+    try:
+        return resilience.call(
+            "stripe",
+            attempt,
+            deadline_s=float(os.getenv("STRIPE_DEADLINE_SECONDS", "20")),
+            idempotent=idempotent,
+            failure_on=stripe_failures(),
+        )
+    except resilience.CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except resilience.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 
 @router.get("/plans")
 def list_plans(db: Session = Depends(get_db)):
-    plans = stripe.Price.list(limit=10)
+    stripe = integrations.get_stripe()
+    plans = stripe_call(lambda: stripe.Price.list(limit=10))
     return plans
 
 
 @router.post("/create-checkout-session")
-def create_checkout_session(stripe_plan_id: str, user_email: str, db: Session = Depends(get_db)):
+def create_checkout_session(
+    stripe_plan_id: str,
+    user_email: str,
+    db: Session = Depends(get_db),
+    idempotency_key: str | None = Header(default=None, alias=idempotency.HEADER),
+):
     """
     Create a Stripe Checkout Session for a given plan and user email.
     The `StripePlan.stripe_plan_id` is expected to be a Stripe Price ID or Price/Product identifier.
+    With an `Idempotency-Key` header, retries return the session created by the first request.
     """
+    if idempotency_key is None:
+        return _create_checkout_session(stripe_plan_id, user_email, str(uuid.uuid4()))
+
+    # Stripe 側にもクライアントのキー由来の値を渡し、保存期間を過ぎた再送でも二重作成しない
+    stripe_key = hashlib.sha256(
+        f"checkout:{user_email}:{idempotency_key}".encode()).hexdigest()
+    return idempotency.get_store().run(
+        "checkout", user_email, idempotency_key,
+        {"stripe_plan_id": stripe_plan_id},
+        lambda: _create_checkout_session(stripe_plan_id, user_email, stripe_key),
+    )
+
+
+def _create_checkout_session(stripe_plan_id: str, user_email: str, idempotency_key: str) -> dict:
+    stripe = integrations.get_stripe()
     if not stripe.api_key:
         raise HTTPException(
             status_code=500, detail="Stripe API key not configured")
 
     try:
-        stripe.Price.retrieve(stripe_plan_id)
-    except stripe.error.InvalidRequestError:
+        stripe_call(lambda: stripe.Price.retrieve(stripe_plan_id))
+    except stripe.InvalidRequestError:
         raise HTTPException(status_code=404, detail="Price not found")
 
     try:
@@ -39,7 +86,8 @@ def create_checkout_session(stripe_plan_id: str, user_email: str, db: Session =
         cancel_url = os.getenv(
             "STRIPE_CANCEL_URL") or "https://example.com/cancel"
 
-        session = stripe.checkout.Session.create(
+        # 同じ idempotency_key で送るのでリトライしても二重作成されない
+        session = stripe_call(lambda: stripe.checkout.Session.create(
             payment_method_types=["card"],
             mode="subscription",
             line_items=[{"price": stripe_plan_id, "quantity": 1}],
@@ -47,18 +95,30 @@ def create_checkout_session(stripe_plan_id: str, user_email: str, db: Session =
             success_url=success_url,
             cancel_url=cancel_url,
             metadata={"plan_id": stripe_plan_id},
-        )
+            idempotency_key=idempotency_key,
+        ))
 
         return {"checkout_session_id": session.id, "checkout_url": session.url}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def subscription_price_id(data: dict) -> str | None:
+    """subscription オブジェクトの最初の item の Price ID"""
+    items = (data.get("items") or {}).get("data") or []
+    if not items:
+        return None
+    return (items[0].get("price") or {}).get("id")
+
+
 @router.post("/webhook")
 async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
     webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+    stripe = integrations.get_stripe()
 
     # stripe-signature header must be present for verification
     if not sig_header:
@@ -93,7 +153,7 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
                 raise HTTPException(
                     status_code=400, detail="Missing plan_id or email")
 
-            user = User.get_user_by_email(db=db, email=customer_email)
+            user = User.get_user(db=db, email=customer_email)
             if not user:
                 raise HTTPException(
                     status_code=404, detail=f"User not found: {customer_email}")
@@ -105,15 +165,13 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
             if existing_sub:
                 return {"status": "duplicate_event"}
 
-            new_sub = Subscription(
+            Subscription.start(
+                db,
                 user_id=user.id,
-                stripe_plan_id=plan_id,
+                stripe_price_id=plan_id,
                 stripe_customer_id=data.get("customer"),
                 stripe_subscription_id=data.get("subscription"),
-                status="active",
-                start_date=datetime.utcnow(),
             )
-            db.add(new_sub)
             db.commit()
 
         # === Subscription更新 ===
@@ -127,9 +185,11 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
                 db=db, stripe_subscription_id=stripe_sub_id)
 
             if sub:
-                sub.status = data.get("status")
-                if sub.status in ("canceled", "unpaid", "past_due"):
-                    sub.end_date = datetime.utcnow()
+                sub.set_status(db, data.get("status"))
+                # プラン変更（クォータの判定に使う Price ID）
+                price_id = subscription_price_id(data)
+                if price_id:
+                    sub.stripe_price_id = price_id
                 db.commit()
 
         # === Invoice支払いイベント ===
@@ -138,7 +198,8 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
             sub = Subscription.get_subscription_by_stripe_subscription_id(
                 db=db, stripe_subscription_id=stripe_sub_id)
             if sub:
-                sub.status = (
+                sub.set_status(
+                    db,
                     "active"
                     if evt_type == "invoice.payment_succeeded"
                     else "past_due"
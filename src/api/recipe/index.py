@@ -1,11 +1,23 @@
+from datetime import datetime
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from src.db_models import User, Image, Recipe
-from src.get_conn import get_db
+from src.db_models import User, Image, Recipe, RecipeNutrition, RecipeVersion
+from src.get_conn import SessionLocal, get_db
 from src.utils import verify_access_token
-from src.api_models import RecipeResponse, RecipeRead, EditedRecipe
+from src.api_models import (
+    RecipeResponse, RecipeRead, RecipeSummary, EditedRecipe, RecipeBulkDelete, RecipeBulkDeleteResponse,
+    RecipeVersionInfo, RecipeVersionRead, RecipeSimilar, MealPlanRequest, MealPlanRead,
+    ImageRead, ImageRegenerateResponse,
+)
 from src.api.payments.index import create_checkout_session
+from src import (
+    cache, export, idempotency, image_variants, llm, meal_plan, metrics, pregen, quota, resilience,
+    similar,
+)
+from src.responses import ORJSONResponse
+from src.tracing import span
 
 router = APIRouter()
 app = FastAPI()
@@ -13,10 +25,113 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
 
 @router.post("/create-recipe", response_model=RecipeResponse)
-# レシピ生成
-async def create_recipe(
+# レシピ生成（LLM・画像APIを同期で呼ぶので def にしてスレッドプールで実行する）
+def create_recipe(
     title: str,
     token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+    idempotency_key: str | None = Header(default=None, alias=idempotency.HEADER)
+):
+    try:
+        with span("create_recipe.auth"):
+            payload = verify_access_token(token)
+
+            if not payload:
+                raise HTTPException(status_code=401, detail="Invalid token")
+
+            email = payload.get("sub")
+            user = User.get_user(db=db, email=email)
+            if not user:
+                raise HTTPException(
+                    status_code=401, detail="User not found"
+                )
+            if user.disabled:
+                raise HTTPException(
+                    status_code=403, detail="User account is disabled")
+
+        def generate():
+            # プランの日・月の上限を確認して1回分を確保する（UPSERT 1回。超過なら 429）
+            reservation = quota.reserve(db, user)
+            # 各段階（生成・保存・画像生成）は registry_recipe / registry_image 内のスパンで計測する
+            with span("create_recipe", user_id=user.id):
+                try:
+                    # ピーク時間帯は事前生成した結果があれば生成せずに割り当てる
+                    assigned = (pregen.assign(db, title, user.id)
+                                if pregen.should_assign() else None)
+                    if assigned is not None:
+                        if assigned["image_url"]:
+                            image_variants.schedule(
+                                SessionLocal, assigned["recipe_id"],
+                                quota.image_variants_for(reservation.plan))
+                        return {
+                            "message": "Recipe and image created successfully",
+                            "recipe_id": assigned["recipe_id"],
+                            "image_url": assigned["image_url"],
+                        }
+                    recipe_result = Recipe.registry_recipe(
+                        title=title,
+                        user_id=user.id,
+                        db=db
+                    )
+                except Exception:
+                    # レシピが保存されなければ回数に数えない
+                    db.rollback()
+                    quota.release(db, reservation)
+                    raise
+                image_result = Image.registry_image(
+                    recipe=recipe_result["content"],
+                    recipe_id=recipe_result["recipe_id"],
+                    db=db,
+                    generation_log_id=recipe_result["generation_log_id"],
+                )
+            # 最初の画像を保存した後、再生成用の画像をバックグラウンドで作っておく
+            image_variants.schedule(
+                SessionLocal, recipe_result["recipe_id"], quota.image_variants_for(reservation.plan))
+
+            return {
+                "message": "Recipe and image created successfully",
+                "recipe_id": recipe_result["recipe_id"],
+                "image_url": image_result.image_url
+            }
+
+        if idempotency_key is None:
+            return generate()
+        # クライアントの再送で有料の生成が二重に走らないよう、同じキーには同じ応答を返す
+        return idempotency.get_store().run(
+            "create-recipe", user.id, idempotency_key, {"title": title}, generate,
+            response_model=RecipeResponse)
+
+    except HTTPException:
+        raise
+    except resilience.CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except llm.GenerationTruncated as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=str(e)
+        )
+    except resilience.DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to registry Recipe: {str(e)}"
+        )
+
+
+@router.get("/user-recipes", response_model=list[RecipeRead] | list[RecipeSummary],
+            response_class=ORJSONResponse)
+# ログインユーザーのレシピ一覧（summary=true なら本文を含まず、本文の読み込み・展開もしない）
+async def get_user_recipes(
+    request: Request,
+    summary: bool = False,
+    token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
     try:
@@ -35,35 +150,81 @@ async def create_recipe(
             raise HTTPException(
                 status_code=403, detail="User account is disabled")
 
-        recipe_result = Recipe.registry_recipe(
-            title=title,
-            user_id=user.id,
-            db=db
+        # 一覧が変わっていなければ 304 / キャッシュ済みボディを返す
+        etag = Recipe.get_user_recipes_etag(db=db, user_id=user.id)
+        if summary:
+            return cache.cached_json_response(
+                request,
+                cache.user_recipe_summaries_key(user.id),
+                etag[:-1] + '-s"',
+                lambda: Recipe.get_recipe_summaries_by_user(user_id=user.id, db=db),
+            )
+        return cache.cached_json_response(
+            request,
+            cache.user_recipes_key(user.id),
+            etag,
+            lambda: Recipe.get_recipes_by_user(user_id=user.id, db=db),
         )
-        image_result = Image.registry_image(
-            recipe=recipe_result["content"],
-            recipe_id=recipe_result["recipe_id"],
-            db=db
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve recipes: {str(e)}"
         )
 
-        return {
-            "message": "Recipe and image created successfully",
-            "recipe_id": recipe_result["recipe_id"],
-            "image_url": image_result.image_url
-        }
+
+@router.get("/recipe/{recipe_id}", response_model=RecipeRead, response_class=ORJSONResponse)
+async def get_recipe(
+    recipe_id: int,
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    # レシピ詳細
+    try:
+        payload = verify_access_token(token)
+
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        email = payload.get("sub")
+        user = User.get_user(db=db, email=email)
+        if not user:
+            raise HTTPException(
+                status_code=401, detail="User not found"
+            )
+        if user.disabled:
+            raise HTTPException(
+                status_code=403, detail="User account is disabled")
+
+        etag = Recipe.get_recipe_etag(db=db, recipe_id=recipe_id)
+        if not etag:
+            raise HTTPException(status_code=404, detail="Recipe not found")
+
+        return cache.cached_json_response(
+            request,
+            cache.recipe_key(recipe_id),
+            etag,
+            lambda: Recipe.get_recipe_by_id(recipe_id=recipe_id, db=db),
+        )
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to registry Recipe: {str(e)}"
+            detail=f"Failed to retrieve recipe: {str(e)}"
         )
 
 
-@router.get("/user-recipes", response_model=list[RecipeRead])
-# ログインユーザーのレシピ一覧
-async def get_user_recipes(
+@router.get("/recipe/{recipe_id}/similar", response_model=list[RecipeSimilar],
+            response_class=ORJSONResponse)
+# 類似レシピ（埋め込みのコサイン類似度が高い順）
+async def get_similar_recipes(
+    recipe_id: int,
+    limit: int = Query(10, ge=1, le=50),
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
@@ -83,26 +244,111 @@ async def get_user_recipes(
             raise HTTPException(
                 status_code=403, detail="User account is disabled")
 
-        recipes = Recipe.get_recipes_by_user(user_id=user.id, db=db)
+        if not Recipe.get_recipe_etag(db=db, recipe_id=recipe_id):
+            raise HTTPException(status_code=404, detail="Recipe not found")
 
-        return recipes
+        with span("similar_recipes", recipe_id=recipe_id, limit=limit):
+            results = similar.get_index().similar(db, [recipe_id], limit)[0]
+        return ORJSONResponse(results)
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to retrieve recipes: {str(e)}"
+            detail=f"Failed to retrieve similar recipes: {str(e)}"
         )
 
 
-@router.get("/recipe/{recipe_id}", response_model=RecipeRead)
-async def get_recipe(
+@router.post("/meal-plan", response_model=MealPlanRead, response_class=ORJSONResponse)
+# 保存済みのレシピから栄養目標に近い1日の献立を組む（足りない分を LLM で生成することがあるので def）
+def create_meal_plan(
+    body: MealPlanRequest,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        payload = verify_access_token(token)
+
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        email = payload.get("sub")
+        user = User.get_user(db=db, email=email)
+        if not user:
+            raise HTTPException(
+                status_code=401, detail="User not found"
+            )
+        if user.disabled:
+            raise HTTPException(
+                status_code=403, detail="User account is disabled")
+
+        targets = body.targets.model_dump(exclude_none=True) if body.targets else None
+        with span("meal_plan", scope=body.scope, meals=body.meals):
+            result = meal_plan.plan(
+                db, user.id, targets, body.meals, body.scope, body.exclude_recipe_ids)
+
+        outcome = "pool"
+        if not result["within_tolerance"] or len(result["meals"]) < body.meals:
+            outcome = "gap"
+            if body.generate_missing:
+                # 足りない分だけを LLM で生成する（栄養価を読み取れるよう JSON モード、画像は作らない）
+                index, needed = meal_plan.gap_to_fill(result, body.meals)
+                reservation = quota.reserve(db, user)
+                try:
+                    recipe_result = Recipe.registry_recipe(
+                        title=meal_plan.gap_theme(needed),
+                        user_id=user.id,
+                        db=db,
+                        mode=llm.JSON_MODE,
+                    )
+                except Exception:
+                    db.rollback()
+                    quota.release(db, reservation)
+                    raise
+                recipe_id = recipe_result["recipe_id"]
+                stored = db.get(RecipeNutrition, recipe_id)
+                nutrition = ({key: getattr(stored, key) for key in RecipeNutrition.NUTRIENTS}
+                             if stored is not None else None)
+                result = meal_plan.apply_generated(
+                    result, index, recipe_id, db.get(Recipe, recipe_id).title, nutrition)
+                outcome = "generated"
+        metrics.meal_plans.inc(outcome)
+        return ORJSONResponse(result)
+
+    except HTTPException:
+        raise
+    except resilience.CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except llm.GenerationTruncated as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=str(e)
+        )
+    except resilience.DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create meal plan: {str(e)}"
+        )
+
+
+@router.post("/recipe/{recipe_id}/regenerate-image", response_model=ImageRegenerateResponse,
+             response_class=ORJSONResponse)
+# 画像の再生成（作り置きの画像があれば画像APIを待たずに使う。生成1回としてクォータに数える。
+# 作り置きが無ければ画像APIを同期で呼ぶので def）
+def regenerate_image(
     recipe_id: int,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ):
-    # レシピ詳細
     try:
         payload = verify_access_token(token)
 
@@ -119,18 +365,61 @@ async def get_recipe(
             raise HTTPException(
                 status_code=403, detail="User account is disabled")
 
-        recipe = Recipe.get_recipe_by_id(recipe_id=recipe_id, db=db)
-        if not recipe:
+        recipe_obj = Recipe.get_recipe_by_recipe_id(db=db, recipe_id=recipe_id)
+        if not recipe_obj:
             raise HTTPException(status_code=404, detail="Recipe not found")
 
-        return recipe
+        if recipe_obj.user_id != user.id:
+            raise HTTPException(
+                status_code=403, detail="Not authorized to regenerate the image of this recipe"
+            )
+
+        reservation = quota.reserve(db, user)
+        with span("regenerate_image", recipe_id=recipe_id):
+            try:
+                image = image_variants.promote(db, recipe_id)
+                source = "variant"
+                if image is None:
+                    # 作り置きが無ければその場で生成する
+                    image = Image.registry_image(
+                        recipe=Recipe.render_content(
+                            recipe_obj.markdown_content, recipe_obj.content_format),
+                        recipe_id=recipe_id,
+                        db=db,
+                        regenerated=True,
+                    )
+                    source = "generated"
+            except Exception:
+                db.rollback()
+                quota.release(db, reservation)
+                raise
+        metrics.image_regenerations.inc(source)
+        # 使った分を補充する
+        image_variants.schedule(SessionLocal, recipe_id, quota.image_variants_for(reservation.plan))
+
+        return ORJSONResponse({
+            "message": "Image regenerated successfully",
+            "recipe_id": recipe_id,
+            "image": ImageRead.model_validate(image).model_dump(),
+            "source": source,
+        })
 
     except HTTPException:
         raise
+    except resilience.CircuitOpenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    except resilience.DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to retrieve recipe: {str(e)}"
+            detail=f"Failed to regenerate image: {str(e)}"
         )
 
 
@@ -186,10 +475,117 @@ async def update_recipe(
             detail=f"Failed to update Recipe: {str(e)}"
         )
 
-# レシピ削除
+
+def _get_own_recipe(db: Session, token: str, recipe_id: int, action: str) -> Recipe:
+    """トークンを確認し、自分のレシピを返す（履歴の参照・復元用）"""
+    payload = verify_access_token(token)
+
+    if not payload:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    email = payload.get("sub")
+    user = User.get_user(db=db, email=email)
+    if not user:
+        raise HTTPException(
+            status_code=401, detail="User not found"
+        )
+    if user.disabled:
+        raise HTTPException(
+            status_code=403, detail="User account is disabled")
+
+    recipe_obj = Recipe.get_recipe_by_recipe_id(db=db, recipe_id=recipe_id)
+    if not recipe_obj:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+
+    if recipe_obj.user_id != user.id:
+        raise HTTPException(
+            status_code=403, detail=f"Not authorized to {action} this recipe"
+        )
+    return recipe_obj
+
+
+@router.get("/recipe/{recipe_id}/versions", response_model=list[RecipeVersionInfo],
+            response_class=ORJSONResponse)
+# 編集履歴の一覧（新しい順、本文は含まない）
+async def list_recipe_versions(
+    recipe_id: int,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        _get_own_recipe(db, token, recipe_id, "view the history of")
+        return ORJSONResponse(RecipeVersion.list_versions(db=db, recipe_id=recipe_id))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve versions: {str(e)}"
+        )
+
+
+@router.get("/recipe/{recipe_id}/versions/{version}", response_model=RecipeVersionRead,
+            response_class=ORJSONResponse)
+# 過去のバージョンの内容
+async def get_recipe_version(
+    recipe_id: int,
+    version: int,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        _get_own_recipe(db, token, recipe_id, "view the history of")
+        found = RecipeVersion.get_version(db=db, recipe_id=recipe_id, version_no=version)
+        if not found:
+            raise HTTPException(status_code=404, detail="Version not found")
+
+        return ORJSONResponse({
+            "version": found["version"],
+            "title": found["title"],
+            "markdown_content": Recipe.render_content(
+                found["markdown_content"], found["content_format"]),
+            "created_at": found["created_at"],
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve version: {str(e)}"
+        )
+
+
+@router.post("/recipe/{recipe_id}/versions/{version}/restore", response_model=RecipeResponse)
+# 過去のバージョンに戻す
+async def restore_recipe_version(
+    recipe_id: int,
+    version: int,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        _get_own_recipe(db, token, recipe_id, "update")
+        if not Recipe.restore_version(db=db, recipe_id=recipe_id, version_no=version):
+            raise HTTPException(status_code=404, detail="Version not found")
+
+        return {
+            "message": "Recipe restored successfully",
+            "recipe_id": recipe_id
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to restore Recipe: {str(e)}"
+        )
 
 
 @router.delete("/recipe/{recipe_id}", response_model=RecipeResponse)
+# レシピ削除（論理削除。画像などは purge ワーカーが後で消す）
 async def delete_recipe(
     recipe_id: int,
     token: str = Depends(oauth2_scheme),
@@ -220,7 +616,7 @@ async def delete_recipe(
                 status_code=403, detail="Not authorized to delete this recipe"
             )
 
-        Recipe.delete_recipe(db=db, recipe_id=recipe_id)
+        Recipe.delete_recipe(db=db, recipe_id=recipe_id, user_id=user.id)
 
         return {
             "message": "Recipe deleted successfully",
@@ -234,3 +630,104 @@ async def delete_recipe(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete Recipe: {str(e)}"
         )
+
+
+@router.post("/bulk-delete", response_model=RecipeBulkDeleteResponse)
+# レシピの一括削除（UPDATE 1回。自分のレシピ以外のIDは not_found に入る）
+async def bulk_delete_recipes(
+    form_data: RecipeBulkDelete,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        payload = verify_access_token(token)
+
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        email = payload.get("sub")
+        user = User.get_user(db=db, email=email)
+        if not user:
+            raise HTTPException(
+                status_code=401, detail="User not found"
+            )
+        if user.disabled:
+            raise HTTPException(
+                status_code=403, detail="User account is disabled")
+
+        deleted = Recipe.delete_recipes(
+            db=db, recipe_ids=form_data.recipe_ids, user_id=user.id)
+        deleted_set = set(deleted)
+
+        return {
+            "message": "Recipes deleted successfully",
+            "deleted": deleted,
+            "not_found": sorted(set(form_data.recipe_ids) - deleted_set),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to delete Recipes: {str(e)}"
+        )
+
+
+@router.get("/export")
+# レシピ一式のエクスポート（NDJSON / ZIP をカーソルから直接ストリーミング。after_id で続きから再開）
+async def export_recipes(
+    format: str = "ndjson",
+    images: bool = True,
+    after_id: int = 0,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    try:
+        payload = verify_access_token(token)
+
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        email = payload.get("sub")
+        user = User.get_user(db=db, email=email)
+        if not user:
+            raise HTTPException(
+                status_code=401, detail="User not found"
+            )
+        if user.disabled:
+            raise HTTPException(
+                status_code=403, detail="User account is disabled")
+
+        if format not in export.FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported format: {format} (ndjson or zip)")
+
+        # 依存注入のセッションは応答の送信前に閉じられるので、ストリーム用に同じ読み取り先で開き直す
+        reader = getattr(db, "reader", None)
+        filename = f"recipes-{user.id}-{datetime.utcnow():%Y%m%d}"
+        if after_id:
+            filename += f"-after-{after_id}"
+        return StreamingResponse(
+            export.stream(
+                format,
+                lambda: SessionLocal(reader=reader),
+                user.id,
+                after_id=after_id,
+                include_images=images,
+            ),
+            media_type=export.FORMATS[format],
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}.{format}"',
+                "Cache-Control": "no-store",
+            },
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to export Recipes: {str(e)}"
+        )
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from datetime import datetime
+from typing import Literal
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import date, datetime
 
 # ------------------------------
 # Login Models
@@ -44,8 +45,7 @@ class UserRead(UserBase):
     id: int = Field(..., example="1")
     created_at: datetime = Field(..., example=datetime.utcnow())
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserResponse(BaseModel):
@@ -53,6 +53,30 @@ class UserResponse(BaseModel):
     user_id: int = Field(..., example="1")
 
 
+class QuotaRead(BaseModel):
+    # None は無制限
+    limit: int | None = Field(..., example=50)
+    used: int = Field(..., example=12)
+    remaining: int | None = Field(..., example=38)
+    resets_at: datetime = Field(..., example="2025-10-12T00:00:00Z")
+
+
+class UsageTotals(BaseModel):
+    generations: int = Field(..., example=12)
+    prompt_tokens: int = Field(..., example=2400)
+    completion_tokens: int = Field(..., example=18000)
+    images: int = Field(..., example=12)
+    cost_usd: float = Field(..., example=0.666)
+
+
+class UsageRead(BaseModel):
+    plan: str = Field(..., example="free")
+    daily: QuotaRead
+    monthly: QuotaRead
+    today: UsageTotals
+    this_month: UsageTotals
+
+
 # ------------------------------
 # Image Models
 # ------------------------------
@@ -67,8 +91,7 @@ class ImageRead(ImageBase):
     id: int = Field(..., example=1)
     created_at: datetime = Field(..., example="2025-10-11T12:34:56Z")
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ImageEdit(BaseModel):
@@ -77,8 +100,7 @@ class ImageEdit(BaseModel):
     is_regenerated: bool | None = Field(None, example=False)
     created_at: datetime | None = Field(None, example="2025-10-11T12:34:56Z")
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 # ------------------------------
 # Recipe Models
 # ------------------------------
@@ -89,14 +111,21 @@ class RecipeResponse(BaseModel):
     recipe_id: int = Field(..., example="1")
 
 
+class ImageRegenerateResponse(BaseModel):
+    message: str = Field(..., example="Image regenerated successfully")
+    recipe_id: int = Field(..., example=1)
+    image: ImageRead
+    # variant: 作り置きの画像を使った / generated: その場で生成した
+    source: str = Field(..., example="variant")
+
+
 class ImageInfo(BaseModel):
     id: int
     image_url: str
     is_regenerated: bool
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class RecipeBase(BaseModel):
@@ -114,8 +143,17 @@ class RecipeRead(RecipeBase):
         example=[{"id": 1, "image_url": "https://example.com/image1.jpg"}],
     )
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RecipeSummary(RecipeBase):
+    """一覧用（本文を含まない）"""
+    id: int = Field(..., example=1)
+    created_at: datetime = Field(..., example="2025-10-11T12:34:56Z")
+    images: list[ImageRead] = Field(
+        default_factory=list,
+        example=[{"id": 1, "image_url": "https://example.com/image1.jpg"}],
+    )
 
 
 class EditedRecipe(BaseModel):
@@ -129,8 +167,136 @@ class EditedRecipe(BaseModel):
         example=[{"id": 1, "image_url": "https://example.com/image1.jpg"}],
     )
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RecipeVersionInfo(BaseModel):
+    version: int = Field(..., example=3)
+    # "snapshot"（全文）または "delta"（直前との差分）
+    kind: str = Field(..., example="delta")
+    title: str = Field(..., example="Tomato Salad")
+    size: int = Field(..., example=120)
+    created_at: datetime = Field(..., example="2025-10-11T12:34:56Z")
+
+
+class RecipeVersionRead(BaseModel):
+    version: int = Field(..., example=3)
+    title: str = Field(..., example="Tomato Salad")
+    markdown_content: str = Field(...,
+                                  example="### How to make a simple tomato salad...")
+    created_at: datetime = Field(..., example="2025-10-11T12:34:56Z")
+
+
+class RecipeBulkDelete(BaseModel):
+    recipe_ids: list[int] = Field(..., min_length=1, max_length=1000, example=[1, 2, 3])
+
+
+class RecipeBulkDeleteResponse(BaseModel):
+    message: str = Field(..., example="Recipes deleted successfully")
+    deleted: list[int] = Field(..., example=[1, 2])
+    # 存在しない・削除済み・他人のレシピ
+    not_found: list[int] = Field(..., example=[3])
+
+
+class RecipeSimilar(BaseModel):
+    id: int = Field(..., example=42)
+    title: str = Field(..., example="Caprese Salad")
+    # コサイン類似度（1 に近いほど似ている）
+    score: float = Field(..., example=0.8731)
+
+
+class NutritionValues(BaseModel):
+    calories: float = Field(..., example=620.0)
+    protein: float = Field(..., example=28.5)
+    fat: float = Field(..., example=18.0)
+    carbohydrates: float = Field(..., example=85.0)
+    fiber: float = Field(..., example=7.0)
+    salt: float = Field(..., example=2.4)
+
+
+class NutritionTargets(BaseModel):
+    # 1日の目標。省略した栄養素は MEAL_PLAN_TARGETS / 既定値を使う
+    calories: float | None = Field(None, gt=0, example=1800.0)
+    protein: float | None = Field(None, gt=0, example=70.0)
+    fat: float | None = Field(None, gt=0, example=55.0)
+    carbohydrates: float | None = Field(None, gt=0, example=250.0)
+    fiber: float | None = Field(None, gt=0, example=21.0)
+    salt: float | None = Field(None, gt=0, example=7.0)
+
+
+class MealPlanRequest(BaseModel):
+    targets: NutritionTargets | None = None
+    meals: int = Field(3, ge=1, le=6, example=3)
+    # own: 自分のレシピだけ / all: 全ユーザーのレシピから選ぶ
+    scope: Literal["own", "all"] = Field("own", example="own")
+    exclude_recipe_ids: list[int] = Field(default_factory=list, max_length=1000, example=[12])
+    # 目標に届かないとき、不足分を補うレシピを1件だけ生成する（生成回数の上限に数える）
+    generate_missing: bool = Field(False, example=False)
+
+
+class MealPlanItem(BaseModel):
+    recipe_id: int = Field(..., example=42)
+    title: str = Field(..., example="Salmon Teriyaki Bowl")
+    # 生成したレシピの栄養価が読み取れなかったときは null
+    nutrition: NutritionValues | None = None
+    generated: bool = Field(..., example=False)
+
+
+class MealPlanRead(BaseModel):
+    meals: list[MealPlanItem]
+    targets: NutritionValues
+    totals: NutritionValues
+    # 目標 - 合計（正なら不足、負なら超過）
+    gap: NutritionValues
+    within_tolerance: bool = Field(..., example=True)
+    solve_ms: float = Field(..., example=18.4)
+
+# ------------------------------
+# Admin Models
+# ------------------------------
+
+
+class DailyStatRead(BaseModel):
+    day: date = Field(..., example="2025-10-11")
+    recipes_created: int = Field(..., example=120)
+    recipes_deleted: int = Field(..., example=4)
+    generations: int = Field(..., example=118)
+    generation_latency_ms: float = Field(..., example=1534000.0)
+    avg_generation_latency_ms: float | None = Field(..., example=13000.0)
+    prompt_tokens: int = Field(..., example=21240)
+    completion_tokens: int = Field(..., example=177000)
+    images: int = Field(..., example=116)
+    cost_usd: float = Field(..., example=6.46)
+    users_created: int = Field(..., example=8)
+    subscriptions_started: int = Field(..., example=3)
+    subscriptions_ended: int = Field(..., example=1)
+    active_subscriptions: int = Field(..., example=412)
+    # その日に終了した数 / その日の開始時点の有効数
+    churn_rate: float | None = Field(..., example=0.0024)
+
+
+class AdminStatsTotals(BaseModel):
+    recipes_created: int = Field(..., example=3400)
+    recipes_deleted: int = Field(..., example=120)
+    generations: int = Field(..., example=3380)
+    generation_latency_ms: float = Field(..., example=43940000.0)
+    avg_generation_latency_ms: float | None = Field(..., example=13000.0)
+    prompt_tokens: int = Field(..., example=608400)
+    completion_tokens: int = Field(..., example=5070000)
+    images: int = Field(..., example=3350)
+    cost_usd: float = Field(..., example=185.2)
+    users_created: int = Field(..., example=240)
+    subscriptions_started: int = Field(..., example=60)
+    subscriptions_ended: int = Field(..., example=18)
+    active_subscriptions: int = Field(..., example=412)
+    churn_rate: float | None = Field(..., example=0.048)
+
+
+class AdminStatsRead(BaseModel):
+    start: date = Field(..., example="2025-09-12")
+    end: date = Field(..., example="2025-10-11")
+    days: list[DailyStatRead]
+    totals: AdminStatsTotals
 
 # ------------------------------
 # StripePlan Models
@@ -147,8 +313,7 @@ class StripePlanBase(BaseModel):
 class StripePlanRead(StripePlanBase):
     id: int = Field(..., example=1)
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # ------------------------------
 # Subscription Models
@@ -170,5 +335,4 @@ class SubscriptionRead(SubscriptionBase):
                  "price": 9.99, "interval": "month"},
     )
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,224 @@
+import gzip
+import os
+import threading
+from fastapi import Request, Response
+from src.responses import ORJSONResponse
+from src.shared_state import InProcessState, SharedState, create_state
+
+try:
+    import brotli
+except ImportError:  # brotli は任意依存（未インストールなら gzip のみ）
+    brotli = None
+
+# これより小さいボディは圧縮しない
+MIN_COMPRESS_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+
+ENCODINGS = ("br", "gzip")
+
+
+class CacheEntry:
+    """シリアライズ済みボディと、エンコーディング別の圧縮結果"""
+
+    __slots__ = ("cache", "key", "etag", "body", "encoded")
+
+    def __init__(self, cache: "ResponseCache", key: str, etag: str, body: bytes):
+        self.cache = cache
+        self.key = key
+        self.etag = etag
+        self.body = body
+        self.encoded = {}
+
+    def get_body(self, encoding: str | None) -> bytes:
+        if encoding is None:
+            return self.body
+        data = self.encoded.get(encoding)
+        if data is None:
+            # 他のワーカーが圧縮済みならそれを使う
+            data = self.cache._load(f"{self.key}|{encoding}", self.etag)
+            if data is None:
+                data = compress(self.body, encoding)
+                self.cache._store(f"{self.key}|{encoding}", self.etag, data)
+            self.encoded[encoding] = data
+        return data
+
+
+class ResponseCache:
+    """
+    ETag 付きでレスポンスボディを保持するキャッシュ。
+    保存先は shared_state のバックエンド（既定はプロセス内の LRU + TTL、Redis ならワーカー間で共有）。
+    値は "ETag\n本文" の形で保存する。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 300.0, state: SharedState | None = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.state = state if state is not None else InProcessState(max_entries)
+        # ヒット率はワーカーごとの値
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(key) -> str:
+        return "cache:" + ":".join(str(part) for part in key)
+
+    def _load(self, state_key: str, etag: str) -> bytes | None:
+        raw = self.state.get(state_key)
+        if raw is None:
+            return None
+        stored_etag, _, body = raw.partition(b"\n")
+        if stored_etag.decode() != etag:
+            return None
+        return body
+
+    def _store(self, state_key: str, etag: str, body: bytes) -> None:
+        self.state.set(state_key, etag.encode() + b"\n" + body, self.ttl_s)
+
+    def get(self, key, etag: str) -> CacheEntry | None:
+        """ETag が一致するエントリだけを返す（不一致は古いデータとして扱う）"""
+        state_key = self._key(key)
+        body = self._load(state_key, etag)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return CacheEntry(self, state_key, etag, body)
+
+    def put(self, key, etag: str, body: bytes) -> CacheEntry:
+        state_key = self._key(key)
+        self._store(state_key, etag, body)
+        return CacheEntry(self, state_key, etag, body)
+
+    def invalidate(self, *keys) -> None:
+        state_keys = []
+        for key in keys:
+            state_key = self._key(key)
+            state_keys.append(state_key)
+            state_keys.extend(f"{state_key}|{encoding}" for encoding in ENCODINGS)
+        self.state.delete(*state_keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self.state.size(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+    ttl_s=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300")),
+    state=create_state(int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))),
+)
+
+
+# ------------------------------
+# キャッシュキー
+# ------------------------------
+def recipe_key(recipe_id: int) -> tuple:
+    return ("recipe", recipe_id)
+
+
+def user_recipes_key(user_id: int) -> tuple:
+    return ("user-recipes", user_id)
+
+
+def user_recipe_summaries_key(user_id: int) -> tuple:
+    return ("user-recipes-summary", user_id)
+
+
+def invalidate_recipe(recipe_id: int, user_id: int | None = None) -> None:
+    """レシピの更新・削除時に詳細と一覧のキャッシュを捨てる"""
+    keys = [recipe_key(recipe_id)]
+    if user_id is not None:
+        keys.extend((user_recipes_key(user_id), user_recipe_summaries_key(user_id)))
+    response_cache.invalidate(*keys)
+
+
+# ------------------------------
+# 圧縮
+# ------------------------------
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def choose_encoding(request: Request, size: int) -> str | None:
+    """Accept-Encoding から使うエンコーディングを選ぶ（brotli 優先）"""
+    if size < MIN_COMPRESS_BYTES:
+        return None
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+# ------------------------------
+# 条件付き GET
+# ------------------------------
+def encoded_etag(etag: str, encoding: str | None) -> str:
+    """圧縮したボディは別の表現なので、エンコーディングを付けた ETag にする（"<v>-gzip"）"""
+    if encoding is None:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def matching_etag(request: Request, etag: str) -> str | None:
+    """If-None-Match に一致した表現の ETag を返す（圧縮の有無・種類を問わない。一致しなければ None）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    # If-None-Match は弱い比較で良い
+    variants = {encoded_etag(etag, encoding) for encoding in (None, *ENCODINGS)}
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag in variants:
+            return tag
+    return None
+
+
+def cached_json_response(request: Request, key, etag: str, build) -> Response:
+    """
+    If-None-Match が一致すれば 304 を返し、そうでなければキャッシュ済み
+    （なければ build() で組み立てて orjson でシリアライズした）ボディを返す。
+    """
+    headers = {
+        # 毎回 ETag で再検証させる
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    matched = matching_etag(request, etag)
+    if matched is not None:
+        headers["ETag"] = matched
+        return Response(status_code=304, headers=headers)
+
+    entry = response_cache.get(key, etag)
+    if entry is None:
+        body = ORJSONResponse(build()).body
+        entry = response_cache.put(key, etag, body)
+
+    encoding = choose_encoding(request, len(entry.body))
+    headers["ETag"] = encoded_etag(etag, encoding)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=entry.get_body(encoding),
+        media_type="application/json",
+        headers=headers,
+    )
@@ -0,0 +1,151 @@
+"""
+レシピ本文（recipes.markdown_content）の zstd 圧縮。
+
+CompressedText カラム型は書き込み時に圧縮し、値を取得したときにだけ展開する。
+Recipe.markdown_content は deferred なので、本文を選択しないクエリ（一覧の要約・ETag・
+所有者チェックなど）では読み込みも展開も行われない。
+
+- 学習済み辞書（`python -m src.db_compress train` で作成）は ZSTD_DICT_DIR に <dict_id>.zdict で置き、
+  書き込みには ZSTD_DICT_ID の辞書を使う。zstd フレームに辞書IDが入るので、読み込み時は
+  フレームのIDで辞書を選ぶ（辞書を入れ替えても古い行はそのまま読める）
+- 移行前の行（TEXT のまま / UTF-8 のバイト列）もそのまま読める
+"""
+import os
+import threading
+import zstandard
+from sqlalchemy.types import LargeBinary, TypeDecorator
+from dotenv import load_dotenv
+
+# .env をロード
+load_dotenv()
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DICT_DIR = os.getenv("ZSTD_DICT_DIR") or os.path.join(BASE_DIR, "zstd_dicts")
+
+
+class Codec:
+    """辞書つき zstd の圧縮・展開（圧縮器は zstandard の制約によりスレッドごとに持つ）"""
+
+    def __init__(self, level: int = 6, dict_id: int | None = None,
+                 dict_dir: str = DICT_DIR, enabled: bool = True):
+        self.level = level
+        self.dict_id = dict_id
+        self.dict_dir = dict_dir
+        self.enabled = enabled
+        self._dicts: dict[int, zstandard.ZstdCompressionDict] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ---------- 辞書 ----------
+    def _dict_path(self, dict_id: int) -> str:
+        return os.path.join(self.dict_dir, f"{dict_id}.zdict")
+
+    def get_dict(self, dict_id: int) -> zstandard.ZstdCompressionDict:
+        zdict = self._dicts.get(dict_id)
+        if zdict is None:
+            with self._lock:
+                zdict = self._dicts.get(dict_id)
+                if zdict is None:
+                    try:
+                        with open(self._dict_path(dict_id), "rb") as f:
+                            zdict = zstandard.ZstdCompressionDict(f.read())
+                    except FileNotFoundError:
+                        raise LookupError(
+                            f"zstd dictionary {dict_id} not found in {self.dict_dir}")
+                    zdict.precompute_compress(level=self.level)
+                    self._dicts[dict_id] = zdict
+        return zdict
+
+    def save_dict(self, zdict: zstandard.ZstdCompressionDict) -> str:
+        os.makedirs(self.dict_dir, exist_ok=True)
+        path = self._dict_path(zdict.dict_id())
+        with open(path, "wb") as f:
+            f.write(zdict.as_bytes())
+        return path
+
+    # ---------- 圧縮・展開 ----------
+    def _compressor(self) -> zstandard.ZstdCompressor:
+        key = (self.level, self.dict_id)
+        cached = getattr(self._local, "compressor", None)
+        if cached is None or cached[0] != key:
+            zdict = self.get_dict(self.dict_id) if self.dict_id else None
+            cached = (key, zstandard.ZstdCompressor(
+                level=self.level, dict_data=zdict, write_checksum=False))
+            self._local.compressor = cached
+        return cached[1]
+
+    def _decompressor(self, dict_id: int) -> zstandard.ZstdDecompressor:
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            zdict = self.get_dict(dict_id) if dict_id else None
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=zdict)
+        return decompressor
+
+    def compress(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if not self.enabled:
+            return data
+        return self._compressor().compress(data)
+
+    def decompress(self, value) -> str:
+        if isinstance(value, str):
+            # 移行前（TEXT 型のまま）の行
+            return value
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        if not value.startswith(ZSTD_MAGIC):
+            # 圧縮されていない UTF-8（移行途中・圧縮無効時の行）
+            return value.decode("utf-8")
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        return self._decompressor(dict_id).decompress(value).decode("utf-8")
+
+    @staticmethod
+    def frame_dict_id(value) -> int | None:
+        """保存値の辞書ID（圧縮されていなければ None、辞書なしは 0）"""
+        if isinstance(value, str):
+            return None
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        if not value.startswith(ZSTD_MAGIC):
+            return None
+        return zstandard.get_frame_parameters(value).dict_id
+
+
+def _dict_id_from_env() -> int | None:
+    raw = os.getenv("ZSTD_DICT_ID")
+    return int(raw) if raw else None
+
+
+codec = Codec(
+    level=int(os.getenv("ZSTD_LEVEL", "6")),
+    dict_id=_dict_id_from_env(),
+    enabled=os.getenv("RECIPE_COMPRESSION", "true").lower() == "true",
+)
+
+
+class CompressedText(TypeDecorator):
+    """str を zstd で圧縮して BLOB に保存するカラム型"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return codec.compress(value)
+
+    def result_processor(self, dialect, coltype):
+        # 移行前の TEXT 値も受け付けるため、LargeBinary の変換（bytes()）は通さない
+        def process(value):
+            if value is None:
+                return None
+            return codec.decompress(value)
+        return process
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else codec.decompress(value)
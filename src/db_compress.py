@@ -0,0 +1,164 @@
+"""
+recipes.markdown_content の圧縮移行・辞書の学習・圧縮状況の確認。
+
+    python -m src.db_compress stats
+    python -m src.db_compress train --samples 5000         # 辞書を作り、ZSTD_DICT_ID に設定する
+    python -m src.db_compress migrate --batch-size 500     # 既存行を圧縮（途中で止めても再開できる）
+    python -m src.db_compress migrate --recompress          # ZSTD_DICT_ID の辞書で圧縮し直す
+
+PostgreSQL では最初に列の型を TEXT から BYTEA に変える（UTF-8 のバイト列に変換するだけで、
+圧縮はその後のバッチで行う）。新しいコードは BYTEA の列を前提に書き込むので、
+デプロイ前に `migrate --prepare-only` を実行する。SQLite は型の変更が不要。
+"""
+import argparse
+import random
+import time
+import zstandard
+from sqlalchemy import (
+    LargeBinary, bindparam, create_engine, func, inspect, literal_column, select, text, update,
+)
+from src.compression import codec
+from src.db_models import Recipe
+from src.get_conn import get_connection_uri
+
+DEFAULT_BATCH_SIZE = 500
+
+recipes = Recipe.__table__
+# 型の変換（展開）を通さずに保存値をそのまま読む
+raw_content = literal_column("recipes.markdown_content")
+
+
+def prepare(engine, log=print) -> bool:
+    """PostgreSQL の TEXT 列を BYTEA に変える。変更した場合 True"""
+    if engine.dialect.name != "postgresql":
+        return False
+    columns = {c["name"]: c for c in inspect(engine).get_columns("recipes")}
+    if "bytea" in str(columns["markdown_content"]["type"]).lower():
+        return False
+    log("Converting recipes.markdown_content to BYTEA...")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE recipes ALTER COLUMN markdown_content TYPE BYTEA "
+            "USING convert_to(markdown_content, 'UTF8')"))
+    return True
+
+
+def _needs_rewrite(value, recompress: bool) -> bool:
+    dict_id = codec.frame_dict_id(value)
+    if dict_id is None:
+        return codec.enabled
+    return recompress and dict_id != (codec.dict_id or 0)
+
+
+def migrate(engine, batch_size: int = DEFAULT_BATCH_SIZE, recompress: bool = False,
+            log=print) -> dict:
+    """
+    主キー順にバッチで読み、未圧縮（recompress なら別の辞書で圧縮済み）の行を書き換える。
+    1バッチ1トランザクションなので、止めてもその続きから再開できる。
+    """
+    prepare(engine, log)
+    stats = {"scanned": 0, "rewritten": 0, "bytes_before": 0, "bytes_after": 0}
+    stmt = (
+        update(recipes)
+        .where(recipes.c.id == bindparam("recipe_id"))
+        # 圧縮済みのバイト列をそのまま書く
+        .values(markdown_content=bindparam("content", type_=LargeBinary()))
+    )
+    last_id = 0
+    start = time.perf_counter()
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(recipes.c.id, raw_content)
+                .select_from(recipes)
+                .where(recipes.c.id > last_id)
+                .order_by(recipes.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            params = []
+            for recipe_id, value in rows:
+                if not _needs_rewrite(value, recompress):
+                    continue
+                compressed = codec.compress(codec.decompress(value))
+                stats["bytes_before"] += len(value.encode() if isinstance(value, str) else value)
+                stats["bytes_after"] += len(compressed)
+                params.append({"recipe_id": recipe_id, "content": compressed})
+            if params:
+                conn.execute(stmt, params)
+            stats["scanned"] += len(rows)
+            stats["rewritten"] += len(params)
+        log(f"  recipes: {stats['scanned']} scanned, {stats['rewritten']} rewritten "
+            f"({time.perf_counter() - start:.1f}s)")
+    return stats
+
+
+def train(engine, samples: int = 5000, dict_size: int = 112_640, seed: int = 0,
+          log=print) -> zstandard.ZstdCompressionDict:
+    """ランダムに選んだレシピ本文から辞書を学習し、ZSTD_DICT_DIR に保存する"""
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(recipes.c.id))).scalar() or 0
+        rng = random.Random(seed)
+        ids = sorted({rng.randint(1, max_id) for _ in range(samples)}) if max_id else []
+        bodies = []
+        for i in range(0, len(ids), 1000):
+            for (value,) in conn.execute(
+                    select(raw_content).select_from(recipes)
+                    .where(recipes.c.id.in_(ids[i:i + 1000]))):
+                bodies.append(codec.decompress(value).encode("utf-8"))
+    if len(bodies) < 10:
+        raise ValueError("Not enough recipes to train a dictionary")
+    zdict = zstandard.train_dictionary(dict_size, bodies, level=codec.level)
+    path = codec.save_dict(zdict)
+    log(f"Trained dictionary {zdict.dict_id()} from {len(bodies)} recipes -> {path}")
+    log(f"Set ZSTD_DICT_ID={zdict.dict_id()} and run `migrate --recompress`.")
+    return zdict
+
+
+def storage_stats(engine) -> dict:
+    """保存形式ごとの行数と保存バイト数"""
+    result = {}
+    with engine.connect() as conn:
+        for (value,) in conn.execute(
+                select(raw_content).select_from(recipes)).yield_per(1000):
+            dict_id = codec.frame_dict_id(value)
+            kind = "raw" if dict_id is None else "zstd" if dict_id == 0 else f"zstd+dict:{dict_id}"
+            item = result.setdefault(kind, {"rows": 0, "bytes": 0})
+            item["rows"] += 1
+            item["bytes"] += len(value.encode() if isinstance(value, str) else value)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compress recipe bodies with zstd.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats")
+    p_train = sub.add_parser("train")
+    p_train.add_argument("--samples", type=int, default=5000)
+    p_train.add_argument("--dict-size", type=int, default=112_640)
+    p_migrate = sub.add_parser("migrate")
+    p_migrate.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    p_migrate.add_argument("--recompress", action="store_true",
+                           help="also rewrite rows compressed with another dictionary")
+    p_migrate.add_argument("--prepare-only", action="store_true",
+                           help="only change the column type (PostgreSQL)")
+    args = parser.parse_args()
+
+    engine = create_engine(get_connection_uri())
+    if args.command == "stats":
+        for kind, item in storage_stats(engine).items():
+            print(f"{kind}: {item['rows']} rows, {item['bytes']} bytes")
+    elif args.command == "train":
+        train(engine, args.samples, args.dict_size)
+    elif args.prepare_only:
+        print("Column converted" if prepare(engine) else "Nothing to do")
+    else:
+        stats = migrate(engine, args.batch_size, args.recompress)
+        print(f"Rewrote {stats['rewritten']} of {stats['scanned']} recipes: "
+              f"{stats['bytes_before']} -> {stats['bytes_after']} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,23 @@
-from datetime import datetime
+from collections import defaultdict
+from datetime import date, datetime
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Text
+    Column, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, LargeBinary, Text, func,
+    select, update, UniqueConstraint, Index, and_, case, or_,
 )
-from sqlalchemy.orm import relationship, declarative_base, Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import relationship, declarative_base, deferred, Session
 from werkzeug.security import generate_password_hash, check_password_hash
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException
+import json
 import os
+import time
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-import requests
+from src import integrations, llm, metrics, pricing, resilience, text_delta
+from src.api_models import ImageRead, RecipeRead, RecipeSummary
+from src.compression import CompressedText
+from src import cache
+from src.tracing import span
 
 # .env をロード
 load_dotenv()
@@ -35,11 +43,26 @@ class User(Base):
         "Subscription", back_populates="user", cascade="all, delete-orphan")
 
     # ------------------------------
-    # 全ユーザー取得
+    # ユーザー一覧（ID順のキーセットページング。サーバー側カーソルで batch_size 件ずつ読む）
     # ------------------------------
     @staticmethod
-    def get_users(db: Session):
-        return db.query(User).all()
+    def get_users(db: Session, after_id: int = 0, limit: int = 100, batch_size: int = 500):
+        return db.execute(
+            select(User.id, User.name, User.email, User.disabled, User.created_at)
+            .where(User.id > after_id)
+            .order_by(User.id)
+            .limit(limit)
+            .execution_options(yield_per=batch_size)
+        )
+
+    @staticmethod
+    def get_page_end(db: Session, after_id: int, limit: int) -> tuple[int, int | None]:
+        """(ページの件数, ページ最後のID)。インデックスだけで求まるので本体より先に読める"""
+        page = (
+            select(User.id).where(User.id > after_id).order_by(User.id).limit(limit)
+        ).subquery()
+        count, last_id = db.execute(select(func.count(), func.max(page.c.id))).one()
+        return count, last_id
 
     # ------------------------------
     # ユーザー取得
@@ -63,6 +86,7 @@ class User(Base):
         )
         new_user.set_password(form_data.password)
         db.add(new_user)
+        DailyStat.add(db, users_created=1)
         db.commit()
         db.refresh(new_user)
         return {
@@ -126,10 +150,23 @@ class Recipe(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey(
-        "users.id", ondelete="CASCADE"), nullable=False)
+        "users.id", ondelete="CASCADE"), nullable=False, index=True)
     title = Column(String, nullable=False)
-    markdown_content = Column(Text, nullable=False)
+    # zstd で圧縮して保存し、アクセスしたときだけ読み込んで展開する
+    markdown_content = deferred(Column(CompressedText, nullable=False))
+    # markdown_content の保存形式（"markdown" / "json"）
+    content_format = Column(String, nullable=False,
+                            default=llm.MARKDOWN_FORMAT)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    # レスポンス（画像を含む）が変わるたびに増やす。ETag に使う
+    version = Column(Integer, nullable=False, default=1)
+    # 論理削除の日時。画像などの後片付けは purge ワーカーが非同期に行う
+    deleted_at = Column(DateTime, nullable=True, index=True)
+    # 事前生成（src/pregen.py）の結果を割り当てたレシピの元の行
+    source_pregen_id = Column(Integer, ForeignKey(
+        "pregenerated_recipes.id", ondelete="SET NULL"), nullable=True, index=True)
 
     # Relationships
     user = relationship("User", back_populates="recipes")
@@ -140,139 +177,266 @@ class Recipe(Base):
         cascade="all, delete-orphan"
     )
 
-    @staticmethod
-    def generate_recipe(title: str, db: Session) -> str:
-        # レシピ生成
-        endpoint = os.getenv("AZURE_ENDPOINT")
-        deployment = os.getenv("AZURE_DEPLOYMENT")
-
-        subscription_key = os.getenv("AZURE_SUBSCRIPTION_KEY")
-        api_version = os.getenv("AZURE_API_VERSION")
+    versions = relationship(
+        "RecipeVersion",
+        back_populates="recipe",
+        cascade="all, delete-orphan"
+    )
 
-        client = AzureOpenAI(
-            api_version=api_version,
-            azure_endpoint=endpoint,
-            api_key=subscription_key,
-        )
+    @staticmethod
+    def generate_recipe(title: str, db: Session, mode: str | None = None) -> llm.GenerationResult:
+        # レシピ生成（mode 未指定時は RECIPE_GENERATION_MODE に従う）
+        return llm.generate(title, mode=mode)
 
-        prompt = f"""
-            あなたは栄養士兼料理研究家です。
-            家庭でも簡単に作れる、栄養バランスの良い料理を考えてください。
-            以下の条件を満たすレシピを提案してください：
-            - 3ステップで調理できる
-            - 調味料は家庭にある基本的なもの（塩、醤油、砂糖、油など）
-            - 1食分あたり、たんぱく質・炭水化物・野菜をバランスよく含む
-            - 短時間で調理できる（20分以内）
-            - 洗い物が少ない
-
-            出力形式：
-            ---
-            料理名：
-            材料：
-            作り方：
-            栄養ポイント：
-            ---
-            テーマ: {title}
-        """
+    @staticmethod
+    def registry_recipe(title: str, user_id: int, db: Session, mode: str | None = None):
+        # レシピ登録
 
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_completion_tokens=16384
-        )
+        with span("recipe.generate", theme=title) as current:
+            generated = Recipe.generate_recipe(title, db, mode)
+            if current is not None:
+                current.set_attribute("llm.deployment", generated.deployment or "")
+                current.set_attribute("llm.completion_tokens", generated.completion_tokens or 0)
+
+        with span("recipe.persist"):
+            new_recipe = Recipe(
+                user_id=user_id,
+                title=title,
+                markdown_content=generated.content,
+                content_format=generated.content_format,
+                created_at=datetime.utcnow(),
+            )
+            db.add(new_recipe)
+            db.flush()
+            # 類似レシピ検索用の埋め込み（作成・編集時に1回だけ計算する）
+            RecipeEmbedding.store(
+                db, new_recipe.id, title, generated.content, generated.content_format)
+            RecipeNutrition.store(
+                db, new_recipe.id, user_id, generated.content, generated.content_format)
+
+            cost = pricing.llm_cost(generated.prompt_tokens, generated.completion_tokens)
+            log = GenerationLog(
+                user_id=user_id,
+                recipe_id=new_recipe.id,
+                mode=generated.mode,
+                deployment=generated.deployment,
+                prompt_tokens=generated.prompt_tokens,
+                completion_tokens=generated.completion_tokens,
+                latency_ms=generated.latency_ms,
+                ttft_ms=generated.ttft_ms,
+                cost_usd=cost,
+            )
+            db.add(log)
+            DailyStat.add(
+                db,
+                recipes_created=1,
+                generations=1,
+                generation_latency_ms=generated.latency_ms or 0.0,
+                prompt_tokens=generated.prompt_tokens or 0,
+                completion_tokens=generated.completion_tokens or 0,
+                cost_usd=cost,
+            )
+            db.commit()
+            db.refresh(new_recipe)
+        metrics.generation_cost.inc("llm", amount=cost)
+        cache.invalidate_recipe(new_recipe.id, user_id)
 
-        print(response)
+        return {
+            "message": "Recipe created successfully",
+            "recipe_id": new_recipe.id,
+            "generation_log_id": log.id,
+            "content": new_recipe.rendered_markdown()
+        }
 
-        if not response.choices or len(response.choices) == 0:
-            raise ValueError("Azure OpenAI response is empty")
+    @staticmethod
+    def registry_pregenerated(pregen: "PregeneratedRecipe", title: str, user_id: int, db: Session):
+        """事前生成した結果をユーザーのレシピとして登録する（LLM・画像APIは呼ばない）"""
+        start = time.perf_counter()
+        with span("recipe.assign_pregenerated", pregen_id=pregen.id):
+            new_recipe = Recipe(
+                user_id=user_id,
+                title=title,
+                markdown_content=pregen.markdown_content,
+                content_format=pregen.content_format,
+                source_pregen_id=pregen.id,
+                created_at=datetime.utcnow(),
+            )
+            db.add(new_recipe)
+            db.flush()
+            RecipeEmbedding.store(
+                db, new_recipe.id, title, pregen.markdown_content, pregen.content_format)
+            RecipeNutrition.store(
+                db, new_recipe.id, user_id, pregen.markdown_content, pregen.content_format)
+            image_count = 0
+            if pregen.image_url:
+                db.add(Image(recipe_id=new_recipe.id, image_url=pregen.image_url))
+                image_count = 1
+
+            latency_ms = (time.perf_counter() - start) * 1000
+            # 費用は事前生成の時点で計上済みなので 0、トークン数も数えない
+            log = GenerationLog(
+                user_id=user_id,
+                recipe_id=new_recipe.id,
+                mode=PregeneratedRecipe.MODE,
+                deployment=pregen.deployment,
+                latency_ms=latency_ms,
+                image_count=image_count,
+                cost_usd=0.0,
+            )
+            db.add(log)
+            DailyStat.add(
+                db,
+                recipes_created=1,
+                generations=1,
+                generation_latency_ms=latency_ms,
+                images=image_count,
+            )
+            db.commit()
+            db.refresh(new_recipe)
+        cache.invalidate_recipe(new_recipe.id, user_id)
 
-        # ChatCompletionの場合はこちら
-        text = response.choices[0].message.content
-        if not text:
-            raise ValueError("Generated text is empty")
+        return {
+            "message": "Recipe created successfully",
+            "recipe_id": new_recipe.id,
+            "generation_log_id": log.id,
+            "image_url": pregen.image_url,
+        }
 
-        return text
+    def rendered_markdown(self) -> str:
+        """表示用のMarkdownを返す（JSON形式はここで変換する）"""
+        return Recipe.render_content(self.markdown_content, self.content_format)
 
     @staticmethod
-    def registry_recipe(title: str, user_id: int, db: Session):
-        # レシピ登録
+    def render_content(markdown_content: str, content_format: str | None) -> str:
+        if content_format == llm.JSON_FORMAT:
+            return llm.render_recipe_markdown(markdown_content)
+        return markdown_content
 
-        generated_recipe = Recipe.generate_recipe(title, db)
+    # ------------------------------
+    # 読み取り用モデルの組み立て
+    # dict + isoformat() を経由せず、射影した行から RecipeRead / ImageRead を直接作る
+    # ------------------------------
+    @staticmethod
+    def _read_rows(db: Session, *criteria):
+        return db.execute(
+            select(
+                Recipe.id,
+                Recipe.title,
+                Recipe.markdown_content,
+                Recipe.content_format,
+                User.name.label("user"),
+                Recipe.created_at,
+            )
+            .join(User, User.id == Recipe.user_id)
+            .where(Recipe.deleted_at.is_(None), *criteria)
+            .order_by(Recipe.id)
+        ).all()
 
-        new_recipe = Recipe(
-            user_id=user_id,
-            title=title,
-            markdown_content=generated_recipe,
-            created_at=datetime.utcnow(),
+    @staticmethod
+    def _images_by_recipe(db: Session, recipe_ids) -> dict[int, list[ImageRead]]:
+        rows = db.execute(
+            select(
+                Image.id,
+                Image.recipe_id,
+                Image.image_url,
+                Image.is_regenerated,
+                Image.created_at,
+            )
+            .where(Image.recipe_id.in_(recipe_ids), Image.is_variant.is_(False))
+            .order_by(Image.id)
         )
+        images = defaultdict(list)
+        for row in rows:
+            images[row.recipe_id].append(ImageRead.model_validate(row))
+        return images
 
-        db.add(new_recipe)
-        db.commit()
-        db.refresh(new_recipe)
-
-        return {
-            "message": "Recipe created successfully",
-            "recipe_id": new_recipe.id,
-            "content": new_recipe.markdown_content
-        }
+    @staticmethod
+    def _to_read_model(row, images: list[ImageRead]) -> RecipeRead:
+        return RecipeRead(
+            id=row.id,
+            title=row.title,
+            markdown_content=Recipe.render_content(
+                row.markdown_content, row.content_format),
+            user=row.user,
+            created_at=row.created_at,
+            images=images,
+        )
 
     # ログインユーザーのレシピ一覧
     @staticmethod
-    def get_recipes_by_user(db: Session, user_id: int) -> list[dict]:
-        recipes = db.query(Recipe).filter(Recipe.user_id == user_id).all()
+    def get_recipes_by_user(db: Session, user_id: int) -> list[RecipeRead]:
+        rows = Recipe._read_rows(db, Recipe.user_id == user_id)
+        images = Recipe._images_by_recipe(
+            db, select(Recipe.id).where(
+                Recipe.user_id == user_id, Recipe.deleted_at.is_(None)))
+        return [Recipe._to_read_model(row, images[row.id]) for row in rows]
+
+    # ログインユーザーのレシピ一覧（本文なし。圧縮された本文を読まない）
+    @staticmethod
+    def get_recipe_summaries_by_user(db: Session, user_id: int) -> list[RecipeSummary]:
+        rows = db.execute(
+            select(Recipe.id, Recipe.title, Recipe.created_at)
+            .where(Recipe.user_id == user_id, Recipe.deleted_at.is_(None))
+            .order_by(Recipe.id)
+        ).all()
+        images = Recipe._images_by_recipe(
+            db, select(Recipe.id).where(
+                Recipe.user_id == user_id, Recipe.deleted_at.is_(None)))
         return [
-            {
-                "id": recipe.id,
-                "title": recipe.title,
-                # pydantic model expects `markdown_content` field name
-                "markdown_content": recipe.markdown_content,
-                # include owner's name for `user` field expected by RecipeRead
-                "user": recipe.user.name if recipe.user else None,
-                "created_at": recipe.created_at.isoformat() if recipe.created_at else None,
-                "images": [
-                    {
-                        "id": image.id,
-                        "image_url": image.image_url,
-                        "is_regenerated": image.is_regenerated,
-                        "created_at": image.created_at.isoformat() if image.created_at else None,
-                    }
-                    for image in recipe.images
-                ]
-            }
-            for recipe in recipes
+            RecipeSummary(id=row.id, title=row.title,
+                          created_at=row.created_at, images=images[row.id])
+            for row in rows
         ]
 
     # レシピ詳細
     @staticmethod
-    def get_recipe_by_id(db: Session, recipe_id: int) -> dict:
-        recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
-        if not recipe:
+    def get_recipe_by_id(db: Session, recipe_id: int) -> RecipeRead | None:
+        rows = Recipe._read_rows(db, Recipe.id == recipe_id)
+        if not rows:
             return None
-        return {
-            "id": recipe.id,
-            "title": recipe.title,
-            # pydantic model expects `markdown_content` field name
-            "markdown_content": recipe.markdown_content,
-            # include owner's name for `user` field expected by RecipeRead
-            "user": recipe.user.name if recipe.user else None,
-            "created_at": recipe.created_at.isoformat() if recipe.created_at else None,
-            "images": [
-                {
-                    "id": image.id,
-                    "image_url": image.image_url,
-                    "is_regenerated": image.is_regenerated,
-                    "created_at": image.created_at.isoformat() if image.created_at else None,
-                }
-                for image in recipe.images
-            ]
-        }
+        images = Recipe._images_by_recipe(db, [recipe_id])
+        return Recipe._to_read_model(rows[0], images[recipe_id])
+
+    # ------------------------------
+    # ETag（本文を読まずにインデックス上の列だけで求める）
+    # ------------------------------
+    @staticmethod
+    def get_recipe_etag(db: Session, recipe_id: int) -> str | None:
+        version = db.execute(
+            select(Recipe.version).where(
+                Recipe.id == recipe_id, Recipe.deleted_at.is_(None))
+        ).scalar_one_or_none()
+        if version is None:
+            return None
+        return f'"r{recipe_id}-v{version}"'
+
+    @staticmethod
+    def get_user_recipes_etag(db: Session, user_id: int) -> str:
+        # 件数・最大ID・version の合計・最終更新日時のどれかが変われば一覧も変わる
+        count, max_id, version_sum, last_updated = db.execute(
+            select(
+                func.count(Recipe.id),
+                func.max(Recipe.id),
+                func.sum(Recipe.version),
+                func.max(Recipe.updated_at),
+            ).where(Recipe.user_id == user_id, Recipe.deleted_at.is_(None))
+        ).one()
+        stamp = last_updated.timestamp() if last_updated else 0
+        return f'"u{user_id}-{count}-{max_id or 0}-{version_sum or 0}-{stamp:.6f}"'
+
+    @staticmethod
+    def touch(db: Session, recipe_id: int) -> None:
+        """画像の追加などレシピ行以外の変更でも ETag を進める"""
+        db.execute(
+            update(Recipe)
+            .where(Recipe.id == recipe_id)
+            .values(version=Recipe.version + 1, updated_at=datetime.utcnow())
+        )
 
     @staticmethod
     def get_recipe_by_recipe_id(db: Session, recipe_id: int) -> dict:
-        recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
+        recipe = db.query(Recipe).filter(
+            Recipe.id == recipe_id, Recipe.deleted_at.is_(None)).first()
         if not recipe:
             return None
         return recipe
@@ -280,22 +444,102 @@ class Recipe(Base):
     # レシピ編集
     @staticmethod
     def update_recipe(db: Session, recipe_id: int, form_data) -> dict:
-        recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
+        recipe = db.query(Recipe).filter(
+            Recipe.id == recipe_id, Recipe.deleted_at.is_(None)
+        ).with_for_update().first()
         if not recipe:
             return None
 
+        title = recipe.title
+        markdown_content = recipe.markdown_content
+        content_format = recipe.content_format
         if getattr(form_data, "title", None) is not None:
-            recipe.title = form_data.title
+            title = form_data.title
         if getattr(form_data, "markdown_content", None) is not None:
-            recipe.markdown_content = form_data.markdown_content
+            # ユーザー編集後はMarkdownとして保存する
+            markdown_content = form_data.markdown_content
+            content_format = llm.MARKDOWN_FORMAT
+        return Recipe._apply_edit(db, recipe, title, markdown_content, content_format)
+
+    # 過去のバージョンに戻す（戻した内容も新しいバージョンとして履歴に残る）
+    @staticmethod
+    def restore_version(db: Session, recipe_id: int, version_no: int) -> dict | None:
+        recipe = db.query(Recipe).filter(
+            Recipe.id == recipe_id, Recipe.deleted_at.is_(None)
+        ).with_for_update().first()
+        if not recipe:
+            return None
+        old = RecipeVersion.get_version(db, recipe_id, version_no)
+        if old is None:
+            return None
+        return Recipe._apply_edit(
+            db, recipe, old["title"], old["markdown_content"], old["content_format"])
+
+    @staticmethod
+    def _apply_edit(db: Session, recipe: "Recipe", title: str,
+                    markdown_content: str, content_format: str) -> dict:
+        changed = (title, markdown_content, content_format) != (
+            recipe.title, recipe.markdown_content, recipe.content_format)
+        if changed:
+            RecipeVersion.record(
+                db, recipe, title, markdown_content, content_format)
+            recipe.title = title
+            recipe.markdown_content = markdown_content
+            recipe.content_format = content_format
+            RecipeEmbedding.store(db, recipe.id, title, markdown_content, content_format)
+            RecipeNutrition.store(
+                db, recipe.id, recipe.user_id, markdown_content, content_format)
+        recipe.version = Recipe.version + 1
         db.commit()
         db.refresh(recipe)
+        cache.invalidate_recipe(recipe.id, recipe.user_id)
         return {
             "message": "Recipe updated successfully",
             "recipe_id": recipe.id,
             "title": recipe.title
         }
-    # レシピ削除
+
+    # ------------------------------
+    # レシピ削除（論理削除。画像などの削除は src/purge.py が後で行う）
+    # ------------------------------
+    @staticmethod
+    def delete_recipe(db: Session, recipe_id: int, user_id: int | None = None) -> bool:
+        return bool(Recipe.delete_recipes(db, [recipe_id], user_id=user_id))
+
+    @staticmethod
+    def delete_recipes(db: Session, recipe_ids, user_id: int | None = None) -> list[int]:
+        """
+        主キーで絞った UPDATE 1回で deleted_at を付け、削除したIDを返す。
+        user_id を渡すとそのユーザーのレシピだけが対象になる（他人のIDは無視される）。
+        """
+        recipe_ids = list(set(recipe_ids))
+        if not recipe_ids:
+            return []
+        now = datetime.utcnow()
+        criteria = [Recipe.id.in_(recipe_ids), Recipe.deleted_at.is_(None)]
+        if user_id is not None:
+            criteria.append(Recipe.user_id == user_id)
+        stmt = (
+            update(Recipe)
+            .where(*criteria)
+            .values(deleted_at=now, updated_at=now, version=Recipe.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if db.get_bind().dialect.update_returning:
+            deleted = list(db.execute(stmt.returning(Recipe.id)).scalars())
+        else:
+            deleted = list(db.execute(select(Recipe.id).where(*criteria)).scalars())
+            db.execute(stmt)
+        if deleted:
+            DailyStat.add(db, recipes_deleted=len(deleted))
+        db.commit()
+
+        owners = db.execute(
+            select(Recipe.id, Recipe.user_id).where(Recipe.id.in_(deleted))
+        ).all() if user_id is None else [(rid, user_id) for rid in deleted]
+        for rid, owner_id in owners:
+            cache.invalidate_recipe(rid, owner_id)
+        return sorted(deleted)
 
 
 class Image(Base):
@@ -303,9 +547,13 @@ class Image(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     recipe_id = Column(Integer, ForeignKey(
-        "recipes.id", ondelete="CASCADE"), nullable=False)
-    image_url = Column(String, nullable=False)
+        "recipes.id", ondelete="CASCADE"), nullable=False, index=True)
+    # ローカル保存（IMAGE_STORAGE=local）では /api/images/<sha256>.<拡張子>。
+    # 同じ内容の画像は同じ URL になり、ファイルを消す前に参照を調べるので index を張る
+    image_url = Column(String, nullable=False, index=True)
     is_regenerated = Column(Boolean, default=False)
+    # 再生成用に先に作っておいた未使用の画像（src/image_variants.py）。レシピの表示・エクスポートには出さない
+    is_variant = Column(Boolean, nullable=False, default=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
@@ -343,26 +591,109 @@ class Image(Base):
         }
 
         url = os.getenv("AZURE_IMAGE_API_URI")
+        requests = integrations.get_requests()
+
+        def post(timeout: float):
+            response = requests.post(
+                url, headers=headers, json=data, timeout=timeout)
+            # 5xx / 429 は上流障害として扱い、それ以外の 4xx は呼び出し側の問題とする
+            if response.status_code >= 500 or response.status_code == 429:
+                response.raise_for_status()
+            return response
+
+        # 画像生成は課金されるためリトライしない（期限とブレーカーのみ）
+        response = resilience.call(
+            "azure-image",
+            post,
+            deadline_s=float(os.getenv("IMAGE_API_TIMEOUT_SECONDS", "120")),
+            failure_on=(requests.ConnectionError,
+                        requests.Timeout, requests.HTTPError),
+        )
+        if response.status_code >= 400:
+            raise ValueError(
+                f"Image API returned {response.status_code}: {response.text[:200]}")
 
-        response = requests.post(url, headers=headers, json=data)
-
-        result = response.json()
-        image_url = result["data"][0]["url"]
+        try:
+            result = response.json()
+            image_url = result["data"][0]["url"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise ValueError("Image API response does not contain an image url")
+        if not image_url:
+            raise ValueError("Image API returned an empty image url")
+        from src import image_store
+        if image_store.enabled():
+            # 画像APIの URL は期限付きなので、取得して内容のハッシュで保存した URL に置き換える
+            image_url = image_store.fetch_and_store(image_url)
         return image_url
 
     @staticmethod
-    def registry_image(recipe: str, recipe_id: int, db: Session):
+    def registry_image(recipe: str, recipe_id: int, db: Session,
+                       generation_log_id: int | None = None, regenerated: bool = False):
+
+        with span("image.generate", recipe_id=recipe_id):
+            start = time.perf_counter()
+            image_url = Image.generate_image(recipe, recipe_id, db)
+            latency_ms = (time.perf_counter() - start) * 1000
+
+        with span("image.persist", recipe_id=recipe_id):
+            new_image = Image(
+                recipe_id=recipe_id,
+                image_url=image_url
+            )
+            if regenerated:
+                new_image.mark_regenerated()
+            db.add(new_image)
+            Recipe.touch(db, recipe_id)
+            if generation_log_id is not None:
+                # 生成1回分の台帳に画像の枚数・時間・費用を同じトランザクションで足す
+                GenerationLog.add_image(db, generation_log_id, latency_ms)
+            DailyStat.add(db, images=1, cost_usd=pricing.IMAGE_COST_USD)
+            db.commit()
+            db.refresh(new_image)
+        metrics.generation_cost.inc("image", amount=pricing.IMAGE_COST_USD)
+        cache.response_cache.invalidate(cache.recipe_key(recipe_id))
 
-        image_url = Image.generate_image(recipe, recipe_id, db)
-        new_image = Image(
-            recipe_id=recipe_id,
-            image_url=image_url
-        )
-        db.add(new_image)
+        return new_image
+
+    @staticmethod
+    def add_variant(db: Session, recipe_id: int, image_url: str) -> "Image":
+        """未使用の画像として保存する（費用は当日の daily_stats に計上する）"""
+        variant = Image(recipe_id=recipe_id, image_url=image_url, is_variant=True)
+        db.add(variant)
+        DailyStat.add(db, images=1, cost_usd=pricing.IMAGE_COST_USD)
         db.commit()
-        db.refresh(new_image)
+        return variant
 
-        return new_image
+    @staticmethod
+    def count_variants(db: Session, recipe_id: int) -> int:
+        return db.execute(
+            select(func.count()).select_from(Image)
+            .where(Image.recipe_id == recipe_id, Image.is_variant.is_(True))
+        ).scalar_one()
+
+    @staticmethod
+    def claim_variant(db: Session, recipe_id: int, attempts: int = 3) -> "Image | None":
+        """
+        未使用の画像を1つ使用済みにして返す（コミットは呼び出し側）。
+        条件付き UPDATE で取るので、同時に再生成されても同じ画像を2回使わない
+        """
+        for _ in range(attempts):
+            image_id = db.execute(
+                select(Image.id)
+                .where(Image.recipe_id == recipe_id, Image.is_variant.is_(True))
+                .order_by(Image.id)
+                .limit(1)
+            ).scalar()
+            if image_id is None:
+                return None
+            claimed = db.execute(
+                update(Image)
+                .where(Image.id == image_id, Image.is_variant.is_(True))
+                .values(is_variant=False, created_at=datetime.utcnow())
+            ).rowcount
+            if claimed:
+                return db.get(Image, image_id, populate_existing=True)
+        return None
 
     def mark_regenerated(self):
         """
@@ -393,6 +724,151 @@ class Image(Base):
         return f"<Image(id={self.id}, url={self.image_url}, regenerated={self.is_regenerated})>"
 
 
+class RecipeVersion(Base):
+    """
+    レシピの編集履歴。直前のバージョンとの行差分（delta）で保存し、
+    K バージョンごとに全文（snapshot）を置くので、どのバージョンも最大 K-1 個の差分で復元できる。
+    履歴は最初の編集時に作られ、編集前の内容が version 1 になる。
+    """
+    __tablename__ = "recipe_versions"
+    __table_args__ = (
+        UniqueConstraint("recipe_id", "version_no", name="uq_recipe_versions_recipe_version"),
+    )
+
+    SNAPSHOT = "snapshot"
+    DELTA = "delta"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipe_id = Column(Integer, ForeignKey(
+        "recipes.id", ondelete="CASCADE"), nullable=False, index=True)
+    version_no = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    content_format = Column(String, nullable=False)
+    # snapshot は本文、delta は text_delta 形式の差分
+    data = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relationships
+    recipe = relationship("Recipe", back_populates="versions")
+
+    @staticmethod
+    def snapshot_interval() -> int:
+        return max(1, int(os.getenv("RECIPE_SNAPSHOT_INTERVAL", "10")))
+
+    @staticmethod
+    def record(db: Session, recipe: Recipe, title: str,
+               markdown_content: str, content_format: str) -> int:
+        """
+        編集前の recipe と編集後の内容から履歴を追加し、新しいバージョン番号を返す。
+        commit は呼び出し側で行う。
+        """
+        latest = db.execute(
+            select(func.max(RecipeVersion.version_no))
+            .where(RecipeVersion.recipe_id == recipe.id)
+        ).scalar()
+        if latest is None:
+            # 初回の編集: 編集前の内容を version 1 として残す
+            latest = 1
+            db.add(RecipeVersion(
+                recipe_id=recipe.id,
+                version_no=1,
+                kind=RecipeVersion.SNAPSHOT,
+                title=recipe.title,
+                content_format=recipe.content_format,
+                data=recipe.markdown_content,
+                created_at=recipe.updated_at or recipe.created_at,
+            ))
+
+        version_no = latest + 1
+        if (version_no - 1) % RecipeVersion.snapshot_interval() == 0:
+            kind, data = RecipeVersion.SNAPSHOT, markdown_content
+        else:
+            kind = RecipeVersion.DELTA
+            data = text_delta.make_delta(recipe.markdown_content, markdown_content)
+        db.add(RecipeVersion(
+            recipe_id=recipe.id,
+            version_no=version_no,
+            kind=kind,
+            title=title,
+            content_format=content_format,
+            data=data,
+            created_at=datetime.utcnow(),
+        ))
+        return version_no
+
+    @staticmethod
+    def list_versions(db: Session, recipe_id: int) -> list[dict]:
+        """本文を読まずにバージョンの一覧を返す（新しい順）"""
+        rows = db.execute(
+            select(
+                RecipeVersion.version_no,
+                RecipeVersion.kind,
+                RecipeVersion.title,
+                func.length(RecipeVersion.data).label("size"),
+                RecipeVersion.created_at,
+            )
+            .where(RecipeVersion.recipe_id == recipe_id)
+            .order_by(RecipeVersion.version_no.desc())
+        )
+        return [
+            {
+                "version": row.version_no,
+                "kind": row.kind,
+                "title": row.title,
+                "size": row.size,
+                "created_at": row.created_at,
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def get_version(db: Session, recipe_id: int, version_no: int) -> dict | None:
+        """直前の snapshot から差分を順に当てて復元する（クエリ1回）"""
+        snapshot_no = (
+            select(func.max(RecipeVersion.version_no))
+            .where(
+                RecipeVersion.recipe_id == recipe_id,
+                RecipeVersion.kind == RecipeVersion.SNAPSHOT,
+                RecipeVersion.version_no <= version_no,
+            )
+            .scalar_subquery()
+        )
+        rows = db.execute(
+            select(
+                RecipeVersion.version_no,
+                RecipeVersion.kind,
+                RecipeVersion.title,
+                RecipeVersion.content_format,
+                RecipeVersion.data,
+                RecipeVersion.created_at,
+            )
+            .where(
+                RecipeVersion.recipe_id == recipe_id,
+                RecipeVersion.version_no >= snapshot_no,
+                RecipeVersion.version_no <= version_no,
+            )
+            .order_by(RecipeVersion.version_no)
+        ).all()
+        if not rows or rows[-1].version_no != version_no:
+            return None
+
+        content = rows[0].data
+        for row in rows[1:]:
+            if row.kind == RecipeVersion.SNAPSHOT:
+                content = row.data
+            else:
+                content = text_delta.apply_delta(content, row.data)
+        last = rows[-1]
+        return {
+            "version": last.version_no,
+            "title": last.title,
+            "markdown_content": content,
+            "content_format": last.content_format,
+            "created_at": last.created_at,
+        }
+
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
 
@@ -402,6 +878,8 @@ class Subscription(Base):
     # Stripe identifiers
     stripe_subscription_id = Column(String, unique=True, nullable=True)
     stripe_customer_id = Column(String, nullable=True)
+    # Stripe の Price ID（プランごとのクォータは src/quota.py の PLAN_QUOTAS で決める）
+    stripe_price_id = Column(String, nullable=True)
     status = Column(String, nullable=False)
     start_date = Column(DateTime, nullable=False)
     end_date = Column(DateTime)
@@ -409,6 +887,41 @@ class Subscription(Base):
     # Relationships
     user = relationship("User", back_populates="subscriptions")
 
+    # 解約・支払い遅延など、有効でなくなった状態
+    ENDED_STATUSES = ("canceled", "unpaid", "past_due")
+
+    @staticmethod
+    def start(db: Session, **values) -> "Subscription":
+        """サブスクリプションを追加する（コミットは呼び出し側）"""
+        sub = Subscription(status="active", start_date=datetime.utcnow(), **values)
+        db.add(sub)
+        DailyStat.add(db, subscriptions_started=1)
+        return sub
+
+    @staticmethod
+    def transition(end_date: datetime | None, status: str,
+                   now: datetime | None = None) -> tuple[datetime | None, str | None]:
+        """
+        状態を status にしたときの end_date と、有効 ⇔ 終了 の切り替わり
+        （"started" / "ended"、変わらなければ None）
+        """
+        was_active = end_date is None
+        if status in Subscription.ENDED_STATUSES and was_active:
+            return now or datetime.utcnow(), "ended"
+        if status == "active" and not was_active:
+            # 支払いの再開などで有効に戻った
+            return None, "started"
+        return end_date, None
+
+    def set_status(self, db: Session, status: str) -> None:
+        """状態を変え、有効 ⇔ 終了 が切り替わったら end_date と日次集計を更新する（コミットは呼び出し側）"""
+        self.status = status
+        self.end_date, changed = Subscription.transition(self.end_date, status)
+        if changed == "ended":
+            DailyStat.add(db, subscriptions_ended=1)
+        elif changed == "started":
+            DailyStat.add(db, subscriptions_started=1)
+
     @staticmethod
     def get_sub_by_subscription_id(db: Session, stripe_sub_id: int):
         sub = db.query(Subscription).filter(
@@ -426,3 +939,423 @@ class Subscription(Base):
         sub = db.query(Subscription).filter(
             Subscription.stripe_subscription_id == stripe_subscription_id).first()
         return sub
+
+
+class SyncCheckpoint(Base):
+    """
+    外部サービスとの突き合わせジョブ（src/stripe_sync.py など）の進み具合。
+    ページごとに更新と同じトランザクションで保存し、途中で止まっても cursor の次から再開する
+    """
+    __tablename__ = "sync_checkpoints"
+
+    name = Column(String, primary_key=True)
+    # 最後に処理したページの末尾の ID（None なら最初から）
+    cursor = Column(String, nullable=True)
+    # 実行中の回の集計（JSON）
+    stats = Column(Text, nullable=False, default="{}")
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # 最後まで終わった日時（実行中・中断中は None）
+    completed_at = Column(DateTime, nullable=True)
+
+    @staticmethod
+    def load(db: Session, name: str) -> "SyncCheckpoint | None":
+        return db.get(SyncCheckpoint, name)
+
+    @staticmethod
+    def begin(db: Session, name: str) -> "SyncCheckpoint":
+        """新しい回を始める（前回の cursor と集計は捨てる。コミットは呼び出し側）"""
+        now = datetime.utcnow()
+        return db.merge(SyncCheckpoint(
+            name=name, cursor=None, stats="{}", started_at=now, updated_at=now, completed_at=None))
+
+    def advance(self, cursor: str | None, stats: dict, completed: bool = False) -> None:
+        """ページの処理結果を記録する（コミットは呼び出し側）"""
+        now = datetime.utcnow()
+        self.cursor = cursor
+        self.stats = json.dumps(stats, sort_keys=True)
+        self.updated_at = now
+        if completed:
+            self.completed_at = now
+
+
+class GenerationLog(Base):
+    """レシピ生成1回ごとのトークン数・画像枚数・レイテンシ・費用（利用量の台帳）"""
+    __tablename__ = "generation_logs"
+    __table_args__ = (
+        # ユーザーの期間内の利用額の集計用
+        Index("ix_generation_logs_user_created", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), nullable=False, index=True)
+    recipe_id = Column(Integer, ForeignKey(
+        "recipes.id", ondelete="SET NULL"), nullable=True)
+    mode = Column(String, nullable=False)
+    deployment = Column(String)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    latency_ms = Column(Float)
+    ttft_ms = Column(Float)
+    image_count = Column(Integer, nullable=False, default=0)
+    image_latency_ms = Column(Float)
+    # LLM と画像生成の概算費用（単価は src/pricing.py）
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def add_image(db: Session, log_id: int, latency_ms: float) -> None:
+        db.execute(
+            update(GenerationLog)
+            .where(GenerationLog.id == log_id)
+            .values(
+                image_count=GenerationLog.image_count + 1,
+                image_latency_ms=func.coalesce(GenerationLog.image_latency_ms, 0) + latency_ms,
+                cost_usd=GenerationLog.cost_usd + pricing.IMAGE_COST_USD,
+            )
+        )
+
+    @staticmethod
+    def summarize_user(db: Session, user_id: int, since: datetime) -> dict:
+        """since 以降のユーザーの生成回数・トークン数・画像枚数・費用"""
+        count, prompt, completion, images, cost = db.execute(
+            select(
+                func.count(GenerationLog.id),
+                func.coalesce(func.sum(GenerationLog.prompt_tokens), 0),
+                func.coalesce(func.sum(GenerationLog.completion_tokens), 0),
+                func.coalesce(func.sum(GenerationLog.image_count), 0),
+                func.coalesce(func.sum(GenerationLog.cost_usd), 0.0),
+            ).where(GenerationLog.user_id == user_id, GenerationLog.created_at >= since)
+        ).one()
+        return {
+            "generations": count,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "images": images,
+            "cost_usd": round(cost, 6),
+        }
+
+    @staticmethod
+    def summarize_by_mode(db: Session) -> list[dict]:
+        """モードごとの平均トークン数・レイテンシ（比較用）"""
+        rows = db.query(
+            GenerationLog.mode,
+            func.count(GenerationLog.id),
+            func.avg(GenerationLog.prompt_tokens),
+            func.avg(GenerationLog.completion_tokens),
+            func.avg(GenerationLog.latency_ms),
+        ).group_by(GenerationLog.mode).all()
+        return [
+            {
+                "mode": mode,
+                "count": count,
+                "avg_prompt_tokens": avg_prompt,
+                "avg_completion_tokens": avg_completion,
+                "avg_latency_ms": avg_latency,
+            }
+            for mode, count, avg_prompt, avg_completion, avg_latency in rows
+        ]
+
+
+class UsageCounter(Base):
+    """
+    ユーザーごとの当日・当月の生成回数（クォータ用）。
+    判定と加算を1回の UPSERT で行い、日・月が変わった行はその UPSERT の中で数え直す。
+    """
+    __tablename__ = "usage_counters"
+
+    user_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(String, nullable=False)      # "2025-10-11"（UTC）
+    day_count = Column(Integer, nullable=False, default=0)
+    month = Column(String, nullable=False)    # "2025-10"（UTC）
+    month_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def _insert(dialect: str):
+        if dialect == "postgresql":
+            return postgresql.insert(UsageCounter)
+        return sqlite.insert(UsageCounter)
+
+    @staticmethod
+    def reserve(db: Session, user_id: int, day: str, month: str,
+                daily: int | None, monthly: int | None) -> tuple[int, int] | None:
+        """
+        上限内なら1回分を加算して (当日の回数, 当月の回数) を返す。上限に達していれば None。
+        daily / monthly が None（または 0）の期間は数えるだけで制限しない。
+        """
+        row = db.execute(UsageCounter.reserve_statement(
+            db.bind.dialect.name, user_id, day, month, daily, monthly)).first()
+        db.commit()
+        return (row.day_count, row.month_count) if row else None
+
+    @staticmethod
+    def reserve_statement(dialect: str, user_id: int, day: str, month: str,
+                          daily: int | None, monthly: int | None):
+        """reserve の UPSERT（dialect は "sqlite" / "postgresql"。上限に達していれば行を返さない）"""
+        t = UsageCounter.__table__
+        conditions = []
+        if daily:
+            conditions.append(or_(t.c.day != day, t.c.day_count < daily))
+        if monthly:
+            conditions.append(or_(t.c.month != month, t.c.month_count < monthly))
+        stmt = UsageCounter._insert(dialect).values(
+            user_id=user_id, day=day, day_count=1, month=month, month_count=1,
+            updated_at=datetime.utcnow(),
+        )
+        return stmt.on_conflict_do_update(
+            index_elements=[t.c.user_id],
+            # SET の右辺は更新前の行の値を参照する
+            set_={
+                "day_count": case((t.c.day == day, t.c.day_count + 1), else_=1),
+                "day": day,
+                "month_count": case((t.c.month == month, t.c.month_count + 1), else_=1),
+                "month": month,
+                "updated_at": datetime.utcnow(),
+            },
+            where=and_(*conditions) if conditions else None,
+        ).returning(t.c.day_count, t.c.month_count)
+
+    @staticmethod
+    def release(db: Session, user_id: int, day: str, month: str) -> None:
+        """reserve した1回分を戻す（生成に失敗したとき。期間が変わっていれば何もしない）"""
+        db.execute(
+            update(UsageCounter)
+            .where(
+                UsageCounter.user_id == user_id,
+                UsageCounter.day == day,
+                UsageCounter.month == month,
+                UsageCounter.day_count > 0,
+            )
+            .values(day_count=UsageCounter.day_count - 1,
+                    month_count=UsageCounter.month_count - 1)
+        )
+        db.commit()
+
+    @staticmethod
+    def get_counts(db: Session, user_id: int, day: str, month: str) -> tuple[int, int]:
+        """(当日の回数, 当月の回数)"""
+        row = db.get(UsageCounter, user_id)
+        if row is None:
+            return 0, 0
+        return (row.day_count if row.day == day else 0,
+                row.month_count if row.month == month else 0)
+
+
+class DailyStat(Base):
+    """
+    日ごとの集計（管理画面用）。レシピの作成・削除、生成、ユーザー登録、サブスクリプションの
+    開始・終了のたびに、その処理のトランザクション内で UPSERT 1回で加算する。
+    集計のずれは `python -m src.analytics rebuild` で元のテーブルから作り直せる。
+    """
+    __tablename__ = "daily_stats"
+
+    day = Column(Date, primary_key=True)    # UTC
+    recipes_created = Column(Integer, nullable=False, default=0)
+    recipes_deleted = Column(Integer, nullable=False, default=0)
+    generations = Column(Integer, nullable=False, default=0)
+    generation_latency_ms = Column(Float, nullable=False, default=0.0)   # 合計（平均は generations で割る）
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    images = Column(Integer, nullable=False, default=0)
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    users_created = Column(Integer, nullable=False, default=0)
+    subscriptions_started = Column(Integer, nullable=False, default=0)
+    subscriptions_ended = Column(Integer, nullable=False, default=0)
+
+    COUNTERS = (
+        "recipes_created", "recipes_deleted", "generations", "generation_latency_ms",
+        "prompt_tokens", "completion_tokens", "images", "cost_usd", "users_created",
+        "subscriptions_started", "subscriptions_ended",
+    )
+
+    @staticmethod
+    def add(db: Session, day: date | None = None, **increments) -> None:
+        """day（既定は今日）の行に increments を加算する（コミットは呼び出し側）"""
+        t = DailyStat.__table__
+        values = {name: 0 for name in DailyStat.COUNTERS}
+        values.update(increments)
+        if db.bind.dialect.name == "postgresql":
+            stmt = postgresql.insert(DailyStat)
+        else:
+            stmt = sqlite.insert(DailyStat)
+        stmt = stmt.values(day=day or datetime.utcnow().date(), **values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[t.c.day],
+            set_={name: t.c[name] + stmt.excluded[name] for name in increments},
+        ))
+
+
+class RecipeEmbedding(Base):
+    """
+    レシピの埋め込みベクトル（src/embeddings.py）。float16 / int8 のバイト列で保存する。
+    検索は src/similar.py のメモリ上のインデックスが行い、updated_at 以降の行を取り込んで追従する。
+    """
+    __tablename__ = "recipe_embeddings"
+
+    recipe_id = Column(Integer, ForeignKey(
+        "recipes.id", ondelete="CASCADE"), primary_key=True)
+    # 埋め込みの方式（方式が変わった行は検索に使わず、backfill で作り直す）
+    model = Column(String, nullable=False)
+    dtype = Column(String, nullable=False)
+    vector = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    @staticmethod
+    def store(db: Session, recipe_id: int, title: str,
+              markdown_content: str, content_format: str | None) -> None:
+        """埋め込みを計算して保存する（コミットは呼び出し側）"""
+        from src import embeddings
+
+        embedder = embeddings.get_embedder()
+        vector = embedder.embed(
+            [embeddings.recipe_text(title, markdown_content, content_format)])[0]
+        db.merge(RecipeEmbedding(
+            recipe_id=recipe_id,
+            model=embedder.name,
+            dtype=embeddings.DTYPE,
+            vector=embeddings.encode(vector),
+            updated_at=datetime.utcnow(),
+        ))
+
+
+class RecipeNutrition(Base):
+    """
+    レシピ1食分の栄養価（llm.parse_nutrition で本文から読み取る）。読み取れないレシピは行を持たない。
+    献立（src/meal_plan.py）はメモリ上の行列に updated_at 以降の行を取り込んで追従する。
+    """
+    __tablename__ = "recipe_nutrition"
+
+    NUTRIENTS = ("calories", "protein", "fat", "carbohydrates", "fiber", "salt")
+
+    recipe_id = Column(Integer, ForeignKey(
+        "recipes.id", ondelete="CASCADE"), primary_key=True)
+    # scope=own の絞り込み用（recipes と結合せずに持ち主で選べるようにする）
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    calories = Column(Float, nullable=False)
+    protein = Column(Float, nullable=False)
+    fat = Column(Float, nullable=False)
+    carbohydrates = Column(Float, nullable=False)
+    fiber = Column(Float, nullable=False)
+    salt = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    @staticmethod
+    def store(db: Session, recipe_id: int, user_id: int,
+              markdown_content: str, content_format: str | None) -> None:
+        """本文から栄養価を読み取って保存する。読み取れなければ行を消す（コミットは呼び出し側）"""
+        values = llm.parse_nutrition(markdown_content, content_format)
+        if values is None:
+            existing = db.get(RecipeNutrition, recipe_id)
+            if existing is not None:
+                db.delete(existing)
+            return
+        db.merge(RecipeNutrition(
+            recipe_id=recipe_id, user_id=user_id, updated_at=datetime.utcnow(), **values))
+
+
+class PregeneratedRecipe(Base):
+    """
+    ピーク前に事前生成したレシピと画像（src/pregen.py）。
+    create-recipe はピーク時間帯に同じテーマの行があれば生成せずに割り当てる。
+    1行は PREGEN_MAX_ASSIGNMENTS 人まで割り当て、同じユーザーには同じ行を割り当てない。
+    """
+    __tablename__ = "pregenerated_recipes"
+    __table_args__ = (
+        Index("ix_pregenerated_recipes_theme_created", "theme", "created_at"),
+    )
+
+    # 割り当てたレシピの GenerationLog.mode
+    MODE = "pregen"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # 正規化したテーマ（pregen.normalize_theme）。割り当て時はこの列で一致させる
+    theme = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    markdown_content = deferred(Column(CompressedText, nullable=False))
+    content_format = Column(String, nullable=False, default=llm.MARKDOWN_FORMAT)
+    image_url = Column(String, nullable=True)
+    mode = Column(String, nullable=False)
+    deployment = Column(String)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    latency_ms = Column(Float)
+    image_latency_ms = Column(Float)
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    assigned_count = Column(Integer, nullable=False, default=0)
+    last_assigned_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    @staticmethod
+    def claim(db: Session, theme: str, user_id: int, since: datetime,
+              max_assignments: int, candidates: int = 3) -> "PregeneratedRecipe | None":
+        """
+        theme の行のうち、since 以降に作られ、割り当て回数に余裕があり、user_id にまだ割り当てていない
+        ものを1つ確保する（割り当て回数の少ない順）。確保は条件付き UPDATE で行うので、
+        同時に同じ行を取り合っても上限を超えない（コミットは呼び出し側）
+        """
+        seen = (
+            select(Recipe.id)
+            .where(Recipe.user_id == user_id, Recipe.source_pregen_id == PregeneratedRecipe.id)
+            .exists()
+        )
+        rows = db.execute(
+            select(PregeneratedRecipe.id)
+            .where(
+                PregeneratedRecipe.theme == theme,
+                PregeneratedRecipe.created_at >= since,
+                PregeneratedRecipe.assigned_count < max_assignments,
+                ~seen,
+            )
+            .order_by(PregeneratedRecipe.assigned_count, PregeneratedRecipe.id)
+            .limit(candidates)
+        ).scalars().all()
+        for pregen_id in rows:
+            claimed = db.execute(
+                update(PregeneratedRecipe)
+                .where(PregeneratedRecipe.id == pregen_id,
+                       PregeneratedRecipe.assigned_count < max_assignments)
+                .values(assigned_count=PregeneratedRecipe.assigned_count + 1,
+                        last_assigned_at=datetime.utcnow())
+            ).rowcount
+            if claimed:
+                return db.get(PregeneratedRecipe, pregen_id)
+        return None
+
+    @staticmethod
+    def remaining_by_theme(db: Session, since: datetime, max_assignments: int) -> dict[str, int]:
+        """テーマごとの残りの割り当て可能回数"""
+        rows = db.execute(
+            select(
+                PregeneratedRecipe.theme,
+                func.sum(max_assignments - PregeneratedRecipe.assigned_count),
+            )
+            .where(PregeneratedRecipe.created_at >= since,
+                   PregeneratedRecipe.assigned_count < max_assignments)
+            .group_by(PregeneratedRecipe.theme)
+        )
+        return {theme: int(remaining) for theme, remaining in rows}
+
+    @staticmethod
+    def spent_since(db: Session, since: datetime) -> float:
+        return db.execute(
+            select(func.coalesce(func.sum(PregeneratedRecipe.cost_usd), 0.0))
+            .where(PregeneratedRecipe.created_at >= since)
+        ).scalar()
+
+    @staticmethod
+    def expire(db: Session, before: datetime) -> int:
+        """before より前に作った行を消す（割り当て済みのレシピからの参照は外す）"""
+        expired = select(PregeneratedRecipe.id).where(PregeneratedRecipe.created_at < before)
+        db.execute(
+            update(Recipe)
+            .where(Recipe.source_pregen_id.in_(expired))
+            .values(source_pregen_id=None)
+        )
+        count = db.execute(
+            PregeneratedRecipe.__table__.delete().where(PregeneratedRecipe.created_at < before)
+        ).rowcount
+        db.commit()
+        return count
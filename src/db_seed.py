@@ -0,0 +1,391 @@
+"""
+大量のダミーデータを投入するツール（本番相当のデータ量での検証用）。
+
+    python -m src.db_seed --users 100000 --recipes 1000000
+
+既定では既存データを消さず、各テーブルの現在の最大 id の後ろに追記する。
+--reset を付けると db_setup と同じくテーブルを作り直す。
+行は ORM オブジェクトを作らずにバッチ単位で投入する（PostgreSQL は COPY、それ以外は
+Core の insert() をコンパイルした文を executemany）。パスワードハッシュは1回だけ計算して全員で使い回す。
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
+from werkzeug.security import generate_password_hash
+from src import analytics, embeddings, llm
+from src.get_conn import get_connection_uri
+from src.db_models import Base, User, Recipe, RecipeEmbedding, RecipeNutrition, Image, Subscription
+
+# シードしたユーザーは全員このパスワードでログインできる
+SEED_PASSWORD = "password"
+
+DEFAULT_BATCH_SIZE = 10_000
+
+_DISHES = ["鶏むね肉のソテー", "豆腐ハンバーグ", "鮭の塩焼き", "野菜たっぷり味噌汁",
+           "ひじきの煮物", "サバの味噌煮", "ほうれん草のおひたし", "オートミール粥",
+           "キヌアサラダ", "ささみの梅しそ巻き", "きのこの炊き込みご飯", "豚しゃぶサラダ"]
+_STYLES = ["", "減塩", "高たんぱく", "作り置き", "10分でできる", "低糖質"]
+
+# (状態, 重み)。解約済みには end_date を入れる
+_SUBSCRIPTION_STATUSES = (("active", 70), ("canceled", 20),
+                          ("past_due", 6), ("unpaid", 4))
+
+
+# ------------------------------
+# バッチ投入
+# ------------------------------
+def _batches(rows, batch_size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_batch(conn, table, columns: list[str], batch: list[tuple]) -> None:
+    """PostgreSQL の COPY FROM STDIN で1バッチ投入する"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        # bytea は16進表記で渡す
+        writer.writerow(
+            "t" if v is True else "f" if v is False else
+            "\\x" + v.hex() if isinstance(v, bytes) else v for v in row)
+    buffer.seek(0)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer)
+    finally:
+        cursor.close()
+
+
+def _process_decorated(row: tuple, decorated, dialect) -> tuple:
+    row = list(row)
+    for i, column_type in decorated:
+        if row[i] is not None:
+            row[i] = column_type.process_bind_param(row[i], dialect)
+    return tuple(row)
+
+
+def _bind_processor(column, dialect):
+    processor = column.type.dialect_impl(dialect).bind_processor(dialect)
+    if processor is None:
+        return None
+    # SQLite の DateTime は isoformat と同じ文字列で保存されるので、一致する場合は
+    # processor（1件あたり数µs）の代わりに isoformat を使う
+    sample = datetime(2001, 2, 3, 4, 5, 6, 7)
+    try:
+        if processor(sample) == sample.isoformat(" ", "microseconds"):
+            return lambda value: value.isoformat(" ", "microseconds")
+    except (TypeError, AttributeError, ValueError):
+        pass
+    return processor
+
+
+def bulk_insert(conn, table, columns: list[str], rows, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    columns の順に並んだタプルを batch_size 件ずつ投入し、件数を返す。
+    値の型変換（DateTime など）は各カラム型の bind processor をそのまま使う。
+    COPY ではカラムの Python 側 default が効かないので、default のある列も columns に含めること。
+    """
+    dialect = conn.dialect
+    if dialect.name == "postgresql":
+        # COPY でも圧縮列（TypeDecorator）の変換だけは行う
+        decorated = [(i, table.c[name].type) for i, name in enumerate(columns)
+                     if isinstance(table.c[name].type, TypeDecorator)]
+        count = 0
+        for batch in _batches(rows, batch_size):
+            if decorated:
+                batch = [_process_decorated(row, decorated, dialect) for row in batch]
+            _copy_batch(conn, table, columns, batch)
+            count += len(batch)
+        return count
+
+    compiled = insert(table).compile(dialect=dialect, column_keys=columns)
+    processors = [_bind_processor(table.c[name], dialect) for name in columns]
+    positional = dialect.positional and compiled.positiontup == columns
+
+    converted = [(i, p) for i, p in enumerate(processors) if p is not None]
+
+    count = 0
+    for batch in _batches(rows, batch_size):
+        if converted:
+            # 同じ値（created_at と updated_at など）は変換結果を使い回す
+            memo = {}
+            out = []
+            for row in batch:
+                row = list(row)
+                for i, processor in converted:
+                    value = row[i]
+                    if value is not None:
+                        result = memo.get(value)
+                        if result is None:
+                            result = memo[value] = processor(value)
+                        row[i] = result
+                out.append(tuple(row))
+            batch = out
+        if positional:
+            conn.exec_driver_sql(str(compiled), batch)
+        else:
+            conn.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+        count += len(batch)
+    return count
+
+
+def _next_id(conn, model) -> int:
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _reset_sequences(conn) -> None:
+    """id を明示して COPY した後に PostgreSQL のシーケンスを進める"""
+    if conn.dialect.name != "postgresql":
+        return
+    for model in (User, Recipe, Image, Subscription):
+        table = model.__tablename__
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+
+
+# ------------------------------
+# 行の生成
+# ------------------------------
+def _recipe_bodies(rng: random.Random) -> list[tuple]:
+    """(title, content, content_format) の候補。本文の生成を行ごとにしないため事前に作る"""
+    bodies = []
+    for dish in _DISHES:
+        for style in _STYLES:
+            title = f"{style}{dish}" if style else dish
+            markdown = (
+                f"---\n料理名：{title}\n"
+                "材料：鶏むね肉 120g、ブロッコリー 80g、玄米ごはん 150g、オリーブオイル 小さじ1\n"
+                "作り方：\n1. 材料を食べやすい大きさに切る\n2. フライパンで焼き、塩こしょうで味を調える\n"
+                "3. ごはんと一緒に盛り付ける\n"
+                "栄養ポイント：たんぱく質と食物繊維がしっかりとれ、脂質は控えめです。\n---\n"
+            )
+            bodies.append((title, markdown, llm.MARKDOWN_FORMAT))
+            structured = json.dumps({
+                "title": title,
+                "ingredients": [{"name": "鶏むね肉", "amount": "120g"},
+                                {"name": "ブロッコリー", "amount": "80g"}],
+                "steps": ["材料を切る", "焼いて味を調える", "盛り付ける"],
+                "nutrition": {"calories": rng.randint(350, 750), "protein": rng.randint(15, 45),
+                              "fat": rng.randint(5, 25), "carbohydrates": rng.randint(30, 90),
+                              "fiber": 4.5, "salt": 1.8},
+                "points": "たんぱく質と食物繊維がしっかりとれます。",
+            }, ensure_ascii=False, separators=(",", ":"))
+            bodies.append((title, structured, llm.JSON_FORMAT))
+    return bodies
+
+
+def seed(
+    engine,
+    users: int,
+    recipes: int,
+    images_per_recipe: float = 1.1,
+    subscription_rate: float = 0.3,
+    days: int = 730,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    reset: bool = False,
+    rng_seed: int = 0,
+    log=print,
+) -> dict:
+    """
+    ダミーデータを投入し、テーブルごとの件数と所要時間を返す。
+
+    レシピの持ち主は少数のヘビーユーザーに偏らせる（上位10%のユーザーが約半分を持つ）。
+    レシピの約15%は JSON 形式、画像は平均 images_per_recipe 枚（2枚目以降は再生成扱い）。
+    """
+    rng = random.Random(rng_seed)
+    if reset:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    now = datetime.utcnow().replace(microsecond=0)
+    span_s = days * 86400
+    bodies = _recipe_bodies(rng)
+    markdown_bodies = [b for b in bodies if b[2] == llm.MARKDOWN_FORMAT]
+    json_bodies = [b for b in bodies if b[2] == llm.JSON_FORMAT]
+    statuses = [s for s, _ in _SUBSCRIPTION_STATUSES]
+    status_weights = [w for _, w in _SUBSCRIPTION_STATUSES]
+    counts = {}
+    timings = {}
+
+    with engine.begin() as conn:
+        user_start = _next_id(conn, User)
+        recipe_start = _next_id(conn, Recipe)
+        image_start = _next_id(conn, Image)
+        subscription_start = _next_id(conn, Subscription)
+        if users <= 0 and recipes > 0:
+            raise ValueError("recipes need at least one user")
+
+        def timed(name, table, columns, rows):
+            start = time.perf_counter()
+            counts[name] = bulk_insert(conn, table, columns, rows, batch_size)
+            timings[name] = round(time.perf_counter() - start, 3)
+            log(f"Inserted {counts[name]} {name} in {timings[name]}s")
+
+        # ---------- users ----------
+        def user_rows():
+            random_ = rng.random
+            for i in range(user_start, user_start + users):
+                yield (i, f"User {i}", f"seed{i}@example.com", password_hash,
+                       random_() < 0.01, now - timedelta(seconds=int(random_() * span_s)))
+
+        timed("users", User.__table__,
+              ["id", "name", "email", "password_hash", "disabled", "created_at"],
+              user_rows())
+
+        # ---------- subscriptions ----------
+        def subscription_rows():
+            sub_id = subscription_start
+            random_ = rng.random
+            for user_id in range(user_start, user_start + users):
+                if random_() >= subscription_rate:
+                    continue
+                status = rng.choices(statuses, status_weights)[0]
+                start_date = now - timedelta(seconds=int(random_() * span_s))
+                end_date = (start_date + timedelta(days=rng.randint(30, 365))
+                            if status == "canceled" else None)
+                yield (sub_id, user_id, f"sub_seed_{sub_id}", f"cus_seed_{user_id}",
+                       status, start_date, end_date)
+                sub_id += 1
+
+        timed("subscriptions", Subscription.__table__,
+              ["id", "user_id", "stripe_subscription_id", "stripe_customer_id",
+               "status", "start_date", "end_date"],
+              subscription_rows())
+
+        # ---------- recipes ----------
+        heavy_users = max(1, users // 10)
+        # 埋め込みは本文の候補ごとに1回だけ計算し、レシピごとに候補の番号を覚えておく
+        body_ids = {id(body): i for i, body in enumerate(bodies)}
+        body_indexes = array("H")
+        recipe_owners = array("I")
+
+        def recipe_rows():
+            random_ = rng.random
+            for recipe_id in range(recipe_start, recipe_start + recipes):
+                # 半分は先頭10%のヘビーユーザーから、残りは全ユーザーから選ぶ
+                owners = heavy_users if random_() < 0.5 else users
+                user_id = user_start + int(random_() * owners)
+                pool = json_bodies if random_() < 0.15 else markdown_bodies
+                title, content, content_format = body = pool[int(random_() * len(pool))]
+                body_indexes.append(body_ids[id(body)])
+                recipe_owners.append(user_id)
+                created_at = now - timedelta(seconds=int(random_() * span_s))
+                yield (recipe_id, user_id, title, content, content_format,
+                       created_at, created_at, 1)
+
+        timed("recipes", Recipe.__table__,
+              ["id", "user_id", "title", "markdown_content", "content_format",
+               "created_at", "updated_at", "version"],
+              recipe_rows())
+
+        # ---------- recipe_embeddings ----------
+        embedder = embeddings.get_embedder()
+        vectors = [vector.tobytes() for vector in embeddings.quantize(embedder.embed(
+            [embeddings.recipe_text(*body) for body in bodies]))]
+
+        def embedding_rows():
+            for recipe_id, index in zip(range(recipe_start, recipe_start + recipes), body_indexes):
+                yield (recipe_id, embedder.name, embeddings.DTYPE, vectors[index], now)
+
+        timed("recipe_embeddings", RecipeEmbedding.__table__,
+              ["recipe_id", "model", "dtype", "vector", "updated_at"],
+              embedding_rows())
+
+        # ---------- recipe_nutrition ----------
+        # 栄養価を読み取れる本文（JSON 形式）のレシピだけ行を持つ
+        nutrition = [llm.parse_nutrition(content, content_format)
+                     for _, content, content_format in bodies]
+
+        def nutrition_rows():
+            for recipe_id, index, user_id in zip(
+                    range(recipe_start, recipe_start + recipes), body_indexes, recipe_owners):
+                values = nutrition[index]
+                if values is not None:
+                    yield (recipe_id, user_id,
+                           *(values[key] for key in RecipeNutrition.NUTRIENTS), now)
+
+        timed("recipe_nutrition", RecipeNutrition.__table__,
+              ["recipe_id", "user_id", *RecipeNutrition.NUTRIENTS, "updated_at"],
+              nutrition_rows())
+
+        # ---------- images ----------
+        whole = int(images_per_recipe)
+        fraction = images_per_recipe - whole
+
+        def image_rows():
+            image_id = image_start
+            random_ = rng.random
+            for recipe_id in range(recipe_start, recipe_start + recipes):
+                n = whole + (1 if random_() < fraction else 0)
+                for k in range(n):
+                    yield (image_id, recipe_id,
+                           f"https://example.com/images/{recipe_id}-{k}.png",
+                           k > 0, False, now)
+                    image_id += 1
+
+        timed("images", Image.__table__,
+              ["id", "recipe_id", "image_url", "is_regenerated", "is_variant", "created_at"],
+              image_rows())
+
+        _reset_sequences(conn)
+
+    return {"counts": counts, "seconds": timings}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Bulk-insert synthetic users, recipes, images and subscriptions.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--recipes", type=int, default=100_000)
+    parser.add_argument("--images-per-recipe", type=float, default=1.1)
+    parser.add_argument("--subscription-rate", type=float, default=0.3)
+    parser.add_argument("--days", type=int, default=730,
+                        help="spread created_at over this many past days")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true",
+                        help="drop and recreate all tables first (destructive)")
+    args = parser.parse_args()
+
+    engine = create_engine(
+        get_connection_uri(), echo=os.getenv("SQL_ECHO", "false").lower() == "true")
+    start = time.perf_counter()
+    result = seed(
+        engine,
+        users=args.users,
+        recipes=args.recipes,
+        images_per_recipe=args.images_per_recipe,
+        subscription_rate=args.subscription_rate,
+        days=args.days,
+        batch_size=args.batch_size,
+        reset=args.reset,
+        rng_seed=args.seed,
+    )
+    print(f"Finished seeding in {time.perf_counter() - start:.1f}s: {result['counts']}")
+
+    # 一括投入は日次集計のフックを通らないので作り直す
+    with Session(engine) as db:
+        print(f"Rebuilt {analytics.rebuild(db)} days of analytics")
+
+
+if __name__ == "__main__":
+    main()
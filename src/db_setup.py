@@ -1,9 +1,10 @@
+import os
 from datetime import datetime
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from werkzeug.security import generate_password_hash
-from get_conn import get_connection_uri
-from db_models import (
+from src.get_conn import get_connection_uri
+from src.db_models import (
     Base,
     User,
     Recipe,
@@ -13,7 +14,8 @@ from db_models import (
 
 conn_string = get_connection_uri()
 
-engine = create_engine(conn_string, echo=True)
+engine = create_engine(
+    conn_string, echo=os.getenv("SQL_ECHO", "false").lower() == "true")
 SessionLocal = sessionmaker(bind=engine)
 session = SessionLocal()
 
@@ -0,0 +1,143 @@
+"""
+レシピの埋め込みベクトル（類似レシピ検索用）。
+
+レシピの作成・編集時に1回だけ計算し、recipe_embeddings に float16 / int8 のバイト列で保存する。
+ベクトルは L2 正規化して保存するので、コサイン類似度は内積で求まる
+（int8 はベクトルごとに最大値で 127 倍に量子化する。方向だけを使うのでスケールは保存しない）。
+
+- hashing（既定）: 文字 bigram と英数字の単語を符号付きハッシュで EMBEDDING_DIM 次元に畳み込む。
+  外部APIを呼ばず決定的なので、ローカル・テスト・ベンチマークでもそのまま使える
+- azure: Azure OpenAI の埋め込みデプロイメント（AZURE_EMBEDDING_*）。dimensions に EMBEDDING_DIM を渡す
+
+numpy は import が重いので integrations 経由で最初の利用時に読み込む。
+"""
+import os
+import re
+import zlib
+from dotenv import load_dotenv
+from src import integrations, llm, resilience
+
+# .env をロード
+load_dotenv()
+
+DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+DTYPES = ("float16", "int8")
+DTYPE = os.getenv("EMBEDDING_DTYPE", "int8")
+if DTYPE not in DTYPES:
+    raise ValueError(f"Unknown EMBEDDING_DTYPE: {DTYPE}")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def recipe_text(title: str, markdown_content: str, content_format: str | None) -> str:
+    """埋め込みの入力（タイトルは2回入れて重みを上げる）"""
+    if content_format == llm.JSON_FORMAT:
+        markdown_content = llm.render_recipe_markdown(markdown_content)
+    return f"{title}\n{title}\n{markdown_content}"
+
+
+class HashingEmbedder:
+    """符号付きの feature hashing（決定的・外部依存なし）"""
+
+    def __init__(self, dim: int = DIM):
+        self.dim = dim
+        self.name = f"hashing-v1-{dim}"
+
+    def _features(self, text: str):
+        text = text.lower()
+        yield from _WORD_RE.findall(text)
+        compact = _SPACE_RE.sub("", text)
+        for i in range(len(compact) - 1):
+            yield compact[i:i + 2]
+
+    def embed(self, texts: list[str]):
+        np = integrations.get_numpy()
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(
+                (zlib.crc32(f.encode("utf-8")) for f in self._features(text)), dtype=np.uint32)
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+            counts = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+            # 頻出する bigram（「する」「ます」など）に引っ張られないよう対数で抑える
+            out[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        return normalize(out)
+
+
+class AzureEmbedder:
+    """Azure OpenAI の埋め込みAPI"""
+
+    def __init__(self, dim: int = DIM):
+        self.dim = dim
+        self.deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT")
+        self.name = f"azure:{self.deployment}-{dim}"
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = integrations.get_openai().AzureOpenAI(
+                api_version=os.getenv("AZURE_EMBEDDING_API_VERSION") or os.getenv("AZURE_API_VERSION"),
+                azure_endpoint=os.getenv("AZURE_EMBEDDING_ENDPOINT") or os.getenv("AZURE_ENDPOINT"),
+                api_key=os.getenv("AZURE_EMBEDDING_API_KEY") or os.getenv("AZURE_SUBSCRIPTION_KEY"),
+                max_retries=0,
+            )
+        return self._client
+
+    def embed(self, texts: list[str]):
+        np = integrations.get_numpy()
+        openai = integrations.get_openai()
+        response = resilience.call(
+            "azure-embedding",
+            lambda timeout: self._get_client().embeddings.create(
+                model=self.deployment, input=texts, dimensions=self.dim, timeout=timeout),
+            deadline_s=float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", "30")),
+            idempotent=True,
+            failure_on=(openai.APIConnectionError, openai.APITimeoutError,
+                        openai.RateLimitError, openai.InternalServerError),
+        )
+        return normalize(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        backend = os.getenv("EMBEDDING_BACKEND", "hashing")
+        if backend == "hashing":
+            _embedder = HashingEmbedder()
+        elif backend == "azure":
+            _embedder = AzureEmbedder()
+        else:
+            raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+    return _embedder
+
+
+# ------------------------------
+# 正規化・量子化
+# ------------------------------
+def normalize(vectors):
+    np = integrations.get_numpy()
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors, dtype: str = DTYPE):
+    """正規化済みの float32 ベクトル（行列）を保存用の dtype に変換する"""
+    np = integrations.get_numpy()
+    if dtype == "float16":
+        return vectors.astype(np.float16)
+    scale = np.abs(vectors).max(axis=-1, keepdims=True)
+    return np.round(vectors * (127.0 / np.where(scale == 0, 1.0, scale))).astype(np.int8)
+
+
+def encode(vector, dtype: str = DTYPE) -> bytes:
+    return quantize(vector, dtype).tobytes()
+
+
+def decode(data: bytes, dtype: str):
+    np = integrations.get_numpy()
+    return np.frombuffer(data, dtype=np.dtype(dtype))
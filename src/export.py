@@ -0,0 +1,204 @@
+"""
+ユーザーのレシピ一式のエクスポート（GET /api/recipe/export）。
+
+一覧 API のように全件を dict / モデルに組み立ててから返すのではなく、
+サーバー側カーソル（yield_per）で EXPORT_BATCH_SIZE 件ずつ読みながらそのまま書き出すので、
+メモリ使用量はコレクションの大きさによらない（ZIP の末尾に置く目次だけはエントリ数に比例する）。
+
+- ndjson: 1行1レシピ（画像はURLのみ）
+- zip: recipes/<id>-<タイトル>.md と images/<recipe_id>-<image_id>.<拡張子>。
+  画像は取得しながらチャンク単位で流す（取得できなかった画像は missing-images.txt に記録）
+
+どちらもレシピID順に書き出す。途中で切れたダウンロードは、受け取れた最後のレシピIDを
+after_id に渡すと続きから再開できる（ndjson は最後の不完全な行を捨てる。zip は続きの分を別の ZIP で返す）。
+"""
+import os
+import re
+import zipfile
+import orjson
+from sqlalchemy import select
+from dotenv import load_dotenv
+from src import image_store, integrations, metrics
+from src.db_models import Image, Recipe, User
+
+# .env をロード
+load_dotenv()
+
+BATCH_SIZE = int(os.getenv("RECIPE_EXPORT_BATCH_SIZE", "200"))
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_TIMEOUT_SECONDS = float(os.getenv("EXPORT_IMAGE_TIMEOUT_SECONDS", "30"))
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "zip": "application/zip",
+}
+
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def iter_recipes(session_factory, user_id: int, after_id: int = 0, batch_size: int = BATCH_SIZE):
+    """(レシピの行, 画像の行のリスト) を ID 順に返す。画像はバッチごとに1クエリで読む"""
+    db = session_factory()
+    try:
+        result = db.execute(
+            select(
+                Recipe.id,
+                Recipe.title,
+                Recipe.markdown_content,
+                Recipe.content_format,
+                User.name.label("user"),
+                Recipe.created_at,
+                Recipe.updated_at,
+            )
+            .join(User, User.id == Recipe.user_id)
+            .where(Recipe.user_id == user_id, Recipe.deleted_at.is_(None), Recipe.id > after_id)
+            .order_by(Recipe.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for rows in result.partitions():
+            images = {row.id: [] for row in rows}
+            for image in db.execute(
+                select(Image.id, Image.recipe_id, Image.image_url, Image.is_regenerated,
+                       Image.created_at)
+                .where(Image.recipe_id.in_(list(images)), Image.is_variant.is_(False))
+                .order_by(Image.id)
+            ):
+                images[image.recipe_id].append(image)
+            for row in rows:
+                yield row, images[row.id]
+    finally:
+        db.close()
+
+
+# ------------------------------
+# NDJSON
+# ------------------------------
+def ndjson_stream(session_factory, user_id: int, after_id: int = 0):
+    metrics.recipe_exports.inc("ndjson")
+    for row, images in iter_recipes(session_factory, user_id, after_id):
+        yield orjson.dumps({
+            "id": row.id,
+            "title": row.title,
+            "markdown_content": Recipe.render_content(row.markdown_content, row.content_format),
+            "user": row.user,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "images": [
+                {"id": image.id, "image_url": image.image_url,
+                 "is_regenerated": image.is_regenerated, "created_at": image.created_at}
+                for image in images
+            ],
+        }, option=orjson.OPT_APPEND_NEWLINE)
+
+
+# ------------------------------
+# ZIP
+# ------------------------------
+class _ChunkBuffer:
+    """ZipFile の書き込み先。tell / seek を持たないので ZipFile はストリーミング形式（データ記述子付き）で書く"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _safe_name(title: str, limit: int = 60) -> str:
+    name = _UNSAFE_CHARS.sub("_", title).strip(" .")
+    return name[:limit] or "recipe"
+
+
+def _image_extension(url: str) -> str:
+    ext = os.path.splitext(url.split("?", 1)[0].rsplit("/", 1)[-1])[1].lower()
+    return ext if ext in (".png", ".jpg", ".jpeg", ".webp", ".gif") else ".png"
+
+
+def _zip_info(name: str, when, compress_type: int) -> zipfile.ZipInfo:
+    # 同じ内容なら同じバイト列になるよう、日時はレコードの値を使う
+    info = zipfile.ZipInfo(name, date_time=when.timetuple()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+class _LocalImage:
+    """ローカル保存した画像を requests のレスポンスと同じように読む"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def iter_content(self, chunk_size: int):
+        return iter(lambda: self.file.read(chunk_size), b"")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _open_image(url: str):
+    """画像を stream=True で開く（ローカル保存した画像はファイルを開く）。取得できなければ None"""
+    if image_store.name_from_url(url):
+        file = image_store.open_local(url)
+        return _LocalImage(file) if file is not None else None
+    requests = integrations.get_requests()
+    try:
+        response = requests.get(url, stream=True, timeout=IMAGE_TIMEOUT_SECONDS)
+    except requests.RequestException:
+        return None
+    if response.status_code >= 400:
+        response.close()
+        return None
+    return response
+
+
+def zip_stream(session_factory, user_id: int, after_id: int = 0, include_images: bool = True):
+    metrics.recipe_exports.inc("zip")
+    buffer = _ChunkBuffer()
+    missing = []
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for row, images in iter_recipes(session_factory, user_id, after_id):
+            archive.writestr(
+                _zip_info(f"recipes/{row.id:08d}-{_safe_name(row.title)}.md",
+                          row.updated_at or row.created_at, zipfile.ZIP_DEFLATED),
+                Recipe.render_content(row.markdown_content, row.content_format),
+            )
+            yield buffer.drain()
+
+            if not include_images:
+                continue
+            for image in images:
+                response = _open_image(image.image_url)
+                if response is None:
+                    missing.append(f"{row.id}\t{image.id}\t{image.image_url}")
+                    continue
+                # 画像は圧縮済みなので無圧縮で格納する
+                info = _zip_info(
+                    f"images/{row.id:08d}-{image.id}{_image_extension(image.image_url)}",
+                    image.created_at or row.created_at, zipfile.ZIP_STORED)
+                try:
+                    with archive.open(info, "w") as dest:
+                        for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                            dest.write(chunk)
+                            metrics.export_image_bytes.inc(amount=len(chunk))
+                            yield buffer.drain()
+                finally:
+                    response.close()
+
+        if missing:
+            archive.writestr("missing-images.txt", "\n".join(missing) + "\n")
+    yield buffer.drain()
+
+
+def stream(format: str, session_factory, user_id: int, after_id: int = 0,
+           include_images: bool = True):
+    if format == "zip":
+        return zip_stream(session_factory, user_id, after_id, include_images)
+    return ndjson_stream(session_factory, user_id, after_id)
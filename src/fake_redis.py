@@ -0,0 +1,226 @@
+"""
+Redis の代わりに使う純 Python の実装（shared_state が使うコマンドのみ）。
+
+FakeRedis はプロセス内で execute(*args) を受け付ける。複数ワーカーから使う場合は
+TCP で Redis プロトコルを話すサーバーとして起動する:
+
+    python -m src.fake_redis --port 6379
+    SHARED_STATE_URL=redis://127.0.0.1:6379/0 python -m src.server
+
+--certfile / --keyfile を渡すと TLS で待ち受ける（rediss:// の確認用）。
+"""
+import argparse
+import socketserver
+import ssl
+import threading
+import time
+from src.shared_state import INCR_SCRIPT, RELEASE_SCRIPT, RedisError, encode_command, read_reply
+
+
+def _b(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakeRedis:
+    def __init__(self):
+        # key -> (値, 期限の monotonic 秒 or None)
+        self._data = {}
+        self._lock = threading.Lock()
+        self._scripts = {
+            RELEASE_SCRIPT: self._release_script,
+            INCR_SCRIPT: self._incr_script,
+        }
+
+    def _live(self, key: bytes):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def execute(self, *args):
+        command = _b(args[0]).upper().decode()
+        handler = getattr(self, f"_cmd_{command.lower()}", None)
+        if handler is None:
+            raise RedisError(f"ERR unknown command '{command}'")
+        with self._lock:
+            return handler(*(_b(a) for a in args[1:]))
+
+    # ---------- commands ----------
+    def _cmd_ping(self, *args):
+        return b"PONG"
+
+    def _cmd_select(self, db):
+        return b"OK"
+
+    def _cmd_auth(self, *args):
+        return b"OK"
+
+    def _cmd_flushall(self, *args):
+        self._data.clear()
+        return b"OK"
+
+    def _cmd_get(self, key):
+        item = self._live(key)
+        return None if item is None else item[0]
+
+    def _cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        expires_at = None
+        nx = b"NX" in options
+        for unit, scale in ((b"PX", 1000), (b"EX", 1)):
+            if unit in options:
+                expires_at = time.monotonic() + int(options[options.index(unit) + 1]) / scale
+        if nx and self._live(key) is not None:
+            return None
+        self._data[key] = (value, expires_at)
+        return b"OK"
+
+    def _cmd_del(self, *keys):
+        return sum(1 for key in keys if self._live(key) is not None and self._data.pop(key))
+
+    def _cmd_incrby(self, key, amount):
+        item = self._live(key)
+        try:
+            value = (int(item[0]) if item else 0) + int(amount)
+        except ValueError:
+            raise RedisError("ERR value is not an integer or out of range")
+        self._data[key] = (_b(value), item[1] if item else None)
+        return value
+
+    def _cmd_pexpire(self, key, ms):
+        item = self._live(key)
+        if item is None:
+            return 0
+        self._data[key] = (item[0], time.monotonic() + int(ms) / 1000)
+        return 1
+
+    def _cmd_pttl(self, key):
+        item = self._live(key)
+        if item is None:
+            return -2
+        if item[1] is None:
+            return -1
+        return int((item[1] - time.monotonic()) * 1000)
+
+    def _cmd_eval(self, script, numkeys, *rest):
+        # shared_state が使うスクリプトだけを Python で実行する
+        fn = self._scripts.get(script.decode())
+        if fn is None:
+            raise RedisError("ERR script not supported by FakeRedis")
+        n = int(numkeys)
+        return fn(list(rest[:n]), list(rest[n:]))
+
+    # ---------- scripts ----------
+    def _release_script(self, keys, argv):
+        item = self._live(keys[0])
+        if item is not None and item[0] == argv[0]:
+            del self._data[keys[0]]
+            return 1
+        return 0
+
+    def _incr_script(self, keys, argv):
+        value = self._cmd_incrby(keys[0], argv[0])
+        if value == int(argv[0]) and int(argv[1]) > 0:
+            self._cmd_pexpire(keys[0], argv[1])
+        return value
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_fake() -> FakeRedis:
+    """fakeredis:// で使うプロセス内の共有インスタンス"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = FakeRedis()
+        return _shared
+
+
+# ------------------------------
+# TCP サーバー
+# ------------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                args = read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            try:
+                reply = self.server.fake.execute(*args)
+            except RedisError as e:
+                self.wfile.write(b"-" + str(e).encode() + b"\r\n")
+                continue
+            self.wfile.write(_encode_reply(reply))
+
+
+def _encode_reply(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if reply in (b"OK", b"PONG"):
+        return b"+" + reply + b"\r\n"
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode_reply(r) for r in reply)
+    return encode_command([reply])[4:]  # "*1\r\n" を除いたバルク文字列
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fake: FakeRedis | None = None,
+                 ssl_context: ssl.SSLContext | None = None):
+        super().__init__((host, port), _Handler)
+        self.fake = fake or FakeRedis()
+        self.ssl_context = ssl_context
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        scheme = "rediss" if self.ssl_context is not None else "redis"
+        return f"{scheme}://{host}:{port}/0"
+
+    def start(self) -> "FakeRedisServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a FakeRedis server speaking the Redis protocol.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--certfile", help="serve TLS with this certificate (PEM)")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+
+    ssl_context = None
+    if args.certfile:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(args.certfile, args.keyfile)
+    server = FakeRedisServer(args.host, args.port, ssl_context=ssl_context)
+    print(f"FakeRedis listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
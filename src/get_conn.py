@@ -1,7 +1,11 @@
+import itertools
 import os
 # import urllib.parse
+from fastapi import Request
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
+from src import metrics
+from src.shared_state import get_state
 # from dotenv import load_dotenv
 
 # # .env をロード
@@ -13,7 +17,10 @@ DB_PATH = os.path.join(BASE_DIR, "app.db")
 
 
 def get_connection_uri() -> str:
-    """SQLiteの接続URIを生成"""
+    """接続URIを生成（DATABASE_URL があればそれを使い、なければSQLite）"""
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        return database_url
     return f"sqlite:///{DB_PATH}"
     # """PostgreSQLの接続URIを生成"""
     # db_host = os.getenv("PGHOST")
@@ -27,14 +34,98 @@ def get_connection_uri() -> str:
 
 # SQLAlchemyエンジンとセッション
 DATABASE_URL = get_connection_uri()
-engine = create_engine(DATABASE_URL, echo=True, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# SQL の全件出力は同期I/Oになるので既定では無効（サンプリングログは logging_config 参照）
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+engine = create_engine(
+    DATABASE_URL,
+    echo=SQL_ECHO,
+    future=True,
+)
 
+# ------------------------------
+# 読み取りレプリカ
+# DATABASE_READ_URLS（カンマ区切り）を設定すると、GET リクエストの読み取りをレプリカに送る。
+# 書き込みをしたユーザーは READ_YOUR_WRITES_SECONDS のあいだプライマリから読む（レプリカの遅延対策）
+# ------------------------------
+READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+READ_METHODS = ("GET", "HEAD")
 
-def get_db() -> Session:
-    """FastAPI依存注入用のDBセッション"""
-    db = SessionLocal()
+reader_engines = [
+    create_engine(url, echo=SQL_ECHO, future=True, pool_pre_ping=True)
+    for url in READ_URLS
+]
+_next_reader = itertools.count()
+
+
+class RoutingSession(Session):
+    """
+    reader を渡されたセッションは SELECT をレプリカに送り、
+    flush と INSERT / UPDATE / DELETE はプライマリ（writer）に送る。
+    """
+
+    def __init__(self, *args, reader=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reader = reader
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.reader is None or self._flushing or getattr(clause, "is_dml", False):
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        return self.reader
+
+
+SessionLocal = sessionmaker(
+    bind=engine, class_=RoutingSession, autoflush=False, autocommit=False)
+
+
+def choose_reader():
+    """レプリカをラウンドロビンで選ぶ（未設定なら None = プライマリ）"""
+    if not reader_engines:
+        return None
+    return reader_engines[next(_next_reader) % len(reader_engines)]
+
+
+def _token_payload(request: Request) -> dict | None:
+    """Authorization ヘッダーのトークンを検証した payload（無いか、署名・期限が不正なら None）"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    from src.utils import verify_access_token
+    return verify_access_token(token)
+
+
+def _recent_write_key(user_id: int) -> str:
+    return f"rw:{user_id}"
+
+
+def get_db(request: Request) -> Session:
+    """
+    FastAPI依存注入用のDBセッション。
+    レプリカが設定されていれば、GET / HEAD のうち直近に書き込みをしていないユーザーの読み取りをレプリカに送る。
+    """
+    reader = None
+    user_id = None
+    if reader_engines:
+        state = get_state()
+        payload = _token_payload(request)
+        # 書き込みの印は検証済みトークンのユーザー ID（uid）をキーにする
+        user_id = payload.get("uid") if payload else None
+        if request.method in READ_METHODS:
+            if payload is None:
+                # 未認証（ルート側で 401 になる）
+                reader = choose_reader()
+            elif user_id is not None and state.get(_recent_write_key(user_id)) is None:
+                reader = choose_reader()
+            # uid の無いトークン（uid を入れる前に発行したもの）は書き込みを追えないのでプライマリから読む
+        elif user_id is not None:
+            state.set(_recent_write_key(user_id), b"1", READ_YOUR_WRITES_SECONDS)
+    metrics.db_sessions.inc("reader" if reader is not None else "writer")
+
+    db = SessionLocal(reader=reader)
     try:
         yield db
     finally:
         db.close()
+        if user_id is not None and request.method not in READ_METHODS:
+            # 書き込みの完了時点から猶予を数え直す
+            get_state().set(_recent_write_key(user_id), b"1", READ_YOUR_WRITES_SECONDS)
@@ -0,0 +1,162 @@
+"""
+Idempotency-Key ヘッダーによる重複実行の防止（レシピ生成・Checkout 作成）。
+
+- 完了したリクエストの応答（2xx と 4xx）を保持期間のあいだ共有状態に保存し、同じキーの再送にはそれを返す
+  （2xx はルートの response_model を通した後の本文を保存するので、初回と再送で同じ本文になる）
+- 同じキーのリクエストが実行中なら、新たに処理を始めずに完了を待って同じ応答を返す
+- 5xx は保存しない（同じキーでの再送で再実行できる）
+- キーはエンドポイントと利用者ごとに区別し、別のパラメーターで使い回されたら 422 を返す
+"""
+import hashlib
+import json
+import os
+import time
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from src import metrics
+from src.shared_state import SharedState, SingleFlight, get_state
+
+# .env をロード
+load_dotenv()
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+# 応答を保持する期間（既定24時間、Stripe と同じ）
+RETENTION_SECONDS = float(os.getenv("IDEMPOTENCY_RETENTION_SECONDS", "86400"))
+# 実行中ロックの有効期限（生成の期限 LLM + 画像より長くする）
+LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+
+
+def fingerprint(params: dict) -> str:
+    """リクエストパラメーターのハッシュ（キーの使い回しの検出用）"""
+    data = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def validate_key(key: str) -> str:
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+    return key
+
+
+def serialize(body, response_model: type[BaseModel] | None = None):
+    """ルートが返す本文を、FastAPI が応答にするのと同じ形（response_model で絞った JSON 互換の値）にする"""
+    if response_model is not None:
+        body = response_model.model_validate(body).model_dump(mode="json")
+    return jsonable_encoder(body)
+
+
+class IdempotencyStore:
+    """
+    保存済み応答は "idem:<scope>:<principal>:<key>" に JSON で置く。
+    実行中かどうかは SingleFlight のロックで表し、複数ワーカーでも1つだけが処理する。
+    """
+
+    def __init__(self, state: SharedState | None = None,
+                 retention_s: float = RETENTION_SECONDS, lock_ttl_s: float = LOCK_SECONDS):
+        self.state = state if state is not None else get_state()
+        self.retention_s = retention_s
+        self.lock_ttl_s = lock_ttl_s
+        self.flight = SingleFlight(self.state, "idem", lock_ttl_s=lock_ttl_s)
+
+    @staticmethod
+    def _key(scope: str, principal, key: str) -> str:
+        return f"idem:{scope}:{principal}:{key}"
+
+    def load(self, record_key: str, params_hash: str) -> dict | None:
+        raw = self.state.get(record_key)
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        if record["fingerprint"] != params_hash:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{HEADER} was already used with different parameters")
+        return record
+
+    def save(self, record_key: str, params_hash: str, status_code: int, body) -> None:
+        record = {"fingerprint": params_hash, "status": status_code,
+                  "body": body, "created_at": time.time()}
+        self.state.set(record_key, json.dumps(record, default=str).encode(), self.retention_s)
+
+    def _attempt(self, record_key: str, params_hash: str):
+        """(保存済み応答, None) / (None, ロックのトークン) / (None, None: 実行中)"""
+        record = self.load(record_key, params_hash)
+        if record is not None:
+            return record, None
+        token = self.flight.try_acquire(record_key)
+        if token is None:
+            return None, None
+        # ロックを取る直前に先行リクエストが完了していた場合
+        record = self.load(record_key, params_hash)
+        if record is not None:
+            self.flight.release(record_key, token)
+            return record, None
+        return None, token
+
+    def _execute(self, record_key: str, params_hash: str, token: bytes, fn, response_model):
+        try:
+            body = serialize(fn(), response_model)
+        except HTTPException as e:
+            # 4xx は同じ入力なら同じ結果なので保存する。5xx と 429（クォータ・レート制限）は再送で再実行させる
+            if e.status_code < 500 and e.status_code != 429:
+                self.save(record_key, params_hash, e.status_code, {"detail": e.detail})
+            raise
+        else:
+            self.save(record_key, params_hash, 200, body)
+            return body
+        finally:
+            self.flight.release(record_key, token)
+
+    def run(self, scope: str, principal, key: str, params: dict, fn,
+            response_model: type[BaseModel] | None = None):
+        """
+        fn() を Idempotency-Key 付きで1回だけ実行する（待機も fn() もブロックするので def のルートから呼ぶ）。
+        初回は fn() の戻り値を response_model で直列化したもの、再送・待機した側は保存済み応答の JSONResponse を返す。
+        """
+        record_key = self._key(scope, principal, validate_key(key))
+        params_hash = fingerprint(params)
+        deadline = time.monotonic() + self.lock_ttl_s
+        while True:
+            record, token = self._attempt(record_key, params_hash)
+            if record is not None:
+                return replay(scope, record)
+            if token is not None:
+                metrics.idempotency_requests.inc(scope, "executed")
+                return self._execute(record_key, params_hash, token, fn, response_model)
+            metrics.idempotency_requests.inc(scope, "attached")
+            if not self.flight.wait(record_key, deadline - time.monotonic()):
+                raise in_progress()
+            # 先行リクエストが 5xx で終わった（保存なし）ならこちらで実行し直す
+
+
+def replay(scope: str, record: dict) -> JSONResponse:
+    metrics.idempotency_requests.inc(scope, "replayed")
+    return JSONResponse(
+        status_code=record["status"],
+        content=record["body"],
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def in_progress() -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail=f"A request with this {HEADER} is still in progress")
+
+
+_store = None
+
+
+def get_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        _store = IdempotencyStore()
+    return _store
@@ -0,0 +1,281 @@
+"""
+生成した画像のローカル保存（IMAGE_STORAGE=local）。
+
+画像APIが返す URL は期限付きなので、生成直後に取得して IMAGE_STORE_DIR に保存し、
+images.image_url には配信用の相対 URL（/api/images/<sha256>.<拡張子>）を入れる。
+- ファイル名は内容の SHA-256。同じ画像は1つのファイルを共有し、内容が変わることはないので
+  配信側は immutable なキャッシュヘッダーを付けられる
+- 保存は一時ファイルに書いてから os.replace するので、途中の状態のファイルは見えない
+- 保存済みの内容をもう一度保存したときは、画像の更新日時（配信の Last-Modified）は変えず、
+  横に置く印のファイル（<名前>.saved）の更新日時で gc の猶予を数え直す
+- 配信は src/api/images/index.py（FileResponse。IMAGE_ACCEL_REDIRECT_PREFIX を設定すると
+  nginx の X-Accel-Redirect に任せて sendfile で返す）
+- どの行からも参照されなくなったファイルは、レシピの物理削除時（purge のフック）、
+  未使用の再生成用画像の削除時（src/image_variants.py）と `python -m src.image_store gc` で消す
+
+IMAGE_STORAGE=remote（既定）のときは従来どおり画像APIの URL をそのまま保存する。
+"""
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+import time
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import integrations, purge
+from src.db_models import Image, PregeneratedRecipe
+
+# .env をロード
+load_dotenv()
+
+STORAGE = os.getenv("IMAGE_STORAGE", "remote").lower()
+STORE_DIR = os.getenv(
+    "IMAGE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_store"))
+URL_PREFIX = "/api/images/"
+MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(20 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("IMAGE_STORE_DOWNLOAD_TIMEOUT_SECONDS", "60"))
+# gc は作成からこの秒数が経ったファイルだけを消す（保存直後でまだ行が無いファイルを残す）
+GC_GRACE_SECONDS = float(os.getenv("IMAGE_STORE_GC_GRACE_SECONDS", "3600"))
+# 保存済みの内容をもう一度保存した時刻を記録する印のファイルの接尾辞
+SAVED_SUFFIX = ".saved"
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+_NAME = re.compile(r"^([0-9a-f]{64})(\.(?:png|jpg|webp|gif))$")
+
+
+def enabled() -> bool:
+    return STORAGE == "local"
+
+
+def parse_name(name: str) -> tuple[str, str] | None:
+    """"<sha256>.<拡張子>" を (sha256, 拡張子) に分ける。形式が違えば None"""
+    match = _NAME.match(name)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def relative_path(name: str) -> str:
+    """保存先の相対パス（先頭2文字でディレクトリを分け、1ディレクトリのファイル数を抑える）"""
+    return f"{name[:2]}/{name}"
+
+
+def path_for(name: str) -> str | None:
+    """配信するファイルのパス。名前の形式が違えば None（パスの組み立てに任意の文字列を使わない）"""
+    if parse_name(name) is None:
+        return None
+    return os.path.join(STORE_DIR, relative_path(name))
+
+
+def url_for(name: str) -> str:
+    return URL_PREFIX + name
+
+
+def name_from_url(url: str | None) -> str | None:
+    """ローカル保存した画像の URL ならファイル名を返す"""
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    name = url[len(URL_PREFIX):]
+    return name if parse_name(name) else None
+
+
+def _extension(content_type: str | None, url: str = "") -> str:
+    ext = _EXTENSIONS.get((content_type or "").split(";", 1)[0].strip().lower())
+    if ext:
+        return ext
+    ext = os.path.splitext(url.split("?", 1)[0])[1].lower()
+    return ".jpg" if ext == ".jpeg" else ext if ext in CONTENT_TYPES else ".png"
+
+
+def _commit(tmp_path: str, digest: str, ext: str) -> str:
+    name = digest + ext
+    path = os.path.join(STORE_DIR, relative_path(name))
+    if os.path.exists(path):
+        # 同じ内容は保存済み。gc の猶予は印のファイルで数え直す（配信中のファイルの更新日時は変えない）
+        os.unlink(tmp_path)
+        with open(path + SAVED_SUFFIX, "a"):
+            pass
+        os.utime(path + SAVED_SUFFIX)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    return name
+
+
+def store_bytes(data: bytes, content_type: str | None = "image/png") -> str:
+    """バイト列を保存してファイル名を返す"""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return _commit(tmp_path, hashlib.sha256(data).hexdigest(), _extension(content_type))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def fetch_and_store(url: str) -> str:
+    """画像APIの URL から取得して保存し、配信用の URL を返す（メモリに全体を載せない）"""
+    requests = integrations.get_requests()
+    os.makedirs(STORE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, prefix=".tmp-")
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f, requests.get(
+                url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+            if response.status_code >= 400:
+                raise ValueError(f"Image download returned {response.status_code}")
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_BYTES:
+                    raise ValueError(f"Image is larger than {MAX_BYTES} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+            content_type = response.headers.get("content-type")
+        if size == 0:
+            raise ValueError("Downloaded image is empty")
+        return url_for(_commit(tmp_path, digest.hexdigest(), _extension(content_type, url)))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def open_local(url: str):
+    """ローカル保存した画像なら読み取り用に開いたファイルを返す（無ければ None）"""
+    name = name_from_url(url)
+    if name is None:
+        return None
+    try:
+        return open(path_for(name), "rb")
+    except FileNotFoundError:
+        return None
+
+
+# ------------------------------
+# 参照されなくなったファイルの削除
+# ------------------------------
+def _referenced(db: Session, urls: set[str]) -> set[str]:
+    referenced = set()
+    for model in (Image, PregeneratedRecipe):
+        referenced.update(db.execute(
+            select(model.image_url).where(model.image_url.in_(list(urls))).distinct()
+        ).scalars())
+    return referenced
+
+
+def _unlink(names) -> int:
+    removed = 0
+    for name in names:
+        path = path_for(name)
+        try:
+            os.unlink(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        try:
+            os.unlink(path + SAVED_SUFFIX)
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def release(db: Session, images) -> None:
+    """
+    削除する画像の行（id, image_url）だけが参照していたファイルを、コミット後に消す。
+    行の削除と同じトランザクションの中で呼ぶ
+    """
+    purged = [row.id for row in images]
+    names = []
+    for url in {row.image_url for row in images}:
+        name = name_from_url(url)
+        if name is None:
+            continue
+        # 同じ内容の画像を持つ他のレシピや事前生成から参照されていれば残す
+        if db.execute(select(Image.id).where(
+                Image.image_url == url, Image.id.not_in(purged)).limit(1)).first():
+            continue
+        if db.execute(select(PregeneratedRecipe.id).where(
+                PregeneratedRecipe.image_url == url).limit(1)).first():
+            continue
+        names.append(name)
+    if names:
+        # ロールバックされたときにファイルだけ消えないよう、コミットしてから消す
+        event.listen(db, "after_commit", lambda session: _unlink(names), once=True)
+
+
+@purge.register
+def _purge_files(db: Session, recipe_ids, images) -> None:
+    """物理削除するレシピだけが参照していたファイルを消す"""
+    release(db, images)
+
+
+def gc(db: Session, grace_s: float = GC_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """どの行からも参照されていないファイルを消す（事前生成の期限切れなど、purge 以外で残ったもの）"""
+    cutoff = time.time() - grace_s
+    candidates = {}
+    if os.path.isdir(STORE_DIR):
+        for directory, _, files in os.walk(STORE_DIR):
+            names = set(files)
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.endswith(SAVED_SUFFIX):
+                    # 猶予を過ぎた印は要らない
+                    if not dry_run and os.stat(path).st_mtime < cutoff:
+                        os.unlink(path)
+                    continue
+                if not parse_name(name):
+                    continue
+                saved_at = os.stat(path).st_mtime
+                if name + SAVED_SUFFIX in names:
+                    try:
+                        saved_at = max(saved_at, os.stat(path + SAVED_SUFFIX).st_mtime)
+                    except FileNotFoundError:
+                        pass
+                if saved_at < cutoff:
+                    candidates[url_for(name)] = name
+    unreferenced = []
+    urls = list(candidates)
+    for i in range(0, len(urls), 500):
+        batch = set(urls[i:i + 500])
+        unreferenced += [candidates[url] for url in batch - _referenced(db, batch)]
+    removed = 0 if dry_run else _unlink(unreferenced)
+    return {"checked": len(candidates), "unreferenced": len(unreferenced), "removed": removed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage locally stored recipe images.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    gc_parser = sub.add_parser("gc", help="remove files no image row references")
+    gc_parser.add_argument("--grace-seconds", type=float, default=GC_GRACE_SECONDS)
+    gc_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(gc(db, args.grace_seconds, args.dry_run))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+再生成用の画像の作り置き。
+
+画像APIは1回の呼び出しが長い（DALL·E 3 は n=1 のみ）ので、別の画像を頼まれてから生成すると
+もう1往復待たせることになる。
+- レシピの最初の画像を返した後、バックグラウンドでプランごとの枚数（quota.image_variants_for、
+  PLAN_QUOTAS の image_variants）まで追加の画像を生成し、未使用の images 行（is_variant）として置いておく
+- 再生成（POST /api/recipe/recipe/{id}/regenerate-image）は未使用の行を1つ使用済みにして
+  mark_regenerated するだけなので画像APIを待たない。使ったら次の1枚を補充する
+- 使われないまま IMAGE_VARIANT_RETENTION_HOURS を過ぎた行は消す（ローカル保存のファイルも
+  他から参照されていなければコミット後に消す）
+
+生成の費用は生成した日の daily_stats に計上する（使われなかった分も含む）。
+
+    python -m src.image_variants evict   # 保持期間を過ぎた未使用の画像を消す
+    python -m src.image_variants stats
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import cache, image_store, metrics, pricing, resilience
+from src.db_models import Image, Recipe
+from src.shared_state import SingleFlight, get_state
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETENTION = timedelta(hours=float(os.getenv("IMAGE_VARIANT_RETENTION_HOURS", "24")))
+# 同時に画像APIを呼ぶ数（ワーカープロセスごと）
+WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", "2"))
+EVICT_INTERVAL_SECONDS = float(os.getenv("IMAGE_VARIANT_EVICT_INTERVAL_SECONDS", "600"))
+EVICT_BATCH_SIZE = int(os.getenv("IMAGE_VARIANT_EVICT_BATCH_SIZE", "500"))
+# 同じレシピの補充は全ワーカーで1つだけ（画像1枚の生成時間より長くする）
+FILL_LOCK_SECONDS = float(os.getenv("IMAGE_VARIANT_FILL_LOCK_SECONDS", "600"))
+
+_fill_flight = SingleFlight(get_state(), "image-variants", lock_ttl_s=FILL_LOCK_SECONDS)
+_executor = None
+_executor_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _stopping.clear()
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="image-variants")
+        return _executor
+
+
+def shutdown(wait: bool = False) -> None:
+    """終了時に待ち行列を捨て、生成中の補充も次の1枚からは作らない（wait=True なら終わるまで待つ）"""
+    global _executor
+    _stopping.set()
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# ------------------------------
+# 補充
+# ------------------------------
+def fill(session_factory, recipe_id: int, limit: int) -> int:
+    """未使用の画像が limit 枚になるまで生成し、生成した枚数を返す（他で補充中なら 0）"""
+    token = _fill_flight.try_acquire(str(recipe_id))
+    if token is None:
+        return 0
+    generated = 0
+    db = session_factory()
+    try:
+        recipe = db.get(Recipe, recipe_id)
+        if recipe is None or recipe.deleted_at is not None:
+            return 0
+        content = Recipe.render_content(recipe.markdown_content, recipe.content_format)
+        while not _stopping.is_set() and Image.count_variants(db, recipe_id) < limit:
+            image_url = Image.generate_image(content, recipe_id, db)
+            Image.add_variant(db, recipe_id, image_url)
+            metrics.generation_cost.inc("image", amount=pricing.IMAGE_COST_USD)
+            metrics.image_variants.inc("generated")
+            generated += 1
+        return generated
+    except (resilience.CircuitOpenError, resilience.DeadlineExceeded) as e:
+        # 上流の障害中は作り置きをあきらめる（再生成はその場で生成する）
+        db.rollback()
+        metrics.image_variants.inc("failed")
+        logger.warning("skipped image variants: %s", e, extra={"recipe_id": recipe_id})
+        return generated
+    except Exception:
+        db.rollback()
+        metrics.image_variants.inc("failed")
+        logger.exception("image variant generation failed", extra={"recipe_id": recipe_id})
+        return generated
+    finally:
+        db.close()
+        _fill_flight.release(str(recipe_id), token)
+
+
+def schedule(session_factory, recipe_id: int, limit: int) -> None:
+    """バックグラウンドで補充する（limit が 0 なら何もしない）"""
+    if limit <= 0:
+        return
+    _get_executor().submit(fill, session_factory, recipe_id, limit)
+
+
+# ------------------------------
+# 再生成
+# ------------------------------
+def promote(db: Session, recipe_id: int) -> Image | None:
+    """未使用の画像があれば再生成した画像として公開して返す（無ければ None）"""
+    image = Image.claim_variant(db, recipe_id)
+    if image is None:
+        return None
+    image.mark_regenerated()
+    Recipe.touch(db, recipe_id)
+    db.commit()
+    db.refresh(image)
+    cache.response_cache.invalidate(cache.recipe_key(recipe_id))
+    return image
+
+
+# ------------------------------
+# 保持期間を過ぎた未使用の画像の削除
+# ------------------------------
+def evict(db: Session, retention: timedelta = RETENTION, batch_size: int = EVICT_BATCH_SIZE,
+          now: datetime | None = None) -> int:
+    """保持期間を過ぎた未使用の画像を batch_size 件ずつ消し、消した件数を返す"""
+    cutoff = (now or datetime.utcnow()) - retention
+    evicted = 0
+    while True:
+        rows = db.execute(
+            select(Image.id, Image.recipe_id, Image.image_url)
+            .where(Image.is_variant.is_(True), Image.created_at < cutoff)
+            .order_by(Image.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return evicted
+        ids = [row.id for row in rows]
+        # 選んでから削除するまでに再生成で使われた行は消さない（そのファイルも残す）
+        db.execute(delete(Image).where(Image.id.in_(ids), Image.is_variant.is_(True)))
+        kept = set(db.execute(select(Image.id).where(Image.id.in_(ids))).scalars())
+        deleted = [row for row in rows if row.id not in kept]
+        image_store.release(db, deleted)
+        db.commit()
+        count = len(deleted)
+        evicted += count
+        metrics.image_variants.inc("evicted", amount=count)
+        if len(rows) < batch_size:
+            return evicted
+
+
+class EvictionWorker:
+    """一定間隔で evict() を回すスレッド。複数ワーカーでは共有ロックで1つだけが実行する"""
+
+    def __init__(self, session_factory, interval_s: float = EVICT_INTERVAL_SECONDS,
+                 retention: timedelta = RETENTION):
+        self.session_factory = session_factory
+        self.interval_s = interval_s
+        self.retention = retention
+        self.flight = SingleFlight(get_state(), "image-variants-evict",
+                                   lock_ttl_s=max(interval_s, 30.0))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> int | None:
+        """ロックを取れたら1回実行して件数を返す（他で実行中なら None）"""
+        token = self.flight.try_acquire("images")
+        if token is None:
+            return None
+        db = self.session_factory()
+        try:
+            count = evict(db, self.retention)
+            if count:
+                logger.info("evicted unused image variants", extra={"images": count})
+            return count
+        finally:
+            db.close()
+            self.flight.release("images", token)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("image variant eviction failed")
+
+    def start(self) -> "EvictionWorker":
+        self._thread = threading.Thread(target=self._run, name="image-variant-evict", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+
+
+def stats(db: Session, now: datetime | None = None) -> dict:
+    cutoff = (now or datetime.utcnow()) - RETENTION
+    total, expired = db.execute(
+        select(func.count(), func.coalesce(func.sum(case((Image.created_at < cutoff, 1), else_=0)), 0))
+        .where(Image.is_variant.is_(True))
+    ).one()
+    recipes = db.execute(
+        select(func.count(func.distinct(Image.recipe_id))).where(Image.is_variant.is_(True))
+    ).scalar_one()
+    return {
+        "unused": total,
+        "recipes": recipes,
+        "expired": expired,
+        "unused_cost_usd": round(total * pricing.IMAGE_COST_USD, 6),
+        "retention_hours": RETENTION.total_seconds() / 3600,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage pre-generated image variants.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_evict = sub.add_parser("evict", help="delete unused variants older than the retention period")
+    p_evict.add_argument("--retention-hours", type=float,
+                         default=RETENTION.total_seconds() / 3600)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+    from src.logging_config import setup_logging
+    setup_logging()
+
+    db = SessionLocal()
+    try:
+        if args.command == "evict":
+            print(json.dumps({"evicted": evict(db, timedelta(hours=args.retention_hours))}))
+        else:
+            print(json.dumps(stats(db), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+重い外部SDK（openai / stripe / requests）と numpy（類似レシピの検索用）の遅延 import。
+
+これらは import だけで合計1秒以上かかるため、アプリの起動時には読み込まず、
+初回利用時か lifespan のウォームアップ（バックグラウンドスレッド）で読み込む。
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INTEGRATIONS = ("openai", "stripe", "requests", "numpy")
+
+_modules = {}
+_import_seconds = {}
+_lock = threading.Lock()
+
+
+# stripe_timeout() の中での Stripe 呼び出しのタイムアウトの上限
+_stripe_timeout: ContextVar[float | None] = ContextVar("stripe_timeout", default=None)
+
+
+@contextmanager
+def stripe_timeout(seconds: float):
+    """
+    この中の Stripe 呼び出しのタイムアウトを seconds 以下にする。
+    stripe の resource メソッドは呼び出しごとのタイムアウトを受け取らないため、
+    resilience.call が渡す残り時間はこれで HTTP クライアントに伝える
+    """
+    token = _stripe_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _stripe_timeout.reset(token)
+
+
+def _configure_stripe(stripe) -> None:
+    stripe.api_key = os.getenv("STRIPE_API_KEY")
+    # stripe-mock やベンチマーク用のモックサーバーに向ける場合のみ設定する
+    stripe.api_base = os.getenv("STRIPE_API_BASE") or stripe.api_base
+    # タイムアウトを明示し、リトライは resilience 側で行う
+    stripe.max_network_retries = 0
+
+    class DeadlineRequestsClient(stripe.RequestsClient):
+        """既定のタイムアウトを stripe_timeout() の値で切り詰める"""
+
+        @property
+        def _timeout(self):
+            limit = _stripe_timeout.get()
+            return self._default_timeout if limit is None else min(self._default_timeout, limit)
+
+        @_timeout.setter
+        def _timeout(self, value):
+            self._default_timeout = value
+
+    stripe.default_http_client = DeadlineRequestsClient(
+        timeout=float(os.getenv("STRIPE_TIMEOUT_SECONDS", "10")))
+
+
+_CONFIGURE = {"stripe": _configure_stripe}
+
+
+def _load(name: str):
+    module = _modules.get(name)
+    if module is not None:
+        return module
+    with _lock:
+        module = _modules.get(name)
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            configure = _CONFIGURE.get(name)
+            if configure is not None:
+                configure(module)
+            _import_seconds[name] = time.perf_counter() - start
+            _modules[name] = module
+    return module
+
+
+def get_openai():
+    return _load("openai")
+
+
+def get_stripe():
+    """設定済みの stripe モジュール"""
+    return _load("stripe")
+
+
+def get_requests():
+    return _load("requests")
+
+
+def get_numpy():
+    return _load("numpy")
+
+
+def loaded() -> dict:
+    """読み込み済みの連携と import にかかった秒数（/healthz 用）"""
+    return {name: round(_import_seconds[name], 3) if name in _modules else None
+            for name in INTEGRATIONS}
+
+
+def warmup() -> threading.Thread:
+    """全連携をバックグラウンドで読み込む（起動と /healthz の応答を待たせない）"""
+
+    def run():
+        for name in INTEGRATIONS:
+            try:
+                _load(name)
+            except Exception:
+                logger.exception("integration warmup failed", extra={"integration": name})
+
+    thread = threading.Thread(target=run, name="integrations-warmup", daemon=True)
+    thread.start()
+    return thread
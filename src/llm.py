@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from dotenv import load_dotenv
+from src.llm_router import get_router
+from src import metrics
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 生成モード
+TEXT_MODE = "text"
+JSON_MODE = "json"
+
+# recipes.content_format に保存する値
+MARKDOWN_FORMAT = "markdown"
+JSON_FORMAT = "json"
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+# ------------------------------
+# プロンプトテンプレート
+# モジュール読み込み時に一度だけ組み立て、呼び出し毎はテーマを連結するだけにする
+# ------------------------------
+_PROMPT_CONDITIONS = (
+    "あなたは栄養士兼料理研究家です。\n"
+    "家庭でも簡単に作れる、栄養バランスの良い料理を考えてください。\n"
+    "以下の条件を満たすレシピを提案してください：\n"
+    "- 3ステップで調理できる\n"
+    "- 調味料は家庭にある基本的なもの（塩、醤油、砂糖、油など）\n"
+    "- 1食分あたり、たんぱく質・炭水化物・野菜をバランスよく含む\n"
+    "- 短時間で調理できる（20分以内）\n"
+    "- 洗い物が少ない\n"
+)
+
+_TEXT_PROMPT_PREFIX = (
+    _PROMPT_CONDITIONS
+    + "\n出力形式：\n"
+    "---\n"
+    "料理名：\n"
+    "材料：\n"
+    "作り方：\n"
+    "栄養ポイント：\n"
+    "---\n"
+    "テーマ: "
+)
+
+_JSON_PROMPT_PREFIX = (
+    _PROMPT_CONDITIONS
+    + "- 栄養価は1食分の概算値（kcal, g）で答える\n"
+    "- 装飾や前置きは不要。指定のJSONスキーマだけを簡潔に出力する\n"
+    "テーマ: "
+)
+
+_PROMPT_PREFIXES = {
+    TEXT_MODE: _TEXT_PROMPT_PREFIX,
+    JSON_MODE: _JSON_PROMPT_PREFIX,
+}
+
+_NUMBER = {"type": "number"}
+
+RECIPE_JSON_SCHEMA = {
+    "name": "recipe",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string"},
+            "ingredients": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "amount": {"type": "string"},
+                    },
+                    "required": ["name", "amount"],
+                    "additionalProperties": False,
+                },
+            },
+            "steps": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
+            "nutrition": {
+                "type": "object",
+                "properties": {
+                    "calories": _NUMBER,
+                    "protein": _NUMBER,
+                    "fat": _NUMBER,
+                    "carbohydrates": _NUMBER,
+                    "fiber": _NUMBER,
+                    "salt": _NUMBER,
+                },
+                "required": [
+                    "calories", "protein", "fat",
+                    "carbohydrates", "fiber", "salt",
+                ],
+                "additionalProperties": False,
+            },
+            "points": {"type": "string"},
+        },
+        "required": ["title", "ingredients", "steps", "nutrition", "points"],
+        "additionalProperties": False,
+    },
+}
+
+RESPONSE_FORMAT = {"type": "json_schema", "json_schema": RECIPE_JSON_SCHEMA}
+
+# 栄養素の表示名と単位
+NUTRITION_LABELS = (
+    ("calories", "エネルギー", "kcal"),
+    ("protein", "たんぱく質", "g"),
+    ("fat", "脂質", "g"),
+    ("carbohydrates", "炭水化物", "g"),
+    ("fiber", "食物繊維", "g"),
+    ("salt", "食塩相当量", "g"),
+)
+
+
+class GenerationTruncated(Exception):
+    """JSON モードの出力が出力トークンの上限で打ち切られた（上限を上げた再試行でも収まらなかった）"""
+
+
+@dataclass
+class GenerationResult:
+    """1回の生成結果と計測値"""
+    content: str
+    content_format: str
+    mode: str
+    prompt_tokens: int | None
+    completion_tokens: int | None
+    latency_ms: float
+    ttft_ms: float | None = None
+    deployment: str | None = None
+
+
+def build_prompt(title: str, mode: str = TEXT_MODE) -> str:
+    """テーマを埋め込んだプロンプトを返す"""
+    return _PROMPT_PREFIXES[mode] + title
+
+
+def get_generation_mode() -> str:
+    """RECIPE_GENERATION_MODE (text / json) を返す"""
+    mode = os.getenv("RECIPE_GENERATION_MODE", TEXT_MODE).lower()
+    if mode not in _PROMPT_PREFIXES:
+        raise ValueError(f"Unknown RECIPE_GENERATION_MODE: {mode}")
+    return mode
+
+
+def get_max_completion_tokens(mode: str) -> int:
+    """モードごとの出力トークン上限"""
+    if mode == JSON_MODE:
+        return int(os.getenv("RECIPE_JSON_MAX_COMPLETION_TOKENS", "1200"))
+    return int(os.getenv("RECIPE_TEXT_MAX_COMPLETION_TOKENS", "16384"))
+
+
+def get_retry_max_completion_tokens() -> int:
+    """JSON モードの出力が上限で打ち切られたときに1回だけ再試行する上限"""
+    return int(os.getenv("RECIPE_JSON_RETRY_MAX_COMPLETION_TOKENS", "2400"))
+
+
+def _sum_tokens(a: int | None, b: int | None) -> int | None:
+    if a is None and b is None:
+        return None
+    return (a or 0) + (b or 0)
+
+
+def generate(title: str, mode: str | None = None) -> GenerationResult:
+    """レシピを生成し、トークン数とレイテンシを合わせて返す"""
+    mode = mode or get_generation_mode()
+    if mode not in _PROMPT_PREFIXES:
+        raise ValueError(f"Unknown generation mode: {mode}")
+
+    kwargs = {}
+    if mode == JSON_MODE:
+        kwargs["response_format"] = RESPONSE_FORMAT
+
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt(title, mode)}
+    ]
+    max_completion_tokens = get_max_completion_tokens(mode)
+    # 複数デプロイメントへのルーティングとヘッジは llm_router が担当する
+    completion = get_router().complete(
+        messages=messages, max_completion_tokens=max_completion_tokens, **kwargs)
+
+    # 上限で打ち切られた JSON は読めないので、上限を上げて1回だけ生成し直す
+    if mode == JSON_MODE and completion.finish_reason == "length":
+        retry_tokens = get_retry_max_completion_tokens()
+        if retry_tokens > max_completion_tokens:
+            metrics.llm_truncations.inc("retried")
+            logger.warning(
+                "generated JSON was truncated, retrying with a larger cap",
+                extra={"max_completion_tokens": max_completion_tokens, "retry_tokens": retry_tokens},
+            )
+            truncated = completion
+            completion = get_router().complete(
+                messages=messages, max_completion_tokens=retry_tokens, **kwargs)
+            # 打ち切られた分のトークンと時間も費用・レイテンシに含める
+            completion.prompt_tokens = _sum_tokens(truncated.prompt_tokens, completion.prompt_tokens)
+            completion.completion_tokens = _sum_tokens(
+                truncated.completion_tokens, completion.completion_tokens)
+            completion.latency_ms += truncated.latency_ms
+            max_completion_tokens = retry_tokens
+        if completion.finish_reason == "length":
+            metrics.llm_truncations.inc("failed")
+            raise GenerationTruncated(
+                f"Generated JSON was truncated at {max_completion_tokens} completion tokens")
+
+    logger.info(
+        "recipe generated",
+        extra={
+            "mode": mode,
+            "deployment": completion.deployment,
+            "hedged": completion.hedged,
+            "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion.completion_tokens,
+            "latency_ms": round(completion.latency_ms, 1),
+            "ttft_ms": round(completion.ttft_ms, 1) if completion.ttft_ms is not None else None,
+        },
+    )
+
+    text = completion.text
+    if not text:
+        raise ValueError("Generated text is empty")
+
+    content_format = MARKDOWN_FORMAT
+    if mode == JSON_MODE:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Generated JSON is invalid: {e}")
+        # 余分な空白を落としてコンパクトに保存する
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        content_format = JSON_FORMAT
+
+    result = GenerationResult(
+        content=text,
+        content_format=content_format,
+        mode=mode,
+        prompt_tokens=completion.prompt_tokens,
+        completion_tokens=completion.completion_tokens,
+        latency_ms=completion.latency_ms,
+        ttft_ms=completion.ttft_ms,
+        deployment=completion.deployment,
+    )
+    metrics.observe_generation(result)
+    return result
+
+
+# Markdown（テキストモードの出力や変換後の表示）から栄養価を拾う
+# 「エネルギー: 520kcal」「| たんぱく質 | 約32.5g |」のような行に一致させる
+_NUTRITION_ALIASES = {
+    "calories": ("エネルギー", "カロリー", "熱量"),
+    "protein": ("たんぱく質", "タンパク質", "蛋白質"),
+    "fat": ("脂質",),
+    "carbohydrates": ("炭水化物", "糖質"),
+    "fiber": ("食物繊維",),
+    "salt": ("食塩相当量", "塩分"),
+}
+_NUTRITION_PATTERNS = {
+    key: re.compile(
+        r"(?:" + "|".join(aliases) + r")[^\d\n]{0,8}?(\d+(?:\.\d+)?)\s*(?:kcal|g|キロカロリー|グラム)")
+    for key, aliases in _NUTRITION_ALIASES.items()
+}
+
+
+def parse_nutrition(content: str, content_format: str | None) -> dict | None:
+    """
+    1食分の栄養価 {calories, protein, fat, carbohydrates, fiber, salt} を返す。
+    JSON 形式は nutrition をそのまま、Markdown は本文から拾う。エネルギーとたんぱく質が
+    取れなければ None（取れなかったその他の栄養素は 0）
+    """
+    values = {}
+    if content_format == JSON_FORMAT:
+        try:
+            nutrition = json.loads(content).get("nutrition") or {}
+        except (ValueError, AttributeError):
+            return None
+        for key, _, _ in NUTRITION_LABELS:
+            if isinstance(nutrition.get(key), (int, float)):
+                values[key] = float(nutrition[key])
+    else:
+        for key, pattern in _NUTRITION_PATTERNS.items():
+            match = pattern.search(content)
+            if match:
+                values[key] = float(match.group(1))
+    if "calories" not in values or "protein" not in values:
+        return None
+    return {key: values.get(key, 0.0) for key, _, _ in NUTRITION_LABELS}
+
+
+def _format_number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+@lru_cache(maxsize=1024)
+def render_recipe_markdown(content: str) -> str:
+    """JSONモードで保存したレシピをMarkdownに変換する"""
+    data = json.loads(content)
+
+    lines = [f"## {data.get('title', '')}", "", "### 材料"]
+    for item in data.get("ingredients", []):
+        lines.append(f"- {item.get('name', '')}: {item.get('amount', '')}")
+
+    lines += ["", "### 作り方"]
+    for i, step in enumerate(data.get("steps", []), start=1):
+        lines.append(f"{i}. {step}")
+
+    nutrition = data.get("nutrition") or {}
+    if nutrition:
+        lines += ["", "### 栄養価（1食分）"]
+        for key, label, unit in NUTRITION_LABELS:
+            if key in nutrition:
+                lines.append(
+                    f"- {label}: {_format_number(nutrition[key])}{unit}")
+
+    if data.get("points"):
+        lines += ["", "### 栄養ポイント", data["points"]]
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,352 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from src import integrations, resilience
+
+# .env をロード
+load_dotenv()
+
+
+@dataclass
+class Deployment:
+    """Azure OpenAI のデプロイメント1つ分の接続設定"""
+    name: str
+    endpoint: str
+    deployment: str
+    api_key: str | None = None
+    api_version: str | None = None
+    weight: float = 1.0
+
+
+@dataclass
+class Completion:
+    """ルーター経由で得た生成結果"""
+    text: str
+    deployment: str
+    prompt_tokens: int | None
+    completion_tokens: int | None
+    latency_ms: float
+    ttft_ms: float | None
+    hedged: bool = False
+    # "stop" / "length"（出力トークンの上限で打ち切られた）など
+    finish_reason: str | None = None
+
+
+class AllDeploymentsFailed(Exception):
+    """全デプロイメントで生成に失敗した"""
+
+    def __init__(self, errors: dict):
+        self.errors = errors
+        detail = ", ".join(f"{name}: {err}" for name, err in errors.items())
+        super().__init__(f"All deployments failed ({detail})")
+
+
+class DeploymentHealth:
+    """観測したレイテンシとエラー率の指数移動平均"""
+
+    def __init__(self, alpha: float = 0.2, initial_latency_ms: float = 1000.0):
+        self.alpha = alpha
+        self.latency_ms = initial_latency_ms
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency_ms: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.latency_ms += self.alpha * (latency_ms - self.latency_ms)
+            self.error_rate += self.alpha * (0.0 - self.error_rate)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.error_rate += self.alpha * (1.0 - self.error_rate)
+
+    def score(self, weight: float) -> float:
+        """大きいほど選ばれやすい"""
+        # エラー率が高いデプロイメントは急激に重みを落とすが、0にはしない（回復を観測するため）
+        return weight / max(self.latency_ms, 1.0) * max(1.0 - self.error_rate, 0.02) ** 2
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_ms": round(self.latency_ms, 1),
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+@dataclass
+class _Attempt:
+    deployment: Deployment
+    started: float
+    first_token: threading.Event = field(default_factory=threading.Event)
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    stream: object = None
+    ttft_ms: float | None = None
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+class ProviderRouter:
+    """
+    複数デプロイメントへのルーティング。
+    最初のトークンが hedge_after_ms 以内に届かなければ別デプロイメントへ
+    ヘッジリクエストを送り、先に完了した方を採用してもう一方は打ち切る。
+    """
+
+    def __init__(
+        self,
+        deployments: list[Deployment],
+        hedge_after_ms: float = 3000.0,
+        timeout_s: float = 60.0,
+        client_factory=None,
+    ):
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        self.deployments = deployments
+        self.hedge_after_ms = hedge_after_ms
+        self.timeout_s = timeout_s
+        self.health = {d.name: DeploymentHealth() for d in deployments}
+        self._client_factory = client_factory or self._default_client
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _default_client(self, deployment: Deployment):
+        # openai は import が重いので最初のクライアント作成時に読み込む
+        return integrations.get_openai().AzureOpenAI(
+            api_version=deployment.api_version,
+            azure_endpoint=deployment.endpoint,
+            api_key=deployment.api_key,
+            timeout=self.timeout_s,
+            # リトライ・フォールバックはルーター側で行う
+            max_retries=0,
+        )
+
+    def _client(self, deployment: Deployment):
+        with self._lock:
+            client = self._clients.get(deployment.name)
+            if client is None:
+                client = self._client_factory(deployment)
+                self._clients[deployment.name] = client
+            return client
+
+    @staticmethod
+    def breaker(deployment: Deployment) -> resilience.CircuitBreaker:
+        return resilience.get_breaker(f"azure-openai:{deployment.name}")
+
+    def pick(self, exclude: set | None = None) -> Deployment | None:
+        """健全性スコアで重み付けしてデプロイメントを選ぶ（ブレーカーが開いているものは除く）"""
+        exclude = exclude or set()
+        candidates = [
+            d for d in self.deployments
+            if d.name not in exclude and self.breaker(d).allows_request()
+        ]
+        if not candidates:
+            return None
+        weights = [self.health[d.name].score(d.weight) for d in candidates]
+        return random.choices(candidates, weights=weights, k=1)[0]
+
+    def _run(self, attempt: _Attempt, messages: list[dict], params: dict, results: queue.Queue) -> None:
+        deployment = attempt.deployment
+        breaker = self.breaker(deployment)
+        try:
+            breaker.before_call()
+        except resilience.CircuitOpenError as e:
+            results.put((attempt, None, e))
+            attempt.first_token.set()
+            return
+
+        try:
+            stream = self._client(deployment).chat.completions.create(
+                model=deployment.deployment,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **params,
+            )
+            attempt.stream = stream
+            if attempt.cancelled.is_set():
+                stream.close()
+                breaker.release()
+                return
+
+            parts = []
+            usage = None
+            finish_reason = None
+            for chunk in stream:
+                if attempt.cancelled.is_set():
+                    stream.close()
+                    breaker.release()
+                    return
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not attempt.first_token.is_set():
+                        attempt.ttft_ms = (time.perf_counter() - attempt.started) * 1000
+                        attempt.first_token.set()
+                    parts.append(delta)
+
+            latency_ms = (time.perf_counter() - attempt.started) * 1000
+            breaker.record_success()
+            results.put((attempt, Completion(
+                text="".join(parts),
+                deployment=deployment.name,
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+                latency_ms=latency_ms,
+                ttft_ms=attempt.ttft_ms,
+                finish_reason=finish_reason,
+            ), None))
+        except Exception as e:
+            if attempt.cancelled.is_set():
+                # 打ち切ったリクエストはエラーとして数えない
+                breaker.release()
+                return
+            breaker.record_failure()
+            results.put((attempt, None, e))
+        finally:
+            # ヘッジ待ちを解除する
+            attempt.first_token.set()
+
+    def _start(self, deployment: Deployment, messages: list[dict], params: dict, results: queue.Queue) -> _Attempt:
+        attempt = _Attempt(deployment=deployment, started=time.perf_counter())
+        threading.Thread(
+            target=self._run,
+            args=(attempt, messages, params, results),
+            name=f"llm-{deployment.name}",
+            daemon=True,
+        ).start()
+        return attempt
+
+    def complete(self, messages: list[dict], **params) -> Completion:
+        """チャット補完を実行し、最初に成功した結果を返す"""
+        deadline = time.monotonic() + self.timeout_s
+        results = queue.Queue()
+        tried = set()
+        running = []
+        errors = {}
+        hedged = False
+
+        primary = self.pick()
+        if primary is None:
+            raise resilience.CircuitOpenError(
+                "azure-openai", min(self.breaker(d).reset_timeout_s for d in self.deployments))
+        tried.add(primary.name)
+        running.append(self._start(primary, messages, params, results))
+
+        # 最初のトークンが閾値内に届かなければヘッジ
+        if not running[0].first_token.wait(self.hedge_after_ms / 1000):
+            backup = self.pick(exclude=tried)
+            if backup is not None:
+                tried.add(backup.name)
+                running.append(self._start(backup, messages, params, results))
+                hedged = True
+
+        try:
+            while running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    for attempt in running:
+                        self.health[attempt.deployment.name].record_failure()
+                        self.breaker(attempt.deployment).record_failure()
+                        errors[attempt.deployment.name] = "timeout"
+                    break
+                try:
+                    attempt, completion, error = results.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+
+                running.remove(attempt)
+                health = self.health[attempt.deployment.name]
+                if error is None:
+                    health.record_success(completion.latency_ms)
+                    completion.hedged = hedged
+                    return completion
+
+                health.record_failure()
+                errors[attempt.deployment.name] = error
+                # 失敗したら未使用のデプロイメントへフォールバック
+                fallback = self.pick(exclude=tried)
+                if fallback is not None:
+                    tried.add(fallback.name)
+                    running.append(self._start(fallback, messages, params, results))
+        finally:
+            for attempt in running:
+                attempt.cancel()
+
+        raise AllDeploymentsFailed(errors)
+
+    def stats(self) -> dict:
+        return {name: h.snapshot() for name, h in self.health.items()}
+
+
+def load_deployments() -> list[Deployment]:
+    """
+    AZURE_DEPLOYMENTS（JSON配列）からデプロイメント一覧を読み込む。
+    未設定の場合は AZURE_ENDPOINT / AZURE_DEPLOYMENT の1件だけを使う。
+    """
+    raw = os.getenv("AZURE_DEPLOYMENTS")
+    if raw:
+        deployments = []
+        for i, item in enumerate(json.loads(raw)):
+            deployments.append(Deployment(
+                name=item.get("name") or f"deployment-{i}",
+                endpoint=item["endpoint"],
+                deployment=item["deployment"],
+                api_key=item.get("api_key") or os.getenv("AZURE_SUBSCRIPTION_KEY"),
+                api_version=item.get("api_version") or os.getenv("AZURE_API_VERSION"),
+                weight=float(item.get("weight", 1.0)),
+            ))
+        return deployments
+
+    return [Deployment(
+        name="default",
+        endpoint=os.getenv("AZURE_ENDPOINT"),
+        deployment=os.getenv("AZURE_DEPLOYMENT"),
+        api_key=os.getenv("AZURE_SUBSCRIPTION_KEY"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+    )]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """環境変数から組み立てたルーター（プロセス内で共有）"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ProviderRouter(
+                load_deployments(),
+                hedge_after_ms=float(os.getenv("LLM_HEDGE_AFTER_MS", "3000")),
+                timeout_s=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+            )
+        return _router
+
+
+def set_router(router: ProviderRouter | None) -> None:
+    """ルーターを差し替える（モックサーバー向けの設定など）"""
+    global _router
+    with _router_lock:
+        _router = router
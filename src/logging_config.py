@@ -0,0 +1,114 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+from src import metrics
+
+# .env をロード
+load_dotenv()
+
+# LogRecord が標準で持つ属性（これ以外は extra として JSON に出す）
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "taskName",
+}
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコード1行のJSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _RequestQueueHandler(QueueHandler):
+    """
+    リクエスト側のスレッドではメッセージの確定だけ行い、
+    JSON 化と書き出しは QueueListener のスレッドに任せる。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # traceback オブジェクトはスレッドをまたいで保持しない
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging() -> None:
+    """LOG_LEVEL に従ってキュー経由のJSONロギングを設定する（複数回呼んでも1回だけ有効）"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = QueueListener(
+        log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [_RequestQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    # uvicorn のアクセスログなども同じ経路で出す
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+
+    _setup_sql_logging()
+
+
+# ------------------------------
+# SQL のサンプリングログ
+# ------------------------------
+sql_logger = logging.getLogger("sql")
+
+
+def _setup_sql_logging() -> None:
+    sample_rate = float(os.getenv("SQL_LOG_SAMPLE_RATE", "0"))
+    slow_ms = float(os.getenv("SQL_SLOW_QUERY_MS", "500"))
+    if sample_rate <= 0 and slow_ms <= 0:
+        return
+
+    def log_query(statement: str, elapsed: float) -> None:
+        elapsed_ms = elapsed * 1000
+        slow = slow_ms > 0 and elapsed_ms >= slow_ms
+        if not slow and (sample_rate <= 0 or random.random() >= sample_rate):
+            return
+        sql_logger.log(
+            logging.WARNING if slow else logging.INFO,
+            "slow query" if slow else "sampled query",
+            extra={"statement": statement, "duration_ms": round(elapsed_ms, 3)},
+        )
+
+    metrics.query_observers.append(log_query)
@@ -1,11 +1,82 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from src.logging_config import setup_logging
 from src.api.auth.index import router as auth_router
 from src.api.recipe.index import router as recipe_router
 from src.api.payments.index import router as payments_router
-app = FastAPI()
+from src.api.admin.index import router as admin_router
+from src.api.images.index import router as images_router
+from src.api.metrics.index import router as metrics_router, prometheus_router
+from src.metrics import MetricsMiddleware
+from src import image_variants, integrations, meal_plan, pregen, purge, similar, stripe_sync
+from src.get_conn import SessionLocal
+
+# ログはキュー経由でリクエスト処理の外で書き出す
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # openai / stripe / requests / numpy は起動をブロックせずバックグラウンドで読み込む
+    if os.getenv("INTEGRATIONS_WARMUP", "true").lower() == "true":
+        integrations.warmup()
+    # 論理削除したレシピの画像・派生データをバックグラウンドで消す
+    worker = None
+    if os.getenv("RECIPE_PURGE_WORKER", "true").lower() == "true":
+        worker = purge.PurgeWorker(SessionLocal).start()
+    # 閑散時間帯に人気テーマのレシピを事前生成する（費用がかかるので既定では無効）
+    pregen_worker = None
+    if os.getenv("PREGEN_WORKER", "false").lower() == "true":
+        pregen_worker = pregen.PregenWorker(SessionLocal).start()
+    # 使われないまま保持期間を過ぎた再生成用の画像を消す
+    variant_worker = None
+    if os.getenv("IMAGE_VARIANT_EVICT_WORKER", "true").lower() == "true":
+        variant_worker = image_variants.EvictionWorker(SessionLocal).start()
+    # Webhook の取りこぼしで Stripe とずれた subscriptions を定期的に直す（既定では無効）
+    reconcile_worker = None
+    if os.getenv("STRIPE_RECONCILE_WORKER", "false").lower() == "true":
+        reconcile_worker = stripe_sync.ReconcileWorker(SessionLocal).start()
+    # 類似レシピのインデックスを読み込み、終了時に保存する
+    index = similar.get_index(SessionLocal)
+    if os.getenv("SIMILAR_INDEX_WARMUP", "true").lower() == "true":
+        index.warmup()
+        # 献立の栄養価の行列も最初のリクエストを待たずに読み込んでおく
+        meal_plan.get_pool(SessionLocal).warmup()
+    yield
+    if worker is not None:
+        worker.stop()
+    if pregen_worker is not None:
+        pregen_worker.stop()
+    if variant_worker is not None:
+        variant_worker.stop()
+    if reconcile_worker is not None:
+        reconcile_worker.stop()
+    image_variants.shutdown()
+    index.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/healthz", tags=["health"])
+# ヘルスチェック（外部連携の読み込みを待たずに応答する）
+def healthz():
+    return {"status": "ok", "integrations": integrations.loaded()}
+
 
 app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
 
 app.include_router(recipe_router, prefix="/api/recipe", tags=["recipe"])
 
 app.include_router(payments_router, prefix="/api/payments", tags=["payments"])
+
+app.include_router(metrics_router, prefix="/api/metrics", tags=["metrics"])
+
+app.include_router(admin_router, prefix="/api/admin", tags=["admin"])
+
+app.include_router(images_router, prefix="/api/images", tags=["images"])
+
+app.include_router(prometheus_router, tags=["metrics"])
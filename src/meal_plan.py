@@ -0,0 +1,452 @@
+"""
+1日の献立（POST /api/recipe/meal-plan）。
+
+レシピを新しく生成する代わりに、保存済みのレシピ（自分のもの、または全員のもの）から
+朝・昼・晩など meals 食分を選び、合計がエネルギー・たんぱく質・脂質・炭水化物・食物繊維・
+食塩相当量の目標に近くなる組み合わせを求める。
+- 栄養価は recipe_nutrition を各ワーカーのメモリ上の行列（float32, N×6）に持ち、
+  MEAL_PLAN_REFRESH_SECONDS ごとに更新・削除された分だけ取り込む
+- 組み合わせが MEAL_PLAN_EXACT_COMBINATIONS 以下（自分のレシピ数十件など）なら全件を調べる
+- それより多ければビームサーチ（1食ずつ、残りの目標を残りの食数で割った値に近いレシピを全件から選ぶ）の後、
+  1食ずつ全件と入れ替えて改善する局所探索。どちらも候補全体への NumPy の一括計算なので、
+  10万件でも数十ms で終わる
+- 目標の TOLERANCE 以内に収まらず generate_missing が指定されたときだけ、最も外れている1食を
+  不足分の栄養価を指定した LLM 生成（JSON モード）に置き換える
+
+目標の種類: range（上下とも外れたら減点）、min（食物繊維・たんぱく質は不足だけ）、max（食塩は超過だけ）
+"""
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import integrations, llm, metrics
+from src.db_models import Recipe, RecipeNutrition
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+NUTRIENTS = RecipeNutrition.NUTRIENTS
+
+# 1日の目標（成人の食事摂取基準を目安にした既定値。MEAL_PLAN_TARGETS の JSON で上書き）
+DEFAULT_TARGETS = {
+    "calories": 2000.0,
+    "protein": 65.0,
+    "fat": 60.0,
+    "carbohydrates": 280.0,
+    "fiber": 21.0,
+    "salt": 7.5,
+}
+TARGET_KINDS = {
+    "calories": "range",
+    "protein": "min",
+    "fat": "range",
+    "carbohydrates": "range",
+    "fiber": "min",
+    "salt": "max",
+}
+# 目標からの相対誤差の2乗に掛ける重み（エネルギーを優先する）
+WEIGHTS = {"calories": 3.0, "protein": 1.5, "fat": 1.0, "carbohydrates": 1.0, "fiber": 0.5, "salt": 1.0}
+
+TOLERANCE = float(os.getenv("MEAL_PLAN_TOLERANCE", "0.1"))
+BEAM_WIDTH = int(os.getenv("MEAL_PLAN_BEAM_WIDTH", "8"))
+SWAP_PASSES = int(os.getenv("MEAL_PLAN_SWAP_PASSES", "2"))
+# 組み合わせの数がこれ以下（自分のレシピだけの小さいプールなど）なら全件を調べて最良を返す
+EXACT_COMBINATIONS = int(os.getenv("MEAL_PLAN_EXACT_COMBINATIONS", "20000"))
+REFRESH_SECONDS = float(os.getenv("MEAL_PLAN_REFRESH_SECONDS", "2"))
+REFRESH_LOOKBACK = timedelta(seconds=float(os.getenv("MEAL_PLAN_REFRESH_LOOKBACK_SECONDS", "60")))
+
+
+def default_targets() -> dict:
+    targets = dict(DEFAULT_TARGETS)
+    raw = os.getenv("MEAL_PLAN_TARGETS")
+    if raw:
+        targets.update({key: float(value) for key, value in json.loads(raw).items()})
+    return targets
+
+
+# ------------------------------
+# 評価と探索
+# ------------------------------
+class Objective:
+    """合計（…×6）の目標からのずれを、種類（range / min / max）と重みを考慮して1つの値にする"""
+
+    def __init__(self, targets: dict):
+        np = integrations.get_numpy()
+        self.targets = np.array([targets[key] for key in NUTRIENTS], dtype=np.float32)
+        self.weights = np.array([WEIGHTS[key] for key in NUTRIENTS], dtype=np.float32)
+        self.min_only = np.array([TARGET_KINDS[key] == "min" for key in NUTRIENTS])
+        self.max_only = np.array([TARGET_KINDS[key] == "max" for key in NUTRIENTS])
+
+    def deviation(self, totals, targets=None):
+        """目標に対する相対誤差（min は不足、max は超過だけ残す）"""
+        np = integrations.get_numpy()
+        targets = self.targets if targets is None else targets
+        d = (totals - targets) / np.maximum(targets, 1e-6)
+        d = np.where(self.min_only, np.minimum(d, 0.0), d)
+        return np.where(self.max_only, np.maximum(d, 0.0), d)
+
+    def loss(self, totals, targets=None):
+        d = self.deviation(totals, targets)
+        return (d * d * self.weights).sum(axis=-1)
+
+    def within(self, totals) -> bool:
+        np = integrations.get_numpy()
+        return bool(np.all(np.abs(self.deviation(totals)) <= TOLERANCE))
+
+    def scores(self, columns, center, scale, out, buf):
+        """
+        候補ごとの loss（候補の値 - center を scale で割った相対誤差）を out に書く。
+        columns は栄養素ごとに連続した（6×N）配列。一時配列を作らないよう buf を使い回す
+        """
+        np = integrations.get_numpy()
+        out.fill(0.0)
+        for j in range(len(NUTRIENTS)):
+            inv = 1.0 / max(float(scale[j]), 1e-6)
+            np.multiply(columns[j], inv, out=buf)
+            buf -= float(center[j]) * inv
+            if self.min_only[j]:
+                np.minimum(buf, 0.0, out=buf)
+            elif self.max_only[j]:
+                np.maximum(buf, 0.0, out=buf)
+            buf *= buf
+            buf *= self.weights[j]
+            out += buf
+        return out
+
+
+def solve(matrix, objective: Objective, meals: int, beam_width: int = BEAM_WIDTH,
+          swap_passes: int = SWAP_PASSES) -> list[int]:
+    """matrix（N×6）の行から meals 個（重複なし）を選び、行番号を返す"""
+    np = integrations.get_numpy()
+    n = len(matrix)
+    meals = min(meals, n)
+    if meals == 0:
+        return []
+    count = math.comb(n, meals)
+    if count <= EXACT_COMBINATIONS:
+        combos = np.fromiter(
+            itertools.chain.from_iterable(itertools.combinations(range(n), meals)),
+            dtype=np.int64, count=count * meals,
+        ).reshape(count, meals)
+        totals = matrix[combos[:, 0]]
+        for i in range(1, meals):
+            totals = totals + matrix[combos[:, i]]
+        return [int(row) for row in combos[int(np.argmin(objective.loss(totals)))]]
+
+    # 栄養素ごとに連続した配列にして、候補全体への計算を列ごとの一括演算にする
+    columns = np.ascontiguousarray(matrix.T, dtype=np.float32)
+    scores = np.empty(n, dtype=np.float32)
+    buf = np.empty(n, dtype=np.float32)
+
+    # ---------- ビームサーチ ----------
+    # 状態: (選んだ行, 合計)。各段で「残りの目標 / 残りの食数」に近い行を候補にし、
+    # 目標を食数で按分した値に対する合計のずれで上位 beam_width 個の状態を残す
+    states = [((), np.zeros(len(NUTRIENTS), dtype=np.float32))]
+    for step in range(meals):
+        remaining = meals - step
+        pro_rata = objective.targets * (step + 1) / meals
+        expanded = []
+        for chosen, totals in states:
+            share = np.maximum(np.maximum(objective.targets - totals, 0.0) / remaining, 1e-3)
+            objective.scores(columns, share, share, scores, buf)
+            if chosen:
+                scores[list(chosen)] = np.inf
+            take = min(beam_width, n - len(chosen))
+            for row in np.argpartition(scores, take - 1)[:take]:
+                new_totals = totals + matrix[row]
+                expanded.append((float(objective.loss(new_totals, pro_rata)),
+                                 chosen + (int(row),), new_totals))
+        expanded.sort(key=lambda item: item[0])
+        seen = set()
+        states = []
+        for _, chosen, totals in expanded:
+            key = frozenset(chosen)
+            if key in seen:
+                continue
+            seen.add(key)
+            states.append((chosen, totals))
+            if len(states) == beam_width:
+                break
+
+    chosen, totals = min(states, key=lambda state: float(objective.loss(state[1])))
+    chosen = list(chosen)
+
+    # ---------- 1食ずつ全件と入れ替える局所探索 ----------
+    best = float(objective.loss(totals))
+    for _ in range(swap_passes):
+        improved = False
+        for i in range(meals):
+            others = totals - matrix[chosen[i]]
+            objective.scores(columns, objective.targets - others, objective.targets, scores, buf)
+            scores[[row for j, row in enumerate(chosen) if j != i]] = np.inf
+            row = int(np.argmin(scores))
+            if scores[row] < best - 1e-6:
+                best = float(objective.loss(others + matrix[row]))
+                chosen[i] = row
+                totals = others + matrix[row]
+                improved = True
+        if not improved:
+            break
+    return chosen
+
+
+# ------------------------------
+# 栄養価の行列（DB との同期）
+# ------------------------------
+class NutritionPool:
+    """recipe_id -> 栄養価 の行列と持ち主。更新・削除された分だけ DB から取り込む"""
+
+    def __init__(self, session_factory):
+        np = integrations.get_numpy()
+        self.session_factory = session_factory
+        self.ids = np.zeros(1024, dtype=np.int64)
+        self.owners = np.zeros(1024, dtype=np.int64)
+        self.matrix = np.zeros((1024, len(NUTRIENTS)), dtype=np.float32)
+        self.size = 0
+        self._rows: dict[int, int] = {}
+        self.synced_at = None
+        self.checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _grow(self, capacity: int) -> None:
+        np = integrations.get_numpy()
+        if len(self.ids) >= capacity:
+            return
+        new_capacity = max(capacity, len(self.ids) * 2)
+        for name in ("ids", "owners", "matrix"):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def upsert(self, rows) -> None:
+        """rows は (recipe_id, user_id, calories, ..., salt)"""
+        with self._lock:
+            self._grow(self.size + len(rows))
+            for recipe_id, user_id, *values in rows:
+                row = self._rows.get(recipe_id)
+                if row is None:
+                    row = self.size
+                    self.size += 1
+                    self._rows[recipe_id] = row
+                    self.ids[row] = recipe_id
+                self.owners[row] = user_id
+                self.matrix[row] = values
+
+    def remove(self, recipe_ids) -> None:
+        with self._lock:
+            for recipe_id in recipe_ids:
+                row = self._rows.pop(recipe_id, None)
+                if row is None:
+                    continue
+                last = self.size - 1
+                if row != last:
+                    moved = int(self.ids[last])
+                    self.ids[row] = moved
+                    self.owners[row] = self.owners[last]
+                    self.matrix[row] = self.matrix[last]
+                    self._rows[moved] = row
+                self.size -= 1
+
+    def refresh(self, force: bool = False) -> int:
+        if not force and time.monotonic() - self.checked_at < REFRESH_SECONDS:
+            return 0
+        with self._lock:
+            if not force and time.monotonic() - self.checked_at < REFRESH_SECONDS:
+                return 0
+            since = self.synced_at - REFRESH_LOOKBACK if self.synced_at else None
+            now = datetime.utcnow()
+            db = self.session_factory()
+            try:
+                stmt = (
+                    select(RecipeNutrition.recipe_id, RecipeNutrition.user_id,
+                           *(getattr(RecipeNutrition, key) for key in NUTRIENTS))
+                    .join(Recipe, Recipe.id == RecipeNutrition.recipe_id)
+                    .where(Recipe.deleted_at.is_(None))
+                    .execution_options(yield_per=10000)
+                )
+                if since is not None:
+                    stmt = stmt.where(RecipeNutrition.updated_at >= since)
+                changed = 0
+                for rows in db.execute(stmt).partitions():
+                    self.upsert([tuple(row) for row in rows])
+                    changed += len(rows)
+                if since is not None:
+                    deleted = list(db.execute(
+                        select(Recipe.id).where(Recipe.deleted_at >= since)).scalars())
+                    self.remove(deleted)
+                    changed += len(deleted)
+            finally:
+                db.close()
+            self.synced_at = now
+            self.checked_at = time.monotonic()
+            return changed
+
+    def candidates(self, user_id: int | None = None, exclude=()):
+        """(行番号, 栄養価の行列)。user_id を渡すとそのユーザーのレシピだけ"""
+        np = integrations.get_numpy()
+        with self._lock:
+            mask = np.ones(self.size, dtype=bool)
+            if user_id is not None:
+                mask &= self.owners[:self.size] == user_id
+            for recipe_id in exclude:
+                row = self._rows.get(recipe_id)
+                if row is not None:
+                    mask[row] = False
+            rows = np.flatnonzero(mask)
+            if len(rows) == self.size:
+                # 全件なら行列をコピーしない（更新は行の入れ替えなので読み取り中の値は壊れない）
+                return rows, self.matrix[:self.size], self.ids[:self.size].copy()
+            return rows, self.matrix[rows], self.ids[rows]
+
+    def warmup(self) -> threading.Thread:
+        def run():
+            try:
+                self.refresh(force=True)
+            except Exception:
+                logger.exception("nutrition pool warmup failed")
+
+        thread = threading.Thread(target=run, name="nutrition-pool-warmup", daemon=True)
+        thread.start()
+        return thread
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(session_factory=None) -> NutritionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if session_factory is None:
+                    from src.get_conn import SessionLocal as session_factory
+                _pool = NutritionPool(session_factory)
+    return _pool
+
+
+# ------------------------------
+# 献立
+# ------------------------------
+def _values(vector) -> dict:
+    return {key: round(float(value), 1) for key, value in zip(NUTRIENTS, vector)}
+
+
+def gap_theme(needed: dict) -> str:
+    """不足分を補うレシピを生成するときのテーマ（栄養価の目安をテーマに含める）"""
+    parts = []
+    for key, label, unit in llm.NUTRITION_LABELS:
+        value = needed[key]
+        if TARGET_KINDS[key] == "max":
+            parts.append(f"{label}{value:.1f}{unit}以下")
+        elif TARGET_KINDS[key] == "min":
+            parts.append(f"{label}{value:.0f}{unit}以上")
+        else:
+            parts.append(f"{label}約{value:.0f}{unit}")
+    return "不足する栄養を補う一品（" + "、".join(parts) + "）"
+
+
+def plan(db: Session, user_id: int, targets: dict | None = None, meals: int = 3,
+         scope: str = "own", exclude=(), pool: NutritionPool | None = None,
+         retry: bool = True) -> dict:
+    """保存済みのレシピから献立を組む（LLM は呼ばない）。不足分の補い方は fill_gap"""
+    np = integrations.get_numpy()
+    pool = pool or get_pool()
+    pool.refresh()
+    targets = {**default_targets(), **(targets or {})}
+    objective = Objective(targets)
+
+    start = time.perf_counter()
+    _, matrix, ids = pool.candidates(user_id if scope == "own" else None, exclude)
+    chosen = solve(matrix, objective, meals)
+    solve_ms = (time.perf_counter() - start) * 1000
+    metrics.meal_plan_duration.observe(solve_ms / 1000, scope)
+
+    recipe_ids = [int(ids[row]) for row in chosen]
+    titles = dict(db.execute(
+        select(Recipe.id, Recipe.title)
+        .join(RecipeNutrition, RecipeNutrition.recipe_id == Recipe.id)
+        .where(Recipe.id.in_(recipe_ids), Recipe.deleted_at.is_(None))
+    ).all()) if recipe_ids else {}
+    stale = [recipe_id for recipe_id in recipe_ids if recipe_id not in titles]
+    if stale and retry:
+        # 取り込み後に削除されたか、編集で栄養価が読めなくなったレシピ。行列から外して探し直す
+        pool.remove(stale)
+        return plan(db, user_id, targets, meals, scope, exclude, pool, retry=False)
+
+    items = []
+    totals = np.zeros(len(NUTRIENTS), dtype=np.float32)
+    for row, recipe_id in zip(chosen, recipe_ids):
+        if recipe_id not in titles:
+            continue
+        totals += matrix[row]
+        items.append({"recipe_id": recipe_id, "title": titles[recipe_id],
+                      "nutrition": _values(matrix[row]), "generated": False})
+    return _result(objective, targets, items, totals, solve_ms)
+
+
+def _result(objective: Objective, targets: dict, items: list, totals, solve_ms: float) -> dict:
+    return {
+        "meals": items,
+        "targets": targets,
+        "totals": _values(totals),
+        "gap": _values(objective.targets - totals),
+        "within_tolerance": objective.within(totals),
+        "solve_ms": round(solve_ms, 2),
+    }
+
+
+def gap_to_fill(result: dict, meals: int) -> tuple[int | None, dict]:
+    """
+    LLM で生成する1食の位置（meals に満たなければ追加 = None）と、その1食に求める栄養価。
+    食数が足りなければ不足分を足りない食数で割った値を求める。揃っていれば置き換えた後の合計が
+    最も目標に近くなる1食（同じなら1食分の目安から最も外れている1食）を選ぶ
+    """
+    np = integrations.get_numpy()
+    objective = Objective(result["targets"])
+    totals = np.array([result["totals"][key] for key in NUTRIENTS], dtype=np.float32)
+    missing = meals - len(result["meals"])
+    if missing > 0:
+        return None, _values(np.maximum(objective.targets - totals, 0.0) / missing)
+    per_meal = objective.targets / meals
+    best = None
+    for i, item in enumerate(result["meals"]):
+        row = np.array([item["nutrition"][key] for key in NUTRIENTS], dtype=np.float32)
+        others = totals - row
+        needed = np.maximum(objective.targets - others, 0.0)
+        key = (round(float(objective.loss(others + needed)), 6),
+               -float(objective.loss(row, per_meal)))
+        if best is None or key < best[0]:
+            best = (key, i, needed)
+    _, index, needed = best
+    return index, _values(needed)
+
+
+def apply_generated(result: dict, index: int | None, recipe_id: int, title: str,
+                    nutrition: dict | None) -> dict:
+    """生成したレシピを献立に入れ、合計と判定を計算し直す"""
+    np = integrations.get_numpy()
+    items = list(result["meals"])
+    item = {"recipe_id": recipe_id, "title": title, "nutrition": nutrition, "generated": True}
+    if index is None:
+        items.append(item)
+    else:
+        items[index] = item
+    totals = np.zeros(len(NUTRIENTS), dtype=np.float32)
+    for meal in items:
+        if meal["nutrition"] is not None:
+            totals += np.array([meal["nutrition"][key] for key in NUTRIENTS], dtype=np.float32)
+    return _result(Objective(result["targets"]), result["targets"], items, totals, result["solve_ms"])
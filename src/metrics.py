@@ -0,0 +1,330 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 秒単位のデフォルトバケット
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケット別件数..., +Inf 件数, 合計]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[labels] = state
+            state[index] += 1
+            state[-1] += value
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """収集時に fn() を呼んで {ラベル値タプル: 値} を得るメトリクス（gauge / counter）"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, fn, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.fn().items():
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ------------------------------
+# HTTP / DB
+# ------------------------------
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route", "status")))
+db_queries_per_request = registry.register(Histogram(
+    "db_queries_per_request", "Number of DB queries issued per request",
+    ("route",), buckets=COUNT_BUCKETS))
+db_time_per_request = registry.register(Histogram(
+    "db_query_time_per_request_seconds", "Total DB query time per request",
+    ("route",)))
+# リクエストのセッションがプライマリ（writer）とレプリカ（reader）のどちらから読んだか
+db_sessions = registry.register(Counter(
+    "db_sessions_total", "Request DB sessions by read target", ("target",)))
+
+# ------------------------------
+# LLM
+# ------------------------------
+llm_duration = registry.register(Histogram(
+    "llm_request_duration_seconds", "Recipe generation latency",
+    ("deployment", "mode")))
+llm_ttft = registry.register(Histogram(
+    "llm_time_to_first_token_seconds", "Time to first streamed token",
+    ("deployment", "mode")))
+llm_tokens = registry.register(Counter(
+    "llm_tokens_total", "Tokens reported in response.usage",
+    ("deployment", "kind")))
+# 生成の概算費用（kind: llm / image、単価は src/pricing.py）
+generation_cost = registry.register(Counter(
+    "generation_cost_usd_total", "Estimated generation spend", ("kind",)))
+quota_rejections = registry.register(Counter(
+    "quota_rejections_total", "create-recipe requests rejected by plan quota",
+    ("plan", "period")))
+# JSON モードの出力が max_completion_tokens で打ち切られた回数（outcome: retried / failed）
+llm_truncations = registry.register(Counter(
+    "llm_truncated_generations_total", "JSON generations cut off at the completion token cap",
+    ("outcome",)))
+
+# ------------------------------
+# 外部呼び出し（画像API / Stripe など resilience.call を通るもの）
+# ------------------------------
+outbound_duration = registry.register(Histogram(
+    "outbound_call_duration_seconds", "Outbound call latency by upstream",
+    ("upstream", "outcome")))
+
+# ------------------------------
+# Idempotency-Key（executed: 初回実行 / replayed: 保存済み応答 / attached: 実行中の処理を待った）
+# ------------------------------
+idempotency_requests = registry.register(Counter(
+    "idempotency_requests_total", "Requests carrying an Idempotency-Key by outcome",
+    ("scope", "outcome")))
+
+# ------------------------------
+# 削除済みレシピの物理削除（src/purge.py）
+# ------------------------------
+purged_recipes = registry.register(Counter(
+    "recipes_purged_total", "Soft-deleted recipes removed by the purge worker"))
+purged_images = registry.register(Counter(
+    "images_purged_total", "Image rows removed together with purged recipes"))
+
+# ------------------------------
+# エクスポート（src/export.py）
+# ------------------------------
+recipe_exports = registry.register(Counter(
+    "recipe_exports_total", "Recipe collection exports started by format", ("format",)))
+export_image_bytes = registry.register(Counter(
+    "export_image_bytes_total", "Image bytes streamed into ZIP exports"))
+
+# ------------------------------
+# 人気テーマの事前生成（src/pregen.py。outcome: hit / miss）
+# ------------------------------
+pregen_generated = registry.register(Counter(
+    "pregen_recipes_generated_total", "Recipes pre-generated off-peak for popular themes"))
+pregen_assignments = registry.register(Counter(
+    "pregen_assignments_total", "create-recipe lookups of pre-generated results by outcome",
+    ("outcome",)))
+
+# ------------------------------
+# 類似レシピ（src/similar.py）
+# ------------------------------
+similar_search_duration = registry.register(Histogram(
+    "similar_search_duration_seconds", "Top-k search over the in-memory vector index"))
+similar_index_updates = registry.register(Counter(
+    "similar_index_updates_total", "Embeddings upserted into or removed from the vector index"))
+
+# ------------------------------
+# 献立（src/meal_plan.py。scope: own / all、outcome: pool / generated / gap）
+# ------------------------------
+meal_plan_duration = registry.register(Histogram(
+    "meal_plan_solve_duration_seconds", "Meal-plan search over the in-memory nutrient matrix",
+    ("scope",)))
+meal_plans = registry.register(Counter(
+    "meal_plans_total", "Meal plans returned by outcome", ("outcome",)))
+
+# ------------------------------
+# 再生成用の画像（src/image_variants.py）
+# outcome: generated / failed / evicted、source: variant（作り置き） / generated（その場で生成）
+# ------------------------------
+image_variants = registry.register(Counter(
+    "image_variants_total", "Spare images generated, failed or evicted by outcome", ("outcome",)))
+image_regenerations = registry.register(Counter(
+    "image_regenerations_total", "Image regenerations served by source", ("source",)))
+
+# ------------------------------
+# Stripe との突き合わせ（src/stripe_sync.py。kind: status / price / missing）
+# ------------------------------
+stripe_reconcile_pages = registry.register(Counter(
+    "stripe_reconcile_pages_total", "Stripe subscription list pages reconciled"))
+stripe_reconcile_changes = registry.register(Counter(
+    "stripe_reconcile_changes_total", "Subscription differences found by reconciliation", ("kind",)))
+
+
+# ------------------------------
+# リクエスト単位のDB統計
+# ------------------------------
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None)
+
+
+def current_request_stats() -> RequestStats | None:
+    return _request_stats.get()
+
+
+# クエリごとに (statement, 経過秒) を受け取るフック（SQL のサンプリングログなど）
+query_observers = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    for observer in query_observers:
+        observer(statement, elapsed)
+
+
+class MetricsMiddleware:
+    """ルート別レイテンシとリクエストあたりのDBクエリ数・時間を記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            route = scope.get("route")
+            # 未マッチのパスはラベルが増えすぎないようにまとめる
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(
+                elapsed, scope["method"], route_path, str(status_holder[0]))
+            db_queries_per_request.observe(stats.queries, route_path)
+            db_time_per_request.observe(stats.db_time, route_path)
+
+
+def observe_generation(result) -> None:
+    """llm.GenerationResult を記録する"""
+    deployment = result.deployment or "unknown"
+    llm_duration.observe(result.latency_ms / 1000, deployment, result.mode)
+    if result.ttft_ms is not None:
+        llm_ttft.observe(result.ttft_ms / 1000, deployment, result.mode)
+    if result.prompt_tokens is not None:
+        llm_tokens.inc(deployment, "prompt", amount=result.prompt_tokens)
+    if result.completion_tokens is not None:
+        llm_tokens.inc(deployment, "completion", amount=result.completion_tokens)
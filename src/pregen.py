@@ -0,0 +1,387 @@
+"""
+人気テーマの事前生成。
+
+食事どき（PREGEN_PEAK_HOURS）は生成リクエストが集中し、Azure のスロットリングに当たりやすい。
+ピークに頼まれるテーマの多くは過去の recipes.title から予測できるので、
+- 閑散時間帯（PREGEN_QUIET_HOURS）に、過去 PREGEN_HISTORY_DAYS 日のピーク時間帯のテーマを
+  時間帯ごとに集計して上位 PREGEN_TOP_THEMES 件を選び、1日あたりの需要に見合う数だけ
+  レシピと画像を事前に生成しておく（1日の費用は PREGEN_DAILY_BUDGET_USD まで）
+- ピーク時間帯の create-recipe は、同じテーマの事前生成があれば LLM・画像APIを呼ばずに割り当てる。
+  そのユーザーにまだ割り当てていない行だけを選び、無ければ通常どおり生成する
+
+時間帯は PREGEN_UTC_OFFSET_HOURS（既定 9 = JST）の現地時刻で指定する（"11-13,17-20" は両端を含む）。
+
+    python -m src.pregen plan     # 何をいくつ生成するか（生成はしない）
+    python -m src.pregen run      # 時間帯に関係なく1回実行する
+    python -m src.pregen stats
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import metrics, pricing, resilience
+from src.db_models import DailyStat, Image, PregeneratedRecipe, Recipe
+from src.shared_state import SingleFlight, get_state
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hours(value: str) -> frozenset[int]:
+    """"11-13,17-20" → {11, 12, 13, 17, 18, 19, 20}（"22-2" のように日をまたいでもよい）"""
+    hours = set()
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        start, _, end = part.partition("-")
+        start = int(start)
+        end = int(end) if end else start
+        hour = start
+        while True:
+            hours.add(hour % 24)
+            if hour % 24 == end % 24:
+                break
+            hour += 1
+    return frozenset(hours)
+
+
+PEAK_HOURS = parse_hours(os.getenv("PREGEN_PEAK_HOURS", "11-13,17-20"))
+QUIET_HOURS = parse_hours(os.getenv("PREGEN_QUIET_HOURS", "1-5"))
+UTC_OFFSET = timedelta(hours=int(os.getenv("PREGEN_UTC_OFFSET_HOURS", "9")))
+HISTORY_DAYS = int(os.getenv("PREGEN_HISTORY_DAYS", "14"))
+TOP_THEMES = int(os.getenv("PREGEN_TOP_THEMES", "20"))
+# 1日あたりの需要（ピーク時間帯の平均件数）の何倍を用意するか
+STOCK_FACTOR = float(os.getenv("PREGEN_STOCK_FACTOR", "1.0"))
+MAX_PER_THEME = int(os.getenv("PREGEN_MAX_PER_THEME", "10"))
+# 1つの事前生成を何人まで割り当てるか（同じユーザーには1回まで）
+MAX_ASSIGNMENTS = int(os.getenv("PREGEN_MAX_ASSIGNMENTS", "1"))
+MAX_AGE = timedelta(hours=float(os.getenv("PREGEN_MAX_AGE_HOURS", "24")))
+DAILY_BUDGET_USD = float(os.getenv("PREGEN_DAILY_BUDGET_USD", "5"))
+MAX_RUN_SECONDS = float(os.getenv("PREGEN_MAX_RUN_SECONDS", "600"))
+INTERVAL_SECONDS = float(os.getenv("PREGEN_INTERVAL_SECONDS", "300"))
+WITH_IMAGES = os.getenv("PREGEN_IMAGES", "true").lower() == "true"
+# "peak"（ピーク時間帯だけ割り当てる） / "always" / "never"
+ASSIGN = os.getenv("PREGEN_ASSIGN", "peak").lower()
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_theme(title: str) -> str:
+    """全角・半角や大文字小文字、空白の違いを無視してテーマを比べる"""
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", title)).strip().lower()
+
+
+def local_hour(now: datetime | None = None) -> int:
+    return ((now or datetime.utcnow()) + UTC_OFFSET).hour
+
+
+def is_peak(now: datetime | None = None) -> bool:
+    return local_hour(now) in PEAK_HOURS
+
+
+def is_quiet(now: datetime | None = None) -> bool:
+    return local_hour(now) in QUIET_HOURS
+
+
+def _utc_hour(db: Session, column):
+    if db.bind.dialect.name == "postgresql":
+        return cast(func.extract("hour", column), Integer)
+    return cast(func.strftime("%H", column), Integer)
+
+
+# ------------------------------
+# テーマの集計と計画
+# ------------------------------
+def top_themes(db: Session, now: datetime | None = None, days: int = HISTORY_DAYS,
+               limit: int = TOP_THEMES, hours: frozenset[int] = PEAK_HOURS) -> list[dict]:
+    """
+    直近 days 日のうち hours（現地時刻）に作られたレシピのテーマを件数の多い順に返す。
+    per_day は1日あたりの平均件数、by_hour は時間帯ごとの件数
+    """
+    now = now or datetime.utcnow()
+    offset_hours = UTC_OFFSET.seconds // 3600
+    hour = _utc_hour(db, Recipe.created_at)
+    rows = db.execute(
+        select(Recipe.title, hour, func.count())
+        .where(Recipe.created_at >= now - timedelta(days=days))
+        .group_by(Recipe.title, hour)
+    )
+    totals = Counter()
+    by_hour = {}
+    titles = {}
+    for title, utc_hour, count in rows:
+        local = (utc_hour + offset_hours) % 24
+        if local not in hours:
+            continue
+        theme = normalize_theme(title)
+        totals[theme] += count
+        by_hour.setdefault(theme, Counter())[local] += count
+        # 表示・生成には一番多い表記を使う
+        titles.setdefault(theme, Counter())[title] += count
+    return [
+        {
+            "theme": theme,
+            "title": titles[theme].most_common(1)[0][0],
+            "count": count,
+            "per_day": count / days,
+            "by_hour": dict(sorted(by_hour[theme].items())),
+        }
+        for theme, count in totals.most_common(limit)
+    ]
+
+
+def plan(db: Session, now: datetime | None = None) -> list[dict]:
+    """
+    テーマごとに生成する件数。需要（1日あたりの件数 × STOCK_FACTOR）から、
+    有効期限内の事前生成の残り割り当て回数を引いた分を MAX_ASSIGNMENTS で割って求める
+    """
+    now = now or datetime.utcnow()
+    remaining = PregeneratedRecipe.remaining_by_theme(db, now - MAX_AGE, MAX_ASSIGNMENTS)
+    items = []
+    for item in top_themes(db, now):
+        demand = math.ceil(item["per_day"] * STOCK_FACTOR)
+        missing = max(0, demand - remaining.get(item["theme"], 0))
+        generate = min(MAX_PER_THEME, math.ceil(missing / MAX_ASSIGNMENTS))
+        items.append({**item, "demand": demand,
+                      "remaining": remaining.get(item["theme"], 0), "generate": generate})
+    return items
+
+
+def _round_robin(items: list[dict]):
+    """需要の多いテーマに偏りすぎないよう、1件ずつ順番に生成する"""
+    pending = {item["theme"]: item["generate"] for item in items}
+    while any(pending.values()):
+        for item in items:
+            if pending[item["theme"]]:
+                pending[item["theme"]] -= 1
+                yield item
+
+
+# ------------------------------
+# 生成
+# ------------------------------
+def generate_one(db: Session, theme: str, title: str, with_images: bool = WITH_IMAGES) -> PregeneratedRecipe:
+    """1件生成して保存する（費用は当日の daily_stats に計上する）"""
+    generated = Recipe.generate_recipe(title, db)
+    llm_cost = pricing.llm_cost(generated.prompt_tokens, generated.completion_tokens)
+    image_url = None
+    image_latency_ms = None
+    if with_images:
+        start = time.perf_counter()
+        image_url = Image.generate_image(
+            Recipe.render_content(generated.content, generated.content_format), None, db)
+        image_latency_ms = (time.perf_counter() - start) * 1000
+    cost = llm_cost + (pricing.IMAGE_COST_USD if image_url else 0.0)
+    pregen = PregeneratedRecipe(
+        theme=theme,
+        title=title,
+        markdown_content=generated.content,
+        content_format=generated.content_format,
+        image_url=image_url,
+        mode=generated.mode,
+        deployment=generated.deployment,
+        prompt_tokens=generated.prompt_tokens,
+        completion_tokens=generated.completion_tokens,
+        latency_ms=generated.latency_ms,
+        image_latency_ms=image_latency_ms,
+        cost_usd=cost,
+        created_at=datetime.utcnow(),
+    )
+    db.add(pregen)
+    DailyStat.add(
+        db,
+        prompt_tokens=generated.prompt_tokens or 0,
+        completion_tokens=generated.completion_tokens or 0,
+        cost_usd=cost,
+    )
+    db.commit()
+    metrics.generation_cost.inc("llm", amount=llm_cost)
+    if image_url:
+        metrics.generation_cost.inc("image", amount=pricing.IMAGE_COST_USD)
+    metrics.pregen_generated.inc()
+    return pregen
+
+
+def run(session_factory, now: datetime | None = None, budget_usd: float = DAILY_BUDGET_USD,
+        max_seconds: float = MAX_RUN_SECONDS, with_images: bool = WITH_IMAGES, log=None) -> dict:
+    """
+    期限切れを消し、計画に沿って予算・時間の範囲で生成する。
+    上流の障害（ブレーカーが開いている・期限切れ）が出たらその回は打ち切る
+    """
+    now = now or datetime.utcnow()
+    log = log or (lambda message: logger.info(message))
+    deadline = time.monotonic() + max_seconds
+    day_start = datetime(now.year, now.month, now.day)
+    result = {"expired": 0, "generated": 0, "failed": 0, "spent_usd": 0.0, "stopped": None}
+
+    db = session_factory()
+    try:
+        result["expired"] = PregeneratedRecipe.expire(db, now - MAX_AGE)
+        items = plan(db, now)
+        spent = PregeneratedRecipe.spent_since(db, day_start)
+        # 1件目は画像の単価だけで見積もり、以降は実績の平均で見積もる
+        estimate = pricing.IMAGE_COST_USD if with_images else 0.0
+        for item in _round_robin(items):
+            if time.monotonic() >= deadline:
+                result["stopped"] = "time"
+                break
+            if spent + estimate > budget_usd:
+                result["stopped"] = "budget"
+                break
+            try:
+                pregen = generate_one(db, item["theme"], item["title"], with_images)
+            except (resilience.CircuitOpenError, resilience.DeadlineExceeded) as e:
+                db.rollback()
+                result["failed"] += 1
+                result["stopped"] = "upstream"
+                log(f"stopped pre-generation: {e}")
+                break
+            except Exception:
+                db.rollback()
+                result["failed"] += 1
+                logger.exception("pre-generation failed", extra={"theme": item["theme"]})
+                continue
+            spent += pregen.cost_usd
+            result["spent_usd"] += pregen.cost_usd
+            result["generated"] += 1
+            estimate = result["spent_usd"] / result["generated"]
+        result["spent_usd"] = round(result["spent_usd"], 6)
+        return result
+    finally:
+        db.close()
+
+
+# ------------------------------
+# 割り当て（create-recipe）
+# ------------------------------
+def should_assign(now: datetime | None = None) -> bool:
+    if ASSIGN == "always":
+        return True
+    if ASSIGN == "peak":
+        return is_peak(now)
+    return False
+
+
+def assign(db: Session, title: str, user_id: int, now: datetime | None = None) -> dict | None:
+    """
+    事前生成があればユーザーのレシピとして登録し、registry_recipe と同じ形の dict（image_url 付き）を返す。
+    割り当てられるものが無ければ None（呼び出し側が通常どおり生成する）
+    """
+    now = now or datetime.utcnow()
+    pregen = PregeneratedRecipe.claim(
+        db, normalize_theme(title), user_id, now - MAX_AGE, MAX_ASSIGNMENTS)
+    if pregen is None:
+        metrics.pregen_assignments.inc("miss")
+        return None
+    result = Recipe.registry_pregenerated(pregen, title, user_id, db)
+    metrics.pregen_assignments.inc("hit")
+    return result
+
+
+# ------------------------------
+# ワーカー
+# ------------------------------
+class PregenWorker:
+    """閑散時間帯に一定間隔で run() を回すスレッド。複数ワーカーでは共有ロックで1つだけが実行する"""
+
+    def __init__(self, session_factory, interval_s: float = INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.interval_s = interval_s
+        self.flight = SingleFlight(get_state(), "pregen", lock_ttl_s=MAX_RUN_SECONDS + 60)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now: datetime | None = None) -> dict | None:
+        """閑散時間帯でロックを取れたら1回実行する（それ以外は None）"""
+        if not is_quiet(now):
+            return None
+        token = self.flight.try_acquire("themes")
+        if token is None:
+            return None
+        try:
+            result = run(self.session_factory, now)
+            if result["generated"] or result["expired"]:
+                logger.info("pre-generated popular themes", extra=result)
+            return result
+        finally:
+            self.flight.release("themes", token)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("pre-generation failed")
+
+    def start(self) -> "PregenWorker":
+        self._thread = threading.Thread(target=self._run, name="recipe-pregen", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+
+
+def stats(db: Session, now: datetime | None = None) -> dict:
+    now = now or datetime.utcnow()
+    since = now - MAX_AGE
+    total, assigned, cost = db.execute(
+        select(func.count(), func.coalesce(func.sum(PregeneratedRecipe.assigned_count), 0),
+               func.coalesce(func.sum(PregeneratedRecipe.cost_usd), 0.0))
+        .where(PregeneratedRecipe.created_at >= since)
+    ).one()
+    return {
+        "local_hour": local_hour(now),
+        "peak": is_peak(now),
+        "quiet": is_quiet(now),
+        "live": total,
+        "assigned": assigned,
+        "cost_usd": round(cost, 6),
+        "spent_today_usd": round(PregeneratedRecipe.spent_since(
+            db, datetime(now.year, now.month, now.day)), 6),
+        "daily_budget_usd": DAILY_BUDGET_USD,
+        "remaining_by_theme": PregeneratedRecipe.remaining_by_theme(db, since, MAX_ASSIGNMENTS),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-generate recipes for popular themes off-peak.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("plan")
+    p_run = sub.add_parser("run")
+    p_run.add_argument("--budget-usd", type=float, default=DAILY_BUDGET_USD)
+    p_run.add_argument("--no-images", action="store_true")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+    from src.logging_config import setup_logging
+    setup_logging()
+
+    if args.command == "run":
+        result = run(SessionLocal, budget_usd=args.budget_usd,
+                     with_images=WITH_IMAGES and not args.no_images, log=print)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    db = SessionLocal()
+    try:
+        data = plan(db) if args.command == "plan" else stats(db)
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""
+生成1回あたりの概算費用（利用量の台帳 generation_logs.cost_usd 用）。
+単価は Azure の契約に合わせて環境変数で上書きする。
+"""
+import os
+from dotenv import load_dotenv
+
+# .env をロード
+load_dotenv()
+
+PROMPT_COST_PER_1K_TOKENS = float(os.getenv("LLM_PROMPT_COST_PER_1K_TOKENS", "0.0025"))
+COMPLETION_COST_PER_1K_TOKENS = float(os.getenv("LLM_COMPLETION_COST_PER_1K_TOKENS", "0.01"))
+IMAGE_COST_USD = float(os.getenv("IMAGE_COST_USD", "0.04"))
+
+
+def llm_cost(prompt_tokens: int | None, completion_tokens: int | None) -> float:
+    return ((prompt_tokens or 0) * PROMPT_COST_PER_1K_TOKENS
+            + (completion_tokens or 0) * COMPLETION_COST_PER_1K_TOKENS) / 1000
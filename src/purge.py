@@ -0,0 +1,184 @@
+"""
+論理削除したレシピの後片付け（画像行・編集履歴・保存済みファイル・派生データの削除）。
+
+削除 API は deleted_at を付けるだけにして応答を速くし、重い削除はここでまとめて行う。
+- API プロセス内のバックグラウンドスレッド（RECIPE_PURGE_WORKER=true、lifespan で起動）
+- または cron などから `python -m src.purge --once`
+
+画像ファイルや検索インデックスなど、レシピに紐づく派生データを持つモジュールは
+register() でフックを登録し、行を消す前に同じトランザクションで片付ける。
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import metrics
+from src.db_models import (
+    GenerationLog, Image, Recipe, RecipeEmbedding, RecipeNutrition, RecipeVersion,
+)
+from src.shared_state import SingleFlight, get_state
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("RECIPE_PURGE_BATCH_SIZE", "500"))
+INTERVAL_SECONDS = float(os.getenv("RECIPE_PURGE_INTERVAL_SECONDS", "60"))
+# 削除から物理削除までの猶予（0 なら次の実行で消す）
+GRACE_SECONDS = float(os.getenv("RECIPE_PURGE_GRACE_SECONDS", "0"))
+
+# hook(db, recipe_ids, images)。images は (id, recipe_id, image_url) の行
+_hooks = []
+
+
+def register(hook):
+    """物理削除の直前に呼ぶフックを登録する（デコレーターとしても使える）"""
+    _hooks.append(hook)
+    return hook
+
+
+def purge_batch(db: Session, batch_size: int = BATCH_SIZE, grace_s: float = GRACE_SECONDS) -> int:
+    """削除済みレシピを最大 batch_size 件だけ物理削除し、件数を返す"""
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_s)
+    recipe_ids = list(db.execute(
+        select(Recipe.id)
+        .where(Recipe.deleted_at.is_not(None), Recipe.deleted_at <= cutoff)
+        .order_by(Recipe.id)
+        .limit(batch_size)
+    ).scalars())
+    if not recipe_ids:
+        return 0
+
+    images = db.execute(
+        select(Image.id, Image.recipe_id, Image.image_url)
+        .where(Image.recipe_id.in_(recipe_ids))
+    ).all()
+    for hook in _hooks:
+        hook(db, recipe_ids, images)
+
+    # SQLite は外部キーの CASCADE / SET NULL を既定で実行しないので明示的に消す
+    db.execute(delete(Image).where(Image.recipe_id.in_(recipe_ids)))
+    db.execute(delete(RecipeVersion).where(RecipeVersion.recipe_id.in_(recipe_ids)))
+    db.execute(delete(RecipeEmbedding).where(RecipeEmbedding.recipe_id.in_(recipe_ids)))
+    db.execute(delete(RecipeNutrition).where(RecipeNutrition.recipe_id.in_(recipe_ids)))
+    db.execute(
+        update(GenerationLog)
+        .where(GenerationLog.recipe_id.in_(recipe_ids))
+        .values(recipe_id=None)
+    )
+    db.execute(
+        delete(Recipe)
+        .where(Recipe.id.in_(recipe_ids), Recipe.deleted_at.is_not(None))
+    )
+    db.commit()
+
+    metrics.purged_recipes.inc(amount=len(recipe_ids))
+    metrics.purged_images.inc(amount=len(images))
+    return len(recipe_ids)
+
+
+def purge(session_factory, batch_size: int = BATCH_SIZE, grace_s: float = GRACE_SECONDS,
+          max_batches: int | None = None) -> int:
+    """削除待ちが無くなるまでバッチを繰り返す"""
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        db = session_factory()
+        try:
+            count = purge_batch(db, batch_size, grace_s)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        total += count
+        batches += 1
+        if count < batch_size:
+            break
+    return total
+
+
+class PurgeWorker:
+    """一定間隔で purge() を回すスレッド。複数ワーカーでは共有ロックで1つだけが実行する"""
+
+    def __init__(self, session_factory, interval_s: float = INTERVAL_SECONDS,
+                 batch_size: int = BATCH_SIZE, grace_s: float = GRACE_SECONDS):
+        self.session_factory = session_factory
+        self.interval_s = interval_s
+        self.batch_size = batch_size
+        self.grace_s = grace_s
+        self.flight = SingleFlight(get_state(), "purge", lock_ttl_s=max(interval_s, 30.0))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> int | None:
+        """ロックを取れたら1回実行して件数を返す（他で実行中なら None）"""
+        token = self.flight.try_acquire("recipes")
+        if token is None:
+            return None
+        try:
+            start = time.perf_counter()
+            count = purge(self.session_factory, self.batch_size, self.grace_s)
+            if count:
+                logger.info("purged deleted recipes", extra={
+                    "recipes": count,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                })
+            return count
+        finally:
+            self.flight.release("recipes", token)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("recipe purge failed")
+
+    def start(self) -> "PurgeWorker":
+        self._thread = threading.Thread(target=self._run, name="recipe-purge", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Purge soft-deleted recipes and their images.")
+    parser.add_argument("--once", action="store_true", help="run until the queue is empty and exit")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--grace-seconds", type=float, default=GRACE_SECONDS)
+    parser.add_argument("--interval", type=float, default=INTERVAL_SECONDS)
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+    from src.logging_config import setup_logging
+    # フックを登録するモジュール（API プロセスではルーターが読み込む）
+    from src import image_store  # noqa: F401
+    setup_logging()
+
+    if args.once:
+        count = purge(SessionLocal, args.batch_size, args.grace_seconds)
+        print(f"Purged {count} recipes")
+        return
+
+    worker = PurgeWorker(SessionLocal, args.interval, args.batch_size, args.grace_seconds)
+    try:
+        while True:
+            worker.run_once()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+プランごとのレシピ生成クォータ（日・月）と利用状況。
+
+- プランは有効なサブスクリプションの Stripe Price ID で決める（なければ "free"、
+  PLAN_QUOTAS に無い Price ID は "paid"）
+- PLAN_QUOTAS（JSON）で上書き・追加できる。例: {"price_xxx": {"daily": 50, "monthly": 1000}}
+  0 または null の期間は制限しない
+- image_variants は再生成用に先に作っておく画像の数（レシピ1件あたり。src/image_variants.py）
+- 判定と加算は UsageCounter.reserve の UPSERT 1回。生成に失敗したら release で戻す
+- 期間は UTC の日・月
+"""
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import metrics
+from src.db_models import GenerationLog, UsageCounter, User
+
+# .env をロード
+load_dotenv()
+
+FREE_PLAN = "free"
+PAID_PLAN = "paid"
+
+DEFAULT_PLAN_QUOTAS = {
+    FREE_PLAN: {"daily": 3, "monthly": 30, "image_variants": 0},
+    PAID_PLAN: {"daily": 50, "monthly": 1000, "image_variants": 1},
+}
+
+
+def _load_plan_quotas() -> dict:
+    quotas = {plan: dict(limits) for plan, limits in DEFAULT_PLAN_QUOTAS.items()}
+    raw = os.getenv("PLAN_QUOTAS")
+    if raw:
+        for plan, limits in json.loads(raw).items():
+            quotas.setdefault(plan, {}).update(limits)
+    return quotas
+
+
+PLAN_QUOTAS = _load_plan_quotas()
+
+
+@dataclass
+class Reservation:
+    """reserve で確保した1回分（失敗時に release で戻す）"""
+    user_id: int
+    plan: str
+    day: str
+    month: str
+    day_count: int
+    month_count: int
+
+
+def periods(now: datetime | None = None) -> tuple[str, str]:
+    now = now or datetime.utcnow()
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+
+def _day_start(now: datetime) -> datetime:
+    return datetime(now.year, now.month, now.day)
+
+
+def _month_start(now: datetime) -> datetime:
+    return datetime(now.year, now.month, 1)
+
+
+def _next_month(now: datetime) -> datetime:
+    return datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+
+
+def plan_for(user: User) -> str:
+    subscription = user.current_subscription()
+    if subscription is None:
+        return FREE_PLAN
+    price_id = subscription.stripe_price_id
+    return price_id if price_id in PLAN_QUOTAS else PAID_PLAN
+
+
+def limits_for(plan: str) -> dict:
+    limits = PLAN_QUOTAS.get(plan) or PLAN_QUOTAS[PAID_PLAN]
+    return {"daily": limits.get("daily") or None, "monthly": limits.get("monthly") or None}
+
+
+def image_variants_for(plan: str) -> int:
+    """レシピ1件あたりに先に作っておく画像の数（0 なら作らない）"""
+    limits = PLAN_QUOTAS.get(plan) or PLAN_QUOTAS[PAID_PLAN]
+    return int(limits.get("image_variants") or 0)
+
+
+def reserve(db: Session, user: User, now: datetime | None = None) -> Reservation:
+    """1回分を確保する。上限に達していれば 429（Retry-After 付き）"""
+    now = now or datetime.utcnow()
+    day, month = periods(now)
+    plan = plan_for(user)
+    limits = limits_for(plan)
+    counts = UsageCounter.reserve(
+        db, user.id, day, month, limits["daily"], limits["monthly"])
+    if counts is not None:
+        return Reservation(user.id, plan, day, month, *counts)
+
+    # 上限に達した（この経路だけ現在の回数を読み、どちらの期間かを判定する）
+    day_count, month_count = UsageCounter.get_counts(db, user.id, day, month)
+    if limits["monthly"] and month_count >= limits["monthly"]:
+        period, reset_at = "monthly", _next_month(now)
+    else:
+        period, reset_at = "daily", _day_start(now) + timedelta(days=1)
+    metrics.quota_rejections.inc(plan, period)
+    raise HTTPException(
+        status_code=429,
+        detail=f"{period.capitalize()} generation quota exceeded for plan {plan}",
+        headers={"Retry-After": str(max(1, int((reset_at - now).total_seconds())))},
+    )
+
+
+def release(db: Session, reservation: Reservation) -> None:
+    UsageCounter.release(db, reservation.user_id, reservation.day, reservation.month)
+
+
+def usage_summary(db: Session, user: User, now: datetime | None = None) -> dict:
+    """プラン・上限・残り回数と、当日・当月の利用量（トークン数・画像枚数・費用）"""
+    now = now or datetime.utcnow()
+    day, month = periods(now)
+    plan = plan_for(user)
+    limits = limits_for(plan)
+    day_count, month_count = UsageCounter.get_counts(db, user.id, day, month)
+
+    def quota(limit, used, reset_at):
+        return {
+            "limit": limit,
+            "used": used,
+            "remaining": None if limit is None else max(0, limit - used),
+            "resets_at": reset_at,
+        }
+
+    return {
+        "plan": plan,
+        "daily": quota(limits["daily"], day_count, _day_start(now) + timedelta(days=1)),
+        "monthly": quota(limits["monthly"], month_count, _next_month(now)),
+        "today": GenerationLog.summarize_user(db, user.id, _day_start(now)),
+        "this_month": GenerationLog.summarize_user(db, user.id, _month_start(now)),
+    }
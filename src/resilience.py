@@ -0,0 +1,200 @@
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+from src.metrics import outbound_duration
+
+# .env をロード
+load_dotenv()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが開いているため呼び出しを行わなかった"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"Circuit '{name}' is open; retry after {retry_after:.1f}s")
+
+
+class DeadlineExceeded(Exception):
+    """呼び出し全体の期限を過ぎた"""
+
+
+class CircuitBreaker:
+    """
+    連続失敗が failure_threshold に達したら開き、reset_timeout_s の間は即座に失敗させる。
+    経過後は1件だけ試行（half-open）し、成功すれば閉じる。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """呼び出し前に状態を確認し、開いていれば CircuitOpenError を送出する"""
+        with self._lock:
+            if self.state == OPEN:
+                elapsed = time.monotonic() - self.opened_at
+                if elapsed < self.reset_timeout_s:
+                    self.total_rejected += 1
+                    raise CircuitOpenError(
+                        self.name, self.reset_timeout_s - elapsed)
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.total_rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout_s)
+                self._probe_in_flight = True
+
+            self.total_calls += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """成功とも失敗とも数えない結果（4xx など）で half-open の試行枠を戻す"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def allows_request(self) -> bool:
+        """状態を変えずに、今呼び出せるかどうかだけを返す"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout_s
+            return not (self.state == HALF_OPEN and self._probe_in_flight)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = self.state
+            # 待機時間を過ぎていれば次の呼び出しは試行されるので half-open として見せる
+            if state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                state = HALF_OPEN
+            return {
+                "state": state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_calls": self.total_calls,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+            }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """名前ごとのブレーカー（プロセス内で共有）"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=int(
+                    os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+                reset_timeout_s=float(
+                    os.getenv("BREAKER_RESET_SECONDS", "30")),
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+def breaker_states() -> dict:
+    """全ブレーカーの状態（メトリクス用）"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
+
+
+def backoff_delay(attempt: int, base_s: float = 0.2, max_s: float = 5.0) -> float:
+    """指数バックオフ + full jitter"""
+    return random.uniform(0, min(max_s, base_s * (2 ** attempt)))
+
+
+def call(
+    name: str,
+    fn,
+    *,
+    deadline_s: float,
+    idempotent: bool = False,
+    failure_on: tuple = (Exception,),
+    max_attempts: int | None = None,
+):
+    """
+    外部呼び出しをブレーカー・期限・リトライで包む。
+
+    fn は残り時間（秒）を1引数で受け取り、下位クライアントのタイムアウトに渡す。
+    failure_on に該当する例外だけを上流障害として数え、idempotent な呼び出しに限り
+    期限内でリトライする。それ以外の例外（4xx など）はそのまま送出する。
+    """
+    breaker = get_breaker(name)
+    if max_attempts is None:
+        max_attempts = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+    if not idempotent:
+        max_attempts = 1
+
+    deadline = time.monotonic() + deadline_s
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{name}: deadline of {deadline_s}s exceeded")
+
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            outbound_duration.observe(0.0, name, "rejected")
+            raise
+        start = time.perf_counter()
+        try:
+            result = fn(remaining)
+        except failure_on:
+            outbound_duration.observe(
+                time.perf_counter() - start, name, "failure")
+            breaker.record_failure()
+            attempt += 1
+            if attempt >= max_attempts:
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+            continue
+        except BaseException:
+            outbound_duration.observe(
+                time.perf_counter() - start, name, "error")
+            breaker.release()
+            raise
+
+        outbound_duration.observe(time.perf_counter() - start, name, "success")
+        breaker.record_success()
+        return result
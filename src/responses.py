@@ -0,0 +1,22 @@
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(obj):
+    # pydantic モデルはフィールドの dict をそのまま渡し、残りは orjson に任せる
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    orjson でシリアライズするレスポンス。
+    datetime はネイティブに ISO 8601 へ変換されるため、事前の isoformat() や
+    jsonable_encoder を通す必要がない。
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default)
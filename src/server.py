@@ -0,0 +1,52 @@
+"""
+本番用の起動スクリプト（uvicorn のマルチワーカー）。
+
+    python -m src.server
+
+WEB_CONCURRENCY でワーカー数（"auto" なら CPU 数）、HOST / PORT で待ち受け先を指定する。
+ワーカーは別プロセスなので、2以上にする場合は SHARED_STATE_URL に Redis を指定して
+キャッシュ・レートリミッター・ロックをワーカー間で共有する。
+"""
+import logging
+import os
+import uvicorn
+from dotenv import load_dotenv
+from src import shared_state
+from src.logging_config import setup_logging
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count() -> int:
+    value = os.getenv("WEB_CONCURRENCY", "1").strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+def main() -> None:
+    setup_logging()
+    workers = worker_count()
+    if workers > 1 and not shared_state.create_state().shared:
+        logger.warning(
+            "WEB_CONCURRENCY=%d with SHARED_STATE_URL=%s: caches, rate limits and locks "
+            "will not be shared between workers", workers, shared_state.state_url())
+
+    uvicorn.run(
+        "src.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        # Container Apps のイングレス越しでもクライアントの IP / スキームを使う
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "*"),
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_SECONDS", "5")),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30")),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+ワーカー間で共有する状態（キャッシュ・レートリミッター・single-flight ロック）のバックエンド。
+
+SHARED_STATE_URL で切り替える。
+- 未設定 / memory://      プロセス内の辞書（ワーカー1つのとき用）
+- redis://host:port/db    Redis プロトコルのサーバー（複数ワーカー・複数レプリカ用）
+- rediss://host:port/db   TLS で接続する Redis（Azure Cache for Redis は既定で TLS のみ。ポート 6380）
+- fakeredis://            プロセス内の FakeRedis（Redis バックエンドの動作確認用）
+
+Redis クライアントは依存を増やさないよう、使うコマンドだけを話す最小実装を持つ。
+"""
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+from dotenv import load_dotenv
+
+# .env をロード
+load_dotenv()
+
+# ロックの解放（自分が取ったロックだけを消す）
+RELEASE_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+# カウンターを増やし、作成時だけ有効期限を付ける
+INCR_SCRIPT = (
+    "local v = redis.call('incrby', KEYS[1], ARGV[1]) "
+    "if v == tonumber(ARGV[1]) and tonumber(ARGV[2]) > 0 then "
+    "redis.call('pexpire', KEYS[1], ARGV[2]) end return v"
+)
+
+
+class SharedState:
+    """共有状態のインターフェース（値は bytes、ttl_s は秒）"""
+
+    # 複数プロセスから同じ状態が見えるか
+    shared = False
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl_s: float | None = None) -> None:
+        raise NotImplementedError
+
+    def set_if_absent(self, key: str, value: bytes, ttl_s: float | None = None) -> bool:
+        """キーが無いときだけ書き込み、書き込めたかを返す"""
+        raise NotImplementedError
+
+    def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def delete_if_equals(self, key: str, value: bytes) -> bool:
+        """値が一致するときだけ削除する（ロックの解放用）"""
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl_s: float | None = None) -> int:
+        """カウンターを増やして新しい値を返す。ttl_s はキー作成時にだけ付く"""
+        raise NotImplementedError
+
+    def size(self) -> int | None:
+        """保持しているキー数（分からなければ None）"""
+        return None
+
+
+# ------------------------------
+# プロセス内バックエンド
+# ------------------------------
+class InProcessState(SharedState):
+    """辞書 + 有効期限。max_entries を超えたら最も古く使われたキーから捨てる"""
+
+    def __init__(self, max_entries: int | None = None):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def _store(self, key: str, value, ttl_s: float | None) -> None:
+        expires_at = time.monotonic() + ttl_s if ttl_s else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            value = item[0]
+            # incr() のカウンターは Redis と同じく10進の bytes で返す
+            return str(value).encode() if isinstance(value, int) else value
+
+    def set(self, key, value, ttl_s=None):
+        with self._lock:
+            self._store(key, value, ttl_s)
+
+    def set_if_absent(self, key, value, ttl_s=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._store(key, value, ttl_s)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_if_equals(self, key, value):
+        with self._lock:
+            item = self._live(key)
+            if item is None or item[0] != value:
+                return False
+            del self._data[key]
+            return True
+
+    def incr(self, key, amount=1, ttl_s=None):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                self._store(key, amount, ttl_s)
+                return amount
+            value = item[0] + amount
+            self._data[key] = (value, item[1])
+            return value
+
+    def size(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# ------------------------------
+# Redis プロトコル
+# ------------------------------
+class RedisError(Exception):
+    """サーバーがエラー応答を返した"""
+
+
+def encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, (int, float)):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def read_reply(reader):
+    """RESP の応答を1つ読む（reader は makefile("rb") したソケット）"""
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        raise RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        count = int(rest)
+        if count < 0:
+            return None
+        return [read_reply(reader) for _ in range(count)]
+    raise RedisError(f"Unexpected reply: {line!r}")
+
+
+class _Connection:
+    def __init__(self, host: str, port: int, timeout_s: float, ssl_context: ssl.SSLContext | None = None):
+        sock = socket.create_connection((host, port), timeout=timeout_s)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if ssl_context is not None:
+            try:
+                sock = ssl_context.wrap_socket(sock, server_hostname=host)
+            except BaseException:
+                sock.close()
+                raise
+        self.sock = sock
+        self.reader = self.sock.makefile("rb")
+
+    def execute(self, args):
+        self.sock.sendall(encode_command(args))
+        return read_reply(self.reader)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisClient:
+    """スレッドセーフな最小の Redis クライアント（コネクションプール付き）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: str | None = None, timeout_s: float = 2.0, pool_size: int = 16,
+                 username: str | None = None, ssl_context: ssl.SSLContext | None = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.username = username
+        self.password = password
+        self.timeout_s = timeout_s
+        # None なら平文。TLS はサーバー証明書とホスト名を検証する
+        self.ssl_context = ssl_context
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisClient":
+        """redis://[[user]:password@]host[:port][/db]。rediss:// は TLS（既定のポートは同じ 6379）"""
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        if parsed.scheme == "rediss" and "ssl_context" not in kwargs:
+            kwargs["ssl_context"] = ssl.create_default_context()
+        return cls(parsed.hostname or "127.0.0.1", parsed.port or 6379, db,
+                   unquote(parsed.password) if parsed.password else None,
+                   username=unquote(parsed.username) if parsed.username else None, **kwargs)
+
+    def _connect(self) -> _Connection:
+        conn = _Connection(self.host, self.port, self.timeout_s, self.ssl_context)
+        if self.username and self.password:
+            # Redis 6 以降の ACL ユーザー
+            conn.execute(("AUTH", self.username, self.password))
+        elif self.password:
+            conn.execute(("AUTH", self.password))
+        if self.db:
+            conn.execute(("SELECT", self.db))
+        return conn
+
+    def execute(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+            pooled = True
+        except queue.Empty:
+            conn = self._connect()
+            pooled = False
+        try:
+            reply = conn.execute(args)
+        except RedisError:
+            self._release(conn)
+            raise
+        except (OSError, ConnectionError):
+            conn.close()
+            if not pooled:
+                raise
+            # プールで切れていた接続なら、張り直して1回だけ送り直す
+            conn = self._connect()
+            reply = conn.execute(args)
+        self._release(conn)
+        return reply
+
+    def _release(self, conn: _Connection) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+class RedisState(SharedState):
+    """Redis プロトコルのバックエンド。client は execute(*args) を持てばよい（FakeRedis も可）"""
+
+    shared = True
+
+    def __init__(self, client, prefix: str = ""):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def get(self, key):
+        return self.client.execute("GET", self._key(key))
+
+    def set(self, key, value, ttl_s=None):
+        if ttl_s:
+            self.client.execute("SET", self._key(key), value, "PX", int(ttl_s * 1000))
+        else:
+            self.client.execute("SET", self._key(key), value)
+
+    def set_if_absent(self, key, value, ttl_s=None):
+        args = ["SET", self._key(key), value, "NX"]
+        if ttl_s:
+            args += ["PX", int(ttl_s * 1000)]
+        return self.client.execute(*args) is not None
+
+    def delete(self, *keys):
+        if keys:
+            self.client.execute("DEL", *(self._key(k) for k in keys))
+
+    def delete_if_equals(self, key, value):
+        return bool(self.client.execute("EVAL", RELEASE_SCRIPT, 1, self._key(key), value))
+
+    def incr(self, key, amount=1, ttl_s=None):
+        return int(self.client.execute(
+            "EVAL", INCR_SCRIPT, 1, self._key(key), amount, int((ttl_s or 0) * 1000)))
+
+
+# ------------------------------
+# 共有状態の上に作る部品
+# ------------------------------
+class RateLimiter:
+    """固定ウィンドウのレートリミッター（1回の判定で INCR 1回）"""
+
+    def __init__(self, state: SharedState, name: str, limit: int, window_s: float):
+        self.state = state
+        self.name = name
+        self.limit = limit
+        self.window_s = window_s
+
+    def hit(self, key: str, cost: int = 1) -> tuple[bool, float]:
+        """(許可されたか, 次のウィンドウまでの秒数)"""
+        now = time.time()
+        window = int(now // self.window_s)
+        count = self.state.incr(
+            f"rl:{self.name}:{key}:{window}", cost, ttl_s=self.window_s + 1)
+        retry_after = (window + 1) * self.window_s - now
+        return count <= self.limit, retry_after
+
+    def blocked(self, key: str) -> float | None:
+        """今のウィンドウで上限に達していれば次のウィンドウまでの秒数（数えずに確認するだけ）"""
+        now = time.time()
+        window = int(now // self.window_s)
+        raw = self.state.get(f"rl:{self.name}:{key}:{window}")
+        if raw is None or int(raw) < self.limit:
+            return None
+        return (window + 1) * self.window_s - now
+
+
+class SingleFlight:
+    """
+    同じキーの処理を全ワーカーで1つだけ走らせるためのロック。
+    取れなかった側は wait() でロックの解放（= 先行処理の完了）を待ち、結果は呼び出し側が共有状態から読む。
+    """
+
+    def __init__(self, state: SharedState, name: str, lock_ttl_s: float = 30.0, poll_s: float = 0.05):
+        self.state = state
+        self.name = name
+        self.lock_ttl_s = lock_ttl_s
+        self.poll_s = poll_s
+
+    def _key(self, key: str) -> str:
+        return f"sf:{self.name}:{key}"
+
+    def try_acquire(self, key: str) -> bytes | None:
+        """ロックを取れたらトークンを返す（解放に使う）"""
+        token = uuid.uuid4().hex.encode()
+        if self.state.set_if_absent(self._key(key), token, self.lock_ttl_s):
+            return token
+        return None
+
+    def release(self, key: str, token: bytes) -> None:
+        self.state.delete_if_equals(self._key(key), token)
+
+    def is_held(self, key: str) -> bool:
+        return self.state.get(self._key(key)) is not None
+
+    def wait(self, key: str, timeout_s: float) -> bool:
+        """ロックが解放されるまで待つ。期限内に解放されれば True"""
+        deadline = time.monotonic() + timeout_s
+        while self.is_held(key):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_s)
+        return True
+
+    @contextmanager
+    def lock(self, key: str, timeout_s: float):
+        """ロックを取るまで待つ（取れなければ TimeoutError）"""
+        deadline = time.monotonic() + timeout_s
+        while True:
+            token = self.try_acquire(key)
+            if token is not None:
+                break
+            if not self.wait(key, deadline - time.monotonic()):
+                raise TimeoutError(f"Timed out waiting for lock {self._key(key)}")
+        try:
+            yield
+        finally:
+            self.release(key, token)
+
+
+# ------------------------------
+# バックエンドの選択
+# ------------------------------
+_default_state = None
+_default_lock = threading.Lock()
+
+
+def state_url() -> str:
+    return os.getenv("SHARED_STATE_URL") or "memory://"
+
+
+def create_state(max_entries: int | None = None) -> SharedState:
+    """
+    SHARED_STATE_URL に従ってバックエンドを作る。
+    memory:// のときは呼び出しごとに独立した（max_entries で上限を持つ）状態を返し、
+    Redis のときは同じサーバーを共有する（上限は Redis の maxmemory に任せる）。
+    """
+    url = state_url()
+    scheme = urlparse(url).scheme
+    prefix = os.getenv("SHARED_STATE_PREFIX", "recipe-ai:")
+    if scheme == "memory":
+        return InProcessState(max_entries)
+    if scheme in ("redis", "rediss"):
+        return RedisState(_redis_client(url), prefix)
+    if scheme == "fakeredis":
+        from src.fake_redis import shared_fake
+        return RedisState(shared_fake(), prefix)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+_clients = {}
+
+
+def _redis_client(url: str) -> RedisClient:
+    with _default_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = RedisClient.from_url(
+                url, timeout_s=float(os.getenv("SHARED_STATE_TIMEOUT_SECONDS", "2")))
+            _clients[url] = client
+        return client
+
+
+def get_state() -> SharedState:
+    """リミッターやロック用の共有状態（プロセス内で1つ）"""
+    global _default_state
+    if _default_state is None:
+        state = create_state()
+        with _default_lock:
+            if _default_state is None:
+                _default_state = state
+    return _default_state
@@ -0,0 +1,459 @@
+"""
+類似レシピ検索（GET /api/recipe/recipe/{id}/similar）。
+
+recipe_embeddings の正規化済みベクトルを NumPy の行列（float16 / int8）としてメモリに持ち、
+内積（= コサイン類似度）で top-k を求める。
+- 複数のクエリはまとめて1回の行列積で計算し、行列は SIMILAR_BLOCK_ROWS 行ずつ float32 に変換する
+  （一時メモリを抑えつつ BLAS を使う）
+- 各ワーカーは SIMILAR_REFRESH_SECONDS ごとに、前回以降に更新された埋め込みと
+  削除されたレシピだけを DB から取り込む（全件の読み直しはしない）
+- インデックスは SIMILAR_INDEX_DIR に .npy で保存し、起動時は memory-map で開いてから差分だけを取り込む。
+  保存は manifest.json の置き換えで切り替えるので、複数のワーカーが保存しても壊れない
+
+    python -m src.similar backfill     # 埋め込みが無い・方式が古いレシピを計算する（再開可能）
+    python -m src.similar build        # DB からインデックスを作って保存する
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import embeddings, integrations, metrics
+from src.db_models import Recipe, RecipeEmbedding
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.getenv("SIMILAR_INDEX_DIR") or os.path.join(BASE_DIR, "similar_index")
+REFRESH_SECONDS = float(os.getenv("SIMILAR_REFRESH_SECONDS", "2"))
+SAVE_SECONDS = float(os.getenv("SIMILAR_SAVE_SECONDS", "300"))
+BLOCK_ROWS = int(os.getenv("SIMILAR_BLOCK_ROWS", "65536"))
+# 遅れてコミットされた行を取りこぼさないよう、前回の取り込み時刻より少し前から読み直す
+REFRESH_LOOKBACK = timedelta(seconds=float(os.getenv("SIMILAR_REFRESH_LOOKBACK_SECONDS", "60")))
+MANIFEST = "manifest.json"
+
+
+class VectorIndex:
+    """
+    recipe_id -> 正規化済みベクトル の行列。追加・更新・削除は1行単位で行う。
+    量子化でずれたノルムは行ごとの逆数（float32）で補正するので、検索時に行列を正規化し直さない
+    """
+
+    def __init__(self, dim: int, dtype: str = embeddings.DTYPE, capacity: int = 1024):
+        np = integrations.get_numpy()
+        self.dim = dim
+        self.dtype = dtype
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, dim), dtype=np.dtype(dtype))
+        self.inv_norms = np.zeros(capacity, dtype=np.float32)
+        self.size = 0
+        self._rows: dict[int, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, recipe_id: int) -> bool:
+        return recipe_id in self._rows
+
+    @staticmethod
+    def _inv_norms(vectors):
+        np = integrations.get_numpy()
+        norms = np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=-1)
+        return 1.0 / np.where(norms == 0, 1.0, norms)
+
+    # ---------- 更新 ----------
+    def _ensure_writable(self, capacity: int) -> None:
+        """memory-map（読み取り専用）や容量不足の配列をメモリ上の配列に置き換える"""
+        np = integrations.get_numpy()
+        if self.vectors.flags.writeable and len(self.ids) >= capacity:
+            return
+        new_capacity = max(capacity, len(self.ids) * 2, 1024)
+        ids = np.zeros(new_capacity, dtype=np.int64)
+        vectors = np.zeros((new_capacity, self.dim), dtype=self.vectors.dtype)
+        inv_norms = np.zeros(new_capacity, dtype=np.float32)
+        ids[:self.size] = self.ids[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        inv_norms[:self.size] = self.inv_norms[:self.size]
+        self.ids, self.vectors, self.inv_norms = ids, vectors, inv_norms
+
+    def upsert(self, recipe_ids, vectors) -> None:
+        """vectors は保存用の dtype に量子化済みの行列"""
+        inv_norms = self._inv_norms(vectors)
+        with self._lock:
+            self._ensure_writable(self.size + len(recipe_ids))
+            for recipe_id, vector, inv_norm in zip(recipe_ids, vectors, inv_norms):
+                row = self._rows.get(recipe_id)
+                if row is None:
+                    row = self.size
+                    self.size += 1
+                    self._rows[recipe_id] = row
+                    self.ids[row] = recipe_id
+                self.vectors[row] = vector
+                self.inv_norms[row] = inv_norm
+
+    def remove(self, recipe_ids) -> None:
+        """末尾の行を空いた位置に移して詰める"""
+        with self._lock:
+            targets = [rid for rid in recipe_ids if rid in self._rows]
+            if not targets:
+                return
+            self._ensure_writable(self.size)
+            for recipe_id in targets:
+                row = self._rows.pop(recipe_id)
+                last = self.size - 1
+                if row != last:
+                    moved = int(self.ids[last])
+                    self.ids[row] = moved
+                    self.vectors[row] = self.vectors[last]
+                    self.inv_norms[row] = self.inv_norms[last]
+                    self._rows[moved] = row
+                self.size -= 1
+
+    def get(self, recipe_id: int):
+        with self._lock:
+            row = self._rows.get(recipe_id)
+            return None if row is None else self.vectors[row].copy()
+
+    # ---------- 検索 ----------
+    def search(self, queries, k: int = 10, exclude=None) -> list[list[tuple[int, float]]]:
+        """
+        queries（量子化済みでも float32 でもよい行列）それぞれについて、
+        類似度の高い順に (recipe_id, score) を最大 k 件返す。exclude[i] の ID は除く
+        """
+        np = integrations.get_numpy()
+        queries = embeddings.normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        exclude = exclude or [()] * len(queries)
+        # 除外するIDのぶん余分に取る
+        want = k + max((len(e) for e in exclude), default=0)
+        with self._lock:
+            size = self.size
+            best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+            for start in range(0, size, BLOCK_ROWS):
+                stop = min(size, start + BLOCK_ROWS)
+                block = self.vectors[start:stop].astype(np.float32)
+                scores = (queries @ block.T) * self.inv_norms[start:stop]
+                take = min(want, scores.shape[1])
+                top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+                best_scores = np.concatenate(
+                    [best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                best_rows = np.concatenate([best_rows, top + start], axis=1)
+                if best_scores.shape[1] > want:
+                    keep = np.argpartition(-best_scores, want - 1, axis=1)[:, :want]
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                    best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            result_ids = self.ids[best_rows]
+
+        results = []
+        for i in range(len(queries)):
+            order = np.argsort(-best_scores[i])
+            skip = set(exclude[i])
+            hits = []
+            for j in order:
+                recipe_id = int(result_ids[i, j])
+                if recipe_id in skip:
+                    continue
+                hits.append((recipe_id, float(best_scores[i, j])))
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    # ---------- 保存・読み込み ----------
+    def save(self, directory: str, meta: dict) -> None:
+        np = integrations.get_numpy()
+        os.makedirs(directory, exist_ok=True)
+        generation = f"{time.time_ns()}-{os.getpid()}"
+        with self._lock:
+            np.save(os.path.join(directory, f"ids-{generation}.npy"), self.ids[:self.size])
+            np.save(os.path.join(directory, f"vectors-{generation}.npy"), self.vectors[:self.size])
+        manifest = {"generation": generation, "dim": self.dim, "dtype": self.dtype, **meta}
+        tmp = os.path.join(directory, f"{MANIFEST}.{generation}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(directory, MANIFEST))
+        _remove_old_generations(directory, generation)
+
+    @classmethod
+    def load(cls, directory: str) -> tuple["VectorIndex", dict] | None:
+        """保存済みのインデックスを memory-map で開く（最初の更新時にメモリへコピーする）"""
+        np = integrations.get_numpy()
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+            generation = manifest["generation"]
+            ids = np.load(os.path.join(directory, f"ids-{generation}.npy"))
+            vectors = np.load(os.path.join(directory, f"vectors-{generation}.npy"), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+        index = cls(manifest["dim"], manifest["dtype"], capacity=1)
+        index.ids = ids
+        index.vectors = vectors
+        index.inv_norms = np.concatenate([
+            cls._inv_norms(vectors[start:start + BLOCK_ROWS]).astype(np.float32)
+            for start in range(0, len(ids), BLOCK_ROWS)
+        ] or [np.zeros(0, dtype=np.float32)])
+        index.size = len(ids)
+        index._rows = {int(recipe_id): row for row, recipe_id in enumerate(ids.tolist())}
+        return index, manifest
+
+
+def _remove_old_generations(directory: str, keep: str) -> None:
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and keep not in name:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                # 他のワーカーが開いている・先に消した
+                pass
+
+
+# ------------------------------
+# DB との同期
+# ------------------------------
+class SimilarIndex:
+    """プロセスで1つのインデックス。DB の更新を差分で取り込み、定期的に保存する"""
+
+    def __init__(self, session_factory, directory: str = INDEX_DIR):
+        self.session_factory = session_factory
+        self.directory = directory
+        self.embedder = embeddings.get_embedder()
+        self.index = None
+        self.synced_at = None       # 最後に取り込んだ時点（DB の updated_at / deleted_at 基準）
+        self.checked_at = 0.0
+        self.saved_at = time.monotonic()
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def _load_or_create(self) -> None:
+        loaded = VectorIndex.load(self.directory)
+        if loaded is not None:
+            index, manifest = loaded
+            if (manifest.get("model") == self.embedder.name
+                    and manifest.get("dtype") == embeddings.DTYPE):
+                self.index = index
+                self.synced_at = datetime.fromisoformat(manifest["synced_at"])
+                logger.info("similar index loaded", extra={"recipes": len(index)})
+                return
+        self.index = VectorIndex(self.embedder.dim)
+        self.synced_at = None
+
+    def refresh(self, force: bool = False) -> int:
+        """前回以降に更新・削除された分を取り込み、取り込んだ件数を返す"""
+        if not force and time.monotonic() - self.checked_at < REFRESH_SECONDS and self.index is not None:
+            return 0
+        with self._lock:
+            if not force and time.monotonic() - self.checked_at < REFRESH_SECONDS and self.index is not None:
+                return 0
+            if self.index is None:
+                self._load_or_create()
+            since = self.synced_at - REFRESH_LOOKBACK if self.synced_at else None
+            now = datetime.utcnow()
+            db = self.session_factory()
+            try:
+                changed = self._apply_updates(db, since) + self._apply_deletes(db, since)
+            finally:
+                db.close()
+            self.synced_at = now
+            self.checked_at = time.monotonic()
+            if changed:
+                self.dirty = True
+                metrics.similar_index_updates.inc(amount=changed)
+            if self.dirty and time.monotonic() - self.saved_at >= SAVE_SECONDS:
+                self.save()
+            return changed
+
+    def _apply_updates(self, db: Session, since) -> int:
+        np = integrations.get_numpy()
+        stmt = (
+            select(RecipeEmbedding.recipe_id, RecipeEmbedding.vector)
+            .join(Recipe, Recipe.id == RecipeEmbedding.recipe_id)
+            .where(
+                RecipeEmbedding.model == self.embedder.name,
+                RecipeEmbedding.dtype == embeddings.DTYPE,
+                Recipe.deleted_at.is_(None),
+            )
+            .execution_options(yield_per=5000)
+        )
+        if since is not None:
+            stmt = stmt.where(RecipeEmbedding.updated_at >= since)
+        count = 0
+        for rows in db.execute(stmt).partitions():
+            vectors = np.frombuffer(
+                b"".join(row.vector for row in rows), dtype=np.dtype(embeddings.DTYPE)
+            ).reshape(len(rows), self.index.dim)
+            self.index.upsert([row.recipe_id for row in rows], vectors)
+            count += len(rows)
+        return count
+
+    def _apply_deletes(self, db: Session, since) -> int:
+        if since is None:
+            # 全件を読み込んだ直後は削除済みを含まない
+            return 0
+        deleted = list(db.execute(
+            select(Recipe.id).where(Recipe.deleted_at >= since)
+        ).scalars())
+        self.index.remove(deleted)
+        return len(deleted)
+
+    def warmup(self) -> threading.Thread:
+        """保存済みのインデックスを開き、差分の取り込みをバックグラウンドで行う"""
+
+        def run():
+            try:
+                self.refresh(force=True)
+            except Exception:
+                logger.exception("similar index warmup failed")
+
+        thread = threading.Thread(target=run, name="similar-index-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        """未保存の更新があれば保存する（シャットダウン時）"""
+        with self._lock:
+            if self.index is not None and self.dirty:
+                self.save()
+
+    def save(self) -> None:
+        self.index.save(self.directory, {
+            "model": self.embedder.name,
+            "synced_at": self.synced_at.isoformat(),
+        })
+        self.saved_at = time.monotonic()
+        self.dirty = False
+
+    def query_vector(self, db: Session, recipe_id: int):
+        """インデックス → DB → その場で計算 の順にクエリのベクトルを得る"""
+        vector = self.index.get(recipe_id)
+        if vector is not None:
+            return vector
+        row = db.execute(
+            select(RecipeEmbedding.vector, RecipeEmbedding.model, RecipeEmbedding.dtype)
+            .where(RecipeEmbedding.recipe_id == recipe_id)
+        ).first()
+        if row is not None and row.model == self.embedder.name:
+            return embeddings.decode(row.vector, row.dtype)
+        recipe = Recipe.get_recipe_by_recipe_id(db, recipe_id)
+        if recipe is None:
+            return None
+        return self.embedder.embed([embeddings.recipe_text(
+            recipe.title, recipe.markdown_content, recipe.content_format)])[0]
+
+    def similar(self, db: Session, recipe_ids: list[int], k: int = 10) -> list[list[dict]]:
+        """複数のレシピの類似レシピをまとめて求める（行列積1回）"""
+        self.refresh()
+        vectors = [self.query_vector(db, recipe_id) for recipe_id in recipe_ids]
+        known = [i for i, vector in enumerate(vectors) if vector is not None]
+        results = [[] for _ in recipe_ids]
+        if not known or not len(self.index):
+            return results
+        np = integrations.get_numpy()
+        start = time.perf_counter()
+        hits = self.index.search(
+            np.stack([vectors[i] for i in known]), k,
+            exclude=[(recipe_ids[i],) for i in known])
+        metrics.similar_search_duration.observe(time.perf_counter() - start)
+
+        titles = dict(db.execute(
+            select(Recipe.id, Recipe.title).where(
+                Recipe.id.in_({rid for row in hits for rid, _ in row}),
+                Recipe.deleted_at.is_(None))
+        ).all())
+        for i, row in zip(known, hits):
+            results[i] = [
+                {"id": rid, "title": titles[rid], "score": round(min(score, 1.0), 4)}
+                for rid, score in row if rid in titles
+            ]
+        return results
+
+
+_similar_index = None
+_instance_lock = threading.Lock()
+
+
+def get_index(session_factory=None) -> SimilarIndex:
+    global _similar_index
+    if _similar_index is None:
+        with _instance_lock:
+            if _similar_index is None:
+                if session_factory is None:
+                    from src.get_conn import SessionLocal as session_factory
+                _similar_index = SimilarIndex(session_factory)
+    return _similar_index
+
+
+# ------------------------------
+# 埋め込みの一括計算
+# ------------------------------
+def backfill(session_factory, batch_size: int = 500, log=print) -> int:
+    """埋め込みが無い・方式が違うレシピを ID 順にバッチで計算する（1バッチ1コミット）"""
+    embedder = embeddings.get_embedder()
+    last_id = 0
+    total = 0
+    while True:
+        db = session_factory()
+        try:
+            recipes = db.execute(
+                select(Recipe.id, Recipe.title, Recipe.markdown_content, Recipe.content_format)
+                .outerjoin(RecipeEmbedding, RecipeEmbedding.recipe_id == Recipe.id)
+                .where(
+                    Recipe.id > last_id,
+                    Recipe.deleted_at.is_(None),
+                    (RecipeEmbedding.recipe_id.is_(None))
+                    | (RecipeEmbedding.model != embedder.name)
+                    | (RecipeEmbedding.dtype != embeddings.DTYPE),
+                )
+                .order_by(Recipe.id)
+                .limit(batch_size)
+            ).all()
+            if not recipes:
+                break
+            vectors = embedder.embed([
+                embeddings.recipe_text(r.title, r.markdown_content, r.content_format)
+                for r in recipes])
+            quantized = embeddings.quantize(vectors)
+            now = datetime.utcnow()
+            for recipe, vector in zip(recipes, quantized):
+                db.merge(RecipeEmbedding(
+                    recipe_id=recipe.id, model=embedder.name, dtype=embeddings.DTYPE,
+                    vector=vector.tobytes(), updated_at=now))
+            db.commit()
+            last_id = recipes[-1].id
+            total += len(recipes)
+            log(f"  embedded {total} recipes (last id {last_id})")
+        finally:
+            db.close()
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain recipe embeddings and the similar-recipe index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_backfill = sub.add_parser("backfill")
+    p_backfill.add_argument("--batch-size", type=int, default=500)
+    sub.add_parser("build")
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+    if args.command == "backfill":
+        print(f"Embedded {backfill(SessionLocal, args.batch_size)} recipes")
+        return
+    index = SimilarIndex(SessionLocal)
+    index.index = VectorIndex(index.embedder.dim)
+    index.refresh(force=True)
+    index.save()
+    print(f"Saved {len(index.index)} vectors to {index.directory}")
+
+
+if __name__ == "__main__":
+    main()
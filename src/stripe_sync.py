@@ -0,0 +1,278 @@
+"""
+subscriptions と Stripe の突き合わせ。
+
+Webhook を取りこぼすと subscriptions の状態・Price ID が Stripe とずれたままになる（Webhook の処理は
+イベントごとに1行ずつ）。このジョブは Stripe の subscription 一覧（status=all）をページ単位で読み、
+- ページ内の ID で subscriptions を1回の SELECT で読み、stripe_subscription_id をキーにした dict で比べる
+- 違う行だけをページごとに1回の UPDATE（executemany）で直す。有効 ⇔ 終了 の切り替わりは
+  Webhook と同じく end_date と日次集計に反映する
+- 進み具合（最後に処理した ID と集計）は sync_checkpoints に同じトランザクションで保存するので、
+  途中で止まっても次の実行はその続きから再開する（--restart で最初から）
+- Stripe にあって subscriptions に無いもの（checkout.session.completed の取りこぼし）は
+  ユーザーを特定できないので作らず、件数と ID を集計に残す
+
+Stripe の一覧を読んでから書き込むまでに Webhook が届いた行は古い状態に戻ることがあるが、次の回で直る。
+
+    python -m src.stripe_sync reconcile            # 前回の続きから（終わっていれば最初から）
+    python -m src.stripe_sync reconcile --dry-run  # 違いを数えるだけ
+    python -m src.stripe_sync status
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src import integrations, metrics, resilience
+from src.api.payments.index import stripe_failures, subscription_price_id
+from src.db_models import DailyStat, Subscription, SyncCheckpoint
+from src.shared_state import SingleFlight, get_state
+
+# .env をロード
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = "stripe-subscriptions"
+# 1ページの件数（Stripe の上限は 100）
+PAGE_SIZE = int(os.getenv("STRIPE_RECONCILE_PAGE_SIZE", "100"))
+INTERVAL_SECONDS = float(os.getenv("STRIPE_RECONCILE_INTERVAL_SECONDS", "21600"))
+# 1回の実行の上限（超えたらチェックポイントを残して次の回に続ける）
+MAX_RUN_SECONDS = float(os.getenv("STRIPE_RECONCILE_MAX_RUN_SECONDS", "300"))
+# 集計に残す「Stripe にだけある ID」の数
+MISSING_SAMPLE = 20
+
+
+def _list_page(starting_after: str | None, limit: int):
+    stripe = integrations.get_stripe()
+    params = {"status": "all", "limit": limit}
+    if starting_after:
+        params["starting_after"] = starting_after
+
+    def attempt(timeout: float):
+        with integrations.stripe_timeout(timeout):
+            return stripe.Subscription.list(**params)
+
+    # 読み取りだけなのでリトライしてよい
+    return resilience.call(
+        "stripe",
+        attempt,
+        deadline_s=float(os.getenv("STRIPE_DEADLINE_SECONDS", "20")),
+        idempotent=True,
+        failure_on=stripe_failures(),
+    )
+
+
+def _new_stats() -> dict:
+    return {"pages": 0, "checked": 0, "updated": 0, "status_changed": 0, "price_changed": 0,
+            "started": 0, "ended": 0, "missing": 0, "missing_ids": []}
+
+
+def diff(remote: list, local: dict, now: datetime | None = None) -> tuple[list[dict], dict]:
+    """
+    Stripe のページ（remote）と、stripe_subscription_id をキーにした行（local）を比べ、
+    UPDATE のパラメーターと件数を返す
+    """
+    now = now or datetime.utcnow()
+    changes = []
+    counts = {"status_changed": 0, "price_changed": 0, "started": 0, "ended": 0, "missing_ids": []}
+    for item in remote:
+        row = local.get(item["id"])
+        if row is None:
+            counts["missing_ids"].append(item["id"])
+            continue
+        status = item["status"]
+        price_id = subscription_price_id(item) or row.stripe_price_id
+        end_date, changed = Subscription.transition(row.end_date, status, now)
+        if status == row.status and price_id == row.stripe_price_id and end_date == row.end_date:
+            continue
+        changes.append({"id": row.id, "status": status,
+                        "stripe_price_id": price_id, "end_date": end_date})
+        counts["status_changed"] += status != row.status
+        counts["price_changed"] += price_id != row.stripe_price_id
+        if changed:
+            counts[changed] += 1
+    return changes, counts
+
+
+def _apply_page(db: Session, remote: list, stats: dict, dry_run: bool) -> None:
+    ids = [item["id"] for item in remote]
+    local = {
+        row.stripe_subscription_id: row
+        for row in db.execute(
+            select(Subscription.id, Subscription.stripe_subscription_id, Subscription.status,
+                   Subscription.stripe_price_id, Subscription.end_date)
+            .where(Subscription.stripe_subscription_id.in_(ids))
+        )
+    }
+    changes, counts = diff(remote, local)
+    if changes and not dry_run:
+        # 主キーごとの UPDATE を1回の executemany で送る
+        db.execute(update(Subscription), changes)
+        if counts["started"] or counts["ended"]:
+            DailyStat.add(db, subscriptions_started=counts["started"],
+                          subscriptions_ended=counts["ended"])
+
+    missing = counts.pop("missing_ids")
+    stats["pages"] += 1
+    stats["checked"] += len(remote)
+    stats["updated"] += len(changes)
+    stats["missing"] += len(missing)
+    stats["missing_ids"] = (stats["missing_ids"] + missing)[:MISSING_SAMPLE]
+    for key, value in counts.items():
+        stats[key] += value
+    metrics.stripe_reconcile_changes.inc("status", amount=counts["status_changed"])
+    metrics.stripe_reconcile_changes.inc("price", amount=counts["price_changed"])
+    metrics.stripe_reconcile_changes.inc("missing", amount=len(missing))
+
+
+def reconcile(db: Session, restart: bool = False, dry_run: bool = False,
+              page_size: int = PAGE_SIZE, max_seconds: float | None = None,
+              max_pages: int | None = None) -> dict:
+    """
+    Stripe の一覧を最後まで（または max_seconds / max_pages まで）突き合わせ、集計を返す。
+    completed が False なら、次の呼び出しは保存した cursor の続きから始まる
+    """
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    checkpoint = None if dry_run else SyncCheckpoint.load(db, CHECKPOINT_NAME)
+    resumed = checkpoint is not None and checkpoint.completed_at is None and not restart
+    if resumed:
+        cursor = checkpoint.cursor
+        stats = {**_new_stats(), **json.loads(checkpoint.stats)}
+    else:
+        cursor = None
+        stats = _new_stats()
+        if not dry_run:
+            checkpoint = SyncCheckpoint.begin(db, CHECKPOINT_NAME)
+            db.commit()
+
+    stripe = integrations.get_stripe()
+    pages = 0
+    completed = False
+    while True:
+        if (deadline is not None and time.monotonic() >= deadline) or \
+                (max_pages is not None and pages >= max_pages):
+            break
+        try:
+            page = _list_page(cursor, page_size)
+        except stripe.InvalidRequestError:
+            if cursor is None:
+                raise
+            # 続きの起点の subscription が Stripe から消えていれば最初からやり直す
+            logger.warning("reconcile cursor is no longer valid, restarting",
+                           extra={"cursor": cursor})
+            cursor = None
+            stats = _new_stats()
+            continue
+        remote = list(page.data)
+        if remote:
+            _apply_page(db, remote, stats, dry_run)
+            cursor = remote[-1]["id"]
+        pages += 1
+        metrics.stripe_reconcile_pages.inc()
+        completed = not page.has_more or not remote
+        if not dry_run:
+            # 更新とチェックポイントを同じトランザクションでコミットする
+            checkpoint.advance(cursor, stats, completed=completed)
+            db.commit()
+        if completed:
+            break
+    return {**stats, "resumed": resumed, "completed": completed, "dry_run": dry_run}
+
+
+def status(db: Session) -> dict | None:
+    checkpoint = SyncCheckpoint.load(db, CHECKPOINT_NAME)
+    if checkpoint is None:
+        return None
+    return {
+        "cursor": checkpoint.cursor,
+        "started_at": checkpoint.started_at.isoformat(),
+        "updated_at": checkpoint.updated_at.isoformat(),
+        "completed_at": checkpoint.completed_at.isoformat() if checkpoint.completed_at else None,
+        "stats": json.loads(checkpoint.stats),
+    }
+
+
+class ReconcileWorker:
+    """一定間隔で reconcile() を回すスレッド。複数ワーカーでは共有ロックで1つだけが実行する"""
+
+    def __init__(self, session_factory, interval_s: float = INTERVAL_SECONDS,
+                 max_seconds: float = MAX_RUN_SECONDS):
+        self.session_factory = session_factory
+        self.interval_s = interval_s
+        self.max_seconds = max_seconds
+        self.flight = SingleFlight(get_state(), "stripe-reconcile", lock_ttl_s=max_seconds + 60)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> dict | None:
+        """ロックを取れたら1回実行する（他で実行中なら None）"""
+        token = self.flight.try_acquire("subscriptions")
+        if token is None:
+            return None
+        db = self.session_factory()
+        try:
+            result = reconcile(db, max_seconds=self.max_seconds)
+            if result["updated"] or result["missing"] or not result["completed"]:
+                logger.info("reconciled subscriptions with Stripe", extra=result)
+            return result
+        except (resilience.CircuitOpenError, resilience.DeadlineExceeded) as e:
+            # チェックポイントは最後にコミットしたページのまま残るので、次の回で続きから再開する
+            db.rollback()
+            logger.warning("stopped subscription reconciliation: %s", e)
+            return None
+        finally:
+            db.close()
+            self.flight.release("subscriptions", token)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("subscription reconciliation failed")
+
+    def start(self) -> "ReconcileWorker":
+        self._thread = threading.Thread(target=self._run, name="stripe-reconcile", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reconcile subscriptions with Stripe.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("reconcile")
+    p_run.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    p_run.add_argument("--dry-run", action="store_true", help="count differences without writing")
+    p_run.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    p_run.add_argument("--max-seconds", type=float)
+    sub.add_parser("status")
+    args = parser.parse_args()
+
+    from src.get_conn import SessionLocal
+    from src.logging_config import setup_logging
+    setup_logging()
+
+    db = SessionLocal()
+    try:
+        if args.command == "reconcile":
+            result = reconcile(db, restart=args.restart, dry_run=args.dry_run,
+                               page_size=args.page_size, max_seconds=args.max_seconds)
+        else:
+            result = status(db)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
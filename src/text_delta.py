@@ -0,0 +1,45 @@
+"""
+行単位の差分（レシピの編集履歴用）。
+
+差分は旧テキストを先頭から読み進める命令の列で、JSON で保存する。
+- 正の整数 n: 旧テキストの n 行をそのまま使う
+- 負の整数 -n: 旧テキストの n 行を捨てる
+- 文字列の配列: 新しい行を挿入する
+
+変わらない行は行数だけを持つので、差分の大きさは変更箇所の大きさに比例する。
+"""
+import json
+from difflib import SequenceMatcher
+
+
+def make_delta(old: str, new: str) -> str:
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(new_lines[j1:j2])
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def apply_delta(old: str, delta: str) -> str:
+    old_lines = old.splitlines(keepends=True)
+    out = []
+    pos = 0
+    for op in json.loads(delta):
+        if isinstance(op, list):
+            out.extend(op)
+        elif op >= 0:
+            out.extend(old_lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    if pos != len(old_lines):
+        raise ValueError("Delta does not match the base text")
+    return "".join(out)
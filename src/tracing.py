@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace
+except ImportError:  # OpenTelemetry は任意依存（未インストールならスパンは何もしない）
+    trace = None
+
+_tracer = trace.get_tracer("recipe-ai-app") if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    OpenTelemetry のスパンを開始する。
+    エクスポーターの設定（SDK / OTLP など）はアプリ外の opentelemetry-instrument 等に任せる。
+    """
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name) as current:
+        for key, value in attributes.items():
+            if value is not None:
+                current.set_attribute(key, value)
+        yield current
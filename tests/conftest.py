@@ -0,0 +1,74 @@
+"""
+テスト共通の設定。
+
+src の各モジュールは import 時に環境変数を読むので、テストモジュールを読み込む前に
+一時ディレクトリの SQLite とモックサーバー（bench/mock_servers.py）に向けておく。
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from bench.mock_servers import MockServers
+
+TMP_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+MOCK_SERVERS = MockServers().start()
+
+os.environ.update(MOCK_SERVERS.app_env())
+os.environ.update({
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "DATABASE_URL": f"sqlite:///{os.path.join(TMP_DIR, 'app.db')}",
+    "LOG_LEVEL": "WARNING",
+    "SIMILAR_INDEX_DIR": os.path.join(TMP_DIR, "similar_index"),
+    "IMAGE_STORE_DIR": os.path.join(TMP_DIR, "image_store"),
+    "RECIPE_PURGE_WORKER": "false",
+    "IMAGE_VARIANT_EVICT_WORKER": "false",
+})
+# 共有状態はプロセス内（Redis のバックエンドは tests/test_shared_state.py で fake_redis を使う）
+os.environ.pop("SHARED_STATE_URL", None)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    from src import image_variants
+    image_variants.shutdown(wait=True)
+    MOCK_SERVERS.stop()
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def mock_servers():
+    return MOCK_SERVERS
+
+
+@pytest.fixture
+def stripe_subscriptions(mock_servers):
+    """モックの Stripe の subscription 一覧（前後で空にする）"""
+    state = mock_servers.stripe_state
+    with state.lock:
+        state.subscriptions.clear()
+    yield state
+    with state.lock:
+        state.subscriptions.clear()
+
+
+@pytest.fixture
+def client():
+    """アプリのテストクライアント（lifespan のワーカーは起動しない）"""
+    from fastapi.testclient import TestClient
+    from src.main import app
+    return TestClient(app)
+
+
+@pytest.fixture
+def login(client):
+    """bench.datasets の初期データのユーザーでログインし、Authorization ヘッダーを返す"""
+    from bench.datasets import BENCH_PASSWORD
+
+    def _login(email: str) -> dict:
+        response = client.post("/api/auth/token", data={"username": email, "password": BENCH_PASSWORD})
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return _login
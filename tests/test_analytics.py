@@ -0,0 +1,47 @@
+"""日次集計の作り直し（src/analytics.py の rebuild）"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, update
+
+from bench.datasets import Scale, recipe_ids_of, seed
+
+SCALE = Scale(users=3, recipes_per_user=10)
+
+
+@pytest.fixture
+def db():
+    from src.get_conn import SessionLocal, engine
+    seed(engine, SCALE)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def _counts(db, name: str) -> dict:
+    from src.db_models import DailyStat
+    db.expire_all()
+    return {day: count for day, count in db.execute(select(DailyStat.day, getattr(DailyStat, name))) if count}
+
+
+def test_rebuild_keeps_counts_of_purged_recipes(db):
+    from src import analytics, purge
+    from src.db_models import DailyStat, Recipe
+    from src.get_conn import SessionLocal
+    analytics.rebuild(db)
+    created = _counts(db, "recipes_created")
+    assert sum(created.values()) == SCALE.users * SCALE.recipes_per_user
+
+    Recipe.delete_recipes(db, list(recipe_ids_of(SCALE, 0))[:2])
+    assert purge.purge(SessionLocal, grace_s=0) == 2
+    # 物理削除した行は元のテーブルに無いが、作成数・削除数は減らさない
+    assert analytics.rebuild(db) >= len(created)
+    assert _counts(db, "recipes_created") == created
+    assert _counts(db, "recipes_deleted") == {datetime.utcnow().date(): 2}
+
+    # 元のテーブルより小さい値は作り直しで補正する
+    day = max(created)
+    db.execute(update(DailyStat).where(DailyStat.day == day).values(recipes_created=0))
+    db.commit()
+    analytics.rebuild(db, since=day)
+    assert _counts(db, "recipes_created") == created
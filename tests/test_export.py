@@ -0,0 +1,114 @@
+"""レシピのエクスポート（src/export.py）。画像はモックの画像サーバーとローカル保存から取得する"""
+import io
+import zipfile
+
+import orjson
+import pytest
+from sqlalchemy import text
+
+from bench.datasets import Scale, recipe_ids_of, seed, user_email
+from bench.mock_servers import PNG_BYTES
+
+SCALE = Scale(users=2, recipes_per_user=5)
+URL = "/api/recipe/export"
+
+
+@pytest.fixture
+def recipes(mock_servers):
+    """
+    user0 のレシピを返す。画像は先頭から順に
+    モックの画像サーバー・モックで 404・ローカル保存・ローカルに無いファイル・モックの画像サーバー
+    """
+    from src import image_store
+    from src.get_conn import engine
+    seed(engine, SCALE)
+    ids = list(recipe_ids_of(SCALE, 0))
+    urls = [
+        f"{mock_servers.image_url}/images/1.png",
+        f"{mock_servers.image_url}/missing.png",
+        image_store.url_for(image_store.store_bytes(b"local image", "image/webp")),
+        image_store.url_for("0" * 64 + ".png"),
+        f"{mock_servers.image_url}/images/2.jpg",
+    ]
+    with engine.begin() as conn:
+        for recipe_id, url in zip(ids, urls):
+            conn.execute(text("UPDATE images SET image_url = :url WHERE recipe_id = :id"),
+                         {"url": url, "id": recipe_id})
+        # 他のユーザーの画像は取得しない
+        conn.execute(text("UPDATE images SET image_url = 'http://127.0.0.1:9/unused.png' "
+                          "WHERE recipe_id NOT IN ({})".format(",".join(map(str, ids)))))
+    return ids
+
+
+def _lines(response) -> list[dict]:
+    return [orjson.loads(line) for line in response.content.splitlines()]
+
+
+def test_ndjson_exports_own_recipes_in_id_order(client, login, recipes, mock_servers):
+    headers = login(user_email(0))
+    assert client.delete(f"/api/recipe/recipe/{recipes[1]}", headers=headers).status_code == 200
+
+    response = client.get(URL, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"].endswith('.ndjson"')
+    lines = _lines(response)
+    # 削除したレシピと他のユーザーのレシピは含まない
+    assert [line["id"] for line in lines] == [recipes[0]] + recipes[2:]
+    first = client.get(f"/api/recipe/recipe/{recipes[0]}", headers=headers).json()
+    assert (lines[0]["title"], lines[0]["markdown_content"]) == (first["title"], first["markdown_content"])
+    # ndjson の画像は URL のみ
+    assert [image["image_url"] for image in lines[0]["images"]] == [f"{mock_servers.image_url}/images/1.png"]
+
+
+def test_ndjson_resumes_after_id(client, login, recipes):
+    headers = login(user_email(0))
+    full = client.get(URL, headers=headers).content
+    # 3件目の途中で切れたダウンロード: 不完全な行を捨て、受け取れた最後の ID から再開する
+    cut = full[:full.index(b"\n", full.index(b"\n") + 1) + 20]
+    received = cut.splitlines(keepends=True)[:-1]
+    last_id = orjson.loads(received[-1])["id"]
+
+    response = client.get(URL, params={"after_id": last_id}, headers=headers)
+    assert f"-after-{last_id}.ndjson" in response.headers["content-disposition"]
+    assert [line["id"] for line in _lines(response)] == recipes[2:]
+    assert b"".join(received) + response.content == full
+
+
+def test_zip_streams_images_and_lists_missing_ones(client, login, recipes):
+    headers = login(user_email(0))
+    response = client.get(URL, params={"format": "zip"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+
+    names = archive.namelist()
+    markdown = [name for name in names if name.startswith("recipes/")]
+    assert len(markdown) == len(recipes) and all(name.endswith(".md") for name in markdown)
+    images = sorted(name for name in names if name.startswith("images/"))
+    assert [name.split("-")[0] for name in images] == [
+        f"images/{recipes[i]:08d}" for i in (0, 2, 4)]
+    assert images[0].endswith(".png") and images[2].endswith(".jpg")
+    assert archive.read(images[0]) == PNG_BYTES
+    assert archive.read(images[1]) == b"local image"
+    # 画像はそのまま（無圧縮で）格納する
+    assert all(archive.getinfo(name).compress_type == zipfile.ZIP_STORED for name in images)
+
+    missing = archive.read("missing-images.txt").decode().splitlines()
+    assert [line.split("\t")[0] for line in missing] == [str(recipes[1]), str(recipes[3])]
+    assert missing[0].endswith("/missing.png")
+
+
+def test_zip_resumes_after_id_without_images(client, login, recipes):
+    headers = login(user_email(0))
+    response = client.get(URL, params={"format": "zip", "after_id": recipes[2], "images": "false"},
+                          headers=headers)
+    names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+    assert [name.split("-")[0] for name in names] == [f"recipes/{i:08d}" for i in recipes[3:]]
+
+
+def test_unsupported_format(client, login, recipes):
+    response = client.get(URL, params={"format": "csv"}, headers=login(user_email(0)))
+    assert response.status_code == 400
+    assert client.get(URL).status_code == 401
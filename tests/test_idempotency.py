@@ -0,0 +1,155 @@
+"""Idempotency-Key（src/idempotency.py）。レシピ生成は LLM・画像、Checkout は Stripe のモックに対して実行する"""
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from bench.datasets import Scale, seed, user_email
+from bench.mock_servers import Latency
+from src import idempotency
+from src.idempotency import HEADER, IdempotencyStore
+from src.shared_state import InProcessState
+
+LLM = "/chat/completions"
+CHECKOUT = "POST /v1/checkout/sessions"
+
+
+@pytest.fixture
+def store(monkeypatch, mock_servers):
+    """テストごとに空のストアを使う（seed で user id が使い回されるため）"""
+    from src import pregen
+    from src.get_conn import engine
+    seed(engine, Scale(users=2, recipes_per_user=0))
+    # 事前生成の割り当ては使わず、毎回 LLM で生成する
+    monkeypatch.setattr(pregen, "ASSIGN", "off")
+    store = IdempotencyStore(InProcessState())
+    monkeypatch.setattr(idempotency, "_store", store)
+    mock_servers.requests.clear()
+    return store
+
+
+@pytest.fixture
+def headers(login, store):
+    # user1 は有効な subscription（モックのプランは上限なし）
+    return login(user_email(1))
+
+
+def _create(client, headers, key: str, title: str = "鶏むね肉のソテー"):
+    return client.post("/api/recipe/create-recipe", params={"title": title},
+                       headers={**headers, HEADER: key})
+
+
+def _recipe_count() -> int:
+    from sqlalchemy import text
+    from src.get_conn import engine
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM recipes")).scalar_one()
+
+
+# ------------------------------
+# レシピ生成
+# ------------------------------
+def test_retry_replays_the_first_response(client, headers, mock_servers):
+    first = _create(client, headers, "create-1")
+    assert first.status_code == 200, first.text
+    assert set(first.json()) == {"message", "recipe_id"}
+    assert "idempotent-replayed" not in first.headers
+
+    again = _create(client, headers, "create-1")
+    assert again.status_code == 200
+    assert again.headers["idempotent-replayed"] == "true"
+    assert again.content == first.content
+    assert mock_servers.requests.count(LLM) == 1
+    assert _recipe_count() == 1
+
+    # 別のキーは別の生成
+    other = _create(client, headers, "create-2")
+    assert other.json()["recipe_id"] != first.json()["recipe_id"]
+    assert mock_servers.requests.count(LLM) == 2
+
+
+def test_concurrent_retry_attaches_to_the_running_request(headers, mock_servers, monkeypatch):
+    from src.main import app
+    monkeypatch.setattr(mock_servers.config, "llm_ttft", Latency("fixed:500"))
+    responses = [None, None]
+
+    def send(i: int) -> None:
+        responses[i] = _create(TestClient(app), headers, "create-concurrent")
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+    for thread in threads:
+        thread.join()
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].content == responses[1].content
+    assert responses[1].headers["idempotent-replayed"] == "true"
+    assert mock_servers.requests.count(LLM) == 1
+    assert _recipe_count() == 1
+
+
+def test_same_key_with_other_parameters_is_rejected(client, headers, mock_servers):
+    assert _create(client, headers, "create-1").status_code == 200
+    response = _create(client, headers, "create-1", title="豆腐ハンバーグ")
+    assert response.status_code == 422
+    assert mock_servers.requests.count(LLM) == 1
+
+
+def test_keys_are_per_user(client, login, headers, mock_servers):
+    first = _create(client, headers, "create-1")
+    # user0 は解約済み（free の上限内）。同じキーでも別の利用者なら別の生成
+    second = _create(client, login(user_email(0)), "create-1")
+    assert second.status_code == 200, second.text
+    assert second.json()["recipe_id"] != first.json()["recipe_id"]
+    assert mock_servers.requests.count(LLM) == 2
+
+
+def test_key_expires_after_retention(client, headers, mock_servers, store):
+    store.retention_s = 0.2
+    first = _create(client, headers, "create-1")
+    time.sleep(0.3)
+    again = _create(client, headers, "create-1")
+    assert again.status_code == 200 and "idempotent-replayed" not in again.headers
+    assert again.json()["recipe_id"] != first.json()["recipe_id"]
+    assert mock_servers.requests.count(LLM) == 2
+
+
+def test_invalid_key(client, headers, mock_servers):
+    assert _create(client, headers, " ").status_code == 400
+    assert _create(client, headers, "k" * 256).status_code == 400
+    assert mock_servers.requests.count(LLM) == 0
+
+
+# ------------------------------
+# Checkout
+# ------------------------------
+def _checkout(client, key: str, plan: str = "price_mock_starter", email: str = "a@example.com"):
+    return client.post("/api/payments/create-checkout-session",
+                       params={"stripe_plan_id": plan, "user_email": email}, headers={HEADER: key})
+
+
+def test_checkout_replays_the_first_session(client, store, mock_servers):
+    first = _checkout(client, "checkout-1")
+    assert first.status_code == 200, first.text
+    assert set(first.json()) == {"checkout_session_id", "checkout_url"}
+
+    again = _checkout(client, "checkout-1")
+    assert again.headers["idempotent-replayed"] == "true"
+    assert again.content == first.content
+    assert mock_servers.requests.count(CHECKOUT) == 1
+
+    assert _checkout(client, "checkout-1", plan="price_mock_pro").status_code == 422
+    assert _checkout(client, "checkout-2").json() != first.json()
+    assert mock_servers.requests.count(CHECKOUT) == 2
+
+
+def test_checkout_client_error_is_replayed(client, store, mock_servers):
+    first = _checkout(client, "checkout-missing", plan="price_missing")
+    assert first.status_code == 404
+    again = _checkout(client, "checkout-missing", plan="price_missing")
+    assert again.status_code == 404 and again.headers["idempotent-replayed"] == "true"
+    assert again.content == first.content
+    assert mock_servers.requests.count("GET /v1/prices/price_missing") == 1
@@ -0,0 +1,29 @@
+"""レシピ生成（src/llm.py）。出力トークンの上限で打ち切られた JSON の検出と再試行をモックの LLM で確かめる"""
+import json
+
+import pytest
+
+from bench.mock_servers import SAMPLE_RECIPE
+from src import llm
+from src.llm_router import Deployment, ProviderRouter
+
+
+def test_router_reports_truncation(mock_servers):
+    router = ProviderRouter([Deployment(name="mock-truncated", endpoint=mock_servers.llm_url,
+                                        deployment="mock-truncated", api_key="mock",
+                                        api_version="2024-10-21")])
+    completion = router.complete([{"role": "user", "content": "レシピ"}], max_completion_tokens=10)
+    assert completion.finish_reason == "length"
+    assert len(completion.text) == 20
+
+
+def test_generate_retries_truncated_json(monkeypatch):
+    monkeypatch.setenv("RECIPE_JSON_MAX_COMPLETION_TOKENS", "50")
+    result = llm.generate("鶏むね肉", mode=llm.JSON_MODE)
+    assert json.loads(result.content) == SAMPLE_RECIPE
+    # 打ち切られた1回目の分も数える
+    assert result.prompt_tokens == 360
+
+    monkeypatch.setenv("RECIPE_JSON_RETRY_MAX_COMPLETION_TOKENS", "40")
+    with pytest.raises(llm.GenerationTruncated):
+        llm.generate("鶏むね肉", mode=llm.JSON_MODE)
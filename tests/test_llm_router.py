@@ -0,0 +1,94 @@
+"""複数デプロイメントのルーター（src/llm_router.py）。デプロイメントはモックの LLM サーバー"""
+import json
+import time
+
+import pytest
+
+from bench.mock_servers import SAMPLE_RECIPE, Latency, MockConfig, MockServers
+from src import llm
+from src.llm_router import Deployment, ProviderRouter
+
+MESSAGES = [{"role": "user", "content": "レシピ"}]
+
+
+def _deployment(servers: MockServers, name: str) -> Deployment:
+    return Deployment(name=name, endpoint=servers.llm_url, deployment=name,
+                      api_key="mock", api_version="2024-10-21")
+
+
+@pytest.fixture
+def failing_llm():
+    with MockServers(MockConfig(error_rate=1.0)) as servers:
+        yield servers
+
+
+@pytest.fixture
+def slow_llm():
+    with MockServers(MockConfig(llm_ttft=Latency("fixed:1500"))) as servers:
+        yield servers
+
+
+def test_router_streams_completion(mock_servers):
+    router = ProviderRouter([_deployment(mock_servers, "mock-stream")])
+    completion = router.complete(MESSAGES, response_format=llm.RESPONSE_FORMAT)
+    assert json.loads(completion.text) == SAMPLE_RECIPE
+    assert completion.finish_reason == "stop"
+    assert completion.prompt_tokens == 180
+    assert completion.completion_tokens == len(completion.text) // 2
+    assert completion.deployment == "mock-stream" and not completion.hedged
+
+
+def test_router_falls_back_on_upstream_errors(mock_servers, failing_llm):
+    failing = _deployment(failing_llm, "mock-failing")
+    healthy = _deployment(mock_servers, "mock-healthy")
+    # 重みで必ず失敗する方を先に選ばせる
+    failing.weight, healthy.weight = 1.0, 1e-9
+    router = ProviderRouter([failing, healthy])
+    completion = router.complete(MESSAGES)
+    assert completion.deployment == "mock-healthy"
+    assert router.stats()["mock-failing"]["failures"] == 1
+
+
+def test_router_hedges_slow_first_token(mock_servers, slow_llm):
+    slow = _deployment(slow_llm, "mock-slow")
+    fast = _deployment(mock_servers, "mock-fast")
+    slow.weight, fast.weight = 1.0, 1e-9
+    router = ProviderRouter([slow, fast], hedge_after_ms=100)
+    start = time.perf_counter()
+    completion = router.complete(MESSAGES)
+    assert completion.deployment == "mock-fast" and completion.hedged
+    assert time.perf_counter() - start < 1.0
+
+
+# ------------------------------
+# 健全性による重み付け
+# ------------------------------
+def test_pick_prefers_the_healthier_deployment(mock_servers):
+    router = ProviderRouter([_deployment(mock_servers, "mock-pick-ok"),
+                             _deployment(mock_servers, "mock-pick-erring")])
+    for name in router.health:
+        router.health[name].record_success(100.0)
+    assert router.health["mock-pick-ok"].score(1.0) == router.health["mock-pick-erring"].score(1.0)
+    for _ in range(5):
+        router.health["mock-pick-erring"].record_failure()
+
+    picks = [router.pick().name for _ in range(2000)]
+    # エラー率 1 - 0.8^5 ≒ 0.67 で、選ばれる割合は 1 割ほどに落ちる
+    assert picks.count("mock-pick-erring") < 400
+    # 0 にはしない（回復を観測するため）
+    assert picks.count("mock-pick-erring") > 0
+    assert router.pick(exclude={"mock-pick-ok"}).name == "mock-pick-erring"
+
+
+def test_failing_deployment_is_picked_less_often(mock_servers, failing_llm, monkeypatch):
+    # ブレーカーは開かせず、健全性スコアだけで避けられることを確かめる
+    monkeypatch.setenv("BREAKER_FAILURE_THRESHOLD", "1000")
+    router = ProviderRouter([_deployment(failing_llm, "mock-weighted-failing"),
+                             _deployment(mock_servers, "mock-weighted-healthy")])
+    for _ in range(20):
+        assert router.complete(MESSAGES).deployment == "mock-weighted-healthy"
+
+    stats = router.stats()
+    assert stats["mock-weighted-healthy"]["requests"] == 20
+    failing = stats["mock-weighted-failing"]
+    assert failing["failures"] == failing["requests"] < 10
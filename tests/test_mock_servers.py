@@ -0,0 +1,127 @@
+"""モックサーバー（bench/mock_servers.py）と、それに向けたアプリ側の Stripe クライアント"""
+import json
+import time
+
+import pytest
+import requests
+
+from bench.mock_servers import PNG_BYTES, SAMPLE_MARKDOWN, Latency
+from src import integrations
+
+CHAT = "/openai/deployments/mock-0/chat/completions"
+
+
+def test_latency_specs():
+    assert Latency("fixed:50").sample_ms() == 50
+    assert Latency().sample_ms() == 0
+    assert all(20 <= Latency("uniform:20,80").sample_ms() <= 80 for _ in range(100))
+    assert all(Latency("normal:0,50").sample_ms() >= 0 for _ in range(100))
+    with pytest.raises(ValueError):
+        Latency("pareto:1")
+
+
+# ------------------------------
+# LLM・画像API
+# ------------------------------
+def _events(response) -> list:
+    lines = [line.decode() for line in response.iter_lines() if line]
+    return [json.loads(line[6:]) if line != "data: [DONE]" else "[DONE]" for line in lines]
+
+
+def test_llm_streams_chunks_then_usage(mock_servers, monkeypatch):
+    monkeypatch.setattr(mock_servers.config, "llm_chunks", 5)
+    with requests.post(mock_servers.llm_url + CHAT, json={"stream": True}, stream=True, timeout=5) as response:
+        assert response.headers["content-type"] == "text/event-stream"
+        events = _events(response)
+    assert events[-1] == "[DONE]"
+    content = [e["choices"][0]["delta"]["content"] for e in events[:-3]]
+    assert len(content) == 5 and "".join(content) == SAMPLE_MARKDOWN
+    assert events[-3]["choices"][0]["finish_reason"] == "stop"
+    assert events[-2]["usage"]["completion_tokens"] == len(SAMPLE_MARKDOWN) // 2
+
+    plain = requests.post(mock_servers.llm_url + CHAT, json={"max_completion_tokens": 5}, timeout=5).json()
+    assert plain["choices"][0]["message"]["content"] == SAMPLE_MARKDOWN[:10]
+    assert plain["choices"][0]["finish_reason"] == "length"
+
+
+def test_image_api_serves_generated_url(mock_servers):
+    response = requests.post(mock_servers.image_url + "/openai/images/generations", json={}, timeout=5)
+    url = response.json()["data"][0]["url"]
+    image = requests.get(url, timeout=5)
+    assert image.headers["content-type"] == "image/png" and image.content == PNG_BYTES
+    assert requests.get(mock_servers.image_url + "/missing.png", timeout=5).status_code == 404
+
+
+def test_error_rate_and_request_log(mock_servers, monkeypatch):
+    mock_servers.requests.clear()
+    monkeypatch.setattr(mock_servers.config, "error_rate", 1.0)
+    response = requests.post(mock_servers.llm_url + CHAT, json={}, timeout=5)
+    assert response.status_code == 503
+    requests.get(mock_servers.image_url + "/images/1.png", timeout=5)
+    # 失敗させたリクエストも数える
+    assert mock_servers.requests.count("POST /openai/deployments/") == 1
+    assert mock_servers.requests.count("GET /images/") == 1
+    assert mock_servers.requests.count() == 2
+
+
+def test_app_env_points_at_the_servers(mock_servers):
+    env = mock_servers.app_env(deployments=2)
+    deployments = json.loads(env["AZURE_DEPLOYMENTS"])
+    assert [d["name"] for d in deployments] == ["mock-0", "mock-1"]
+    assert {d["endpoint"] for d in deployments} == {mock_servers.llm_url}
+    assert env["AZURE_IMAGE_API_URI"].startswith(mock_servers.image_url)
+    assert env["STRIPE_API_BASE"] == mock_servers.stripe_url
+
+
+# ------------------------------
+# Stripe
+# ------------------------------
+def test_stripe_prices(mock_servers):
+    stripe = integrations.get_stripe()
+    prices = stripe.Price.list(active=True)
+    assert [p.id for p in prices.data] == ["price_mock_starter"]
+    assert stripe.Price.retrieve("price_mock_starter").unit_amount == 1200
+    with pytest.raises(stripe.InvalidRequestError):
+        stripe.Price.retrieve("price_missing")
+
+
+def test_stripe_subscription_pages(stripe_subscriptions):
+    for i in range(5):
+        stripe_subscriptions.add_subscription(f"sub_{i}", f"cus_{i}", "canceled" if i == 2 else "active")
+    stripe = integrations.get_stripe()
+
+    first = stripe.Subscription.list(status="all", limit=2)
+    assert [s.id for s in first.data] == ["sub_0", "sub_1"] and first.has_more
+    last = stripe.Subscription.list(status="all", limit=2, starting_after="sub_3")
+    assert [s.id for s in last.data] == ["sub_4"] and not last.has_more
+    active = stripe.Subscription.list(status="active", limit=10)
+    assert [s.id for s in active.data] == ["sub_0", "sub_1", "sub_3", "sub_4"]
+
+
+def test_stripe_checkout_idempotency_key(mock_servers):
+    stripe = integrations.get_stripe()
+    params = {"mode": "subscription", "customer_email": "a@example.com",
+              "line_items": [{"price": "price_mock_starter", "quantity": 1}],
+              "success_url": "https://example.com/ok", "cancel_url": "https://example.com/cancel"}
+    first = stripe.checkout.Session.create(**params, idempotency_key="checkout-test-1")
+    again = stripe.checkout.Session.create(**params, idempotency_key="checkout-test-1")
+    other = stripe.checkout.Session.create(**params)
+    assert first.id == again.id != other.id
+    assert first.customer_email == "a@example.com"
+
+
+def test_stripe_timeout_caps_slow_calls(mock_servers, monkeypatch):
+    stripe = integrations.get_stripe()
+    monkeypatch.setattr(mock_servers.config, "stripe_latency", Latency("fixed:1500"))
+    start = time.perf_counter()
+    with integrations.stripe_timeout(0.2), pytest.raises(stripe.APIConnectionError):
+        stripe.Price.list()
+    assert time.perf_counter() - start < 1.0
+
+
+def test_stripe_error_rate(mock_servers, monkeypatch):
+    stripe = integrations.get_stripe()
+    monkeypatch.setattr(mock_servers.config, "error_rate", 1.0)
+    with pytest.raises(stripe.StripeError) as e:
+        stripe.Price.list()
+    assert e.value.http_status == 503
@@ -0,0 +1,119 @@
+"""レシピの論理削除・一括削除と、物理削除（src/purge.py）"""
+import pytest
+from sqlalchemy import text
+
+from bench.datasets import Scale, recipe_ids_of, seed, user_email
+
+SCALE = Scale(users=2, recipes_per_user=5)
+
+
+@pytest.fixture
+def engine():
+    from src.get_conn import engine
+    seed(engine, SCALE)
+    return engine
+
+
+def _count(engine, table: str, recipe_ids) -> int:
+    ids = ",".join(str(i) for i in recipe_ids)
+    with engine.connect() as conn:
+        column = "id" if table == "recipes" else "recipe_id"
+        return conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {column} IN ({ids})")).scalar_one()
+
+
+def _add_generation_log(engine, user_id: int, recipe_id: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO generation_logs (user_id, recipe_id, mode, image_count, cost_usd) "
+            "VALUES (:u, :r, 'text', 1, 0.01)"), {"u": user_id, "r": recipe_id})
+
+
+def test_delete_hides_recipe_until_purged(client, login, engine):
+    from src import purge
+    from src.get_conn import SessionLocal
+    headers = login(user_email(0))
+    recipe_id = recipe_ids_of(SCALE, 0)[0]
+    _add_generation_log(engine, 1, recipe_id)
+    # 編集履歴も物理削除の対象
+    assert client.put(f"/api/recipe/recipe/{recipe_id}", json={"title": "edited"}, headers=headers).status_code == 200
+    assert _count(engine, "recipe_versions", [recipe_id]) > 0
+
+    response = client.delete(f"/api/recipe/recipe/{recipe_id}", headers=headers)
+    assert response.status_code == 200
+    assert client.get(f"/api/recipe/recipe/{recipe_id}", headers=headers).status_code == 404
+    listed = [r["id"] for r in client.get("/api/recipe/user-recipes?summary=true", headers=headers).json()]
+    assert recipe_id not in listed and len(listed) == SCALE.recipes_per_user - 1
+    # 2回目は見つからない
+    assert client.delete(f"/api/recipe/recipe/{recipe_id}", headers=headers).status_code == 404
+
+    # 行と画像は物理削除まで残る（猶予中は消さない）
+    assert _count(engine, "recipes", [recipe_id]) == 1
+    assert _count(engine, "images", [recipe_id]) == 1
+    assert purge.purge(SessionLocal, grace_s=3600) == 0
+
+    assert purge.purge(SessionLocal, grace_s=0) == 1
+    for table in ("recipes", "images", "recipe_embeddings", "recipe_nutrition", "recipe_versions"):
+        assert _count(engine, table, [recipe_id]) == 0, table
+    # 利用量の台帳は残し、レシピへの参照だけを外す
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT recipe_id FROM generation_logs")).scalar_one() is None
+    # 削除していないレシピはそのまま
+    assert _count(engine, "recipes", recipe_ids_of(SCALE, 0)[1:]) == SCALE.recipes_per_user - 1
+
+
+def test_cannot_delete_other_users_recipe(client, login, engine):
+    other = recipe_ids_of(SCALE, 1)[0]
+    response = client.delete(f"/api/recipe/recipe/{other}", headers=login(user_email(0)))
+    assert response.status_code == 403
+    assert client.get(f"/api/recipe/recipe/{other}", headers=login(user_email(1))).status_code == 200
+
+
+def test_bulk_delete(client, login, engine):
+    own = list(recipe_ids_of(SCALE, 0))
+    other = recipe_ids_of(SCALE, 1)[0]
+    response = client.post("/api/recipe/bulk-delete", headers=login(user_email(0)),
+                           json={"recipe_ids": [own[0], own[1], own[1], other, 9999]})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert sorted(body["deleted"]) == own[:2]
+    assert body["not_found"] == sorted([other, 9999])
+    with engine.connect() as conn:
+        deleted = conn.execute(text("SELECT id FROM recipes WHERE deleted_at IS NOT NULL ORDER BY id")).scalars()
+        assert list(deleted) == own[:2]
+
+
+def test_purge_runs_in_batches_and_calls_hooks(engine, monkeypatch):
+    from src import purge
+    from src.db_models import Recipe
+    from src.get_conn import SessionLocal
+    calls = []
+    monkeypatch.setattr(purge, "_hooks", [lambda db, recipe_ids, images: calls.append(
+        (sorted(recipe_ids), sorted(row.recipe_id for row in images)))])
+    ids = list(recipe_ids_of(SCALE, 0)) + [recipe_ids_of(SCALE, 1)[0]]
+    db = SessionLocal()
+    try:
+        Recipe.delete_recipes(db, ids)
+    finally:
+        db.close()
+
+    assert purge.purge(SessionLocal, batch_size=4, grace_s=0) == 6
+    assert calls == [(ids[:4], ids[:4]), (ids[4:], ids[4:])]
+    assert _count(engine, "recipes", ids) == 0
+
+
+def test_worker_runs_once_under_the_shared_lock(engine):
+    from src import purge
+    from src.db_models import Recipe
+    from src.get_conn import SessionLocal
+    db = SessionLocal()
+    try:
+        Recipe.delete_recipes(db, [recipe_ids_of(SCALE, 0)[0]])
+    finally:
+        db.close()
+    worker = purge.PurgeWorker(SessionLocal, grace_s=0)
+    # 他のワーカーが実行中ならスキップする
+    token = worker.flight.try_acquire("recipes")
+    assert worker.run_once() is None
+    worker.flight.release("recipes", token)
+    assert worker.run_once() == 1
+    assert worker.run_once() == 0
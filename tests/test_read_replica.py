@@ -0,0 +1,110 @@
+"""読み取りレプリカの振り分け（src/get_conn.py）。レプリカは初期データを複製した2つ目の SQLite ファイル"""
+import shutil
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from bench.datasets import Scale, seed, user_email
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    from src import get_conn
+    from src.shared_state import get_state
+    seed(get_conn.engine, Scale(users=2, recipes_per_user=1))
+    # 前のテストの書き込みの印を消す
+    get_state().delete(get_conn._recent_write_key(1), get_conn._recent_write_key(2))
+    get_conn.engine.dispose()
+    path = tmp_path / "replica.db"
+    shutil.copy(get_conn.engine.url.database, path)
+    engine = create_engine(f"sqlite:///{path}")
+    monkeypatch.setattr(get_conn, "reader_engines", [engine])
+    yield engine
+    engine.dispose()
+
+
+def _recipe_id(engine, user_id: int) -> int:
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT id FROM recipes WHERE user_id = :u"), {"u": user_id}).scalar_one()
+
+
+def _title(engine, recipe_id: int) -> str:
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT title FROM recipes WHERE id = :r"), {"r": recipe_id}).scalar_one()
+
+
+def _set_title_on_primary(recipe_id: int, title: str) -> None:
+    """API を通さずにプライマリだけを変える（レプリカの遅延の再現）"""
+    from src.get_conn import engine
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE recipes SET title = :t, version = version + 1 WHERE id = :r"),
+                     {"t": title, "r": recipe_id})
+
+
+def test_read_after_write_goes_to_primary(client, login, replica):
+    headers = login(user_email(0))
+    recipe_id = _recipe_id(replica, 1)
+
+    response = client.put(f"/api/recipe/recipe/{recipe_id}", json={"title": "written"}, headers=headers)
+    assert response.status_code == 200, response.text
+
+    # レプリカには届いていない
+    assert _title(replica, recipe_id) != "written"
+    response = client.get(f"/api/recipe/recipe/{recipe_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["title"] == "written"
+
+
+def test_read_without_recent_write_goes_to_replica(client, login, replica):
+    headers = login(user_email(1))
+    recipe_id = _recipe_id(replica, 2)
+    stale = _title(replica, recipe_id)
+    _set_title_on_primary(recipe_id, "primary only")
+
+    response = client.get(f"/api/recipe/recipe/{recipe_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["title"] == stale
+
+
+def test_write_by_another_user_does_not_pin_reads(client, login, replica):
+    writer = login(user_email(0))
+    reader = login(user_email(1))
+    response = client.put(f"/api/recipe/recipe/{_recipe_id(replica, 1)}",
+                          json={"title": "written"}, headers=writer)
+    assert response.status_code == 200
+
+    recipe_id = _recipe_id(replica, 2)
+    stale = _title(replica, recipe_id)
+    _set_title_on_primary(recipe_id, "primary only")
+    assert client.get(f"/api/recipe/recipe/{recipe_id}", headers=reader).json()["title"] == stale
+
+
+def test_token_without_user_id_reads_from_primary(client, replica):
+    from src.utils import create_access_token
+    # uid を入れる前に発行したトークン
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user_email(1)})}"}
+    recipe_id = _recipe_id(replica, 2)
+    _set_title_on_primary(recipe_id, "primary only")
+
+    response = client.get(f"/api/recipe/recipe/{recipe_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["title"] == "primary only"
+
+
+def test_forged_token_does_not_pin_reads(client, login, replica):
+    from jose import jwt
+    headers = login(user_email(0))
+    # 署名の不正なトークンは書き込みの印を付けない（ルート側で 401）
+    forged = jwt.encode({"sub": user_email(0), "uid": 1}, "not-the-secret", algorithm="HS256")
+    response = client.put(f"/api/recipe/recipe/{_recipe_id(replica, 1)}", json={"title": "forged"},
+                          headers={"Authorization": f"Bearer {forged}"})
+    assert response.status_code == 401
+
+    from src.get_conn import _recent_write_key
+    from src.shared_state import get_state
+    assert get_state().get(_recent_write_key(1)) is None
+    recipe_id = _recipe_id(replica, 1)
+    _set_title_on_primary(recipe_id, "primary only")
+    assert client.get(f"/api/recipe/recipe/{recipe_id}", headers=headers).json()["title"] != "primary only"
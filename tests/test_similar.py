@@ -0,0 +1,142 @@
+"""類似レシピ検索（src/embeddings.py の hashing 埋め込みと src/similar.py）"""
+import numpy as np
+import pytest
+
+from bench.datasets import Scale, recipe_ids_of, seed, user_email
+from src import embeddings, similar
+from src.similar import SimilarIndex, VectorIndex
+
+
+def _vectors(texts: list[str], dtype: str = "int8"):
+    return embeddings.quantize(embeddings.HashingEmbedder(dim=64).embed(texts), dtype)
+
+
+# ------------------------------
+# 埋め込み
+# ------------------------------
+def test_hashing_embedder_is_deterministic():
+    embedder = embeddings.HashingEmbedder(dim=64)
+    first = embedder.embed(["鶏むね肉のソテー", "Chicken 120g", ""])
+    second = embeddings.HashingEmbedder(dim=64).embed(["鶏むね肉のソテー", "Chicken 120g", ""])
+    assert first.shape == (3, 64) and first.dtype == np.float32
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_allclose(np.linalg.norm(first[:2], axis=1), 1.0, rtol=1e-6)
+    # 特徴の無いテキストはゼロベクトル
+    assert not first[2].any()
+    assert embedder.name == "hashing-v1-64"
+
+
+def test_hashing_embedder_ranks_shared_words_higher():
+    query, near, far = embeddings.HashingEmbedder().embed(
+        ["鶏むね肉のソテー", "鶏むね肉の照り焼き", "ほうれん草のおひたし"])
+    assert query @ near > query @ far
+
+
+@pytest.mark.parametrize("dtype", embeddings.DTYPES)
+def test_quantize_round_trip(dtype):
+    vectors = embeddings.HashingEmbedder(dim=64).embed(["豆腐ハンバーグ", "鮭の塩焼き"])
+    quantized = embeddings.quantize(vectors, dtype)
+    assert quantized.dtype == np.dtype(dtype)
+    if dtype == "int8":
+        assert (np.abs(quantized).max(axis=1) == 127).all()
+    decoded = embeddings.decode(embeddings.encode(vectors[0], dtype), dtype)
+    np.testing.assert_array_equal(decoded, quantized[0])
+    # 量子化しても向きはほぼ変わらない
+    restored = embeddings.normalize(decoded.astype(np.float32))
+    assert restored @ vectors[0] > 0.99
+
+
+# ------------------------------
+# VectorIndex
+# ------------------------------
+TEXTS = ["鶏むね肉のソテー", "鶏むね肉の照り焼き", "豆腐ハンバーグ", "鮭の塩焼き", "サバの味噌煮"]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    # ブロックをまたぐ top-k のマージも通す
+    monkeypatch.setattr(similar, "BLOCK_ROWS", 2)
+    index = VectorIndex(dim=64, dtype="int8", capacity=2)
+    index.upsert([10, 11, 12, 13, 14], _vectors(TEXTS))
+    return index
+
+
+def test_search_excludes_query_and_orders_by_score(index):
+    hits = index.search(_vectors(TEXTS[:1]), k=3, exclude=[(10,)])[0]
+    assert [recipe_id for recipe_id, _ in hits][0] == 11
+    assert len(hits) == 3 and 10 not in dict(hits)
+    scores = [score for _, score in hits]
+    assert scores == sorted(scores, reverse=True)
+
+    # 量子化済みでも float32 でも同じ順位
+    float_hits = index.search(embeddings.HashingEmbedder(dim=64).embed(TEXTS[:1]), k=3, exclude=[(10,)])[0]
+    assert [r for r, _ in float_hits] == [r for r, _ in hits]
+
+
+def test_upsert_and_remove(index):
+    assert len(index) == 5 and 12 in index
+    index.remove([10, 99])
+    assert len(index) == 4 and 10 not in index
+    # 末尾の行を詰めても ID とベクトルの対応は保たれる
+    np.testing.assert_array_equal(index.get(14), _vectors(TEXTS)[4])
+    index.upsert([12], _vectors(["鶏むね肉のソテー"]))
+    assert len(index) == 4
+    assert index.search(_vectors(TEXTS[:1]), k=1)[0][0][0] == 12
+
+
+def test_save_and_load(index, tmp_path):
+    index.save(str(tmp_path), {"model": "hashing-v1-64"})
+    loaded, manifest = VectorIndex.load(str(tmp_path))
+    assert manifest["model"] == "hashing-v1-64" and manifest["dtype"] == "int8"
+    assert not loaded.vectors.flags.writeable
+    query = _vectors(TEXTS[2:3])
+    assert loaded.search(query, k=5) == index.search(query, k=5)
+
+    # memory-map のまま更新できる（メモリへコピーする）
+    loaded.upsert([20], _vectors(["豆腐ハンバーグ"]))
+    assert len(loaded) == 6
+    # 保存し直すと古い世代は消える
+    loaded.save(str(tmp_path), {"model": "hashing-v1-64"})
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+
+
+def test_load_without_manifest(tmp_path):
+    assert VectorIndex.load(str(tmp_path)) is None
+
+
+# ------------------------------
+# GET /api/recipe/recipe/{id}/similar
+# ------------------------------
+@pytest.fixture
+def similar_index(tmp_path, monkeypatch):
+    from src.get_conn import SessionLocal
+    index = SimilarIndex(SessionLocal, directory=str(tmp_path))
+    monkeypatch.setattr(similar, "_similar_index", index)
+    return index
+
+
+def test_similar_route(client, login, similar_index):
+    from src.get_conn import engine
+    scale = Scale(users=2, recipes_per_user=10)
+    seed(engine, scale)
+    headers = login(user_email(0))
+    recipe_id = recipe_ids_of(scale, 0)[0]
+    title = client.get(f"/api/recipe/recipe/{recipe_id}", headers=headers).json()["title"]
+
+    response = client.get(f"/api/recipe/recipe/{recipe_id}/similar?limit=3", headers=headers)
+    assert response.status_code == 200, response.text
+    hits = response.json()
+    assert 0 < len(hits) <= 3 and recipe_id not in [hit["id"] for hit in hits]
+    # 同じタイトル（同じ本文）のレシピがあれば類似度 1 で先頭に来る
+    same = [hit for hit in hits if hit["title"] == title]
+    assert hits[:len(same)] == same and all(hit["score"] == 1.0 for hit in same)
+
+    # 削除したレシピは次の取り込みで結果から消える
+    top = hits[0]["id"]
+    owner = 0 if top in recipe_ids_of(scale, 0) else 1
+    assert client.delete(f"/api/recipe/recipe/{top}", headers=login(user_email(owner))).status_code == 200
+    similar_index.refresh(force=True)
+    hits = client.get(f"/api/recipe/recipe/{recipe_id}/similar?limit=3", headers=headers).json()
+    assert top not in [hit["id"] for hit in hits]
+
+    assert client.get("/api/recipe/recipe/99999/similar", headers=headers).status_code == 404
@@ -0,0 +1,120 @@
+"""subscriptions と Stripe の突き合わせ（src/stripe_sync.py）。Stripe はモックサーバー"""
+import pytest
+from sqlalchemy import text
+
+from bench.datasets import Scale, seed
+
+USERS = 6
+
+
+@pytest.fixture
+def db(stripe_subscriptions):
+    """
+    ユーザー6人分の subscription を DB とモックの Stripe の両方に同じ状態で作る
+    （sub_bench_{i} は i % 3 == 0 が解約済み）
+    """
+    from src.get_conn import SessionLocal, engine
+    seed(engine, Scale(users=USERS, recipes_per_user=0))
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE subscriptions SET end_date = start_date WHERE status = 'canceled'"))
+    for i in range(USERS):
+        stripe_subscriptions.add_subscription(
+            f"sub_bench_{i}", f"cus_bench_{i}", "active" if i % 3 else "canceled")
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def _drift(state, changes: dict) -> None:
+    """Stripe 側だけ subscription の状態・Price ID を変える（Webhook の取りこぼし）"""
+    with state.lock:
+        for item in state.subscriptions:
+            change = changes.get(item["id"])
+            if change:
+                item["status"] = change.get("status", item["status"])
+                if "price" in change:
+                    item["items"]["data"][0]["price"]["id"] = change["price"]
+
+
+def _local(db) -> dict:
+    from src.db_models import Subscription
+    db.expire_all()
+    return {row.stripe_subscription_id: row for row in db.query(Subscription)}
+
+
+def test_reconcile_fixes_drift(db, stripe_subscriptions):
+    from src import stripe_sync
+    from src.db_models import DailyStat
+    _drift(stripe_subscriptions, {
+        "sub_bench_1": {"status": "past_due"},
+        "sub_bench_3": {"status": "active"},
+        "sub_bench_4": {"price": "price_mock_pro"},
+    })
+    stripe_subscriptions.add_subscription("sub_stripe_only", "cus_stripe_only", "active")
+
+    result = stripe_sync.reconcile(db, page_size=2)
+    assert result["completed"] and not result["resumed"] and not result["dry_run"]
+    assert (result["pages"], result["checked"], result["updated"]) == (4, 7, 3)
+    assert (result["status_changed"], result["price_changed"]) == (2, 1)
+    assert (result["started"], result["ended"]) == (1, 1)
+    assert result["missing_ids"] == ["sub_stripe_only"]
+
+    local = _local(db)
+    assert local["sub_bench_1"].status == "past_due" and local["sub_bench_1"].end_date is not None
+    assert local["sub_bench_3"].status == "active" and local["sub_bench_3"].end_date is None
+    assert local["sub_bench_4"].stripe_price_id == "price_mock_pro"
+    stats = db.query(DailyStat).one()
+    assert (stats.subscriptions_started, stats.subscriptions_ended) == (1, 1)
+
+    # 揃った後は何も書かない
+    again = stripe_sync.reconcile(db, page_size=2)
+    assert again["updated"] == 0 and again["completed"] and not again["resumed"]
+
+
+def test_dry_run_does_not_write(db, stripe_subscriptions):
+    from src import stripe_sync
+    _drift(stripe_subscriptions, {"sub_bench_1": {"status": "unpaid"}})
+
+    result = stripe_sync.reconcile(db, dry_run=True, page_size=4)
+    assert result["dry_run"] and result["updated"] == 1
+    assert _local(db)["sub_bench_1"].status == "active"
+    assert stripe_sync.status(db) is None
+
+
+def test_resume_from_checkpoint(db, stripe_subscriptions):
+    from src import stripe_sync
+    _drift(stripe_subscriptions, {"sub_bench_1": {"status": "unpaid"}, "sub_bench_5": {"status": "unpaid"}})
+
+    first = stripe_sync.reconcile(db, page_size=2, max_pages=1)
+    assert not first["completed"] and first["updated"] == 1
+    checkpoint = stripe_sync.status(db)
+    assert checkpoint["cursor"] == "sub_bench_1" and checkpoint["completed_at"] is None
+    # 止まる前にコミットしたページは反映済み
+    assert _local(db)["sub_bench_1"].status == "unpaid"
+    assert _local(db)["sub_bench_5"].status == "active"
+
+    second = stripe_sync.reconcile(db, page_size=2)
+    assert second["resumed"] and second["completed"]
+    # 集計は前回の分から続けて数える
+    assert (second["pages"], second["checked"], second["updated"]) == (3, 6, 2)
+    assert _local(db)["sub_bench_5"].status == "unpaid"
+    assert stripe_sync.status(db)["completed_at"] is not None
+
+    restarted = stripe_sync.reconcile(db, page_size=2, max_pages=1, restart=True)
+    assert not restarted["resumed"] and restarted["checked"] == 2
+
+
+def test_restart_when_cursor_was_deleted(db, stripe_subscriptions, caplog):
+    from src import stripe_sync
+    stripe_sync.reconcile(db, page_size=2, max_pages=1)
+    assert stripe_sync.status(db)["cursor"] == "sub_bench_1"
+    # 続きの起点が Stripe から消えた
+    with stripe_subscriptions.lock:
+        stripe_subscriptions.subscriptions = [
+            item for item in stripe_subscriptions.subscriptions if item["id"] != "sub_bench_1"]
+    _drift(stripe_subscriptions, {"sub_bench_0": {"status": "active"}})
+
+    result = stripe_sync.reconcile(db, page_size=2)
+    assert "cursor is no longer valid" in caplog.text
+    assert result["completed"] and result["checked"] == 5
+    assert _local(db)["sub_bench_0"].status == "active"
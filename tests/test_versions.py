@@ -0,0 +1,118 @@
+"""レシピの編集履歴（src/text_delta.py と RecipeVersion）"""
+import json
+
+import pytest
+
+from bench.datasets import Scale, recipe_ids_of, seed, user_email
+from src import text_delta
+
+SCALE = Scale(users=2, recipes_per_user=2)
+
+
+# ------------------------------
+# 行差分
+# ------------------------------
+@pytest.mark.parametrize("old, new", [
+    ("a\nb\nc\n", "a\nb\nc\n"),
+    ("a\nb\nc\n", "a\nB\nc\nd\n"),
+    ("a\nb\nc", "x\ny"),
+    ("", "新しい行\n"),
+    ("古い行\n", ""),
+    ("1\n2\n3\n4\n", "0\n1\n3\n4\n5"),
+])
+def test_delta_round_trip(old, new):
+    assert text_delta.apply_delta(old, text_delta.make_delta(old, new)) == new
+
+
+def test_delta_keeps_only_changed_lines():
+    old = "".join(f"line {i}\n" for i in range(100))
+    new = old.replace("line 50\n", "changed\n")
+    assert json.loads(text_delta.make_delta(old, new)) == [50, -1, ["changed\n"], 49]
+
+
+def test_delta_rejects_another_base():
+    delta = text_delta.make_delta("a\nb\n", "a\nc\n")
+    with pytest.raises(ValueError):
+        text_delta.apply_delta("a\nb\nc\n", delta)
+
+
+# ------------------------------
+# /api/recipe/recipe/{id}/versions
+# ------------------------------
+@pytest.fixture
+def recipe(client, login, monkeypatch):
+    """3 バージョンごとに snapshot を置き、自分のレシピを 1 件返す"""
+    from src.get_conn import engine
+    seed(engine, SCALE)
+    monkeypatch.setenv("RECIPE_SNAPSHOT_INTERVAL", "3")
+    return recipe_ids_of(SCALE, 0)[0], login(user_email(0))
+
+
+def _edit(client, recipe_id, headers, n: int) -> dict:
+    body = {"title": f"版 {n}", "markdown_content": "".join(f"手順 {i}: {i * n}\n" for i in range(1, 6))}
+    response = client.put(f"/api/recipe/recipe/{recipe_id}", json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    return body
+
+
+def test_versions_across_snapshot_boundary(client, recipe):
+    recipe_id, headers = recipe
+    url = f"/api/recipe/recipe/{recipe_id}"
+    original = client.get(url, headers=headers).json()
+    edits = [_edit(client, recipe_id, headers, n) for n in range(2, 9)]
+
+    versions = client.get(f"{url}/versions", headers=headers).json()
+    assert [v["version"] for v in versions] == list(range(8, 0, -1))
+    # version 1 は編集前の内容、以降は 3 つごとに snapshot
+    kinds = {v["version"]: v["kind"] for v in reversed(versions)}
+    assert [n for n, kind in kinds.items() if kind == "snapshot"] == [1, 4, 7]
+    assert versions[0]["title"] == "版 8"
+
+    first = client.get(f"{url}/versions/1", headers=headers).json()
+    assert (first["title"], first["markdown_content"]) == (original["title"], original["markdown_content"])
+    for n, edit in enumerate(edits, start=2):
+        found = client.get(f"{url}/versions/{n}", headers=headers).json()
+        assert (found["version"], found["title"], found["markdown_content"]) == (
+            n, edit["title"], edit["markdown_content"])
+
+    assert client.get(f"{url}/versions/9", headers=headers).status_code == 404
+    assert client.get(f"{url}/versions/0", headers=headers).status_code == 404
+
+
+def test_unchanged_edit_adds_no_version(client, recipe):
+    recipe_id, headers = recipe
+    edit = _edit(client, recipe_id, headers, 2)
+    _edit(client, recipe_id, headers, 2)
+    versions = client.get(f"/api/recipe/recipe/{recipe_id}/versions", headers=headers).json()
+    assert [v["version"] for v in versions] == [2, 1]
+    assert versions[0]["title"] == edit["title"]
+
+
+def test_restore_adds_a_new_version(client, recipe):
+    recipe_id, headers = recipe
+    url = f"/api/recipe/recipe/{recipe_id}"
+    for n in range(2, 6):
+        _edit(client, recipe_id, headers, n)
+    old = client.get(f"{url}/versions/3", headers=headers).json()
+
+    response = client.post(f"{url}/versions/3/restore", headers=headers)
+    assert response.status_code == 200, response.text
+    current = client.get(url, headers=headers).json()
+    assert (current["title"], current["markdown_content"]) == (old["title"], old["markdown_content"])
+    # 戻した内容も履歴に残り、戻す前の版も読める
+    versions = client.get(f"{url}/versions", headers=headers).json()
+    assert versions[0]["version"] == 6 and versions[0]["title"] == old["title"]
+    assert client.get(f"{url}/versions/5", headers=headers).json()["title"] == "版 5"
+
+    assert client.post(f"{url}/versions/99/restore", headers=headers).status_code == 404
+
+
+def test_other_users_history_is_forbidden(client, login, recipe):
+    recipe_id, headers = recipe
+    _edit(client, recipe_id, headers, 2)
+    other = login(user_email(1))
+    url = f"/api/recipe/recipe/{recipe_id}"
+    assert client.get(f"{url}/versions", headers=other).status_code == 403
+    assert client.get(f"{url}/versions/1", headers=other).status_code == 403
+    assert client.post(f"{url}/versions/1/restore", headers=other).status_code == 403
+    assert client.get("/api/recipe/recipe/99999/versions", headers=headers).status_code == 404